@@ -2,6 +2,10 @@
 from .db import Base, engine, SessionLocal, get_db
 from . import models
 from . import utils
+from . import rollups
+from . import cache
+from . import pagination
+from . import archive
 
 __all__ = [
     "Base",
@@ -10,5 +14,9 @@ __all__ = [
     "get_db",
     "models",
     "utils",
+    "rollups",
+    "cache",
+    "pagination",
+    "archive",
 ]
 
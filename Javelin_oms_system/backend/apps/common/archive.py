@@ -0,0 +1,311 @@
+"""
+Archive of closed months
+
+dispatch_scans, sync_logs, orders, stock_ledger and the per-channel physical
+tables only ever grow. Months that closed more than ARCHIVE_HOT_MONTHS ago can
+be moved out of the main database into one SQLite file per table and month,
+ARCHIVE_DIR/<table>/<YYYY-MM>.db, so the hot tables and their indexes only
+hold recent history. archived_periods catalogues what has been moved; a
+month's catalogue row is written before its rows start moving, so readers
+never miss rows halfway through a run.
+
+A row still referenced through a foreign key by a row that stays (an order
+with a recent dispatch scan or a return) is kept hot until a later run finds
+nothing pointing at it. Child rows named in the table's spec (order items)
+move with their parent into the same file.
+
+Readers that may need old data run a single-table statement through
+union_rows() or archived_rows(): it runs against the hot table and, only for
+archived months overlapping the requested range, against their files, so the
+statement must stick to portable SQL. Readers that do not are hot-only, which
+is why only DEFAULT_TABLES are archived unless more are named (see
+backend/archive_closed_months.py): the order and channel lists show recent
+orders only, and stock figures sum the whole stock ledger. Rollups are left
+alone, so dashboards keep archived months (a rollup rebuild only sees hot
+rows, though).
+"""
+
+import heapq
+import os
+import threading
+from datetime import datetime
+from itertools import chain
+from typing import Callable, Dict, Iterator, List, Optional, Tuple
+
+from sqlalchemy import Column, Index, MetaData, Table, create_engine, delete, exists, func, insert, select
+from sqlalchemy.orm import Session
+
+from . import cache, models, rollups
+from .db import Base, project_root
+
+ARCHIVE_DIR = os.getenv("ARCHIVE_DIR", str(project_root / "archive"))
+ARCHIVE_HOT_MONTHS = int(os.getenv("ARCHIVE_HOT_MONTHS", "6"))  # Closed months kept in the main database
+BATCH_SIZE = 2000
+
+
+class ArchiveSpec:
+    def __init__(self, time_column: str, children: Tuple[Tuple[str, str], ...] = ()):
+        self.time_column = time_column
+        self.children = children  # (table, column referencing the parent's id) moved along with the parent
+
+
+SPECS = {
+    "dispatch_scans": ArchiveSpec("scanned_at"),
+    "sync_logs": ArchiveSpec("created_at"),
+    "stock_ledger": ArchiveSpec("created_at"),
+    # After dispatch_scans: orders referenced by hot scans stay hot
+    "orders": ArchiveSpec("purchase_date", children=(("order_items", "order_id"),)),
+}
+DEFAULT_TABLES = ("dispatch_scans", "sync_logs")
+CHANNEL_TIME_COLUMN = "uploaded_at"  # Channel tables are archived by upload time
+
+# Called as hook(connection, table_name, ids) for every batch moved, before it commits
+_hooks: List[Callable] = []
+
+_engines: Dict[str, object] = {}
+_engines_lock = threading.Lock()
+
+
+def on_archive(hook: Callable) -> Callable:
+    """Register hook(connection, table_name, ids) to clean up after rows leave the main database"""
+    _hooks.append(hook)
+    return hook
+
+
+# ---------------------------------------------------------------------------
+# Periods
+# ---------------------------------------------------------------------------
+
+def month_start(value: datetime) -> datetime:
+    return datetime(value.year, value.month, 1)
+
+
+def next_month(start: datetime) -> datetime:
+    return datetime(start.year + start.month // 12, start.month % 12 + 1, 1)
+
+
+def hot_boundary(now: Optional[datetime] = None) -> datetime:
+    """Start of the oldest month kept in the main database"""
+    start = month_start(now or datetime.now())
+    months = start.year * 12 + start.month - 1 - ARCHIVE_HOT_MONTHS
+    return datetime(months // 12, months % 12 + 1, 1)
+
+
+def periods(db: Session, table_name: str, start: Optional[datetime] = None,
+            end: Optional[datetime] = None) -> List[models.ArchivedPeriod]:
+    """Archived months of table_name overlapping [start, end), oldest first"""
+    period = models.ArchivedPeriod
+    query = db.query(period).filter(period.table_name == table_name)
+    if start is not None:
+        query = query.filter(period.period_end > start)
+    if end is not None:
+        query = query.filter(period.period_start < end)
+    return query.order_by(period.period_start).all()
+
+
+# ---------------------------------------------------------------------------
+# Archive files
+# ---------------------------------------------------------------------------
+
+def _engine(location: str):
+    with _engines_lock:
+        if location not in _engines:
+            path = os.path.join(ARCHIVE_DIR, location)
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            _engines[location] = create_engine(f"sqlite:///{path}")
+        return _engines[location]
+
+
+def _generic(column_type):
+    try:
+        return column_type.as_generic()
+    except NotImplementedError:
+        return column_type
+
+
+def _archive_table(table: Table, metadata: MetaData, time_column: Optional[str] = None) -> Table:
+    """Same name and columns as the hot table, without foreign keys or server defaults"""
+    archived = Table(table.name, metadata, *[
+        Column(column.name, _generic(column.type), primary_key=column.primary_key) for column in table.columns
+    ])
+    if time_column:
+        Index(f"ix_{table.name}_{time_column}", archived.c[time_column])
+    return archived
+
+
+def _table(conn, table_name: str) -> Table:
+    if table_name in Base.metadata.tables:
+        return Base.metadata.tables[table_name]
+    return Table(table_name, MetaData(), autoload_with=conn)
+
+
+def _spec(table: Table) -> ArchiveSpec:
+    if table.name in SPECS:
+        return SPECS[table.name]
+    if CHANNEL_TIME_COLUMN in table.c:
+        return ArchiveSpec(CHANNEL_TIME_COLUMN)
+    raise ValueError(f"{table.name} cannot be archived (no {CHANNEL_TIME_COLUMN} column)")
+
+
+def _primary_key(table: Table):
+    columns = list(table.primary_key.columns)
+    if len(columns) != 1:
+        raise ValueError(f"{table.name} cannot be archived (needs a single-column primary key)")
+    return columns[0]
+
+
+def _references(table: Table, excluded: List[Table]) -> list:
+    """Columns of other tables with a foreign key to table"""
+    return [
+        foreign_key.parent
+        for other in Base.metadata.tables.values() if other is not table and other not in excluded
+        for foreign_key in other.foreign_keys if foreign_key.column.table is table
+    ]
+
+
+def _kept(table: Table, children: List[Tuple[Table, str]]) -> list:
+    """Conditions leaving out rows (or rows whose children are) still referenced from hot rows"""
+    child_tables = [child for child, _ in children]
+    pk = _primary_key(table)
+    conditions = [~exists().where(column == pk) for column in _references(table, child_tables)]
+    for child, parent_column in children:
+        child_pk = _primary_key(child)
+        for column in _references(child, [table] + child_tables):
+            conditions.append(~exists().where(child.c[parent_column] == pk, column == child_pk))
+    return conditions
+
+
+def _namespaces(table_name: str) -> List[str]:
+    return [namespace for namespace, tables in cache.NAMESPACE_TABLES.items() if table_name in tables]
+
+
+# ---------------------------------------------------------------------------
+# Moving closed months
+# ---------------------------------------------------------------------------
+
+def closed_months(db: Session, table_name: str) -> List[Tuple[datetime, int]]:
+    """(month start, hot rows) of every month of table_name old enough to archive"""
+    table = _table(db.connection(), table_name)
+    time_column = table.c[_spec(table).time_column]
+    month = rollups.month_key(db, time_column)
+    months = db.execute(
+        select(month, func.count()).where(time_column < hot_boundary()).group_by(month).order_by(month)
+    ).all()
+    return [(datetime.strptime(key, "%Y-%m"), count) for key, count in months if key]
+
+
+def _catalogue(db: Session, table_name: str, start: datetime) -> models.ArchivedPeriod:
+    period = models.ArchivedPeriod
+    key = start.strftime("%Y-%m")
+    row = db.query(period).filter(period.table_name == table_name, period.period == key).first()
+    if row is None:
+        row = period(
+            table_name=table_name, period=key, period_start=start, period_end=next_month(start),
+            location=os.path.join(table_name, f"{key}.db"), row_count=0
+        )
+        db.add(row)
+        db.commit()
+    return row
+
+
+def archive_month(db: Session, table_name: str, month: datetime) -> int:
+    """
+    Move the hot rows of one closed month of table_name to its archive file,
+    BATCH_SIZE at a time. Commits after every batch; returns the rows moved.
+    Safe to run again: rows already in the file are replaced.
+    """
+    start = month_start(month)
+    end = next_month(start)
+    if end > hot_boundary():
+        raise ValueError(f"{start:%Y-%m} is within the last {ARCHIVE_HOT_MONTHS} closed months and stays hot")
+
+    conn = db.connection()
+    table = _table(conn, table_name)
+    spec = _spec(table)
+    pk = _primary_key(table)
+    time_column = table.c[spec.time_column]
+    children = [(_table(conn, child), parent_column) for child, parent_column in spec.children]
+    conditions = [time_column >= start, time_column < end] + _kept(table, children)
+
+    period = _catalogue(db, table_name, start)
+    archive_engine = _engine(period.location)
+    metadata = MetaData()
+    archived = _archive_table(table, metadata, spec.time_column)
+    archived_children = [_archive_table(child, metadata, parent_column) for child, parent_column in children]
+    metadata.create_all(archive_engine)
+
+    moved = 0
+    last_id = None
+    while True:
+        batch = conditions + ([pk > last_id] if last_id is not None else [])
+        ids = list(db.execute(select(pk).where(*batch).order_by(pk).limit(BATCH_SIZE)).scalars())
+        if not ids:
+            break
+        last_id = ids[-1]
+
+        conn = db.connection()
+        rows = [dict(row._mapping) for row in conn.execute(select(table).where(pk.in_(ids)))]
+        child_rows = [
+            [dict(row._mapping) for row in conn.execute(select(child).where(child.c[parent_column].in_(ids)))]
+            for child, parent_column in children
+        ]
+        # Written to the archive first: a crash in between leaves rows in both, never in neither
+        with archive_engine.begin() as archive:
+            archive.execute(insert(archived).prefix_with("OR REPLACE"), rows)
+            for archived_child, values in zip(archived_children, child_rows):
+                if values:
+                    archive.execute(insert(archived_child).prefix_with("OR REPLACE"), values)
+
+        for child, parent_column in children:
+            conn.execute(delete(child).where(child.c[parent_column].in_(ids)))
+        conn.execute(delete(table).where(pk.in_(ids)))
+        for hook in _hooks:
+            hook(conn, table_name, ids)
+        period.row_count += len(ids)
+        cache.touch(db, *_namespaces(table_name))
+        db.commit()
+        moved += len(ids)
+    return moved
+
+
+def archive_closed_months(db: Session, table_name: str) -> Dict[str, int]:
+    """Archive every closed month of table_name; rows moved by month"""
+    return {
+        month.strftime("%Y-%m"): archive_month(db, table_name, month)
+        for month, _ in closed_months(db, table_name)
+    }
+
+
+# ---------------------------------------------------------------------------
+# Reading
+# ---------------------------------------------------------------------------
+
+def _run(location: str, statement) -> Iterator:
+    with _engine(location).connect() as conn:
+        yield from conn.execute(statement)
+
+
+def archived_rows(db: Session, statement, table_name: str, start: Optional[datetime] = None,
+                  end: Optional[datetime] = None) -> Iterator:
+    """Rows of a single-table statement from the archived months overlapping [start, end), oldest month first"""
+    return chain.from_iterable(
+        _run(period.location, statement) for period in periods(db, table_name, start, end)
+    )
+
+
+def union_rows(db: Session, statement, table_name: str, start: Optional[datetime] = None,
+               end: Optional[datetime] = None, key: Optional[Callable] = None, reverse: bool = False) -> Iterator:
+    """
+    Rows of a single-table statement from the hot table plus the archived
+    months overlapping [start, end). With key, every source must be ordered by
+    it (descending with reverse) and the rows are merged in that order;
+    otherwise archived rows come first. Without overlapping archived months
+    this is just db.execute(statement).
+    """
+    archived = periods(db, table_name, start, end)
+    if not archived:
+        return iter(db.execute(statement))
+    if key is None:
+        return chain(archived_rows(db, statement, table_name, start, end), db.execute(statement))
+    sources = [_run(period.location, statement) for period in archived] + [iter(db.execute(statement))]
+    return heapq.merge(*sources, key=key, reverse=reverse)
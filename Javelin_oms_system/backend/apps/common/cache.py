@@ -0,0 +1,212 @@
+"""
+Response cache
+
+In-process cache for expensive summary endpoints. Entries are keyed by the
+endpoint, its parameters and the current version of every data namespace the
+response depends on. Versions are bumped after a commit that wrote to one of
+the namespace's tables, so a write makes older entries unreachable instead of
+having to find and delete them. A write to a row with a company_id only bumps
+that company's version; responses for one company (company_id passed to
+get_or_compute) are invalidated by writes of that company and by writes
+without a company, and responses for everyone by any write.
+
+Versions live in the process: a write handled by another worker is not seen
+here, so a worker may answer from data older than a commit elsewhere for up
+to CACHE_TTL seconds (plus one recomputation, during which concurrent
+requests get the previous value). Entries invalidated in this process are
+never served stale.
+
+When a fresh entry expires, the first request recomputes it while concurrent
+requests keep getting the previous value until it is replaced
+(stale-while-revalidate); without a previous value they wait for that one
+computation instead of running their own.
+"""
+import os
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Callable, Hashable, Iterable, Optional, Set, Tuple
+
+from sqlalchemy import event, inspect
+from sqlalchemy.orm import Session
+
+ORDERS = "orders"
+INVENTORY = "inventory"
+DISPATCH = "dispatch"
+AUTH = "auth"
+
+# Tables whose writes invalidate each namespace
+NAMESPACE_TABLES = {
+    ORDERS: {"orders", "order_items", "platforms", "order_daily_rollups"},
+    INVENTORY: {"inventory", "products", "warehouses", "stock_ledger", "stock_balances"},
+    DISPATCH: {"dispatch_scans", "dispatch_daily_rollups"},
+    AUTH: {"users", "applications", "company_apps", "user_app_access"},
+}
+_TABLE_NAMESPACES = {
+    table: namespace
+    for namespace, tables in NAMESPACE_TABLES.items()
+    for table in tables
+}
+
+CACHE_TTL = float(os.getenv("RESPONSE_CACHE_TTL", "30"))  # seconds an entry is fresh
+CACHE_STALE_TTL = float(os.getenv("RESPONSE_CACHE_STALE_TTL", "300"))  # seconds it may still be served stale
+CACHE_MAX_ENTRIES = int(os.getenv("RESPONSE_CACHE_MAX_ENTRIES", "1000"))
+
+_ANY = "*"  # Key of a namespace's count of every write, whatever its company
+_versions = {}  # (namespace, company_id, None for writes without one, or _ANY) -> version
+_versions_lock = threading.Lock()
+
+
+def version(namespace: str, company_id: Optional[int] = None):
+    """Version of a namespace as seen by responses for company_id (None: for every company)"""
+    if company_id is None:
+        return _versions.get((namespace, _ANY), 0)
+    return _versions.get((namespace, None), 0), _versions.get((namespace, company_id), 0)
+
+
+def bump(*namespaces: str, company_id: Optional[int] = None):
+    """
+    Invalidate every cached response that depends on the given namespaces:
+    for company_id only, or for every company when it is None
+    """
+    with _versions_lock:
+        for namespace in namespaces:
+            for key in ((namespace, _ANY), (namespace, company_id)):
+                _versions[key] = _versions.get(key, 0) + 1
+
+
+def touch(db: Session, *namespaces: str, company_id: Optional[int] = None):
+    """Bump namespaces once db commits (for writes the flush hook cannot see, e.g. bulk inserts)"""
+    db.info.setdefault("cache_namespaces", set()).update((namespace, company_id) for namespace in namespaces)
+
+
+def _companies(obj) -> Set[Optional[int]]:
+    """Companies a written row belonged to before and after the flush (None: no company scope)"""
+    if not hasattr(obj, "company_id"):
+        return {None}
+    history = inspect(obj).attrs.company_id.history
+    companies = {company for company in list(history.added) + list(history.unchanged) + list(history.deleted)}
+    return companies or {None}
+
+
+@event.listens_for(Session, "after_flush")
+def _collect_written_namespaces(session, flush_context):
+    for obj in list(session.new) + list(session.dirty) + list(session.deleted):
+        namespace = _TABLE_NAMESPACES.get(getattr(obj, "__tablename__", None))
+        if namespace:
+            session.info.setdefault("cache_namespaces", set()).update(
+                (namespace, company_id) for company_id in _companies(obj)
+            )
+
+
+@event.listens_for(Session, "after_bulk_update")
+@event.listens_for(Session, "after_bulk_delete")
+def _collect_bulk_namespaces(update_context):
+    # The rows are not known, so every company's responses go
+    namespace = _TABLE_NAMESPACES.get(getattr(update_context.mapper.class_, "__tablename__", None))
+    if namespace:
+        update_context.session.info.setdefault("cache_namespaces", set()).add((namespace, None))
+
+
+@event.listens_for(Session, "after_commit")
+def _bump_committed_namespaces(session):
+    for namespace, company_id in session.info.pop("cache_namespaces", ()):
+        bump(namespace, company_id=company_id)
+
+
+@event.listens_for(Session, "after_rollback")
+def _discard_namespaces(session):
+    session.info.pop("cache_namespaces", None)
+
+
+class _Entry:
+    __slots__ = ("value", "fresh_until", "stale_until")
+
+    def __init__(self, value: Any, ttl: float, stale_ttl: float):
+        now = time.monotonic()
+        self.value = value
+        self.fresh_until = now + ttl
+        self.stale_until = now + ttl + stale_ttl
+
+
+class ResponseCache:
+    """Bounded LRU of computed responses with single-flight recomputation"""
+
+    def __init__(self, max_entries: int = CACHE_MAX_ENTRIES):
+        self.max_entries = max_entries
+        self._entries: "OrderedDict[Tuple, _Entry]" = OrderedDict()
+        self._latest: "OrderedDict[Hashable, Tuple]" = OrderedDict()  # key -> last versioned key
+        self._lock = threading.Lock()
+        self._computing = {}  # key -> threading.Lock held by the recomputing request
+
+    def get_or_compute(
+        self,
+        key: Hashable,
+        namespaces: Iterable[str],
+        compute: Callable[[], Any],
+        ttl: float = CACHE_TTL,
+        stale_ttl: float = CACHE_STALE_TTL,
+        company_id: Optional[int] = None
+    ) -> Any:
+        """
+        Cached value of compute() for key while the namespaces are unchanged;
+        with company_id, only writes of that company (or without a company)
+        count as changes
+        """
+        versioned_key = (key, tuple((ns, version(ns, company_id)) for ns in namespaces))
+        now = time.monotonic()
+
+        with self._lock:
+            entry = self._entries.get(versioned_key)
+            if entry and now < entry.fresh_until:
+                self._entries.move_to_end(versioned_key)
+                return entry.value
+
+            stale = None
+            if entry and now < entry.stale_until:
+                stale = entry
+            flight = self._computing.get(key)
+            if flight is None:
+                flight = self._computing[key] = threading.Lock()
+                flight.acquire()
+                leader = True
+            else:
+                leader = False
+
+        if not leader:
+            if stale:
+                return stale.value
+            # Wait for the leader, then use what it stored (or compute if it failed)
+            with flight:
+                pass
+            with self._lock:
+                entry = self._entries.get(versioned_key)
+            if entry:
+                return entry.value
+            return compute()
+
+        try:
+            value = compute()
+            with self._lock:
+                previous = self._latest.pop(key, None)
+                if previous and previous != versioned_key:
+                    self._entries.pop(previous, None)
+                self._entries[versioned_key] = _Entry(value, ttl, stale_ttl)
+                self._latest[key] = versioned_key
+                while len(self._entries) > self.max_entries:
+                    evicted, _ = self._entries.popitem(last=False)
+                    if self._latest.get(evicted[0]) == evicted:
+                        del self._latest[evicted[0]]
+            return value
+        finally:
+            with self._lock:
+                self._computing.pop(key, None)
+            flight.release()
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._latest.clear()
+
+
+response_cache = ResponseCache()
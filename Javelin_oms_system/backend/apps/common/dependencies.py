@@ -1,11 +1,53 @@
+import os
+import threading
+import time
 from fastapi import Depends, HTTPException, status
 from fastapi.security import OAuth2PasswordBearer
-from sqlalchemy.orm import Session
+from sqlalchemy.orm import Session, make_transient_to_detached
 from jose import JWTError
-from . import models, security, SessionLocal
+from . import models, security, cache, SessionLocal
 
 oauth2_scheme = OAuth2PasswordBearer(tokenUrl="/oms/auth/login")
 
+# Short-lived cache of authenticated principals, so a request does not re-read
+# the user and the company's enabled apps on every call. Entries are dropped
+# once the auth namespace version moves (a commit touched users, applications,
+# company_apps or user_app_access) or after PRINCIPAL_CACHE_TTL seconds.
+PRINCIPAL_CACHE_TTL = float(os.getenv("PRINCIPAL_CACHE_TTL", "60"))
+PRINCIPAL_CACHE_MAX_ENTRIES = 10000
+
+_principals = {}  # token -> (expires_at, auth_version, detached User snapshot)
+_company_apps = {}  # company_id -> (expires_at, auth_version, {app_code: (app_name, enabled)})
+_principal_lock = threading.Lock()
+
+
+def _cached(store: dict, key):
+    entry = store.get(key)
+    if entry and entry[0] > time.time() and entry[1] == cache.version(cache.AUTH):
+        return entry[2]
+    return None
+
+
+def _remember(store: dict, key, value, expires_at: float, auth_version: int):
+    with _principal_lock:
+        if len(store) >= PRINCIPAL_CACHE_MAX_ENTRIES:
+            now = time.time()
+            for stale_key in [k for k, entry in store.items() if entry[0] <= now or entry[1] != auth_version]:
+                del store[stale_key]
+            if len(store) >= PRINCIPAL_CACHE_MAX_ENTRIES:
+                store.clear()
+        store[key] = (expires_at, auth_version, value)
+
+
+def _user_snapshot(user: models.User) -> models.User:
+    """Detached copy of the user's columns that can be merged into any session"""
+    snapshot = models.User(**{
+        attr.key: getattr(user, attr.key)
+        for attr in models.User.__mapper__.column_attrs
+    })
+    make_transient_to_detached(snapshot)
+    return snapshot
+
 def get_db():
     db = SessionLocal()
     try:
@@ -20,6 +62,13 @@ async def get_current_user(token: str = Depends(oauth2_scheme), db: Session = De
         detail="Could not validate credentials",
         headers={"WWW-Authenticate": "Bearer"},
     )
+    snapshot = _cached(_principals, token)
+    if snapshot is not None:
+        # Attach to this request's session without a SELECT; lazy attributes
+        # (e.g. user.company) and updates work as on a queried user
+        return db.merge(snapshot, load=False)
+
+    auth_version = cache.version(cache.AUTH)
     try:
         payload = security.jwt.decode(token, security.SECRET_KEY, algorithms=[security.ALGORITHM])
         email: str = payload.get("sub")
@@ -31,6 +80,11 @@ async def get_current_user(token: str = Depends(oauth2_scheme), db: Session = De
     user = db.query(models.User).filter(models.User.email == email).first()
     if user is None:
         raise credentials_exception
+
+    expires_at = time.time() + PRINCIPAL_CACHE_TTL
+    if payload.get("exp"):
+        expires_at = min(expires_at, float(payload["exp"]))
+    _remember(_principals, token, _user_snapshot(user), expires_at, auth_version)
     return user
 
 async def get_current_active_user(current_user: models.User = Depends(get_current_user)):
@@ -51,22 +105,43 @@ class AppAccessChecker:
             )
             
         # 2. Check if App is Enabled for this Company
-        app = db.query(models.Application).filter(models.Application.code == self.app_code).first()
-        if not app:
+        apps = company_apps(db, current_user.company_id)
+        if self.app_code not in apps:
              raise HTTPException(status_code=500, detail=f"Application definition for '{self.app_code}' not found.")
              
         # Check CompanyApp Is Active
-        company_app = db.query(models.CompanyApp).filter(
-            models.CompanyApp.company_id == current_user.company_id,
-            models.CompanyApp.app_id == app.id,
-            models.CompanyApp.is_active == 1
-        ).first()
-
-        if not company_app:
-             print(f"DEBUG: AppAccessChecker FAILED. User Company: {current_user.company_id}, App: {self.app_code} (ID: {app.id}) -> Not Active/Found.")
+        app_name, enabled = apps[self.app_code]
+        if not enabled:
+             print(f"DEBUG: AppAccessChecker FAILED. User Company: {current_user.company_id}, App: {self.app_code} -> Not Active/Found.")
              raise HTTPException(
                 status_code=status.HTTP_403_FORBIDDEN, 
-                detail=f"The '{app.name}' application is not enabled for your organization."
+                detail=f"The '{app_name}' application is not enabled for your organization."
             )
             
         return current_user
+
+
+def company_apps(db: Session, company_id: int) -> dict:
+    """All application codes mapped to (name, enabled for company), cached per company"""
+    apps = _cached(_company_apps, company_id)
+    if apps is not None:
+        return apps
+
+    auth_version = cache.version(cache.AUTH)
+    rows = db.query(
+        models.Application.code,
+        models.Application.name,
+        models.CompanyApp.id
+    ).outerjoin(
+        models.CompanyApp,
+        (models.CompanyApp.app_id == models.Application.id)
+        & (models.CompanyApp.company_id == company_id)
+        & (models.CompanyApp.is_active == 1)
+    ).all()
+
+    apps = {}
+    for code, name, company_app_id in rows:
+        enabled = company_app_id is not None
+        apps[code] = (name, apps.get(code, (name, False))[1] or enabled)
+    _remember(_company_apps, company_id, apps, time.time() + PRINCIPAL_CACHE_TTL, auth_version)
+    return apps
@@ -1,5 +1,5 @@
 """Unified database models for all platforms"""
-from sqlalchemy import Column, Integer, String, DateTime, Numeric, ForeignKey, Text, JSON, Boolean
+from sqlalchemy import Column, Integer, String, Date, DateTime, Numeric, ForeignKey, Text, JSON, Boolean, UniqueConstraint, Index
 from sqlalchemy.sql import func
 from sqlalchemy.orm import relationship
 from .db import Base
@@ -565,6 +565,11 @@ class Quotation(Base):
     customer = relationship("Customer")
     items = relationship("QuotationItem", back_populates="quotation", cascade="all, delete-orphan")
 
+    __table_args__ = (
+        # Keyset pagination of the quotation list
+        Index("ix_quotations_company_date_id", "company_id", "quotation_date", "id"),
+    )
+
 
 class QuotationItem(Base):
     """Quotation Lines"""
@@ -643,6 +648,11 @@ class SalesOrder(Base):
     quotation = relationship("Quotation")
     items = relationship("SalesOrderItem", back_populates="order", cascade="all, delete-orphan")
 
+    __table_args__ = (
+        # Keyset pagination of the sales order list
+        Index("ix_sales_orders_company_date_id", "company_id", "order_date", "id"),
+    )
+
 
 class SalesOrderItem(Base):
     """Sales Order Lines"""
@@ -744,6 +754,11 @@ class Invoice(Base):
     quotation = relationship("Quotation")
     items = relationship("InvoiceItem", back_populates="invoice", cascade="all, delete-orphan")
 
+    __table_args__ = (
+        # Keyset pagination of the invoice list
+        Index("ix_invoices_company_date_id", "company_id", "invoice_date", "id"),
+    )
+
 
 class InvoiceItem(Base):
     """Invoice Lines"""
@@ -839,6 +854,22 @@ class StockLedger(Base):
     created_at = Column(DateTime(timezone=True), server_default=func.now())
 
 
+class StockBalance(Base):
+    """Maintained on-hand quantity per product per warehouse (sum of StockLedger)"""
+    __tablename__ = "stock_balances"
+
+    id = Column(Integer, primary_key=True, index=True)
+    product_id = Column(Integer, ForeignKey("products.id"), nullable=False)
+    warehouse_id = Column(Integer, ForeignKey("warehouses.id"), nullable=False, index=True)
+    quantity = Column(Integer, nullable=False, default=0)
+    updated_at = Column(DateTime(timezone=True), server_default=func.now(), onupdate=func.now())
+
+    __table_args__ = (
+        UniqueConstraint("product_id", "warehouse_id", name="uq_stock_balance_product_warehouse"),
+        {"mysql_engine": "InnoDB"},
+    )
+
+
 class StockTransfer(Base):
     """Inter-warehouse Stock Transfer Head"""
     __tablename__ = "stock_transfers"
@@ -1139,6 +1170,35 @@ class DispatchScan(Base):
     warehouse = relationship("Warehouse")
     
     __table_args__ = (
+        # Keyset pagination of the scan list
+        Index("ix_dispatch_scans_company_scanned_id", "company_id", "scanned_at", "id"),
+        # Unmanifested scans up to a cutoff, and a manifest's parcels
+        Index("ix_dispatch_scans_company_manifest", "company_id", "manifest_id", "scanned_at"),
+        {"mysql_engine": "InnoDB"},
+    )
+
+
+class CourierManifest(Base):
+    """Handover sheet of the parcels scanned for one courier at one warehouse up to a cutoff"""
+    __tablename__ = "courier_manifests"
+
+    id = Column(Integer, primary_key=True, index=True)
+    company_id = Column(Integer, ForeignKey("companies.id"), nullable=False)
+    manifest_number = Column(String(50), nullable=False)
+    courier_partner = Column(String(100))
+    warehouse_id = Column(Integer, ForeignKey("warehouses.id"), nullable=True)
+    cutoff_at = Column(DateTime, nullable=False)
+    parcel_count = Column(Integer, nullable=False, default=0)
+    status = Column(String(20), nullable=False, default="closed")  # closed, handed_over
+    handed_over_at = Column(DateTime, nullable=True)
+    created_by_user_id = Column(Integer, ForeignKey("users.id"), nullable=True)
+    created_at = Column(DateTime(timezone=True), server_default=func.now())
+
+    warehouse = relationship("Warehouse")
+
+    __table_args__ = (
+        UniqueConstraint("company_id", "manifest_number", name="uq_courier_manifest_number"),
+        Index("ix_courier_manifests_company_cutoff", "company_id", "cutoff_at"),
         {"mysql_engine": "InnoDB"},
     )
 
@@ -1246,3 +1306,276 @@ class MangoChannelOrder(Base):
     __table_args__ = (
         {"mysql_engine": "InnoDB"},
     )
+
+
+# ============================================================
+# ANALYTICS ROLLUP MODELS
+# ============================================================
+
+class OrderDailyRollup(Base):
+    """Orders and revenue per day, platform and status (maintained on write)"""
+    __tablename__ = "order_daily_rollups"
+
+    id = Column(Integer, primary_key=True, index=True)
+    day = Column(Date, nullable=False, index=True)
+    platform_id = Column(Integer, nullable=False, default=0)  # 0 = no platform
+    order_status = Column(String(50), nullable=False, default="")
+    order_count = Column(Integer, nullable=False, default=0)
+    revenue = Column(Numeric(15, 2), nullable=False, default=0)
+
+    __table_args__ = (
+        UniqueConstraint("day", "platform_id", "order_status", name="uq_order_daily_rollup"),
+        {"mysql_engine": "InnoDB"},
+    )
+
+
+class DispatchDailyRollup(Base):
+    """Dispatch scans per company, day, courier, platform and status (maintained on write)"""
+    __tablename__ = "dispatch_daily_rollups"
+
+    id = Column(Integer, primary_key=True, index=True)
+    company_id = Column(Integer, nullable=False, index=True)
+    day = Column(Date, nullable=False, index=True)
+    courier_partner = Column(String(100), nullable=False, default="")
+    platform_name = Column(String(50), nullable=False, default="")
+    dispatch_status = Column(String(50), nullable=False, default="")
+    scan_count = Column(Integer, nullable=False, default=0)
+
+    __table_args__ = (
+        UniqueConstraint(
+            "company_id", "day", "courier_partner", "platform_name", "dispatch_status",
+            name="uq_dispatch_daily_rollup"
+        ),
+        {"mysql_engine": "InnoDB"},
+    )
+
+
+class CustomerLedgerMonthlyRollup(Base):
+    """Ledger flows per customer, month and transaction type (maintained on write)"""
+    __tablename__ = "customer_ledger_monthly_rollups"
+
+    id = Column(Integer, primary_key=True, index=True)
+    company_id = Column(Integer, index=True)
+    customer_id = Column(Integer, nullable=False, index=True)
+    month = Column(String(7), nullable=False)  # YYYY-MM
+    transaction_type = Column(String(50), nullable=False)
+    entry_count = Column(Integer, nullable=False, default=0)
+    debit_total = Column(Numeric(15, 2), nullable=False, default=0)
+    credit_total = Column(Numeric(15, 2), nullable=False, default=0)
+    closing_balance = Column(Numeric(15, 2), default=0)  # Balance of the latest entry in the month
+    last_transaction_at = Column(DateTime)
+
+    __table_args__ = (
+        UniqueConstraint("customer_id", "month", "transaction_type", name="uq_customer_ledger_monthly_rollup"),
+        {"mysql_engine": "InnoDB"},
+    )
+
+
+class CustomerOpenItem(Base):
+    """
+    Ledger entry with an amount not matched yet: an unpaid debit (invoice,
+    opening balance, debit note) or an unapplied credit (payment, credit note).
+    Fully matched entries are removed, so this stays small.
+    """
+    __tablename__ = "customer_open_items"
+
+    id = Column(Integer, primary_key=True, index=True)
+    company_id = Column(Integer, index=True)
+    customer_id = Column(Integer, nullable=False)
+    ledger_entry_id = Column(Integer, ForeignKey("customer_ledger.id"), nullable=False, unique=True)
+    side = Column(String(6), nullable=False)  # DEBIT (customer owes) or CREDIT (paid/credited, not applied)
+    transaction_type = Column(String(50))
+    reference_number = Column(String(100), index=True)
+    document_date = Column(DateTime)
+    due_date = Column(DateTime)
+    original_amount = Column(Numeric(15, 2), nullable=False, default=0)
+    open_amount = Column(Numeric(15, 2), nullable=False, default=0)
+
+    __table_args__ = (
+        Index("ix_customer_open_items_customer", "customer_id", "side", "due_date"),
+        {"mysql_engine": "InnoDB"},
+    )
+
+
+class LedgerAllocation(Base):
+    """Part of a credit ledger entry applied to a debit ledger entry"""
+    __tablename__ = "ledger_allocations"
+
+    id = Column(Integer, primary_key=True, index=True)
+    company_id = Column(Integer, index=True)
+    customer_id = Column(Integer, nullable=False, index=True)
+    credit_entry_id = Column(Integer, ForeignKey("customer_ledger.id"), nullable=False, index=True)
+    debit_entry_id = Column(Integer, ForeignKey("customer_ledger.id"), nullable=False, index=True)
+    amount = Column(Numeric(15, 2), nullable=False)
+    method = Column(String(20), nullable=False)  # FIFO, EXPLICIT, SETTLEMENT, REVERSAL
+    allocated_at = Column(DateTime, nullable=False)
+    created_by_user_id = Column(Integer, ForeignKey("users.id"))
+
+    __table_args__ = (
+        {"mysql_engine": "InnoDB"},
+    )
+
+
+class CustomerBalanceSummary(Base):
+    """Running ledger totals and open invoices per customer (maintained on write)"""
+    __tablename__ = "customer_balance_summaries"
+
+    id = Column(Integer, primary_key=True, index=True)
+    company_id = Column(Integer, index=True)
+    customer_id = Column(Integer, nullable=False, unique=True)
+    entry_count = Column(Integer, nullable=False, default=0)
+    debit_total = Column(Numeric(15, 2), nullable=False, default=0)
+    credit_total = Column(Numeric(15, 2), nullable=False, default=0)
+    closing_balance = Column(Numeric(15, 2), default=0)  # Balance of the latest entry
+    last_transaction_at = Column(DateTime)
+    open_invoice_count = Column(Integer, nullable=False, default=0)  # Unreconciled INVOICE entries
+    open_invoice_amount = Column(Numeric(15, 2), nullable=False, default=0)
+
+    __table_args__ = (
+        {"mysql_engine": "InnoDB"},
+    )
+
+
+class CustomerAgingRollup(Base):
+    """Unreconciled invoice amounts per customer and due day, for aging buckets (maintained on write)"""
+    __tablename__ = "customer_aging_rollups"
+
+    id = Column(Integer, primary_key=True, index=True)
+    company_id = Column(Integer, index=True)
+    customer_id = Column(Integer, nullable=False, index=True)
+    due_day = Column(Date, nullable=False)
+    invoice_count = Column(Integer, nullable=False, default=0)
+    open_amount = Column(Numeric(15, 2), nullable=False, default=0)
+
+    __table_args__ = (
+        UniqueConstraint("customer_id", "due_day", name="uq_customer_aging_rollup"),
+        {"mysql_engine": "InnoDB"},
+    )
+
+
+class RollupState(Base):
+    """Marks a rollup family as fully built so readers can trust it"""
+    __tablename__ = "rollup_state"
+
+    name = Column(String(50), primary_key=True)  # orders, dispatch, customer_ledger, customer_balances, open_items
+    rebuilt_at = Column(DateTime(timezone=True), server_default=func.now())
+
+
+class ArchivedPeriod(Base):
+    """A month of a high-volume table moved out to an archive file (see apps/common/archive.py)"""
+    __tablename__ = "archived_periods"
+
+    id = Column(Integer, primary_key=True, index=True)
+    table_name = Column(String(100), nullable=False)
+    period = Column(String(7), nullable=False)  # YYYY-MM
+    period_start = Column(DateTime, nullable=False)
+    period_end = Column(DateTime, nullable=False)  # Exclusive
+    location = Column(String(500), nullable=False)  # Archive file, relative to ARCHIVE_DIR
+    row_count = Column(Integer, nullable=False, default=0)
+    archived_at = Column(DateTime(timezone=True), server_default=func.now())
+
+    __table_args__ = (
+        UniqueConstraint("table_name", "period", name="uq_archived_period"),
+        Index("ix_archived_periods_table_start", "table_name", "period_start"),
+    )
+
+
+# ============================================================
+# DOCUMENT NUMBER SEQUENCES
+# ============================================================
+
+class DocumentSequence(Base):
+    """Next number to hand out per company, document type and period"""
+    __tablename__ = "document_sequences"
+
+    id = Column(Integer, primary_key=True, index=True)
+    company_id = Column(Integer, nullable=False, default=0)  # 0 = shared across companies
+    doc_type = Column(String(30), nullable=False)  # invoice, quotation, sales_order, customer
+    period = Column(String(10), nullable=False, default="")  # Financial year (e.g. 2025-26) or "" if not reset
+    next_value = Column(Integer, nullable=False, default=1)
+    updated_at = Column(DateTime(timezone=True), server_default=func.now(), onupdate=func.now())
+
+    __table_args__ = (
+        UniqueConstraint("company_id", "doc_type", "period", name="uq_document_sequence"),
+        {"mysql_engine": "InnoDB"},
+    )
+
+
+class DocumentSequenceGap(Base):
+    """Numbers that were allocated but never used on a document (GST gap register)"""
+    __tablename__ = "document_sequence_gaps"
+
+    id = Column(Integer, primary_key=True, index=True)
+    company_id = Column(Integer, nullable=False, index=True)
+    doc_type = Column(String(30), nullable=False, index=True)
+    period = Column(String(10), nullable=False, default="")
+    number = Column(Integer, nullable=False)
+    document_number = Column(String(50))  # Formatted number that was skipped
+    reason = Column(String(30))  # rolled_back, unused_block
+    created_at = Column(DateTime(timezone=True), server_default=func.now())
+
+
+# ============================================================
+# SEARCH INDEX
+# ============================================================
+
+class SearchTerm(Base):
+    """Inverted index: one row per searchable word of a customer or sales document"""
+    __tablename__ = "search_terms"
+
+    id = Column(Integer, primary_key=True, index=True)
+    company_id = Column(Integer, nullable=False)
+    doc_type = Column(String(20), nullable=False)  # customer, invoice, quotation, sales_order
+    doc_id = Column(Integer, nullable=False)
+    term = Column(String(64), nullable=False)  # Lower-case word; prefix searches are range scans on it
+    weight = Column(Integer, nullable=False, default=1)  # Higher for document numbers and names
+
+    __table_args__ = (
+        Index("ix_search_terms_lookup", "company_id", "doc_type", "term"),
+        Index("ix_search_terms_doc", "doc_type", "doc_id"),
+        {"mysql_engine": "InnoDB"},
+    )
+
+
+# ============================================================
+# ORDER LOOKUP INDEX
+# ============================================================
+
+class OrderLookupEntry(Base):
+    """One order-like record from any store (OMS, Mango uploads, channel tables, master sheet, dispatch)"""
+    __tablename__ = "order_lookup_entries"
+
+    id = Column(Integer, primary_key=True, index=True)
+    company_id = Column(Integer, nullable=False, default=0)  # 0 = OMS orders, which are not company scoped
+    source = Column(String(20), nullable=False)  # oms, mango, channel_table, master, dispatch
+    source_table = Column(String(100), nullable=False, default="")  # Physical table for channel_table rows
+    record_id = Column(Integer, nullable=False)
+    order_ref = Column(String(100))  # Channel order id / order number
+    channel = Column(String(100))
+    customer_name = Column(String(200))
+    status = Column(String(50))
+    order_date = Column(DateTime)
+
+    __table_args__ = (
+        UniqueConstraint("source", "source_table", "record_id", name="uq_order_lookup_entry"),
+        {"mysql_engine": "InnoDB"},
+    )
+
+
+class OrderLookupKey(Base):
+    """Normalized search key (order id, AWB, phone, SKU or name word) of an OrderLookupEntry"""
+    __tablename__ = "order_lookup_keys"
+
+    id = Column(Integer, primary_key=True, index=True)
+    company_id = Column(Integer, nullable=False, default=0)
+    source = Column(String(20), nullable=False)
+    source_table = Column(String(100), nullable=False, default="")
+    record_id = Column(Integer, nullable=False)
+    key_type = Column(String(20), nullable=False)  # order_id, awb, awb_suffix, phone, sku, email, name
+    lookup_key = Column(String(100), nullable=False)  # Lower-case, letters and digits only
+
+    __table_args__ = (
+        Index("ix_order_lookup_keys_key", "company_id", "lookup_key"),
+        Index("ix_order_lookup_keys_record", "source", "source_table", "record_id"),
+        {"mysql_engine": "InnoDB"},
+    )
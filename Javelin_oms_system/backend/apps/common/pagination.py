@@ -0,0 +1,165 @@
+"""
+Keyset pagination
+
+List endpoints page by seeking past the last row of the previous page
+(WHERE (sort columns) after (last values)) instead of OFFSET, so page 500
+costs the same as page 1. The position is handed to the client as an opaque
+cursor in the X-Next-Cursor response header; the response body is unchanged.
+
+Sort columns must end with a unique column (normally id). NULLs are treated
+as the lowest value, which is how SQLite and MySQL order them.
+
+Totals are optional because COUNT(*) over a large history is often the most
+expensive part of a page:
+    total=exact     COUNT(*) on every request
+    total=estimate  count cached per filter set for COUNT_CACHE_TTL seconds,
+                    so it may lag recent writes
+"""
+import base64
+import json
+import os
+from datetime import date, datetime
+from decimal import Decimal
+from typing import Any, Hashable, List, Optional, Sequence, Tuple
+
+from fastapi import HTTPException, Response
+from sqlalchemy import and_, false, or_
+
+from . import cache
+
+COUNT_CACHE_TTL = float(os.getenv("COUNT_CACHE_TTL", "60"))
+
+TOTAL_MODES = ("exact", "estimate")
+
+_count_cache = cache.ResponseCache()
+
+
+def encode_cursor(values: Sequence[Any]) -> str:
+    encoded = []
+    for value in values:
+        if isinstance(value, datetime):
+            encoded.append({"dt": value.isoformat()})
+        elif isinstance(value, date):
+            encoded.append({"d": value.isoformat()})
+        elif isinstance(value, Decimal):
+            encoded.append({"dec": str(value)})
+        else:
+            encoded.append(value)
+    raw = json.dumps(encoded, separators=(",", ":")).encode("utf-8")
+    return base64.urlsafe_b64encode(raw).decode("ascii").rstrip("=")
+
+
+def decode_cursor(cursor: str, size: int) -> List[Any]:
+    try:
+        raw = base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4))
+        encoded = json.loads(raw)
+        if not isinstance(encoded, list) or len(encoded) != size:
+            raise ValueError("wrong number of values")
+        values = []
+        for value in encoded:
+            if isinstance(value, dict):
+                if "dt" in value:
+                    value = datetime.fromisoformat(value["dt"])
+                elif "d" in value:
+                    value = date.fromisoformat(value["d"])
+                elif "dec" in value:
+                    value = Decimal(value["dec"])
+                else:
+                    raise ValueError("unknown value type")
+            values.append(value)
+        return values
+    except (ValueError, TypeError, KeyError):
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+
+
+def _after(column, value, descending: bool):
+    """Rows strictly after value in the sort order (NULL lowest)"""
+    if value is None:
+        return column.isnot(None) if not descending else None
+    if descending:
+        return or_(column < value, column.is_(None))
+    return column > value
+
+
+def _same(column, value):
+    return column.is_(None) if value is None else column == value
+
+
+def seek_filter(sort: Sequence[Tuple[Any, bool]], values: Sequence[Any]):
+    """WHERE clause selecting the rows after `values` for the given (column, descending) sort"""
+    clause = None
+    for (column, descending), value in reversed(list(zip(sort, values))):
+        after = _after(column, value, descending)
+        if clause is None:
+            # Nothing comes after NULL in a descending last column
+            clause = after if after is not None else false()
+        else:
+            tail = and_(_same(column, value), clause)
+            clause = tail if after is None else or_(after, tail)
+    return clause
+
+
+class Page:
+    def __init__(self, items: list, next_cursor: Optional[str], total: Optional[int] = None,
+                 total_is_estimate: bool = False):
+        self.items = items
+        self.next_cursor = next_cursor
+        self.total = total
+        self.total_is_estimate = total_is_estimate
+
+    def apply_headers(self, response: Response):
+        if self.next_cursor:
+            response.headers["X-Next-Cursor"] = self.next_cursor
+        if self.total is not None:
+            response.headers["X-Total-Count"] = str(self.total)
+            if self.total_is_estimate:
+                response.headers["X-Total-Count-Estimated"] = "true"
+
+
+def count_rows(query, mode: Optional[str], count_key: Hashable = None) -> Optional[int]:
+    if not mode:
+        return None
+    if mode not in TOTAL_MODES:
+        raise HTTPException(status_code=400, detail=f"total must be one of: {', '.join(TOTAL_MODES)}")
+
+    count_query = query.enable_eagerloads(False).order_by(None)
+    if mode == "estimate" and count_key is not None:
+        return _count_cache.get_or_compute(
+            count_key, (), count_query.count, ttl=COUNT_CACHE_TTL, stale_ttl=COUNT_CACHE_TTL
+        )
+    return count_query.count()
+
+
+def paginate(
+    query,
+    sort: Sequence[Tuple[Any, bool]],
+    limit: int,
+    cursor: Optional[str] = None,
+    offset: int = 0,
+    total: Optional[str] = None,
+    count_key: Hashable = None
+) -> Page:
+    """
+    One page of query ordered by sort, a list of (column, descending) pairs.
+
+    With a cursor the page starts right after the row it points at and offset
+    is ignored; without one offset still works for existing callers. count_key
+    identifies the filter set for total=estimate.
+    """
+    total_count = count_rows(query, total, count_key)
+
+    if cursor:
+        query = query.filter(seek_filter(sort, decode_cursor(cursor, len(sort))))
+    query = query.order_by(*[column.desc() if descending else column.asc() for column, descending in sort])
+    if offset and not cursor:
+        query = query.offset(offset)
+
+    # Sort values ride along with each row so the cursor can come from
+    # expressions that are not attributes of the entity (e.g. a search rank)
+    rows = query.add_columns(*[column for column, _ in sort]).limit(limit + 1).all()
+    next_cursor = None
+    if len(rows) > limit:
+        rows = rows[:limit]
+        next_cursor = encode_cursor(list(rows[-1][1:]))
+
+    return Page([row[0] for row in rows], next_cursor, total_count, total == "estimate")
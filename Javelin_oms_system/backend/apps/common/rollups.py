@@ -0,0 +1,464 @@
+"""
+Analytics rollups
+
+Daily/monthly aggregates of orders, dispatch scans and customer ledger rows,
+plus per-customer running balances and open invoices by due day for aging,
+updated incrementally by the write paths and rebuilt from scratch with
+backend/rebuild_rollups.py. Readers should only trust a rollup family once
+is_ready() reports it has been rebuilt at least once.
+"""
+from collections import defaultdict
+from datetime import date, datetime
+from decimal import Decimal
+from typing import Dict, Iterable, Optional
+
+from sqlalchemy import func, or_
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import Session
+
+from . import models
+
+ORDERS = "orders"
+DISPATCH = "dispatch"
+CUSTOMER_LEDGER = "customer_ledger"
+CUSTOMER_BALANCES = "customer_balances"
+OPEN_ITEMS = "open_items"  # customer_open_items, built by the receivables matching engine
+
+# Families seen as ready by this process (state only ever moves to ready)
+_ready = set()
+
+
+def is_ready(db: Session, name: str) -> bool:
+    """True once the rollup family has been rebuilt"""
+    if name in _ready:
+        return True
+    if db.query(models.RollupState.name).filter(models.RollupState.name == name).first():
+        _ready.add(name)
+        return True
+    return False
+
+
+def _to_day(value) -> Optional[date]:
+    if value is None:
+        return None
+    if isinstance(value, datetime):
+        return value.date()
+    if isinstance(value, date):
+        return value
+    return date.fromisoformat(str(value)[:10])
+
+
+def month_key(db: Session, column):
+    """YYYY-MM of a datetime column, computed by the database"""
+    dialect = db.get_bind().dialect.name
+    if dialect == "sqlite":
+        return func.strftime("%Y-%m", column)
+    if dialect == "postgresql":
+        return func.to_char(column, "YYYY-MM")
+    return func.date_format(column, "%Y-%m")
+
+
+def _bump(db: Session, model, key: Dict, increments: Dict, assign: Optional[Dict] = None):
+    """Add increments to the rollup row for key, creating it if needed"""
+    row = db.query(model).filter_by(**key).with_for_update().first()
+    if row is None:
+        try:
+            with db.begin_nested():
+                row = model(**key, **{column: 0 for column in increments})
+                db.add(row)
+        except IntegrityError:
+            # Another writer created it first
+            row = db.query(model).filter_by(**key).with_for_update().first()
+
+    for column, delta in increments.items():
+        setattr(row, column, (getattr(row, column) or 0) + delta)
+    for column, value in (assign or {}).items():
+        setattr(row, column, value)
+    return row
+
+
+# ============================================================
+# ORDERS
+# ============================================================
+
+def record_order(db: Session, order: models.Order, sign: int = 1, status: Optional[str] = None):
+    """Count (sign=1) or uncount (sign=-1) an order in its daily rollup"""
+    day = _to_day(order.purchase_date)
+    if day is None:
+        return
+    _bump(db, models.OrderDailyRollup, {
+        "day": day,
+        "platform_id": order.platform_id or 0,
+        "order_status": (status if status is not None else order.order_status) or "",
+    }, {
+        "order_count": sign,
+        "revenue": sign * Decimal(str(order.order_total or 0)),
+    })
+
+
+def record_order_status_change(db: Session, order: models.Order, old_status: Optional[str]):
+    """Move an order between status buckets after order.order_status changed"""
+    if (old_status or "") == (order.order_status or ""):
+        return
+    record_order(db, order, sign=-1, status=old_status or "")
+    record_order(db, order, sign=1)
+
+
+# ============================================================
+# DISPATCH SCANS
+# ============================================================
+
+def dispatch_key(scan: models.DispatchScan) -> Optional[Dict]:
+    """Rollup key for a scan; take it before changing a scan to move its count"""
+    day = _to_day(scan.scanned_at)
+    if day is None:
+        return None
+    return {
+        "company_id": scan.company_id,
+        "day": day,
+        "courier_partner": scan.courier_partner or "",
+        "platform_name": scan.platform_name or "",
+        "dispatch_status": scan.dispatch_status or "",
+    }
+
+
+def record_dispatch_scan(db: Session, scan: models.DispatchScan, previous_key: Optional[Dict] = None):
+    """Count a new scan, or move an updated one from previous_key to its current key"""
+    key = dispatch_key(scan)
+    if previous_key == key:
+        return
+    if previous_key:
+        _bump(db, models.DispatchDailyRollup, previous_key, {"scan_count": -1})
+    if key:
+        _bump(db, models.DispatchDailyRollup, key, {"scan_count": 1})
+
+
+def record_dispatch_scans(db: Session, changes: Iterable):
+    """record_dispatch_scan for a batch of (scan, previous_key) pairs, one update per rollup row"""
+    deltas = defaultdict(int)
+    for scan, previous_key in changes:
+        key = dispatch_key(scan)
+        if previous_key == key:
+            continue
+        if previous_key:
+            deltas[tuple(sorted(previous_key.items()))] -= 1
+        if key:
+            deltas[tuple(sorted(key.items()))] += 1
+    for key, delta in sorted(deltas.items()):
+        if delta:
+            _bump(db, models.DispatchDailyRollup, dict(key), {"scan_count": delta})
+
+
+# ============================================================
+# CUSTOMER LEDGER
+# ============================================================
+
+def record_ledger_entry(db: Session, entry: models.CustomerLedger):
+    """Add a new ledger entry to its customer's monthly rollup"""
+    record_ledger_entries(db, [entry])
+
+
+def record_ledger_entries(db: Session, entries):
+    """record_ledger_entry for many entries, one rollup update per customer/month/type"""
+    grouped = {}
+    for entry in entries:
+        key = (entry.customer_id, entry.transaction_date.strftime("%Y-%m"), entry.transaction_type)
+        group = grouped.get(key)
+        if group is None:
+            group = grouped[key] = {"entry": entry, "count": 0, "debit": Decimal(0), "credit": Decimal(0)}
+        group["count"] += 1
+        group["debit"] += Decimal(str(entry.debit_amount or 0))
+        group["credit"] += Decimal(str(entry.credit_amount or 0))
+        if entry.transaction_date >= group["entry"].transaction_date:
+            group["entry"] = entry
+
+    for (customer_id, month, transaction_type), group in grouped.items():
+        latest = group["entry"]
+        row = _bump(db, models.CustomerLedgerMonthlyRollup, {
+            "customer_id": customer_id,
+            "month": month,
+            "transaction_type": transaction_type,
+        }, {
+            "entry_count": group["count"],
+            "debit_total": group["debit"],
+            "credit_total": group["credit"],
+        }, {
+            "company_id": latest.company_id,
+        })
+        if row.last_transaction_at is None or latest.transaction_date >= row.last_transaction_at:
+            row.last_transaction_at = latest.transaction_date
+            row.closing_balance = latest.balance or 0
+
+    _record_balances(db, entries)
+
+
+def _is_open_invoice(entry) -> bool:
+    # is_reconciled is still None on entries that have not been flushed yet
+    return entry.transaction_type == "INVOICE" and not entry.is_reconciled
+
+
+def _record_open_invoices(db: Session, changes: Iterable):
+    """Apply (invoice, count delta, amount delta) changes to customers' open amounts and aging"""
+    summaries = {}
+    aging = {}
+    for invoice, count, amount in changes:
+        totals = summaries.setdefault(invoice.customer_id, [invoice.company_id, 0, Decimal(0)])
+        totals[1] += count
+        totals[2] += amount
+        day = _to_day(invoice.due_date)
+        if day is not None:
+            totals = aging.setdefault((invoice.customer_id, day), [invoice.company_id, 0, Decimal(0)])
+            totals[1] += count
+            totals[2] += amount
+
+    for customer_id, (company_id, count, amount) in summaries.items():
+        _bump(db, models.CustomerBalanceSummary, {"customer_id": customer_id}, {
+            "open_invoice_count": count,
+            "open_invoice_amount": amount,
+        }, {"company_id": company_id})
+    for (customer_id, day), (company_id, count, amount) in aging.items():
+        _bump(db, models.CustomerAgingRollup, {"customer_id": customer_id, "due_day": day}, {
+            "invoice_count": count,
+            "open_amount": amount,
+        }, {"company_id": company_id})
+
+
+def _record_balances(db: Session, entries):
+    """Roll new ledger entries into their customers' balance summaries"""
+    grouped = {}
+    for entry in entries:
+        group = grouped.get(entry.customer_id)
+        if group is None:
+            group = grouped[entry.customer_id] = {"entry": entry, "count": 0, "debit": Decimal(0), "credit": Decimal(0)}
+        group["count"] += 1
+        group["debit"] += Decimal(str(entry.debit_amount or 0))
+        group["credit"] += Decimal(str(entry.credit_amount or 0))
+        if entry.transaction_date >= group["entry"].transaction_date:
+            group["entry"] = entry
+
+    for customer_id, group in grouped.items():
+        latest = group["entry"]
+        row = _bump(db, models.CustomerBalanceSummary, {"customer_id": customer_id}, {
+            "entry_count": group["count"],
+            "debit_total": group["debit"],
+            "credit_total": group["credit"],
+        }, {
+            "company_id": latest.company_id,
+        })
+        if row.last_transaction_at is None or latest.transaction_date >= row.last_transaction_at:
+            row.last_transaction_at = latest.transaction_date
+            row.closing_balance = latest.balance or 0
+
+    _record_open_invoices(db, [
+        (entry, 1, Decimal(str(entry.debit_amount or 0))) for entry in entries if _is_open_invoice(entry)
+    ])
+
+
+def record_invoice_payments(db: Session, payments):
+    """
+    Reduce open amounts and aging by payments matched to invoices.
+    payments are (invoice, amount applied, fully paid) where invoice has
+    customer_id, company_id and due_date (a ledger entry or its open item).
+    """
+    _record_open_invoices(db, [
+        (invoice, -1 if paid else 0, -Decimal(str(amount))) for invoice, amount, paid in payments
+    ])
+
+
+# ============================================================
+# REBUILD
+# ============================================================
+
+def _mark_ready(db: Session, name: str):
+    state = db.query(models.RollupState).filter(models.RollupState.name == name).first()
+    if state:
+        state.rebuilt_at = datetime.now()
+    else:
+        db.add(models.RollupState(name=name, rebuilt_at=datetime.now()))
+
+
+def rebuild_orders(db: Session) -> int:
+    """Recompute order_daily_rollups from the orders table"""
+    day = func.date(models.Order.purchase_date)
+    grouped = db.query(
+        day,
+        models.Order.platform_id,
+        models.Order.order_status,
+        func.count(models.Order.id),
+        func.sum(models.Order.order_total)
+    ).filter(
+        models.Order.purchase_date.isnot(None)
+    ).group_by(
+        day, models.Order.platform_id, models.Order.order_status
+    ).all()
+
+    # NULL platform/status fold into the same bucket, so merge before inserting
+    merged = {}
+    for row_day, platform_id, status, count, revenue in grouped:
+        key = (_to_day(row_day), platform_id or 0, status or "")
+        totals = merged.setdefault(key, [0, Decimal(0)])
+        totals[0] += count
+        totals[1] += Decimal(str(revenue or 0))
+
+    db.query(models.OrderDailyRollup).delete(synchronize_session=False)
+    db.bulk_insert_mappings(models.OrderDailyRollup, [
+        {"day": d, "platform_id": p, "order_status": s, "order_count": c, "revenue": r}
+        for (d, p, s), (c, r) in merged.items()
+    ])
+    _mark_ready(db, ORDERS)
+    return len(merged)
+
+
+def rebuild_dispatch(db: Session) -> int:
+    """Recompute dispatch_daily_rollups from the dispatch_scans table"""
+    day = func.date(models.DispatchScan.scanned_at)
+    grouped = db.query(
+        models.DispatchScan.company_id,
+        day,
+        models.DispatchScan.courier_partner,
+        models.DispatchScan.platform_name,
+        models.DispatchScan.dispatch_status,
+        func.count(models.DispatchScan.id)
+    ).group_by(
+        models.DispatchScan.company_id,
+        day,
+        models.DispatchScan.courier_partner,
+        models.DispatchScan.platform_name,
+        models.DispatchScan.dispatch_status
+    ).all()
+
+    merged = {}
+    for company_id, row_day, courier, platform_name, status, count in grouped:
+        key = (company_id, _to_day(row_day), courier or "", platform_name or "", status or "")
+        merged[key] = merged.get(key, 0) + count
+
+    db.query(models.DispatchDailyRollup).delete(synchronize_session=False)
+    db.bulk_insert_mappings(models.DispatchDailyRollup, [
+        {
+            "company_id": c, "day": d, "courier_partner": cp,
+            "platform_name": p, "dispatch_status": s, "scan_count": n
+        }
+        for (c, d, cp, p, s), n in merged.items()
+    ])
+    _mark_ready(db, DISPATCH)
+    return len(merged)
+
+
+def rebuild_customer_ledger(db: Session) -> int:
+    """Recompute customer_ledger_monthly_rollups from the customer_ledger table"""
+    entries = db.query(
+        models.CustomerLedger.company_id,
+        models.CustomerLedger.customer_id,
+        models.CustomerLedger.transaction_date,
+        models.CustomerLedger.transaction_type,
+        models.CustomerLedger.debit_amount,
+        models.CustomerLedger.credit_amount,
+        models.CustomerLedger.balance
+    ).order_by(
+        models.CustomerLedger.transaction_date, models.CustomerLedger.id
+    ).yield_per(5000)
+
+    rollup = {}
+    for company_id, customer_id, txn_date, txn_type, debit, credit, balance in entries:
+        key = (customer_id, txn_date.strftime("%Y-%m"), txn_type)
+        row = rollup.get(key)
+        if row is None:
+            row = rollup[key] = {
+                "company_id": company_id, "customer_id": customer_id,
+                "month": key[1], "transaction_type": txn_type,
+                "entry_count": 0, "debit_total": Decimal(0), "credit_total": Decimal(0),
+            }
+        row["entry_count"] += 1
+        row["debit_total"] += Decimal(str(debit or 0))
+        row["credit_total"] += Decimal(str(credit or 0))
+        # Rows arrive in date order, so the last one seen closes the month
+        row["closing_balance"] = balance or 0
+        row["last_transaction_at"] = txn_date
+
+    db.query(models.CustomerLedgerMonthlyRollup).delete(synchronize_session=False)
+    db.bulk_insert_mappings(models.CustomerLedgerMonthlyRollup, list(rollup.values()))
+    _mark_ready(db, CUSTOMER_LEDGER)
+    return len(rollup)
+
+
+def _open_invoice_filter():
+    return (
+        models.CustomerLedger.transaction_type == "INVOICE",
+        or_(models.CustomerLedger.is_reconciled == False, models.CustomerLedger.is_reconciled.is_(None)),
+    )
+
+
+def rebuild_customer_balances(db: Session) -> int:
+    """Recompute customer_balance_summaries and customer_aging_rollups from the customer_ledger table"""
+    ledger = models.CustomerLedger
+    summaries = {}
+    for company_id, customer_id, count, debit, credit in db.query(
+        func.max(ledger.company_id),
+        ledger.customer_id,
+        func.count(ledger.id),
+        func.sum(ledger.debit_amount),
+        func.sum(ledger.credit_amount)
+    ).group_by(ledger.customer_id).all():
+        summaries[customer_id] = {
+            "company_id": company_id, "customer_id": customer_id, "entry_count": count,
+            "debit_total": debit or 0, "credit_total": credit or 0,
+            "open_invoice_count": 0, "open_invoice_amount": 0,
+        }
+
+    # Closing balance = balance of each customer's latest entry
+    latest = db.query(
+        ledger.customer_id, func.max(ledger.transaction_date).label("last_at")
+    ).group_by(ledger.customer_id).subquery()
+    for customer_id, last_at, balance in db.query(
+        ledger.customer_id, ledger.transaction_date, ledger.balance
+    ).join(
+        latest, (ledger.customer_id == latest.c.customer_id) & (ledger.transaction_date == latest.c.last_at)
+    ).order_by(ledger.id):
+        summaries[customer_id]["last_transaction_at"] = last_at
+        summaries[customer_id]["closing_balance"] = balance or 0
+
+    # Open invoices: what the matching engine says is still unpaid once it has
+    # been built, otherwise every unreconciled invoice in full
+    if is_ready(db, OPEN_ITEMS):
+        item = models.CustomerOpenItem
+        source, amount_column, due_column = item, item.open_amount, item.due_date
+        open_filter = (item.side == "DEBIT", item.transaction_type == "INVOICE")
+    else:
+        source, amount_column, due_column = ledger, ledger.debit_amount, ledger.due_date
+        open_filter = _open_invoice_filter()
+
+    for customer_id, count, amount in db.query(
+        source.customer_id, func.count(source.id), func.sum(amount_column)
+    ).filter(*open_filter).group_by(source.customer_id).all():
+        if customer_id in summaries:
+            summaries[customer_id]["open_invoice_count"] = count
+            summaries[customer_id]["open_invoice_amount"] = amount or 0
+
+    due_day = func.date(due_column)
+    aging = {}
+    for company_id, customer_id, day, count, amount in db.query(
+        func.max(source.company_id), source.customer_id, due_day, func.count(source.id), func.sum(amount_column)
+    ).filter(
+        *open_filter, due_column.isnot(None)
+    ).group_by(source.customer_id, due_day).all():
+        aging[(customer_id, _to_day(day))] = {
+            "company_id": company_id, "customer_id": customer_id, "due_day": _to_day(day),
+            "invoice_count": count, "open_amount": amount or 0,
+        }
+
+    db.query(models.CustomerBalanceSummary).delete(synchronize_session=False)
+    db.query(models.CustomerAgingRollup).delete(synchronize_session=False)
+    db.bulk_insert_mappings(models.CustomerBalanceSummary, list(summaries.values()))
+    db.bulk_insert_mappings(models.CustomerAgingRollup, list(aging.values()))
+    _mark_ready(db, CUSTOMER_BALANCES)
+    return len(summaries) + len(aging)
+
+
+def rebuild_all(db: Session) -> Dict[str, int]:
+    """Rebuild every rollup family; caller commits"""
+    return {
+        ORDERS: rebuild_orders(db),
+        DISPATCH: rebuild_dispatch(db),
+        CUSTOMER_LEDGER: rebuild_customer_ledger(db),
+        CUSTOMER_BALANCES: rebuild_customer_balances(db),
+    }
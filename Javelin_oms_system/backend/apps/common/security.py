@@ -1,4 +1,7 @@
 import os
+import asyncio
+import threading
+from concurrent.futures import Executor, ProcessPoolExecutor, ThreadPoolExecutor
 from datetime import datetime, timedelta
 from typing import Optional, Any, Union
 from jose import jwt
@@ -12,6 +15,11 @@ SECRET_KEY = os.getenv("SECRET_KEY", "09d25e094faa6ca2556c818166b7a9563b93f7099f
 ALGORITHM = "HS256"
 ACCESS_TOKEN_EXPIRE_MINUTES = 60 * 24  # 24 hours
 
+# Password hashing
+BCRYPT_ROUNDS = int(os.getenv("BCRYPT_ROUNDS", "12"))  # Existing hashes are upgraded/downgraded on login
+HASHING_WORKERS = int(os.getenv("HASHING_WORKERS", "4"))
+HASHING_EXECUTOR = os.getenv("HASHING_EXECUTOR", "thread")  # "thread" or "process"
+
 
 def verify_password(plain_password: str, hashed_password: str) -> bool:
     """Verify a plain password against its hash"""
@@ -24,9 +32,62 @@ def verify_password(plain_password: str, hashed_password: str) -> bool:
         return False
 
 
-def get_password_hash(password: str) -> str:
+def get_password_hash(password: str, rounds: Optional[int] = None) -> str:
     """Generate password hash"""
-    return bcrypt.hashpw(password.encode('utf-8'), bcrypt.gensalt()).decode('utf-8')
+    salt = bcrypt.gensalt(rounds=rounds or BCRYPT_ROUNDS)
+    return bcrypt.hashpw(password.encode('utf-8'), salt).decode('utf-8')
+
+
+def password_needs_rehash(hashed_password: str) -> bool:
+    """True when the hash was made with a different cost than BCRYPT_ROUNDS"""
+    try:
+        # $2b$12$<salt+hash>
+        return int(hashed_password.split("$")[2]) != BCRYPT_ROUNDS
+    except (IndexError, ValueError, AttributeError):
+        return False
+
+
+# --- Hashing executor ---
+# bcrypt is deliberately slow; running it on the shared request threadpool lets a
+# burst of logins starve every other sync endpoint. Hashing gets its own
+# fixed-size pool instead, optionally of processes.
+
+_hashing_executor: Optional[Executor] = None
+_hashing_executor_lock = threading.Lock()
+
+
+def get_hashing_executor() -> Executor:
+    global _hashing_executor
+    if _hashing_executor is None:
+        with _hashing_executor_lock:
+            if _hashing_executor is None:
+                if HASHING_EXECUTOR == "process":
+                    _hashing_executor = ProcessPoolExecutor(max_workers=HASHING_WORKERS)
+                else:
+                    _hashing_executor = ThreadPoolExecutor(
+                        max_workers=HASHING_WORKERS, thread_name_prefix="password-hashing"
+                    )
+    return _hashing_executor
+
+
+def shutdown_hashing_executor():
+    global _hashing_executor
+    with _hashing_executor_lock:
+        if _hashing_executor is not None:
+            _hashing_executor.shutdown(wait=False)
+            _hashing_executor = None
+
+
+async def verify_password_async(plain_password: str, hashed_password: str) -> bool:
+    """verify_password on the hashing executor"""
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(get_hashing_executor(), verify_password, plain_password, hashed_password)
+
+
+async def get_password_hash_async(password: str) -> str:
+    """get_password_hash on the hashing executor"""
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(get_hashing_executor(), get_password_hash, password, BCRYPT_ROUNDS)
 
 
 def create_access_token(data: dict, expires_delta: Optional[timedelta] = None) -> str:
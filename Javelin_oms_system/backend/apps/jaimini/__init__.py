@@ -0,0 +1 @@
+"""Jaimini Intelligence: analytics over the columnar exports"""
@@ -0,0 +1,262 @@
+"""
+Jaimini Analytics
+Answers declarative aggregate queries (metrics by dimensions, optionally by a
+bucketed date) from the columnar exports (mango/columnar_export.py) instead of
+the live database. Hive partitions (company, channel, month) are pruned before
+any file is read; filtering, date bucketing and grouping run vectorised in
+Arrow.
+
+Results are cached by company, query fingerprint and snapshot version. Every
+export run that writes rows bumps the version, so a cached answer is never
+older than the files it was computed from.
+"""
+
+import hashlib
+import json
+import os
+from datetime import datetime, timedelta
+from typing import Dict, List, Optional, Tuple
+
+from ..common import cache
+from ..mango import columnar_export
+from .schemas import AnalyticsFilter, AnalyticsQuery
+
+ANALYTICS_CACHE_ENTRIES = int(os.getenv("ANALYTICS_CACHE_ENTRIES", "500"))
+ANALYTICS_CACHE_TTL = float(os.getenv("ANALYTICS_CACHE_TTL", "3600"))  # Upper bound; new snapshots invalidate sooner
+
+COUNT = "count"
+AGGREGATES = {"sum": "sum", "avg": "mean", "min": "min", "max": "max", "count_distinct": "count_distinct"}
+PERIOD = "period"
+DATASET_FORMATS = {"parquet": "parquet", "arrow": "ipc"}
+
+_results = cache.ResponseCache(ANALYTICS_CACHE_ENTRIES)
+
+
+def _metric(metric: str) -> Tuple[str, Optional[str], str]:
+    """(aggregate, field, result column) of "count" or "<aggregate>:<field>\""""
+    if metric == COUNT:
+        return COUNT, None, COUNT
+    aggregate, _, field = metric.partition(":")
+    if aggregate not in AGGREGATES or not field:
+        raise ValueError(f"Unknown metric '{metric}'; use {COUNT} or <{'|'.join(AGGREGATES)}>:<field>")
+    return aggregate, field, f"{aggregate}_{field}"
+
+
+def _naive(value: datetime) -> datetime:
+    # Exported timestamps are naive, like the database's
+    return value.replace(tzinfo=None)
+
+
+def _partitioning(spec: columnar_export.Dataset):
+    """
+    The export's directory layout with its types spelled out; inferring them
+    fails when every channel directory is the null partition
+    """
+    import pyarrow as pa
+    import pyarrow.dataset as ds
+
+    fields = [("company", pa.int64())]
+    if spec.channel_column:
+        fields.append(("channel", pa.int64()))
+    fields.append(("month", pa.string()))
+    return ds.partitioning(pa.schema(fields), flavor="hive")
+
+
+def _open(name: str, fmt: str):
+    import pyarrow.dataset as ds
+
+    if name not in columnar_export.DATASETS:
+        raise ValueError(f"Unknown dataset '{name}'; available: {', '.join(columnar_export.DATASETS)}")
+    path = columnar_export.dataset_path(name)
+    if not os.path.isdir(path):
+        raise ValueError(f"Dataset '{name}' has not been exported yet")
+    return ds.dataset(path, format=DATASET_FORMATS[fmt], partitioning=_partitioning(columnar_export.DATASETS[name]))
+
+
+def _is_numeric(field_type) -> bool:
+    import pyarrow as pa
+
+    return pa.types.is_integer(field_type) or pa.types.is_floating(field_type) or pa.types.is_decimal(field_type)
+
+
+def _is_orderable(field_type) -> bool:
+    import pyarrow as pa
+
+    return (_is_numeric(field_type) or pa.types.is_temporal(field_type)
+            or pa.types.is_string(field_type) or pa.types.is_large_string(field_type))
+
+
+def _check_fields(schema, names: List[str], metrics: List[Tuple[str, Optional[str], str]]):
+    unknown = [name for name in dict.fromkeys(names) if schema.get_field_index(name) < 0]
+    if unknown:
+        raise ValueError(f"Unknown fields: {', '.join(unknown)}")
+    for aggregate, field, _ in metrics:
+        if not field:
+            continue
+        field_type = schema.field(field).type
+        if aggregate in ("sum", "avg") and not _is_numeric(field_type):
+            raise ValueError(f"'{aggregate}' needs a numeric field; {field} is {field_type}")
+        if aggregate in ("min", "max") and not _is_orderable(field_type):
+            raise ValueError(f"'{aggregate}' needs a numeric, date or text field; {field} is {field_type}")
+
+
+def _value(field, value):
+    """value coerced to the field's type, for comparing against it"""
+    import pyarrow as pa
+
+    if isinstance(value, list):
+        return [_value(field, item) for item in value]
+    if value is None:
+        return None
+
+    field_type = field.type
+    try:
+        if pa.types.is_timestamp(field_type) or pa.types.is_date(field_type):
+            if isinstance(value, str):
+                return _naive(datetime.fromisoformat(value))
+        elif _is_numeric(field_type):
+            if isinstance(value, bool):
+                raise TypeError
+            if isinstance(value, str):
+                number = float(value)
+                return int(number) if pa.types.is_integer(field_type) and number.is_integer() else number
+            if not isinstance(value, (int, float)):
+                raise TypeError
+        elif pa.types.is_boolean(field_type):
+            if isinstance(value, str) and value.lower() in ("true", "false"):
+                return value.lower() == "true"
+            if not isinstance(value, bool):
+                raise TypeError
+        elif pa.types.is_string(field_type) or pa.types.is_large_string(field_type):
+            if isinstance(value, (dict, bool)):
+                raise TypeError
+            return str(value)
+    except (TypeError, ValueError):
+        raise ValueError(f"{value!r} is not a valid {field_type} value for {field.name}")
+    return value
+
+
+def _condition(schema, condition: AnalyticsFilter):
+    import pyarrow.dataset as ds
+
+    column = ds.field(condition.field)
+    if condition.op == "is_null":
+        return column.is_null()
+    if condition.op == "not_null":
+        return column.is_valid()
+
+    value = _value(schema.field(condition.field), condition.value)
+    if condition.op in ("in", "not_in"):
+        if not isinstance(value, list):
+            raise ValueError(f"'{condition.op}' on {condition.field} needs a list of values")
+        return column.isin(value) if condition.op == "in" else ~column.isin(value)
+    if value is None:
+        raise ValueError(f"'{condition.op}' on {condition.field} needs a value")
+    return {
+        "eq": lambda: column == value,
+        "ne": lambda: column != value,
+        "gt": lambda: column > value,
+        "gte": lambda: column >= value,
+        "lt": lambda: column < value,
+        "lte": lambda: column <= value,
+    }[condition.op]()
+
+
+def _execute(company_id: int, query: AnalyticsQuery, state: Dict) -> Dict:
+    import pyarrow as pa
+    import pyarrow.compute as pc
+    import pyarrow.dataset as ds
+
+    dataset = _open(query.dataset, state.get("format", columnar_export.COLUMNAR_EXPORT_FORMAT))
+    spec = columnar_export.DATASETS[query.dataset]
+    date_field = spec.time_columns[0]
+    metrics = list(dict.fromkeys(_metric(metric) for metric in query.metrics))
+    metric_fields = [field for _, field, _ in metrics if field]
+    _check_fields(
+        dataset.schema, query.dimensions + metric_fields + [condition.field for condition in query.filters], metrics
+    )
+
+    # Partition pruning first: the company's files, then the months in range
+    company = company_id if spec.company_scoped else columnar_export.OMS_COMPANY
+    expression = ds.field("company") == company
+    if query.date_from:
+        date_from = _naive(query.date_from)
+        expression &= (ds.field("month") >= f"{date_from:%Y-%m}") & (ds.field(date_field) >= date_from)
+    if query.date_to:
+        date_to = _naive(query.date_to)
+        expression &= (ds.field("month") <= f"{date_to:%Y-%m}") & (ds.field(date_field) < date_to + timedelta(days=1))
+    for condition in query.filters:
+        expression &= _condition(dataset.schema, condition)
+
+    columns = list(dict.fromkeys(query.dimensions + metric_fields + ([date_field] if query.date_grain else [])))
+    table = dataset.to_table(columns=columns, filter=expression)
+
+    keys = list(query.dimensions)
+    if query.date_grain:
+        periods = pc.floor_temporal(table[date_field], unit=query.date_grain, week_starts_monday=True)
+        table = table.append_column(PERIOD, periods)
+        keys = [PERIOD] + keys
+
+    labels = [label for _, _, label in metrics]
+    if keys:
+        grouped = table.group_by(keys).aggregate([
+            ([], "count_all") if aggregate == COUNT else (field, AGGREGATES[aggregate])
+            for aggregate, field, _ in metrics
+        ])
+        names = {
+            "count_all" if aggregate == COUNT else f"{field}_{AGGREGATES[aggregate]}": label
+            for aggregate, field, label in metrics
+        }
+        result = grouped.rename_columns([names.get(name, name) for name in grouped.column_names]).select(keys + labels)
+    else:
+        result = pa.table({
+            label: [table.num_rows if aggregate == COUNT else getattr(pc, AGGREGATES[aggregate])(table[field]).as_py()]
+            for aggregate, field, label in metrics
+        })
+
+    if query.order_by:
+        if query.order_by not in result.column_names:
+            raise ValueError(f"Cannot order by '{query.order_by}'; use one of {', '.join(result.column_names)}")
+        result = result.sort_by([(query.order_by, "descending" if query.descending else "ascending")])
+    elif keys:
+        result = result.sort_by([(key, "descending" if query.descending else "ascending") for key in keys])
+
+    return {
+        "dataset": query.dataset,
+        "snapshot_version": state["version"],
+        "columns": result.column_names,
+        "rows": result.slice(0, query.limit).to_pylist(),
+        "row_count": result.num_rows,
+        "truncated": result.num_rows > query.limit,
+        "computed_at": datetime.now(),
+    }
+
+
+def run_query(company_id: int, query: AnalyticsQuery) -> Dict:
+    """Result of query for a company, from the cache while the snapshot is unchanged"""
+    state = columnar_export.load_state()
+    fingerprint = hashlib.sha256(json.dumps(query.model_dump(mode="json"), sort_keys=True).encode()).hexdigest()
+    return _results.get_or_compute(
+        (company_id, fingerprint, state["version"]), (),
+        lambda: _execute(company_id, query, state),
+        ttl=ANALYTICS_CACHE_TTL, stale_ttl=0
+    )
+
+
+def datasets() -> List[Dict]:
+    """Exported datasets with their fields"""
+    state = columnar_export.load_state()
+    available = []
+    for name, spec in columnar_export.DATASETS.items():
+        if not os.path.isdir(columnar_export.dataset_path(name)):
+            continue
+        schema = _open(name, state.get("format", columnar_export.COLUMNAR_EXPORT_FORMAT)).schema
+        progress = state["datasets"].get(name, {})
+        available.append({
+            "name": name,
+            "date_field": spec.time_columns[0],
+            "fields": [{"name": field.name, "type": str(field.type)} for field in schema],
+            "rows": progress.get("rows", 0),
+            "last_exported_at": progress.get("exported_at"),
+        })
+    return available
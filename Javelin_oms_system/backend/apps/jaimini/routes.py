@@ -0,0 +1,48 @@
+"""Jaimini Intelligence analytics API"""
+from fastapi import APIRouter, Depends, HTTPException
+from typing import List
+
+from ..common import models
+from ..common.dependencies import AppAccessChecker
+from . import analytics
+from .schemas import AnalyticsDataset, AnalyticsQuery, AnalyticsResult
+
+router = APIRouter(prefix="/analytics")
+
+require_jaimini = AppAccessChecker("jaimini")
+
+
+def _arrow_errors():
+    """Arrow's errors for a query that does not fit the data (a type mismatch, say), when pyarrow is installed"""
+    try:
+        import pyarrow as pa
+    except ImportError:
+        return ()
+    return (pa.lib.ArrowInvalid, pa.lib.ArrowTypeError, pa.lib.ArrowNotImplementedError)
+
+
+def _run(function, *args):
+    try:
+        return function(*args)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    except ImportError:
+        raise HTTPException(status_code=503, detail="Analytics is not available: pyarrow is not installed on the server")
+    except _arrow_errors() as e:
+        raise HTTPException(status_code=400, detail=f"Query does not fit the data: {e}")
+
+
+@router.get("/datasets", response_model=List[AnalyticsDataset])
+def list_analytics_datasets(current_user: models.User = Depends(require_jaimini)):
+    """Exported datasets and their queryable fields (refreshed by backend/export_columnar.py)"""
+    return _run(analytics.datasets)
+
+
+@router.post("/query", response_model=AnalyticsResult)
+def run_analytics_query(query: AnalyticsQuery, current_user: models.User = Depends(require_jaimini)):
+    """
+    Aggregate one dataset, e.g. order count and revenue by platform per week:
+    {"dataset": "orders", "metrics": ["count", "sum:order_total"],
+     "dimensions": ["platform_name"], "date_grain": "week"}
+    """
+    return _run(analytics.run_query, current_user.company_id, query)
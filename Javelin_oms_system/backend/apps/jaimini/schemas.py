@@ -0,0 +1,55 @@
+"""Pydantic schemas for Jaimini analytics queries"""
+from pydantic import BaseModel, Field
+from typing import Any, Dict, List, Optional
+from datetime import datetime
+
+
+class AnalyticsFilter(BaseModel):
+    """Condition on one field of the dataset"""
+    field: str
+    op: str = Field("eq", pattern="^(eq|ne|in|not_in|gt|gte|lt|lte|is_null|not_null)$")
+    value: Any = Field(None, description="Compared value; a list for in / not_in, unused for is_null / not_null")
+
+
+class AnalyticsQuery(BaseModel):
+    """Declarative aggregate query over one exported dataset"""
+    dataset: str = Field(..., description="orders, order_items, master_orders, returns, customer_ledger, dispatch_scans")
+    metrics: List[str] = Field(
+        default_factory=lambda: ["count"], min_length=1, max_length=20,
+        description="count, or <sum|avg|min|max|count_distinct>:<field>"
+    )
+    dimensions: List[str] = Field(default_factory=list, max_length=5, description="Fields to group by")
+    date_grain: Optional[str] = Field(
+        None, pattern="^(day|week|month|quarter|year)$", description="Also group by the dataset's date, bucketed"
+    )
+    date_from: Optional[datetime] = None
+    date_to: Optional[datetime] = Field(None, description="Inclusive")
+    filters: List[AnalyticsFilter] = Field(default_factory=list, max_length=20)
+    order_by: Optional[str] = Field(None, description="A dimension, period or metric column (default: period, dimensions)")
+    descending: bool = False
+    limit: int = Field(1000, ge=1, le=10000)
+
+
+class AnalyticsResult(BaseModel):
+    """Aggregated rows of an analytics query"""
+    dataset: str
+    snapshot_version: int
+    columns: List[str]
+    rows: List[Dict[str, Any]]
+    row_count: int
+    truncated: bool
+    computed_at: datetime
+
+
+class AnalyticsField(BaseModel):
+    name: str
+    type: str
+
+
+class AnalyticsDataset(BaseModel):
+    """An exported dataset and what can be queried on it"""
+    name: str
+    date_field: str
+    fields: List[AnalyticsField]
+    rows: int
+    last_exported_at: Optional[str] = None
@@ -8,7 +8,6 @@ from sqlalchemy.orm import Session
 from sqlalchemy import and_
 from typing import List, Optional
 import pandas as pd
-import io
 import re
 from datetime import datetime
 
@@ -20,6 +19,7 @@ from ..common.models import (
     Order
 )
 from ..common.dependencies import get_current_user
+from . import schema_inference
 from pydantic import BaseModel
 
 router = APIRouter(prefix="/channel", tags=["Channel Configuration"])
@@ -75,33 +75,8 @@ def to_snake_case(text: str) -> str:
 
 def detect_field_type(values: pd.Series) -> str:
     """Intelligently detect field type from sample data"""
-    # Remove nulls
-    values = values.dropna()
-    
-    if len(values) == 0:
-        return 'text'
-    
-    # Check for dates
-    try:
-        pd.to_datetime(values, errors='raise')
-        return 'date'
-    except:
-        pass
-    
-    # Check for numbers
-    try:
-        pd.to_numeric(values, errors='raise')
-        return 'number'
-    except:
-        pass
-    
-    # Check for boolean
-    unique_values = set(str(v).lower() for v in values.unique())
-    if unique_values.issubset({'yes', 'no', 'true', 'false', '0', '1', 'y', 'n'}):
-        return 'boolean'
-    
-    # Default to text
-    return 'text'
+    profiles = schema_inference.profile_frame(schema_inference.sample_frame(values.to_frame(name=str(values.name))))
+    return schema_inference.config_type(next(iter(profiles.values())))
 
 
 def to_title_case(text: str) -> str:
@@ -115,62 +90,46 @@ def to_title_case(text: str) -> str:
 # API Endpoints
 
 @router.post("/upload-schema")
-async def upload_schema(
+def upload_schema(
     file: UploadFile = File(...),
     platform: str = Query(...),
     db: Session = Depends(get_db),
     current_user: User = Depends(get_current_user)
 ):
     """
-    Upload Excel/CSV file and auto-detect field definitions
+    Upload Excel/CSV file and auto-detect field definitions from a random
+    sample of its rows (see schema_inference.py)
     """
     try:
-        # Read file content
-        content = await file.read()
-        
-        # Parse based on file type
-        if file.filename.endswith('.csv'):
-            df = pd.read_csv(io.BytesIO(content))
-        elif file.filename.endswith(('.xlsx', '.xls')):
-            df = pd.read_excel(io.BytesIO(content))
-        else:
-            raise HTTPException(status_code=400, detail="Unsupported file type")
-        
-        # Detect fields
-        detected_fields = []
-        
-        for column in df.columns:
-            # Get sample values (first 10 non-null)
-            sample_values = df[column].dropna().head(10).astype(str).tolist()
-            
-            # Detect type
-            detected_type = detect_field_type(df[column])
-            
-            # Generate field name and key
-            field_name = to_title_case(column)
-            field_key = to_snake_case(column)
-            
-            # Suggest if required (if less than 10% null values)
-            null_percentage = df[column].isnull().sum() / len(df)
-            is_required_suggestion = bool(null_percentage < 0.1)  # Convert to Python bool
-            
-            detected_fields.append({
-                "column_name": str(column),
-                "suggested_field_name": field_name,
-                "field_key": field_key,
-                "detected_type": detected_type,
-                "is_required_suggestion": is_required_suggestion,
-                "sample_values": [str(v) for v in sample_values[:3]]  # Only first 3, convert to str
-            })
-        
-        return {
-            "detected_fields": detected_fields,
-            "total_columns": int(len(detected_fields)),  # Convert to Python int
-            "total_rows": int(len(df))  # Convert to Python int
-        }
-        
+        profiles, rows_scanned, rows_sampled, complete = schema_inference.infer_file(file.file, file.filename)
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Unsupported file type")
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Failed to parse file: {str(e)}")
+    
+    # Detect fields
+    detected_fields = []
+    
+    for column, profile in profiles.items():
+        detected_fields.append({
+            "column_name": column,
+            "suggested_field_name": to_title_case(column),
+            "field_key": to_snake_case(column),
+            "detected_type": schema_inference.config_type(profile),
+            "detected_kind": profile.kind,
+            "confidence": profile.confidence,
+            # Suggest if required (if less than 10% null values)
+            "is_required_suggestion": profile.null_ratio < 0.1,
+            "sample_values": profile.sample_values
+        })
+    
+    return {
+        "detected_fields": detected_fields,
+        "total_columns": len(detected_fields),
+        "total_rows": rows_scanned,
+        "rows_sampled": rows_sampled,
+        "sample_complete": complete
+    }
 
 
 @router.post("/{platform}/fields/bulk")
@@ -4,7 +4,6 @@ Phase 2: Channel creation, listing, editing, deletion
 """
 
 from fastapi import APIRouter, Depends, HTTPException, status, UploadFile, File
-import csv
 import io
 from sqlalchemy.orm import Session
 from sqlalchemy import text, inspect
@@ -18,6 +17,7 @@ from ..common.db import get_db
 from ..common.models import User, Company
 from ..common.dependencies import get_current_user
 from .channel_master_models import Channel, ChannelFieldMapping, ChannelTableSchema, ChannelTable
+from . import schema_inference
 
 
 # ============ Request/Response Models ============
@@ -1355,104 +1355,42 @@ async def infer_schema_from_sql(
 
 
 @router.post("/{channel_id}/schema/infer-file")
-async def infer_schema_from_file(
+def infer_schema_from_file(
     channel_id: int,
     file: UploadFile = File(...),
     current_user: User = Depends(get_current_user)
 ):
-    """Infer fields from CSV or Excel file headers"""
+    """Infer fields from a random sample of a CSV or Excel file's rows (see schema_inference.py)"""
     try:
-        headers = []
-        sample_data = None
-        
-        if file.filename.endswith('.csv'):
-            content = await file.read()
-            decoded = content.decode('utf-8')
-            try:
-                f = io.StringIO(decoded)
-                reader = csv.reader(f)
-                headers = next(reader)
-                try:
-                    sample_data = next(reader)
-                except StopIteration:
-                    pass
-            except Exception as e:
-                raise HTTPException(status_code=400, detail=f"Failed to parse CSV: {str(e)}")
-                
-        elif file.filename.endswith(('.xlsx', '.xls')):
-            try:
-                contents = await file.read()
-                df = pd.read_excel(io.BytesIO(contents), nrows=5)
-                headers = df.columns.tolist()
-                if not df.empty:
-                    sample_data = df.iloc[0].tolist()
-                    # Convert numpy types to native python types for JSON serialization
-                    sample_data = [
-                        x.item() if hasattr(x, 'item') else x 
-                        for x in sample_data
-                    ]
-            except Exception as e:
-                raise HTTPException(status_code=400, detail=f"Failed to parse Excel file: {str(e)}")
-                
-        else:
-            raise HTTPException(status_code=400, detail="Only CSV and Excel files are supported.")
-             
-        fields = []
-        for i, header in enumerate(headers):
-            field_name = str(header).strip() if header else f"column_{i}"
-            field_type = "Text"
-        
-            # Infer type from sample data if available
-            if sample_data and len(sample_data) > i:
-                val = sample_data[i]
-                # Handle None values and pandas NaT
-                if val is None or (hasattr(val, '__class__') and 'NaT' in str(type(val))):
-                    field_type = "Text"
-                elif isinstance(val, bool):
-                    field_type = "Select"
-                elif isinstance(val, (int, float)):
-                    # Check for NaN
-                    try:
-                        if pd.isna(val):
-                            field_type = "Text"
-                        else:
-                            field_type = "Number"
-                    except:
-                        field_type = "Number"
-                elif isinstance(val, str):
-                    val_str = val.strip()
-                    # Try to detect number strings
-                    try:
-                        float(val_str.replace(',', ''))
-                        field_type = "Number"
-                    except (ValueError, AttributeError):
-                        pass
-                    # Check for boolean strings
-                    if val_str.lower() in ['true', 'false', 'yes', 'no', '0', '1']:
-                        field_type = "Select"
-                # Basic date check
-                elif hasattr(val, 'strftime'):
-                    field_type = "Date"
-            
-            fields.append({
-                "field_name": field_name,
-                "field_key": field_name.lower().replace(" ", "_").replace("-", "_"),
-                "field_type": field_type,
-                "is_required": False,
-                "is_primary_key": False, 
-                "is_unique": False,
-                "is_indexed": False
-            })
-        
-        return {"fields": fields}
-
-    except HTTPException:
-        raise
+        profiles, rows_scanned, rows_sampled, complete = schema_inference.infer_file(file.file, file.filename)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
     except Exception as e:
-        raise HTTPException(
-            status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
-            detail=f"Failed to process file: {str(e)}"
-        )
+        raise HTTPException(status_code=400, detail=f"Failed to parse file: {str(e)}")
+
+    fields = []
+    for profile in profiles.values():
+        field_name = profile.name
+        fields.append({
+            "field_name": field_name,
+            "field_key": field_name.lower().replace(" ", "_").replace("-", "_"),
+            "field_type": schema_inference.field_type(profile),
+            "detected_type": profile.kind,
+            "confidence": profile.confidence,
+            "validation": schema_inference.validation(profile),
+            "sample_values": profile.sample_values,
+            "is_required": False,
+            "is_primary_key": False, 
+            "is_unique": False,
+            "is_indexed": False
+        })
+
+    return {
+        "fields": fields,
+        "rows_scanned": rows_scanned,
+        "rows_sampled": rows_sampled,
+        "sample_complete": complete
+    }
 
 
 # Endpoint moved to before /{channel_id} routes
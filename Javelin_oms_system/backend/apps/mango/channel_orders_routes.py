@@ -3,66 +3,112 @@ Channel Orders List Routes
 Fetch and filter orders
 """
 
-from fastapi import APIRouter, Depends, Query
-from sqlalchemy.orm import Session
+from fastapi import APIRouter, Depends, HTTPException, Query, Response
+from fastapi.responses import StreamingResponse
+from sqlalchemy.orm import Session, defer, joinedload
 from sqlalchemy import and_, or_
-from typing import Optional
+from typing import List, Optional
 from datetime import datetime
+import csv
+import io
+import json
+import os
+import time
 
-from ..common.db import get_db
-from ..common.models import User, Order
+from ..common.db import get_db, SessionLocal
+from ..common.models import User, Order, OMSSyncConfig, MangoChannelOrder, Platform
 from ..common.dependencies import get_current_user
+from ..common import pagination
+from . import order_lookup
 
 router = APIRouter(prefix="/channel", tags=["Channel Orders List"])
 
+EXPORT_BATCH_SIZE = int(os.getenv("ORDER_EXPORT_BATCH_SIZE", "1000"))  # Rows fetched per round trip when streaming
+EXPORT_FORMATS = ("ndjson", "csv")
+ORDER_FIELDS = ["id", "platform_order_id", "source_platform", "customer_name", "order_status",
+                "data_source", "created_at", "channel_data"]
 
-@router.get("/orders")
-async def get_orders(
-    channel: Optional[str] = Query(None),
-    status: Optional[str] = Query(None),
-    from_date: Optional[str] = Query(None),
-    to_date: Optional[str] = Query(None),
-    search: Optional[str] = Query(None),
+
+@router.get("/orders/lookup")
+async def lookup_orders(
+    q: str = Query(..., min_length=2, description="Order id, AWB, customer name/phone or SKU"),
+    source: Optional[List[str]] = Query(None, description=f"Limit to: {', '.join(order_lookup.SOURCES)}"),
+    limit: int = Query(50, ge=1, le=order_lookup.MAX_HITS),
     db: Session = Depends(get_db),
     current_user: User = Depends(get_current_user)
 ):
     """
-    Get all orders with optional filters
+    Find an order in every store at once: OMS orders, Mango imports,
+    channel upload tables, the master order sheet and dispatch scans
     """
-    from ..common.models import OMSSyncConfig, MangoChannelOrder, Platform
-    
-    # Get OMS config to determine data source
-    oms_configs = db.query(OMSSyncConfig).filter(
-        OMSSyncConfig.company_id == current_user.company_id
-    ).all()
-    
-    # If filtering by channel, check if OMS is enabled for that channel
-    if channel:
-        channel_config = next((c for c in oms_configs if c.platform == channel), None)
-        use_oms = channel_config and channel_config.sync_enabled
-    else:
+    if source:
+        unknown = [name for name in source if name not in order_lookup.SOURCES]
+        if unknown:
+            raise HTTPException(
+                status_code=400,
+                detail=f"Unknown source: {', '.join(unknown)}. Use: {', '.join(order_lookup.SOURCES)}"
+            )
+    if not order_lookup.is_ready(db):
+        raise HTTPException(
+            status_code=503,
+            detail="Order lookup index has not been built yet. Run backend/rebuild_order_lookup.py"
+        )
+
+    started = time.perf_counter()
+    hits = order_lookup.lookup(db, current_user.company_id, q, sources=source, limit=limit)
+    return {
+        "query": q,
+        "hits": hits,
+        "total": len(hits),
+        "took_ms": round((time.perf_counter() - started) * 1000, 2)
+    }
+
+
+def _parse_date(value: Optional[str], name: str) -> Optional[datetime]:
+    if not value:
+        return None
+    try:
+        return datetime.fromisoformat(value)
+    except ValueError:
+        raise HTTPException(status_code=400, detail=f"{name} must be an ISO date, e.g. 2024-01-31")
+
+
+def _uses_oms(db: Session, company_id: int, channel: Optional[str]) -> bool:
+    """Orders of a channel come from the OMS tables when OMS sync is enabled for it, otherwise from Mango imports"""
+    if not channel:
         # If no channel filter, default to showing Mango orders
-        use_oms = False
-    
+        return False
+    config = db.query(OMSSyncConfig).filter(
+        OMSSyncConfig.company_id == company_id,
+        OMSSyncConfig.platform == channel
+    ).first()
+    return bool(config and config.sync_enabled)
+
+
+def _orders_query(
+    db: Session,
+    use_oms: bool,
+    company_id: int,
+    channel: Optional[str],
+    status: Optional[str],
+    from_date: Optional[datetime],
+    to_date: Optional[datetime],
+    search: Optional[str],
+    include_channel_data: bool
+):
+    """(model, filtered query) for the order list; channel_data is only loaded when asked for"""
     if use_oms:
-        # Query from OMS orders table
-        query = db.query(Order)
-        
+        model = Order
+        query = db.query(Order).options(joinedload(Order.platform))
         if channel:
             platform_obj = db.query(Platform).filter(Platform.name.ilike(f"%{channel}%")).first()
             if platform_obj:
                 query = query.filter(Order.platform_id == platform_obj.id)
-        
         if status:
             query = query.filter(Order.order_status == status)
-        
-        if from_date:
-            query = query.filter(Order.created_at >= datetime.fromisoformat(from_date))
-        
-        if to_date:
-            query = query.filter(Order.created_at <= datetime.fromisoformat(to_date))
-        
-        if search:
+        if search and order_lookup.is_ready(db):
+            query = query.filter(Order.id.in_(order_lookup.record_ids(company_id, search, order_lookup.OMS)))
+        elif search:
             search_term = f"%{search}%"
             query = query.filter(
                 or_(
@@ -70,46 +116,20 @@ async def get_orders(
                     Order.customer_name.like(search_term)
                 )
             )
-        
-        orders = query.order_by(Order.created_at.desc()).all()
-        
-        return {
-            "orders": [
-                {
-                    "id": o.id,
-                    "platform_order_id": o.platform_order_id,
-                    "source_platform": o.platform.name.lower() if o.platform else "unknown",
-                    "customer_name": o.customer_name,
-                    "order_status": o.order_status,
-                    "channel_data": o.platform_metadata,
-                    "data_source": "oms",
-                    "created_at": o.created_at.isoformat() if o.created_at else None
-                }
-                for o in orders
-            ],
-            "total": len(orders),
-            "data_source": "oms"
-        }
-    
+        if not include_channel_data:
+            query = query.options(defer(Order.platform_metadata))
     else:
-        # Query from Mango orders table
-        query = db.query(MangoChannelOrder).filter(
-            MangoChannelOrder.company_id == current_user.company_id
-        )
-        
+        model = MangoChannelOrder
+        query = db.query(MangoChannelOrder).filter(MangoChannelOrder.company_id == company_id)
         if channel:
             query = query.filter(MangoChannelOrder.platform == channel)
-        
         if status:
             query = query.filter(MangoChannelOrder.order_status == status)
-        
-        if from_date:
-            query = query.filter(MangoChannelOrder.created_at >= datetime.fromisoformat(from_date))
-        
-        if to_date:
-            query = query.filter(MangoChannelOrder.created_at <= datetime.fromisoformat(to_date))
-        
-        if search:
+        if search and order_lookup.is_ready(db):
+            query = query.filter(
+                MangoChannelOrder.id.in_(order_lookup.record_ids(company_id, search, order_lookup.MANGO))
+            )
+        elif search:
             search_term = f"%{search}%"
             query = query.filter(
                 or_(
@@ -117,23 +137,153 @@ async def get_orders(
                     MangoChannelOrder.customer_name.like(search_term)
                 )
             )
-        
-        orders = query.order_by(MangoChannelOrder.created_at.desc()).all()
-        
-        return {
-            "orders": [
-                {
-                    "id": o.id,
-                    "platform_order_id": o.platform_order_id,
-                    "source_platform": o.platform,
-                    "customer_name": o.customer_name,
-                    "order_status": o.order_status,
-                    "channel_data": o.channel_data,
-                    "data_source": "mango",
-                    "created_at": o.created_at.isoformat() if o.created_at else None
-                }
-                for o in orders
-            ],
-            "total": len(orders),
-            "data_source": "mango"
+        if not include_channel_data:
+            query = query.options(defer(MangoChannelOrder.channel_data))
+
+    if from_date:
+        query = query.filter(model.created_at >= from_date)
+    if to_date:
+        query = query.filter(model.created_at <= to_date)
+    return model, query
+
+
+def _order_row(o, use_oms: bool, include_channel_data: bool) -> dict:
+    if use_oms:
+        row = {
+            "id": o.id,
+            "platform_order_id": o.platform_order_id,
+            "source_platform": o.platform.name.lower() if o.platform else "unknown",
+            "customer_name": o.customer_name,
+            "order_status": o.order_status,
+            "data_source": "oms",
+            "created_at": o.created_at.isoformat() if o.created_at else None
+        }
+        if include_channel_data:
+            row["channel_data"] = o.platform_metadata
+    else:
+        row = {
+            "id": o.id,
+            "platform_order_id": o.platform_order_id,
+            "source_platform": o.platform,
+            "customer_name": o.customer_name,
+            "order_status": o.order_status,
+            "data_source": "mango",
+            "created_at": o.created_at.isoformat() if o.created_at else None
         }
+        if include_channel_data:
+            row["channel_data"] = o.channel_data
+    return row
+
+
+@router.get("/orders")
+async def get_orders(
+    response: Response,
+    channel: Optional[str] = Query(None),
+    status: Optional[str] = Query(None),
+    from_date: Optional[str] = Query(None),
+    to_date: Optional[str] = Query(None),
+    search: Optional[str] = Query(None),
+    include_channel_data: bool = Query(False, description="Include each order's channel_data JSON"),
+    limit: int = Query(100, ge=1, le=1000),
+    cursor: Optional[str] = Query(None, description="X-Next-Cursor / next_cursor of the previous page"),
+    total: Optional[str] = Query(None, enum=list(pagination.TOTAL_MODES)),
+    db: Session = Depends(get_db),
+    current_user: User = Depends(get_current_user)
+):
+    """
+    Get orders with optional filters, newest first, one page at a time.
+    Pass next_cursor back as cursor for the next page; total is only counted
+    when asked for. Use /channel/orders/export for the full result set.
+    """
+    from_dt = _parse_date(from_date, "from_date")
+    to_dt = _parse_date(to_date, "to_date")
+    use_oms = _uses_oms(db, current_user.company_id, channel)
+    model, query = _orders_query(
+        db, use_oms, current_user.company_id, channel, status, from_dt, to_dt, search, include_channel_data
+    )
+    data_source = "oms" if use_oms else "mango"
+
+    page = pagination.paginate(
+        query, [(model.created_at, True), (model.id, True)], limit, cursor=cursor, total=total,
+        count_key=("channel_orders", current_user.company_id, data_source, channel, status, from_date, to_date, search)
+    )
+    page.apply_headers(response)
+
+    return {
+        "orders": [_order_row(o, use_oms, include_channel_data) for o in page.items],
+        "count": len(page.items),
+        "total": page.total,
+        "next_cursor": page.next_cursor,
+        "data_source": data_source
+    }
+
+
+def _stream_orders(fmt: str, use_oms: bool, include_channel_data: bool, filters: dict):
+    """
+    Yield the export in chunks. Rows come from a server-side cursor EXPORT_BATCH_SIZE
+    at a time on a session of its own, so memory stays flat whatever the result size.
+    """
+    db = SessionLocal()
+    try:
+        model, query = _orders_query(db, use_oms, include_channel_data=include_channel_data, **filters)
+        orders = query.order_by(model.created_at.desc(), model.id.desc()).yield_per(EXPORT_BATCH_SIZE)
+        fields = ORDER_FIELDS if include_channel_data else ORDER_FIELDS[:-1]
+
+        buffer = io.StringIO()
+        writer = csv.DictWriter(buffer, fieldnames=fields) if fmt == "csv" else None
+        if writer:
+            writer.writeheader()
+
+        for count, o in enumerate(orders, 1):
+            row = _order_row(o, use_oms, include_channel_data)
+            if writer:
+                if include_channel_data:
+                    row["channel_data"] = json.dumps(row["channel_data"], default=str) if row["channel_data"] else ""
+                writer.writerow(row)
+            else:
+                buffer.write(json.dumps(row, default=str))
+                buffer.write("\n")
+            if count % EXPORT_BATCH_SIZE == 0:
+                yield buffer.getvalue()
+                buffer.seek(0)
+                buffer.truncate()
+        yield buffer.getvalue()
+    finally:
+        db.close()
+
+
+@router.get("/orders/export")
+async def export_orders(
+    format: str = Query("ndjson", enum=list(EXPORT_FORMATS)),
+    channel: Optional[str] = Query(None),
+    status: Optional[str] = Query(None),
+    from_date: Optional[str] = Query(None),
+    to_date: Optional[str] = Query(None),
+    search: Optional[str] = Query(None),
+    include_channel_data: bool = Query(False, description="Include each order's channel_data JSON"),
+    db: Session = Depends(get_db),
+    current_user: User = Depends(get_current_user)
+):
+    """
+    Stream every order matching the filters as NDJSON (one order per line) or CSV
+    """
+    if format not in EXPORT_FORMATS:
+        raise HTTPException(status_code=400, detail=f"format must be one of: {', '.join(EXPORT_FORMATS)}")
+
+    filters = {
+        "company_id": current_user.company_id,
+        "channel": channel,
+        "status": status,
+        "from_date": _parse_date(from_date, "from_date"),
+        "to_date": _parse_date(to_date, "to_date"),
+        "search": search,
+    }
+    use_oms = _uses_oms(db, current_user.company_id, channel)
+
+    media_type = "application/x-ndjson" if format == "ndjson" else "text/csv"
+    filename = f"orders_{channel or 'all'}_{datetime.now().strftime('%Y%m%d_%H%M%S')}.{format}"
+    return StreamingResponse(
+        _stream_orders(format, use_oms, include_channel_data, filters),
+        media_type=media_type,
+        headers={"Content-Disposition": f"attachment; filename={filename}"}
+    )
@@ -17,6 +17,7 @@ from ..common.db import get_db
 from ..common.models import User
 from ..common.dependencies import get_current_user
 from .channel_master_models import Channel, ChannelFieldMapping, ChannelTableSchema, MasterOrderSheet
+from . import order_lookup, schema_inference
 
 
 # ============ Request/Response Models ============
@@ -63,33 +64,9 @@ def sanitize_column_name(name: str) -> str:
 
 
 def infer_sql_type(series: pd.Series) -> str:
-    """Infer SQL data type from pandas series"""
-    # Remove nulls for type detection
-    series = series.dropna()
-    
-    if len(series) == 0:
-        return "VARCHAR(255)"
-    
-    # Try to infer type
-    dtype = series.dtype
-    
-    if pd.api.types.is_integer_dtype(dtype):
-        return "INT"
-    elif pd.api.types.is_float_dtype(dtype):
-        return "DECIMAL(12,2)"
-    elif pd.api.types.is_bool_dtype(dtype):
-        return "BOOLEAN"
-    elif pd.api.types.is_datetime64_any_dtype(dtype):
-        return "DATETIME"
-    else:
-        # String type - determine length
-        max_length = series.astype(str).str.len().max()
-        if max_length > 500:
-            return "TEXT"
-        elif max_length > 255:
-            return f"VARCHAR({min(max_length + 50, 1000)})"
-        else:
-            return "VARCHAR(255)"
+    """Infer SQL data type from pandas series (a random sample of it when large)"""
+    profiles = schema_inference.profile_frame(schema_inference.sample_frame(series.to_frame(name=str(series.name))))
+    return schema_inference.sql_type(next(iter(profiles.values())))
 
 
 def suggest_master_field_mapping(column_name: str) -> tuple[Optional[str], float]:
@@ -197,9 +174,13 @@ async def upload_channel_orders(
         # Sanitize column names
         df.columns = [sanitize_column_name(col) for col in df.columns]
         
-        # Detect schema
+        # Detect schema: every column classified at once from a random sample of rows
         detected_columns = []
         mapping_suggestions = []
+        profiles = schema_inference.profile_frame(schema_inference.sample_frame(df))
+        column_types = {
+            col['name']: str(col['type']) for col in inspect(db.bind).get_columns(channel.table_name)
+        }
         
         for column in df.columns:
             # Skip system columns
@@ -207,12 +188,15 @@ async def upload_channel_orders(
                           'is_synced_to_master', 'master_order_id', 'created_at', 'updated_at']:
                 continue
             
-            sql_type = infer_sql_type(df[column])
-            sample_values = df[column].dropna().head(3).astype(str).tolist()
+            profile = profiles[column]
+            sql_type = schema_inference.sql_type(profile)
+            sample_values = profile.sample_values
             
             detected_columns.append({
                 "column_name": column,
                 "sql_type": sql_type,
+                "detected_type": profile.kind,
+                "confidence": profile.confidence,
                 "sample_values": sample_values
             })
             
@@ -228,8 +212,9 @@ async def upload_channel_orders(
             ))
             
             # Add column to table if it doesn't exist
-            if not column_exists(channel.table_name, column, db):
+            if column not in column_types:
                 add_column_to_table(channel.table_name, column, sql_type, db)
+                column_types[column] = sql_type
                 
                 # Save to schema registry
                 schema_entry = ChannelTableSchema(
@@ -243,9 +228,11 @@ async def upload_channel_orders(
         
         db.commit()
         
-        # Insert data into channel table
+        # Insert data into channel table, values parsed to the columns' types (raw_data keeps the file's)
         records_inserted = 0
-        for idx, row in df.iterrows():
+        inserted_rows = []
+        values = schema_inference.convert(df, profiles, column_types)
+        for idx, row in values.iterrows():
             # Prepare data dict
             data_dict = {}
             for column in df.columns:
@@ -255,6 +242,9 @@ async def upload_channel_orders(
                     data_dict[column] = None
                 else:
                     data_dict[column] = value
+            raw_row = {
+                column: None if pd.isna(value) else value for column, value in df.loc[idx].items()
+            }
             
             # Build INSERT query
             columns_list = list(data_dict.keys())
@@ -273,11 +263,14 @@ async def upload_channel_orders(
             params['company_id'] = current_user.company_id
             params['uploaded_by_user_id'] = current_user.id
             params['uploaded_at'] = datetime.utcnow()
-            params['raw_data'] = json.dumps(data_dict, default=str)
+            params['raw_data'] = json.dumps(raw_row, default=str)
             
-            db.execute(text(sql), params)
+            result = db.execute(text(sql), params)
+            inserted_rows.append((result.lastrowid, data_dict))
             records_inserted += 1
         
+        # Raw inserts bypass the ORM, so index the new rows for order lookup here
+        order_lookup.index_channel_rows(db, channel, channel.table_name, inserted_rows)
         db.commit()
         
         return SchemaDetectionResponse(
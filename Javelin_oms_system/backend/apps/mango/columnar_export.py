@@ -0,0 +1,298 @@
+"""
+Columnar Analytics Export
+Copies master orders, OMS orders and items, returns, the customer ledger and
+dispatch scans into
+Parquet (or Arrow IPC) files for analytics, so analysts query compact columnar
+files with an in-process engine instead of the live database.
+
+Each dataset is a hive-partitioned directory under COLUMNAR_EXPORT_DIR:
+
+    <dataset>/company=<id>/[channel=<id>/]month=<YYYY-MM>/part-<first id>-<last id>.<ext>
+
+Exports are incremental: rows are read in id order, EXPORT_BATCH_SIZE at a
+time, after the last id exported for the dataset. _state.json next to the
+datasets records that id and a version that goes up with every run that wrote
+something, so readers can tell when their cached results are stale. A batch's
+files are named after its id range, so re-running after a crash overwrites
+instead of duplicating. Rows changed after they were exported are only picked
+up by a rebuild (export(..., rebuild=True)).
+
+OMS orders and their items are not company scoped and are exported under
+company 0, as in the order lookup index; readers show them to every company. Rows archived from the main database (common/archive.py)
+are months past their export by then and are not read again.
+
+pyarrow (see requirements.txt) is imported when an export runs, so the API
+does not load it until exports or analytics are used.
+"""
+
+import json
+import os
+import shutil
+import threading
+from datetime import date, datetime
+from typing import Callable, Dict, List, Optional, Sequence
+
+from sqlalchemy import func, literal, select, types
+from sqlalchemy.orm import Session
+
+from ..common import models
+from ..common.db import project_root
+from .channel_master_models import Channel, MasterOrderSheet
+
+COLUMNAR_EXPORT_DIR = os.getenv("COLUMNAR_EXPORT_DIR", str(project_root / "columnar"))
+COLUMNAR_EXPORT_FORMAT = os.getenv("COLUMNAR_EXPORT_FORMAT", "parquet")  # parquet or arrow (IPC)
+EXPORT_BATCH_SIZE = int(os.getenv("COLUMNAR_EXPORT_BATCH_SIZE", "50000"))
+
+EXTENSIONS = {"parquet": "parquet", "arrow": "arrow"}
+STATE_FILE = "_state.json"
+NULL_PARTITION = "__HIVE_DEFAULT_PARTITION__"  # Read back as null by hive partitioning
+
+OMS_COMPANY = 0
+
+_lock = threading.Lock()
+
+
+class Dataset:
+    def __init__(self, name: str, statement: Callable, id_column: str, time_columns: Sequence[str],
+                 channel_column: Optional[str] = None, company_scoped: bool = True):
+        self.name = name
+        self.statement = statement  # () -> select with id_column, company_id, time and channel columns
+        self.id_column = id_column
+        self.time_columns = time_columns  # First non-null one decides the month
+        self.channel_column = channel_column
+        self.company_scoped = company_scoped  # False: everything is under OMS_COMPANY
+
+
+def _master_orders():
+    sheet = MasterOrderSheet
+    return select(
+        sheet.master_order_id, Channel.company_id, sheet.channel_id, Channel.channel_name, sheet.channel_order_id,
+        sheet.order_number, sheet.order_date, sheet.customer_name, sheet.customer_email, sheet.customer_phone,
+        sheet.shipping_city, sheet.shipping_state, sheet.shipping_pincode, sheet.shipping_country,
+        sheet.order_amount, sheet.payment_method, sheet.payment_status, sheet.order_status, sheet.items,
+        sheet.source_table_name, sheet.created_at, sheet.synced_at
+    ).outerjoin(Channel, Channel.id == sheet.channel_id)
+
+
+def _orders():
+    order = models.Order
+    return select(
+        order.id, literal(OMS_COMPANY).label("company_id"), order.platform_id,
+        models.Platform.name.label("platform_name"), order.platform_order_id, order.order_status,
+        order.purchase_date, order.order_total, order.currency, order.customer_name, order.customer_email,
+        order.is_dispatched, order.dispatched_at, order.created_at
+    ).outerjoin(models.Platform, models.Platform.id == order.platform_id)
+
+
+def _order_items():
+    item, order = models.OrderItem, models.Order
+    return select(
+        item.id, literal(OMS_COMPANY).label("company_id"), order.platform_id, models.Platform.name.label("platform_name"),
+        item.order_id, item.platform_order_id, item.product_id, item.sku, item.product_name, item.quantity,
+        item.item_price, order.order_status, order.purchase_date, order.currency, item.created_at
+    ).outerjoin(order, order.id == item.order_id).outerjoin(models.Platform, models.Platform.id == order.platform_id)
+
+
+def _returns():
+    returned, order = models.CustomerReturn, models.Order
+    quantity = select(func.coalesce(func.sum(models.CustomerReturnItem.quantity), 0)).where(
+        models.CustomerReturnItem.return_id == returned.id
+    ).scalar_subquery()
+    return select(
+        returned.id, models.Warehouse.company_id, order.platform_id, models.Platform.name.label("platform_name"),
+        returned.return_number, returned.order_id, order.platform_order_id, order.order_total,
+        returned.warehouse_id, returned.status, returned.return_type, quantity.label("quantity"),
+        returned.created_at, returned.updated_at
+    ).outerjoin(
+        models.Warehouse, models.Warehouse.id == returned.warehouse_id
+    ).outerjoin(
+        order, order.id == returned.order_id
+    ).outerjoin(models.Platform, models.Platform.id == order.platform_id)
+
+
+def _customer_ledger():
+    ledger = models.CustomerLedger
+    return select(
+        ledger.id, ledger.company_id, ledger.customer_id, ledger.transaction_date, ledger.transaction_type,
+        ledger.reference_number, ledger.reference_type, ledger.reference_id, ledger.debit_amount,
+        ledger.credit_amount, ledger.balance, ledger.description, ledger.due_date
+    )
+
+
+def _dispatch_scans():
+    scan = models.DispatchScan
+    return select(
+        scan.id, scan.company_id, scan.order_id, scan.platform_id, scan.platform_name, scan.platform_order_id,
+        scan.awb_number, scan.courier_partner, scan.dispatch_status, scan.warehouse_id, scan.manifest_id,
+        scan.scanned_by_user_id, scan.scanned_at
+    )
+
+
+DATASETS = {
+    dataset.name: dataset for dataset in (
+        Dataset("master_orders", _master_orders, "master_order_id", ("order_date", "created_at"), "channel_id"),
+        Dataset("orders", _orders, "id", ("purchase_date", "created_at"), "platform_id", company_scoped=False),
+        Dataset("order_items", _order_items, "id", ("purchase_date", "created_at"), "platform_id",
+                company_scoped=False),
+        Dataset("returns", _returns, "id", ("created_at",), "platform_id"),
+        Dataset("customer_ledger", _customer_ledger, "id", ("transaction_date",)),
+        Dataset("dispatch_scans", _dispatch_scans, "id", ("scanned_at",), "platform_id"),
+    )
+}
+
+
+# ---------------------------------------------------------------------------
+# State
+# ---------------------------------------------------------------------------
+
+def _state_path() -> str:
+    return os.path.join(COLUMNAR_EXPORT_DIR, STATE_FILE)
+
+
+def load_state() -> Dict:
+    """{"version": n, "format": ..., "datasets": {name: {"last_id", "rows", "exported_at"}}}"""
+    try:
+        with open(_state_path(), encoding="utf-8") as state_file:
+            return json.load(state_file)
+    except FileNotFoundError:
+        return {"version": 0, "format": COLUMNAR_EXPORT_FORMAT, "datasets": {}}
+
+
+def _save_state(state: Dict):
+    os.makedirs(COLUMNAR_EXPORT_DIR, exist_ok=True)
+    with open(_state_path() + ".tmp", "w", encoding="utf-8") as state_file:
+        json.dump(state, state_file, indent=2)
+    os.replace(_state_path() + ".tmp", _state_path())
+
+
+def dataset_path(name: str) -> str:
+    return os.path.join(COLUMNAR_EXPORT_DIR, name)
+
+
+# ---------------------------------------------------------------------------
+# Arrow conversion
+# ---------------------------------------------------------------------------
+
+def _json(value):
+    return json.dumps(value, default=str) if value is not None else None
+
+
+def _float(value):
+    return float(value) if value is not None else None
+
+
+def _arrow_field(pa, column):
+    """(arrow field, value converter) for a selected column"""
+    column_type = column.type
+    if isinstance(column_type, types.JSON):
+        return pa.field(column.name, pa.string()), _json
+    if isinstance(column_type, types.Boolean):
+        return pa.field(column.name, pa.bool_()), None
+    if isinstance(column_type, types.Integer):
+        return pa.field(column.name, pa.int64()), None
+    if isinstance(column_type, types.Numeric):
+        return pa.field(column.name, pa.float64()), _float
+    if isinstance(column_type, types.DateTime):
+        return pa.field(column.name, pa.timestamp("us")), None
+    if isinstance(column_type, types.Date):
+        return pa.field(column.name, pa.date32()), None
+    return pa.field(column.name, pa.string()), lambda value: str(value) if value is not None else None
+
+
+def _month(row, time_columns: Sequence[str]) -> str:
+    for name in time_columns:
+        value = row[name]
+        if isinstance(value, (datetime, date)):
+            return value.strftime("%Y-%m")
+    return "unknown"
+
+
+def _partition(dataset: Dataset, row) -> str:
+    parts = [f"company={row['company_id'] if row['company_id'] is not None else NULL_PARTITION}"]
+    if dataset.channel_column:
+        channel = row[dataset.channel_column]
+        parts.append(f"channel={channel if channel is not None else NULL_PARTITION}")
+    parts.append(f"month={_month(row, dataset.time_columns)}")
+    return os.path.join(*parts)
+
+
+def _write(pa, schema, converters: List, rows: List, path: str, fmt: str):
+    columns = [
+        [convert(row[index]) for row in rows] if convert else [row[index] for row in rows]
+        for index, convert in enumerate(converters)
+    ]
+    table = pa.Table.from_arrays([pa.array(values, type=field.type) for values, field in zip(columns, schema)],
+                                 schema=schema)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    if fmt == "arrow":
+        from pyarrow import feather
+        feather.write_feather(table, path + ".tmp", compression="zstd")
+    else:
+        from pyarrow import parquet
+        parquet.write_table(table, path + ".tmp", compression="zstd")
+    os.replace(path + ".tmp", path)
+
+
+# ---------------------------------------------------------------------------
+# Export
+# ---------------------------------------------------------------------------
+
+def export(db: Session, names: Optional[Sequence[str]] = None, rebuild: bool = False) -> Dict[str, int]:
+    """Export new rows of the given datasets (default: all); rows written per dataset"""
+    import pyarrow as pa
+
+    names = list(names or DATASETS)
+    unknown = set(names) - set(DATASETS)
+    if unknown:
+        raise ValueError(f"Unknown datasets: {', '.join(sorted(unknown))}")
+
+    with _lock:
+        state = load_state()
+        fmt = COLUMNAR_EXPORT_FORMAT
+        if state.get("format") != fmt and state["datasets"]:
+            raise ValueError(f"Existing export is {state.get('format')}; rebuild every dataset to switch to {fmt}")
+        state["format"] = fmt
+
+        counts = {}
+        for name in names:
+            dataset = DATASETS[name]
+            if rebuild:
+                shutil.rmtree(dataset_path(name), ignore_errors=True)
+                state["datasets"].pop(name, None)
+            counts[name] = _export_dataset(db, pa, dataset, state, fmt)
+        if any(counts.values()) or rebuild:
+            state["version"] += 1
+            _save_state(state)
+        return counts
+
+
+def _export_dataset(db: Session, pa, dataset: Dataset, state: Dict, fmt: str) -> int:
+    progress = state["datasets"].setdefault(dataset.name, {"last_id": 0, "rows": 0, "exported_at": None})
+    statement = dataset.statement()
+    id_column = statement.selected_columns[dataset.id_column]
+    fields = [_arrow_field(pa, column) for column in statement.selected_columns]
+    schema = pa.schema([field for field, _ in fields])
+    converters = [convert for _, convert in fields]
+
+    written = 0
+    while True:
+        rows = db.execute(
+            statement.where(id_column > progress["last_id"]).order_by(id_column).limit(EXPORT_BATCH_SIZE)
+        ).all()
+        if not rows:
+            break
+        partitions: Dict[str, List] = {}
+        for row in rows:
+            partitions.setdefault(_partition(dataset, row._mapping), []).append(row)
+        for partition, partition_rows in partitions.items():
+            first, last = partition_rows[0]._mapping[dataset.id_column], partition_rows[-1]._mapping[dataset.id_column]
+            path = os.path.join(dataset_path(dataset.name), partition, f"part-{first}-{last}.{EXTENSIONS[fmt]}")
+            _write(pa, schema, converters, partition_rows, path, fmt)
+
+        progress["last_id"] = rows[-1]._mapping[dataset.id_column]
+        progress["rows"] += len(rows)
+        progress["exported_at"] = datetime.now().isoformat(timespec="seconds")
+        written += len(rows)
+        # Saved per batch so an interrupted run resumes where it stopped
+        _save_state(state)
+    return written
@@ -0,0 +1,299 @@
+"""
+Live Dispatch Feed
+Pushes dispatch scans to floor dashboards over Server-Sent Events instead of
+having them poll /dispatch/summary and /dispatch/scans.
+
+Each subscriber of a company receives:
+    counters  today's scans in total and by warehouse, courier, platform and
+              status; sent on connect and after every committed change
+    scan      a scan that was recorded or changed (e.g. cancelled)
+
+Counters are loaded once per company with a single GROUP BY over today's
+scans, then maintained from the scans committed through this process's
+sessions (including bulk batch inserts). Since other worker processes do
+not publish here, counters are reloaded every DISPATCH_FEED_RESYNC seconds
+while someone is subscribed, which also picks up the day rollover.
+
+Configuration:
+    DISPATCH_FEED_HEARTBEAT     seconds between keep-alive comments
+    DISPATCH_FEED_RESYNC        seconds before counters are reloaded from the database
+    DISPATCH_FEED_QUEUE_SIZE    events buffered per subscriber before it is resynced
+"""
+
+import asyncio
+import json
+import os
+import threading
+import time
+from collections import defaultdict
+from datetime import date, datetime, timedelta
+from typing import Dict, Iterable, List, Optional
+
+from sqlalchemy import event, func, inspect
+from sqlalchemy.orm import Session
+
+from ..common import SessionLocal, models
+
+HEARTBEAT_SECONDS = float(os.getenv("DISPATCH_FEED_HEARTBEAT", "15"))
+RESYNC_SECONDS = float(os.getenv("DISPATCH_FEED_RESYNC", "30"))
+QUEUE_SIZE = int(os.getenv("DISPATCH_FEED_QUEUE_SIZE", "1000"))
+
+# counter group -> scan column
+DIMENSIONS = (
+    ("by_warehouse", "warehouse_id"),
+    ("by_courier", "courier_partner"),
+    ("by_platform", "platform_name"),
+    ("by_status", "dispatch_status"),
+)
+_SCAN_FIELDS = (
+    "id", "company_id", "platform_order_id", "warehouse_id", "courier_partner", "platform_name",
+    "dispatch_status", "awb_number", "scan_action", "scanned_at",
+)
+
+
+def _group_key(value) -> str:
+    return "" if value is None else str(value)
+
+
+def _day(value) -> Optional[date]:
+    return value.date() if isinstance(value, datetime) else value
+
+
+class Counters:
+    """One company's scans of one day, by each dimension"""
+
+    def __init__(self, day: date):
+        self.day = day
+        self.total = 0
+        self.groups = {name: defaultdict(int) for name, _ in DIMENSIONS}
+        self.loaded_at = time.monotonic()
+
+    def add(self, values: Dict, count: int = 1):
+        self.total += count
+        for name, column in DIMENSIONS:
+            key = _group_key(values.get(column))
+            self.groups[name][key] += count
+            if not self.groups[name][key]:
+                del self.groups[name][key]
+
+    def as_dict(self) -> dict:
+        return {
+            "day": self.day.isoformat(),
+            "total": self.total,
+            **{name: dict(groups) for name, groups in self.groups.items()},
+        }
+
+
+class Subscriber:
+    def __init__(self, company_id: int):
+        self.company_id = company_id
+        self.loop = asyncio.get_running_loop()
+        self.queue: asyncio.Queue = asyncio.Queue(maxsize=QUEUE_SIZE)
+        self.overflowed = False
+
+    def put(self, message):
+        # Runs on the subscriber's event loop
+        try:
+            self.queue.put_nowait(message)
+        except asyncio.QueueFull:
+            self.overflowed = True
+
+
+class DispatchFeed:
+    """Per-company subscribers and counters; publish() may be called from any thread"""
+
+    def __init__(self):
+        self._subscribers: Dict[int, set] = defaultdict(set)
+        self._counters: Dict[int, Counters] = {}
+        self._refreshing = set()
+        self._lock = threading.Lock()
+
+    @property
+    def active(self) -> bool:
+        return bool(self._subscribers)
+
+    def subscribe(self, company_id: int) -> Subscriber:
+        subscriber = Subscriber(company_id)
+        with self._lock:
+            self._subscribers[company_id].add(subscriber)
+        return subscriber
+
+    def unsubscribe(self, subscriber: Subscriber):
+        with self._lock:
+            subscribers = self._subscribers.get(subscriber.company_id)
+            if subscribers is None:
+                return
+            subscribers.discard(subscriber)
+            if not subscribers:
+                # Nobody is maintaining them any more
+                del self._subscribers[subscriber.company_id]
+                self._counters.pop(subscriber.company_id, None)
+
+    def counters(self, company_id: int) -> Optional[dict]:
+        """Current counters if they are fresh, else None (call refresh())"""
+        with self._lock:
+            counters = self._counters.get(company_id)
+            if counters is None or counters.day != date.today() or time.monotonic() - counters.loaded_at > RESYNC_SECONDS:
+                return None
+            return counters.as_dict()
+
+    def refresh(self, company_id: int):
+        """Reload a company's counters from the database and send them to its subscribers (blocking)"""
+        with self._lock:
+            if company_id in self._refreshing:
+                return
+            self._refreshing.add(company_id)
+        try:
+            counters = _load_counters(company_id)
+            with self._lock:
+                if company_id in self._subscribers:
+                    self._counters[company_id] = counters
+            self._send(company_id, [("counters", counters.as_dict())])
+        finally:
+            with self._lock:
+                self._refreshing.discard(company_id)
+
+    def publish(self, company_id: int, changes: Iterable):
+        """Apply committed (scan values, previous values or None) changes and push them"""
+        messages = []
+        with self._lock:
+            if company_id not in self._subscribers:
+                return
+            counters = self._counters.get(company_id)
+            for values, previous in changes:
+                if counters is not None:
+                    if previous is not None and _day(previous["scanned_at"]) == counters.day:
+                        counters.add(previous, -1)
+                    if _day(values["scanned_at"]) == counters.day:
+                        counters.add(values)
+                messages.append(("scan", values))
+            if counters is not None:
+                messages.append(("counters", counters.as_dict()))
+        self._send(company_id, messages)
+
+    def _send(self, company_id: int, messages: List[tuple]):
+        with self._lock:
+            subscribers = list(self._subscribers.get(company_id, ()))
+        for subscriber in subscribers:
+            for message in messages:
+                subscriber.loop.call_soon_threadsafe(subscriber.put, message)
+
+
+feed = DispatchFeed()
+
+
+def _load_counters(company_id: int) -> Counters:
+    today = date.today()
+    start = datetime.combine(today, datetime.min.time())
+    scan = models.DispatchScan
+    columns = [getattr(scan, column) for _, column in DIMENSIONS]
+    counters = Counters(today)
+    db = SessionLocal()
+    try:
+        for row in db.query(*columns, func.count(scan.id)).filter(
+            scan.company_id == company_id,
+            scan.scanned_at >= start,
+            scan.scanned_at < start + timedelta(days=1)
+        ).group_by(*columns):
+            counters.add({column: value for (_, column), value in zip(DIMENSIONS, row)}, row[-1])
+    finally:
+        db.close()
+    return counters
+
+
+def format_event(name: str, data) -> str:
+    return f"event: {name}\ndata: {json.dumps(data, default=str)}\n\n"
+
+
+async def stream(company_id: int):
+    """Server-Sent Events for one subscriber; runs until the client disconnects"""
+    subscriber = feed.subscribe(company_id)
+    loop = asyncio.get_running_loop()
+    try:
+        counters = feed.counters(company_id)
+        if counters is None:
+            await loop.run_in_executor(None, feed.refresh, company_id)
+        else:
+            yield format_event("counters", counters)
+
+        while True:
+            try:
+                name, data = await asyncio.wait_for(subscriber.queue.get(), timeout=HEARTBEAT_SECONDS)
+            except asyncio.TimeoutError:
+                if feed.counters(company_id) is None:
+                    await loop.run_in_executor(None, feed.refresh, company_id)
+                yield ": keep-alive\n\n"
+                continue
+
+            if subscriber.overflowed:
+                # Fell behind: skip what is queued and start again from fresh counters
+                subscriber.overflowed = False
+                while not subscriber.queue.empty():
+                    subscriber.queue.get_nowait()
+                await loop.run_in_executor(None, feed.refresh, company_id)
+                continue
+            yield format_event(name, data)
+    finally:
+        feed.unsubscribe(subscriber)
+
+
+# ---------------------------------------------------------------------------
+# Feeding from the scan write paths
+# ---------------------------------------------------------------------------
+
+def _scan_values(scan: models.DispatchScan) -> dict:
+    values = {field: getattr(scan, field) for field in _SCAN_FIELDS}
+    values["dispatch_status"] = values["dispatch_status"] or "scanned"
+    return values
+
+
+def note_scans(db: Session, scans: Iterable[models.DispatchScan]):
+    """Queue new scans written without a flush (bulk inserts); published on commit"""
+    if feed.active:
+        db.info.setdefault("dispatch_feed", []).extend((_scan_values(scan), None) for scan in scans)
+
+
+@event.listens_for(Session, "after_flush")
+def _collect_scans(session, flush_context):
+    if not feed.active:
+        return
+    changes = []
+    for obj in session.new:
+        if isinstance(obj, models.DispatchScan):
+            changes.append((_scan_values(obj), None))
+    for obj in session.dirty:
+        if isinstance(obj, models.DispatchScan):
+            state = inspect(obj)
+            columns = [column for _, column in DIMENSIONS] + ["scanned_at"]
+            if not any(state.attrs[column].history.has_changes() for column in columns):
+                continue
+            values = _scan_values(obj)
+            previous = dict(values)
+            for column in columns:
+                history = state.attrs[column].history
+                if history.has_changes() and history.deleted:
+                    previous[column] = history.deleted[0]
+            changes.append((values, previous))
+    if changes:
+        session.info.setdefault("dispatch_feed", []).extend(changes)
+
+
+@event.listens_for(Session, "after_commit")
+def _publish_scans(session):
+    if session.in_nested_transaction():
+        return
+    changes = session.info.pop("dispatch_feed", None)
+    if not changes:
+        return
+    by_company = defaultdict(list)
+    for values, previous in changes:
+        by_company[values["company_id"]].append((values, previous))
+    for company_id, company_changes in by_company.items():
+        feed.publish(company_id, company_changes)
+
+
+@event.listens_for(Session, "after_rollback")
+def _discard_scans(session):
+    if session.in_nested_transaction():
+        return
+    session.info.pop("dispatch_feed", None)
@@ -0,0 +1,334 @@
+"""
+Hot Order Index
+In-process index of dispatchable orders so barcode validation and duplicate
+checks at the packing stations are answered from memory.
+
+Orders are keyed by platform order id, with each company's dispatch scan
+(scan id, time, AWB, status) and an AWB -> order map for scanned parcels.
+The index is warmed at startup with undispatched and recently dispatched
+orders, kept current from the flushes that write orders and scans (applied
+once the transaction commits), and bounded by least-recently-used eviction.
+A miss loads the order from the database, so an evicted or never-warmed
+order costs one query, not a wrong answer.
+
+The index is per process. A scan recorded by another worker is only seen
+there; the write paths still confirm "not scanned yet" against the database
+before inserting, and only trust the index when it says an order has been
+scanned, which never becomes false (cancelled scans still count, as in
+POST /scan).
+
+Configuration:
+    DISPATCH_INDEX_MAX_ORDERS  orders kept in memory (0 disables the index)
+    DISPATCH_INDEX_WARM_DAYS   dispatched orders younger than this are warmed too
+"""
+
+import os
+import threading
+from collections import OrderedDict
+from datetime import datetime, timedelta
+from typing import Dict, Iterable, List, Optional
+
+from sqlalchemy import event, inspect, or_, select
+from sqlalchemy.orm import Session
+
+from ..common import models
+
+MAX_ORDERS = int(os.getenv("DISPATCH_INDEX_MAX_ORDERS", "200000"))
+WARM_DAYS = int(os.getenv("DISPATCH_INDEX_WARM_DAYS", "30"))
+BATCH_SIZE = 1000
+
+_ORDER_FIELDS = ("platform_order_id", "platform_id", "customer_name", "order_total", "order_status")
+
+
+class ScanInfo:
+    __slots__ = ("scan_id", "scanned_at", "awb_number", "dispatch_status")
+
+    def __init__(self, scan_id, scanned_at, awb_number, dispatch_status):
+        self.scan_id = scan_id
+        self.scanned_at = scanned_at
+        self.awb_number = awb_number
+        self.dispatch_status = dispatch_status
+
+
+class OrderInfo:
+    __slots__ = (
+        "order_id", "platform_order_id", "platform_id", "platform_name",
+        "customer_name", "order_total", "order_status", "scans",
+    )
+
+    def __init__(self, order_id, platform_order_id, platform_id, platform_name,
+                 customer_name, order_total, order_status):
+        self.order_id = order_id
+        self.platform_order_id = platform_order_id
+        self.platform_id = platform_id
+        self.platform_name = platform_name
+        self.customer_name = customer_name
+        self.order_total = order_total
+        self.order_status = order_status
+        self.scans: Dict[int, ScanInfo] = {}  # company_id -> scan
+
+    def scan(self, company_id: int) -> Optional[ScanInfo]:
+        return self.scans.get(company_id)
+
+
+class HotOrderIndex:
+    """LRU map of platform order id -> OrderInfo, plus (company, AWB) -> platform order id"""
+
+    def __init__(self, max_orders: int = MAX_ORDERS):
+        self.max_orders = max_orders
+        self._orders: "OrderedDict[str, OrderInfo]" = OrderedDict()
+        self._awbs: Dict[tuple, str] = {}
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    @property
+    def enabled(self) -> bool:
+        return self.max_orders > 0
+
+    def __len__(self):
+        return len(self._orders)
+
+    def get(self, platform_order_id: str) -> Optional[OrderInfo]:
+        with self._lock:
+            info = self._orders.get(platform_order_id)
+            if info is not None:
+                self._orders.move_to_end(platform_order_id)
+            return info
+
+    def by_awb(self, company_id: int, awb_number: str) -> Optional[OrderInfo]:
+        with self._lock:
+            platform_order_id = self._awbs.get((company_id, awb_number))
+        return self.get(platform_order_id) if platform_order_id else None
+
+    def put(self, info: OrderInfo):
+        with self._lock:
+            previous = self._orders.pop(info.platform_order_id, None)
+            if previous is not None and not info.scans:
+                # Order fields changed; its scans did not
+                info.scans = previous.scans
+            self._orders[info.platform_order_id] = info
+            for company_id, scan in info.scans.items():
+                if scan.awb_number:
+                    self._awbs[(company_id, scan.awb_number)] = info.platform_order_id
+            while len(self._orders) > self.max_orders:
+                _, evicted = self._orders.popitem(last=False)
+                self._forget_awbs(evicted)
+
+    def remove(self, platform_order_id: str):
+        with self._lock:
+            info = self._orders.pop(platform_order_id, None)
+            if info is not None:
+                self._forget_awbs(info)
+
+    def set_scan(self, company_id: int, platform_order_id: str, scan: Optional[ScanInfo]):
+        """Record (or with scan=None drop) a company's scan of an order already in the index"""
+        with self._lock:
+            info = self._orders.get(platform_order_id)
+            if info is None:
+                return
+            previous = info.scans.pop(company_id, None)
+            if previous is not None and previous.awb_number:
+                self._awbs.pop((company_id, previous.awb_number), None)
+            if scan is not None:
+                info.scans[company_id] = scan
+                if scan.awb_number:
+                    self._awbs[(company_id, scan.awb_number)] = platform_order_id
+
+    def _forget_awbs(self, info: OrderInfo):
+        for company_id, scan in info.scans.items():
+            if scan.awb_number and self._awbs.get((company_id, scan.awb_number)) == info.platform_order_id:
+                del self._awbs[(company_id, scan.awb_number)]
+
+    def clear(self):
+        with self._lock:
+            self._orders.clear()
+            self._awbs.clear()
+
+    def stats(self) -> dict:
+        return {
+            "orders": len(self._orders),
+            "awbs": len(self._awbs),
+            "max_orders": self.max_orders,
+            "hits": self.hits,
+            "misses": self.misses,
+        }
+
+
+index = HotOrderIndex()
+_platforms: Dict[int, str] = {}  # platform id -> name
+
+
+# ---------------------------------------------------------------------------
+# Loading
+# ---------------------------------------------------------------------------
+
+def _load_platform_names(conn, platform_ids: Iterable[int]):
+    missing = {platform_id for platform_id in platform_ids if platform_id and platform_id not in _platforms}
+    if missing:
+        _platforms.update(conn.execute(
+            select(models.Platform.id, models.Platform.name).where(models.Platform.id.in_(list(missing)))
+        ).all())
+
+
+def _platform_name(platform_id) -> Optional[str]:
+    return _platforms.get(platform_id) if platform_id else None
+
+
+def _load(conn, condition) -> List[OrderInfo]:
+    """OrderInfo, with every company's scan, for the orders matching condition"""
+    order = models.Order
+    rows = conn.execute(
+        select(order.id, *[getattr(order, name) for name in _ORDER_FIELDS]).where(condition).order_by(order.id)
+    ).all()
+    _load_platform_names(conn, {row.platform_id for row in rows})
+
+    infos = {}
+    for row in rows:
+        # First order wins for a repeated platform order id, as in POST /scan
+        if row.platform_order_id and row.platform_order_id not in infos:
+            infos[row.platform_order_id] = OrderInfo(
+                row.id, row.platform_order_id, row.platform_id, _platform_name(row.platform_id),
+                row.customer_name, row.order_total, row.order_status
+            )
+
+    scan = models.DispatchScan
+    refs = list(infos)
+    for start in range(0, len(refs), BATCH_SIZE):
+        for row in conn.execute(select(
+            scan.id, scan.company_id, scan.platform_order_id, scan.scanned_at, scan.awb_number, scan.dispatch_status
+        ).where(scan.platform_order_id.in_(refs[start:start + BATCH_SIZE])).order_by(scan.id)):
+            infos[row.platform_order_id].scans.setdefault(
+                row.company_id, ScanInfo(row.id, row.scanned_at, row.awb_number, row.dispatch_status)
+            )
+    return list(infos.values())
+
+
+def warm(db: Session) -> int:
+    """Load undispatched and recently dispatched orders, newest first, up to the index size"""
+    if not index.enabled:
+        return 0
+    order = models.Order
+    cutoff = datetime.now() - timedelta(days=WARM_DAYS)
+    conn = db.connection()
+    ids = [order_id for (order_id,) in conn.execute(
+        select(order.id).where(
+            or_(order.is_dispatched.is_(False), order.is_dispatched.is_(None), order.dispatched_at >= cutoff)
+        ).order_by(order.id.desc()).limit(index.max_orders)
+    )]
+    # Oldest first, so the newest orders are the last to be evicted
+    for start in range(len(ids), 0, -BATCH_SIZE):
+        for info in _load(conn, order.id.in_(ids[max(start - BATCH_SIZE, 0):start])):
+            index.put(info)
+    return len(ids)
+
+
+def lookup(db: Session, company_id: int, barcode: str) -> Optional[OrderInfo]:
+    """The order a barcode (platform order id, or AWB of a scanned parcel) refers to"""
+    if not barcode:
+        return None
+    if index.enabled:
+        info = index.get(barcode) or index.by_awb(company_id, barcode)
+        if info is not None:
+            index.hits += 1
+            return info
+        index.misses += 1
+
+    conn = db.connection()
+    infos = _load(conn, models.Order.platform_order_id == barcode)
+    if not infos:
+        scan = models.DispatchScan
+        platform_order_id = conn.execute(select(scan.platform_order_id).where(
+            scan.company_id == company_id, scan.awb_number == barcode
+        ).limit(1)).scalar()
+        if platform_order_id:
+            infos = _load(conn, models.Order.platform_order_id == platform_order_id)
+    if index.enabled:
+        for info in infos:
+            index.put(info)
+    return infos[0] if infos else None
+
+
+def note_scans(db: Session, scans: Iterable[models.DispatchScan]):
+    """Queue scans written without a flush (bulk inserts) for the index; applied on commit"""
+    ops = db.info.setdefault("dispatch_index_ops", [])
+    ops.extend(("scan", _scan_values(scan)) for scan in scans)
+
+
+# ---------------------------------------------------------------------------
+# Keeping the index current
+# ---------------------------------------------------------------------------
+
+def _scan_values(scan: models.DispatchScan) -> tuple:
+    return (
+        scan.company_id, scan.platform_order_id,
+        ScanInfo(scan.id, scan.scanned_at, scan.awb_number, scan.dispatch_status or "scanned"),
+    )
+
+
+@event.listens_for(Session, "after_flush")
+def _collect_changes(session, flush_context):
+    if not index.enabled:
+        return
+    ops = None
+    for obj in list(session.new) + list(session.dirty):
+        if isinstance(obj, models.Order):
+            ops = ops if ops is not None else session.info.setdefault("dispatch_index_ops", [])
+            old_ref = inspect(obj).attrs.platform_order_id.history.deleted
+            if old_ref and old_ref[0] and old_ref[0] != obj.platform_order_id:
+                ops.append(("drop_order", old_ref[0]))
+            ops.append(("order", (obj.id,) + tuple(getattr(obj, name) for name in _ORDER_FIELDS)))
+        elif isinstance(obj, models.DispatchScan):
+            ops = ops if ops is not None else session.info.setdefault("dispatch_index_ops", [])
+            ops.append(("scan", _scan_values(obj)))
+    for obj in session.deleted:
+        if isinstance(obj, models.Order):
+            ops = ops if ops is not None else session.info.setdefault("dispatch_index_ops", [])
+            ops.append(("drop_order", obj.platform_order_id))
+        elif isinstance(obj, models.DispatchScan):
+            ops = ops if ops is not None else session.info.setdefault("dispatch_index_ops", [])
+            ops.append(("drop_scan", (obj.company_id, obj.platform_order_id)))
+
+    if ops and any(op == "order" and values[2] not in _platforms for op, values in ops):
+        # Resolve platform names now, while the transaction can still query
+        _load_platform_names(session.connection(), {values[2] for op, values in ops if op == "order"})
+
+
+@event.listens_for(Session, "after_commit")
+def _apply_changes(session):
+    if session.in_nested_transaction():
+        # Released savepoint; wait for the real commit
+        return
+    ops = session.info.pop("dispatch_index_ops", None)
+    if not ops:
+        return
+    for op, values in ops:
+        if op == "order":
+            order_id, platform_order_id, platform_id, customer_name, order_total, order_status = values
+            if platform_order_id:
+                existing = index.get(platform_order_id)
+                if existing is None or existing.order_id >= order_id:
+                    index.put(OrderInfo(
+                        order_id, platform_order_id, platform_id,
+                        _platform_name(platform_id),
+                        customer_name, order_total, order_status
+                    ))
+        elif op == "drop_order":
+            index.remove(values)
+        elif op == "scan":
+            company_id, platform_order_id, scan = values
+            info = index.get(platform_order_id)
+            existing = info.scan(company_id) if info else None
+            # The first scan of an order is the one that counts
+            if existing is None or existing.scan_id is None or scan.scan_id is None or existing.scan_id >= scan.scan_id:
+                index.set_scan(company_id, platform_order_id, scan)
+        elif op == "drop_scan":
+            # Another scan of the order may remain; reload it on next use
+            index.remove(values[1])
+
+
+@event.listens_for(Session, "after_rollback")
+def _discard_changes(session):
+    if session.in_nested_transaction():
+        return
+    session.info.pop("dispatch_index_ops", None)
@@ -0,0 +1,226 @@
+"""
+Dispatch Scan Ingestion
+Records a batch of dispatch scans with a fixed number of queries instead of
+a handful of round trips per parcel: existing scans and orders for the whole
+batch are resolved with one IN query each, new scans are bulk-inserted,
+orders are flagged dispatched with one UPDATE, and the dispatch rollups get
+one update per day/courier/platform/status.
+
+Each scan gets its own outcome, so one bad barcode does not fail the batch:
+    recorded   new scan inserted (scan_id set)
+    cancelled  existing scan cancelled
+    duplicate  order already has a scan (or appears twice in the batch)
+    error      order not found in strict mode, or nothing to cancel
+
+Replay mode is for scanners that buffered scans while offline: the scan
+time reported by the scanner is kept (never later than now), and re-sending
+a batch that was partly recorded only reports the recorded ones as
+duplicates.
+"""
+
+from datetime import datetime
+from typing import Dict, List, Sequence
+
+from sqlalchemy.orm import Session
+
+from ..common import cache, models, rollups
+from . import dispatch_feed, dispatch_index, order_lookup
+
+RECORDED = "recorded"
+CANCELLED = "cancelled"
+DUPLICATE = "duplicate"
+ERROR = "error"
+
+BATCH_SIZE = 500  # ids per IN clause
+
+
+def _chunks(values: list):
+    for start in range(0, len(values), BATCH_SIZE):
+        yield values[start:start + BATCH_SIZE]
+
+
+def _existing_scans(db: Session, company_id: int, order_refs: List[str]) -> Dict[str, models.DispatchScan]:
+    scans = {}
+    for chunk in _chunks(order_refs):
+        for scan in db.query(models.DispatchScan).filter(
+            models.DispatchScan.company_id == company_id,
+            models.DispatchScan.platform_order_id.in_(chunk)
+        ).order_by(models.DispatchScan.id):
+            scans.setdefault(scan.platform_order_id, scan)
+    return scans
+
+
+def _orders(db: Session, order_refs: List[str]) -> Dict[str, tuple]:
+    """platform_order_id -> (order id, platform id, platform name); first order wins, as in /scan"""
+    orders = {}
+    for chunk in _chunks(order_refs):
+        for row in db.query(
+            models.Order.platform_order_id, models.Order.id, models.Order.platform_id, models.Platform.name
+        ).outerjoin(
+            models.Platform, models.Platform.id == models.Order.platform_id
+        ).filter(
+            models.Order.platform_order_id.in_(chunk)
+        ).order_by(models.Order.id):
+            orders.setdefault(row[0], tuple(row[1:]))
+    return orders
+
+
+def _scan_time(item, replay: bool, now: datetime) -> datetime:
+    scanned_at = getattr(item, "scanned_at", None)
+    if not replay or scanned_at is None:
+        return now
+    if scanned_at.tzinfo is not None:
+        scanned_at = scanned_at.astimezone().replace(tzinfo=None)
+    return min(scanned_at, now)
+
+
+def _outcome(index: int, item, status: str, scan_id=None, order_id=None, detail=None) -> dict:
+    return {
+        "index": index,
+        "client_scan_id": getattr(item, "client_scan_id", None),
+        "platform_order_id": item.platform_order_id,
+        "status": status,
+        "scan_id": scan_id,
+        "order_id": order_id,
+        "detail": detail,
+    }
+
+
+def ingest_scans(
+    db: Session,
+    company_id: int,
+    user_id: int,
+    items: Sequence,
+    validation_mode: str = "strict",
+    scan_action: str = "dispatch",
+    replay: bool = False
+) -> List[dict]:
+    """
+    Record a batch of scans (DispatchScanBatchItem or DispatchScanCreate) and
+    return one outcome per item, in order. Items without their own scan_action
+    use the batch's. The caller commits.
+    """
+    now = datetime.now()
+    order_refs = list(dict.fromkeys(item.platform_order_id for item in items))
+    existing = _existing_scans(db, company_id, order_refs)
+    orders = _orders(db, order_refs)
+
+    outcomes = []
+    new_scans = []
+    scan_outcomes = []  # (outcome, scan) for outcomes that need the id of a new scan
+    pending = {}  # platform_order_id -> scan created earlier in this batch
+    rollup_changes = []
+    dispatched_orders = {}  # order id -> dispatched_at
+    undispatched_orders = set()
+
+    for index, item in enumerate(items):
+        action = getattr(item, "scan_action", None) or scan_action
+        order_ref = item.platform_order_id
+        scan = pending.get(order_ref) or existing.get(order_ref)
+
+        if action == "cancel":
+            if scan is None:
+                outcomes.append(_outcome(index, item, ERROR, detail=f"Order '{order_ref}' has no dispatch scan to cancel"))
+                continue
+            if scan.dispatch_status == "cancelled":
+                outcomes.append(_outcome(index, item, DUPLICATE, scan.id, scan.order_id, "Scan is already cancelled"))
+                scan_outcomes.append((outcomes[-1], scan))
+                continue
+            if order_ref in pending:
+                # Scanned and cancelled within the batch: insert it cancelled
+                scan.scan_action = "cancel"
+                scan.dispatch_status = "cancelled"
+                dispatched_orders.pop(scan.order_id, None)
+                outcomes.append(_outcome(index, item, CANCELLED, order_id=scan.order_id))
+                scan_outcomes.append((outcomes[-1], scan))
+                continue
+            previous_key = rollups.dispatch_key(scan)
+            scan.scan_action = "cancel"
+            scan.dispatch_status = "cancelled"
+            scan.notes = (scan.notes or "") + f"\nCancelled at {now}"
+            rollup_changes.append((scan, previous_key))
+            if scan.order_id:
+                dispatched_orders.pop(scan.order_id, None)
+                undispatched_orders.add(scan.order_id)
+            outcomes.append(_outcome(index, item, CANCELLED, scan.id, scan.order_id))
+            continue
+
+        if scan is not None:
+            outcomes.append(_outcome(
+                index, item, DUPLICATE, scan.id, scan.order_id,
+                f"Order '{order_ref}' has already been scanned on {scan.scanned_at}"
+            ))
+            scan_outcomes.append((outcomes[-1], scan))
+            continue
+
+        order_id, platform_id, platform_name = orders.get(order_ref, (None, None, None))
+        if order_id is None and validation_mode == "strict":
+            outcomes.append(_outcome(index, item, ERROR, detail=f"Order with ID '{order_ref}' not found"))
+            continue
+
+        scanned_at = _scan_time(item, replay, now)
+        scan = models.DispatchScan(
+            company_id=company_id,
+            order_id=order_id,
+            platform_id=platform_id,
+            platform_name=item.platform_name or platform_name,
+            platform_order_id=order_ref,
+            barcode_data=item.barcode_data,
+            qr_code_data=item.qr_code_data,
+            scanned_by_user_id=user_id,
+            warehouse_id=item.warehouse_id,
+            awb_number=item.awb_number,
+            courier_partner=item.courier_partner,
+            notes=item.notes,
+            scan_metadata=item.metadata,
+            scan_action="dispatch",
+            dispatch_status="scanned",
+            scanned_at=scanned_at
+        )
+        pending[order_ref] = scan
+        if order_id:
+            undispatched_orders.discard(order_id)
+            dispatched_orders[order_id] = scanned_at
+        outcomes.append(_outcome(index, item, RECORDED, order_id=order_id))
+        new_scans.append(scan)
+        scan_outcomes.append((outcomes[-1], scan))
+
+    if new_scans:
+        db.bulk_save_objects(new_scans)
+        # No earlier scan exists for these order refs, so their ids come back with one query
+        ids = {}
+        for chunk in _chunks([scan.platform_order_id for scan in new_scans]):
+            ids.update(db.query(models.DispatchScan.platform_order_id, models.DispatchScan.id).filter(
+                models.DispatchScan.company_id == company_id,
+                models.DispatchScan.platform_order_id.in_(chunk)
+            ))
+        for scan in new_scans:
+            scan.id = ids.get(scan.platform_order_id)
+        for outcome, scan in scan_outcomes:
+            if outcome["scan_id"] is None:
+                outcome["scan_id"] = scan.id
+        rollup_changes.extend((scan, None) for scan in new_scans)
+        # Bulk inserts skip the flush hooks that keep the indexes and caches current
+        order_lookup.reindex(db.connection(), order_lookup.DISPATCH, list(ids.values()))
+        dispatch_index.note_scans(db, new_scans)
+        dispatch_feed.note_scans(db, new_scans)
+        cache.touch(db, cache.DISPATCH, company_id=company_id)
+
+    # One UPDATE per distinct dispatch time (a single one outside replay mode)
+    by_time = {}
+    for order_id, dispatched_at in dispatched_orders.items():
+        by_time.setdefault(dispatched_at, []).append(order_id)
+    for dispatched_at, order_ids in by_time.items():
+        for chunk in _chunks(order_ids):
+            db.query(models.Order).filter(models.Order.id.in_(chunk)).update(
+                {models.Order.is_dispatched: True, models.Order.dispatched_at: dispatched_at},
+                synchronize_session=False
+            )
+    for chunk in _chunks(list(undispatched_orders)):
+        db.query(models.Order).filter(models.Order.id.in_(chunk)).update(
+            {models.Order.is_dispatched: False, models.Order.dispatched_at: None},
+            synchronize_session=False
+        )
+
+    rollups.record_dispatch_scans(db, rollup_changes)
+    return outcomes
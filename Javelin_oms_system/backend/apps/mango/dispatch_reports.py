@@ -0,0 +1,292 @@
+"""
+Dispatch Report Export
+CSV/XLSX dispatch reports that stay flat in memory whatever the period:
+rows come from a server-side cursor REPORT_BATCH_SIZE at a time and are
+written out as they arrive, and the summary (totals by platform, status
+and courier for the report's filters) is a single GROUP BY in the database.
+
+Reports are either streamed in the response or, for periods large enough
+to outlast a request timeout, generated in the background into
+REPORT_EXPORT_DIR and downloaded once ready. Background files are named
+after the company and a random job id; "<name>.part" while being written,
+"<name>.error" if generation failed. Files older than REPORT_EXPORT_TTL
+hours are removed when a new one is started.
+
+Rows and summaries include archived months (see common/archive.py) when the
+report's period reaches back into them; archived scans get their user,
+warehouse and order details looked up a batch at a time.
+"""
+
+import csv
+import heapq
+import io
+import os
+import re
+import tempfile
+import time
+import uuid
+from datetime import datetime, timedelta
+from itertools import islice
+from typing import Dict, Iterable, Iterator, Optional, Tuple
+
+from sqlalchemy import func, select
+from sqlalchemy.orm import Session
+
+from ..common import SessionLocal, archive, models
+
+REPORT_BATCH_SIZE = int(os.getenv("REPORT_BATCH_SIZE", "2000"))
+REPORT_EXPORT_DIR = os.getenv("REPORT_EXPORT_DIR", os.path.join(tempfile.gettempdir(), "javelin_reports"))
+REPORT_EXPORT_TTL = float(os.getenv("REPORT_EXPORT_TTL", "24"))
+
+FORMATS = ("csv", "xlsx")
+MEDIA_TYPES = {
+    "csv": "text/csv",
+    "xlsx": "application/vnd.openxmlformats-officedocument.spreadsheetml.sheet",
+}
+REPORT_FIELDS = (
+    "scan_id", "platform_order_id", "platform_name", "scanned_at", "scanned_by", "warehouse_name",
+    "awb_number", "courier_partner", "dispatch_status", "order_total", "customer_name",
+)
+
+_JOB_ID = re.compile(r"^[0-9a-f]{32}$")
+
+
+def report_span(date_from: datetime, date_to: datetime) -> Tuple[datetime, datetime]:
+    """[start, end) of scanned_at covered by a report; date_to is inclusive"""
+    return date_from, date_to + timedelta(days=1)
+
+
+def report_filters(company_id: int, date_from: datetime, date_to: datetime,
+                   platform_id: Optional[int], platform_name: Optional[str]) -> list:
+    scan = models.DispatchScan
+    start, end = report_span(date_from, date_to)
+    filters = [
+        scan.company_id == company_id,
+        scan.scanned_at >= start,
+        scan.scanned_at < end,
+    ]
+    if platform_id:
+        filters.append(scan.platform_id == platform_id)
+    if platform_name:
+        filters.append(scan.platform_name == platform_name)
+    return filters
+
+
+def report_rows(db: Session, filters: list, span: Tuple[datetime, datetime]) -> Iterator[tuple]:
+    """Report rows in REPORT_FIELDS order, by scan time, with archived months the span reaches"""
+    rows = _hot_rows(db, filters)
+    if not archive.periods(db, models.DispatchScan.__tablename__, *span):
+        return rows
+    return heapq.merge(_archived_rows(db, filters, span), rows, key=lambda row: (row[3], row[0]))
+
+
+def _hot_rows(db: Session, filters: list) -> Iterator[tuple]:
+    """Rows still in the main database, read from a server-side cursor"""
+    scan = models.DispatchScan
+    query = db.query(
+        scan.id, scan.platform_order_id, scan.platform_name, scan.scanned_at,
+        models.User.full_name, models.Warehouse.name,
+        scan.awb_number, scan.courier_partner, scan.dispatch_status,
+        models.Order.order_total, models.Order.customer_name
+    ).join(
+        models.User, scan.scanned_by_user_id == models.User.id
+    ).outerjoin(
+        models.Warehouse, scan.warehouse_id == models.Warehouse.id
+    ).outerjoin(
+        models.Order, scan.order_id == models.Order.id
+    ).filter(*filters).order_by(scan.scanned_at, scan.id)
+
+    for row in query.execution_options(stream_results=True).yield_per(REPORT_BATCH_SIZE):
+        row = list(row)
+        row[4] = row[4] or "Unknown"
+        row[9] = float(row[9]) if row[9] else None
+        yield tuple(row)
+
+
+def _names(db: Session, column, known: Dict, ids: Iterable):
+    """Add column's value for ids not in known yet (None for missing rows)"""
+    model = column.class_
+    missing = {record_id for record_id in ids if record_id is not None and record_id not in known}
+    if missing:
+        known.update(dict.fromkeys(missing))
+        known.update(db.query(model.id, column).filter(model.id.in_(missing)).all())
+
+
+def _order_details(db: Session, order_ids: set) -> Dict[int, tuple]:
+    """(order_total, customer_name) by order id, from the main database or the orders archive"""
+    order = models.Order
+    details = {}
+    statement = select(order.id, order.order_total, order.customer_name)
+    if order_ids:
+        details.update((row[0], row[1:]) for row in db.execute(statement.where(order.id.in_(order_ids))))
+    missing = order_ids - set(details)
+    if missing:
+        details.update(
+            (row[0], row[1:])
+            for row in archive.archived_rows(db, statement.where(order.id.in_(missing)), order.__tablename__)
+        )
+    return details
+
+
+def _archived_rows(db: Session, filters: list, span: Tuple[datetime, datetime]) -> Iterator[tuple]:
+    scan = models.DispatchScan
+    statement = select(
+        scan.id, scan.platform_order_id, scan.platform_name, scan.scanned_at, scan.scanned_by_user_id,
+        scan.warehouse_id, scan.awb_number, scan.courier_partner, scan.dispatch_status, scan.order_id
+    ).where(*filters).order_by(scan.scanned_at, scan.id)
+    rows = archive.archived_rows(db, statement, scan.__tablename__, *span)
+
+    users, warehouses = {}, {}
+    while True:
+        batch = list(islice(rows, REPORT_BATCH_SIZE))
+        if not batch:
+            break
+        _names(db, models.User.full_name, users, (row.scanned_by_user_id for row in batch))
+        _names(db, models.Warehouse.name, warehouses, (row.warehouse_id for row in batch))
+        orders = _order_details(db, {row.order_id for row in batch if row.order_id is not None})
+        for row in batch:
+            order_total, customer_name = orders.get(row.order_id, (None, None))
+            yield (
+                row.id, row.platform_order_id, row.platform_name, row.scanned_at,
+                users.get(row.scanned_by_user_id) or "Unknown", warehouses.get(row.warehouse_id),
+                row.awb_number, row.courier_partner, row.dispatch_status,
+                float(order_total) if order_total else None, customer_name
+            )
+
+
+def report_summary(db: Session, filters: list, span: Tuple[datetime, datetime]) -> Dict:
+    """Row count and counts by platform, status and courier for the report's filters"""
+    scan = models.DispatchScan
+    summary = {"total_records": 0, "by_platform": {}, "by_status": {}, "by_courier": {}}
+    statement = select(
+        scan.platform_name, scan.dispatch_status, scan.courier_partner, func.count(scan.id)
+    ).where(*filters).group_by(scan.platform_name, scan.dispatch_status, scan.courier_partner)
+    for platform, status, courier, count in archive.union_rows(db, statement, scan.__tablename__, *span):
+        summary["total_records"] += count
+        for group, key in (("by_platform", platform or "Unknown"), ("by_status", status),
+                           ("by_courier", courier or "Unknown")):
+            summary[group][key] = summary[group].get(key, 0) + count
+    return summary
+
+
+# ---------------------------------------------------------------------------
+# Writers
+# ---------------------------------------------------------------------------
+
+def _csv_chunks(rows: Iterator[tuple]) -> Iterator[str]:
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow(REPORT_FIELDS)
+    for count, row in enumerate(rows, 1):
+        writer.writerow(row)
+        if count % REPORT_BATCH_SIZE == 0:
+            yield buffer.getvalue()
+            buffer.seek(0)
+            buffer.truncate()
+    yield buffer.getvalue()
+
+
+def _write_xlsx(target, rows: Iterator[tuple], summary: Dict, title: str):
+    """Write the workbook to a path or binary file; write-only mode keeps rows out of memory"""
+    from openpyxl import Workbook
+
+    workbook = Workbook(write_only=True)
+    sheet = workbook.create_sheet("Scans")
+    sheet.append(REPORT_FIELDS)
+    for row in rows:
+        sheet.append(row)
+
+    summary_sheet = workbook.create_sheet("Summary")
+    summary_sheet.append([title])
+    summary_sheet.append(["Total records", summary["total_records"]])
+    for group, label in (("by_platform", "Platform"), ("by_status", "Status"), ("by_courier", "Courier")):
+        summary_sheet.append([])
+        summary_sheet.append([label, "Scans"])
+        for key, count in sorted(summary[group].items(), key=lambda item: -item[1]):
+            summary_sheet.append([key, count])
+    workbook.save(target)
+
+
+def stream_report(fmt: str, filters: list, span: Tuple[datetime, datetime], title: str) -> Iterator:
+    """Response body for a streamed report, on a session of its own"""
+    db = SessionLocal()
+    try:
+        if fmt == "csv":
+            yield from _csv_chunks(report_rows(db, filters, span))
+            return
+        # A zip can only be sent once complete; spool it to disk, then stream it
+        with tempfile.TemporaryFile() as spool:
+            _write_xlsx(spool, report_rows(db, filters, span), report_summary(db, filters, span), title)
+            spool.seek(0)
+            while True:
+                chunk = spool.read(1024 * 1024)
+                if not chunk:
+                    break
+                yield chunk
+    finally:
+        db.close()
+
+
+# ---------------------------------------------------------------------------
+# Background files
+# ---------------------------------------------------------------------------
+
+def _file_path(company_id: int, job_id: str, fmt: str) -> str:
+    return os.path.join(REPORT_EXPORT_DIR, f"dispatch_report_{company_id}_{job_id}.{fmt}")
+
+
+def _remove_expired():
+    cutoff = time.time() - REPORT_EXPORT_TTL * 3600
+    for name in os.listdir(REPORT_EXPORT_DIR):
+        path = os.path.join(REPORT_EXPORT_DIR, name)
+        try:
+            if name.startswith("dispatch_report_") and os.path.getmtime(path) < cutoff:
+                os.remove(path)
+        except OSError:
+            pass
+
+
+def start_file(company_id: int, fmt: str) -> str:
+    """Reserve a job id for a background report; call write_file() to generate it"""
+    os.makedirs(REPORT_EXPORT_DIR, exist_ok=True)
+    _remove_expired()
+    job_id = uuid.uuid4().hex
+    open(_file_path(company_id, job_id, fmt) + ".part", "wb").close()
+    return job_id
+
+
+def write_file(company_id: int, job_id: str, fmt: str, filters: list, span: Tuple[datetime, datetime], title: str):
+    """Generate a background report (runs after the response has been sent)"""
+    path = _file_path(company_id, job_id, fmt)
+    db = SessionLocal()
+    try:
+        if fmt == "csv":
+            with open(path + ".part", "w", newline="", encoding="utf-8") as out:
+                for chunk in _csv_chunks(report_rows(db, filters, span)):
+                    out.write(chunk)
+        else:
+            _write_xlsx(path + ".part", report_rows(db, filters, span), report_summary(db, filters, span), title)
+        os.replace(path + ".part", path)
+    except Exception as e:
+        with open(path + ".error", "w", encoding="utf-8") as out:
+            out.write(str(e))
+        if os.path.exists(path + ".part"):
+            os.remove(path + ".part")
+    finally:
+        db.close()
+
+
+def file_status(company_id: int, job_id: str):
+    """(status, path or error message) for a background report; status is ready, running, failed or None"""
+    if not _JOB_ID.match(job_id or ""):
+        return None, None
+    for fmt in FORMATS:
+        path = _file_path(company_id, job_id, fmt)
+        if os.path.exists(path):
+            return "ready", path
+        if os.path.exists(path + ".part"):
+            return "running", None
+        if os.path.exists(path + ".error"):
+            with open(path + ".error", encoding="utf-8") as error:
+                return "failed", error.read()
+    return None, None
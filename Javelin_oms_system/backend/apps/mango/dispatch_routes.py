@@ -1,23 +1,34 @@
 """Dispatch Scanning API Routes"""
-from fastapi import APIRouter, Depends, HTTPException, Query
-from sqlalchemy.orm import Session
+import os
+
+from fastapi import APIRouter, BackgroundTasks, Depends, HTTPException, Query, Request, Response
+from fastapi.responses import FileResponse, HTMLResponse, JSONResponse, StreamingResponse
+from sqlalchemy.orm import Session, object_session
 from sqlalchemy import func, and_, or_
 from typing import List, Optional
-from datetime import datetime, timedelta
+from datetime import date, datetime, timedelta
 
 from ..common.db import get_db
-from ..common.models import DispatchScan, Order, Platform, User, Warehouse
+from ..common import rollups, cache, pagination
+from ..common.models import CourierManifest, DispatchScan, DispatchDailyRollup, Order, Platform, User
 from .dispatch_schemas import (
     DispatchScanCreate,
+    DispatchScanBatch,
+    DispatchScanBatchResponse,
     DispatchScanUpdate,
     DispatchScanResponse,
     DispatchScanFilter,
     DispatchReport,
     DispatchReportItem,
     DispatchSummary,
-    ValidationResponse
+    ValidationResponse,
+    ManifestCloseRequest,
+    ManifestCloseResponse,
+    ManifestExportRequest,
+    CourierManifestResponse
 )
 from ..common.dependencies import get_current_user
+from . import dispatch_feed, dispatch_index, dispatch_ingest, dispatch_reports, documents, manifests, order_lookup
 
 router = APIRouter(prefix="/dispatch", tags=["dispatch"])
 
@@ -46,6 +57,14 @@ async def record_dispatch_scan(
     platform_id = None
     platform_name_resolved = scan_data.platform_name
     
+    order_info = dispatch_index.lookup(db, current_user.company_id, scan_data.platform_order_id)
+    indexed_scan = order_info.scan(current_user.company_id) if order_info else None
+    if scan_action == "dispatch" and indexed_scan and order_info.platform_order_id == scan_data.platform_order_id:
+        raise HTTPException(
+            status_code=400,
+            detail=f"Order '{scan_data.platform_order_id}' has already been scanned on {indexed_scan.scanned_at}"
+        )
+    
     # Check if already scanned
     existing_scan = db.query(DispatchScan).filter(
         and_(
@@ -56,8 +75,10 @@ async def record_dispatch_scan(
     
     # If CANCEL mode and scan exists, update it to cancelled
     if scan_action == "cancel" and existing_scan:
+        previous_key = rollups.dispatch_key(existing_scan)
         existing_scan.scan_action = "cancel"
         existing_scan.dispatch_status = "cancelled"
+        rollups.record_dispatch_scan(db, existing_scan, previous_key)
         existing_scan.notes = (existing_scan.notes or "") + f"\nCancelled at {datetime.now()}"
         
         # Update order status if linked
@@ -78,41 +99,28 @@ async def record_dispatch_scan(
             detail=f"Order '{scan_data.platform_order_id}' has already been scanned on {existing_scan.scanned_at}"
         )
     
+    # The index also resolves AWBs; a scan is recorded against an order id only
+    order = order_info if order_info and order_info.platform_order_id == scan_data.platform_order_id else None
+    
     if validation_mode == "strict":
         # METHOD 1: STRICT - Order must exist first
-        order = db.query(Order).filter(
-            Order.platform_order_id == scan_data.platform_order_id
-        ).first()
-        
         if not order:
             raise HTTPException(
                 status_code=404,
                 detail=f"Order with ID '{scan_data.platform_order_id}' not found. Enable 'Loose Validation' mode to scan without order data."
             )
-        
-        order_id = order.id
+    # METHOD 2: LOOSE - If order not found, we still proceed with null order_id
+    
+    if order:
+        order_id = order.order_id
         platform_id = order.platform_id
-        platform_name_resolved = scan_data.platform_name or (order.platform.name if order.platform else None)
+        platform_name_resolved = scan_data.platform_name or order.platform_name
         
         # Update order dispatch status
-        order.is_dispatched = True
-        order.dispatched_at = datetime.now()
-        
-    else:  # loose mode
-        # METHOD 2: LOOSE - Try to find order, but proceed anyway
-        order = db.query(Order).filter(
-            Order.platform_order_id == scan_data.platform_order_id
-        ).first()
-        
-        if order:
-            order_id = order.id
-            platform_id = order.platform_id
-            platform_name_resolved = scan_data.platform_name or (order.platform.name if order.platform else None)
-            
-            # Update order dispatch status if order exists
-            order.is_dispatched = True
-            order.dispatched_at = datetime.now()
-        # If order not found, we still proceed with null order_id
+        db.query(Order).filter(Order.id == order_id).update(
+            {Order.is_dispatched: True, Order.dispatched_at: datetime.now()},
+            synchronize_session=False
+        )
     
     # Create dispatch scan record
     dispatch_scan = DispatchScan(
@@ -129,18 +137,67 @@ async def record_dispatch_scan(
         courier_partner=scan_data.courier_partner,
         notes=scan_data.notes,
         scan_metadata=scan_data.metadata,
-        scan_action=scan_action
+        scan_action=scan_action,
+        scanned_at=datetime.now()
     )
     
     db.add(dispatch_scan)
+    db.flush()
+    rollups.record_dispatch_scan(db, dispatch_scan)
     db.commit()
     db.refresh(dispatch_scan)
     
     return dispatch_scan
 
 
+@router.post("/scans/batch", response_model=DispatchScanBatchResponse)
+def record_dispatch_scans(
+    batch: DispatchScanBatch,
+    validation_mode: str = Query(default="strict", enum=["strict", "loose"]),
+    scan_action: str = Query(default="dispatch", enum=["dispatch", "cancel"]),
+    mode: str = Query(default="live", enum=["live", "replay"]),
+    db: Session = Depends(get_db),
+    current_user: User = Depends(get_current_user)
+):
+    """
+    Record a batch of dispatch scans in one request
+    
+    Each scan is validated like POST /scan (validation_mode, scan_action) but
+    gets its own outcome instead of failing the request: recorded, cancelled,
+    duplicate or error. A scan's own scan_action overrides the batch's.
+    
+    Modes:
+    - live: Scans are timestamped now (default)
+    - replay: Scans buffered by an offline scanner keep their scanned_at
+    """
+    outcomes = dispatch_ingest.ingest_scans(
+        db,
+        current_user.company_id,
+        current_user.id,
+        batch.scans,
+        validation_mode=validation_mode,
+        scan_action=scan_action,
+        replay=mode == "replay"
+    )
+    db.commit()
+
+    counts = {status: 0 for status in (
+        dispatch_ingest.RECORDED, dispatch_ingest.CANCELLED, dispatch_ingest.DUPLICATE, dispatch_ingest.ERROR
+    )}
+    for outcome in outcomes:
+        counts[outcome["status"]] += 1
+    return {
+        "recorded": counts[dispatch_ingest.RECORDED],
+        "cancelled": counts[dispatch_ingest.CANCELLED],
+        "duplicates": counts[dispatch_ingest.DUPLICATE],
+        "errors": counts[dispatch_ingest.ERROR],
+        "outcomes": outcomes,
+    }
+
+
 @router.get("/scans", response_model=List[DispatchScanResponse])
 async def list_dispatch_scans(
+    response: Response,
     platform_id: Optional[int] = None,
     platform_name: Optional[str] = None,
     dispatch_status: Optional[str] = None,
@@ -149,12 +206,15 @@ async def list_dispatch_scans(
     scanned_by_user_id: Optional[int] = None,
     warehouse_id: Optional[int] = None,
     awb_number: Optional[str] = None,
+    awb_match: str = Query(order_lookup.AWB_CONTAINS, enum=list(order_lookup.AWB_MATCHES), description="How awb_number matches"),
     limit: int = Query(default=100, le=1000),
     offset: int = Query(default=0, ge=0),
+    cursor: Optional[str] = Query(None, description="X-Next-Cursor from the previous page"),
+    total: Optional[str] = Query(None, enum=list(pagination.TOTAL_MODES), description="Include X-Total-Count: exact or estimate (cached)"),
     db: Session = Depends(get_db),
     current_user: User = Depends(get_current_user)
 ):
-    """List dispatch scans with optional filters"""
+    """List dispatch scans with optional filters (keyset paginated, see X-Next-Cursor)"""
     
     query = db.query(DispatchScan).filter(
         DispatchScan.company_id == current_user.company_id
@@ -185,15 +245,29 @@ async def list_dispatch_scans(
         query = query.filter(DispatchScan.warehouse_id == warehouse_id)
     
     if awb_number:
-        query = query.filter(DispatchScan.awb_number.like(f"%{awb_number}%"))
-    
-    # Order by most recent first
-    query = query.order_by(DispatchScan.scanned_at.desc())
-    
-    # Pagination
-    scans = query.offset(offset).limit(limit).all()
+        if order_lookup.awb_ready(db) and order_lookup.awb_indexed(awb_number, awb_match):
+            # Ranges over order_lookup_keys, whichever part of the AWB was given
+            matching = order_lookup.awb_record_ids(current_user.company_id, awb_number, awb_match)
+            query = query.filter(DispatchScan.id.in_(matching))
+        elif awb_match == order_lookup.AWB_EXACT:
+            query = query.filter(DispatchScan.awb_number == awb_number)
+        elif awb_match == order_lookup.AWB_PREFIX:
+            query = query.filter(DispatchScan.awb_number.like(f"{awb_number}%"))
+        elif awb_match == order_lookup.AWB_ENDS_WITH:
+            query = query.filter(DispatchScan.awb_number.like(f"%{awb_number}"))
+        else:
+            query = query.filter(DispatchScan.awb_number.like(f"%{awb_number}%"))
+    
+    # Most recent first; pages continue from the cursor when one is given
+    page = pagination.paginate(
+        query, [(DispatchScan.scanned_at, True), (DispatchScan.id, True)], limit,
+        cursor=cursor, offset=offset, total=total,
+        count_key=("dispatch_scans", current_user.company_id, platform_id, platform_name, dispatch_status,
+                   date_from, date_to, scanned_by_user_id, warehouse_id, awb_number, awb_match)
+    )
+    page.apply_headers(response)
     
-    return scans
+    return page.items
 
 
 @router.get("/scans/{scan_id}", response_model=DispatchScanResponse)
@@ -236,6 +310,8 @@ async def update_dispatch_scan(
     if not scan:
         raise HTTPException(status_code=404, detail="Dispatch scan not found")
     
+    previous_key = rollups.dispatch_key(scan)
+    
     # Update fields
     if update_data.dispatch_status:
         scan.dispatch_status = update_data.dispatch_status
@@ -252,12 +328,78 @@ async def update_dispatch_scan(
     if update_data.notes:
         scan.notes = update_data.notes
     
+    rollups.record_dispatch_scan(db, scan, previous_key)
     db.commit()
     db.refresh(scan)
     
     return scan
 
 
+def _dispatch_summary_from_rollups(
+    db: Session,
+    company_id: int,
+    date_from: Optional[datetime],
+    date_to: Optional[datetime]
+) -> DispatchSummary:
+    """Dispatch summary read from dispatch_daily_rollups (whole-day ranges only)"""
+    Rollup = DispatchDailyRollup
+    company_filter = Rollup.company_id == company_id
+    
+    total_query = db.query(func.coalesce(func.sum(Rollup.scan_count), 0)).filter(company_filter)
+    if date_from:
+        total_query = total_query.filter(Rollup.day >= date_from.date())
+    if date_to:
+        total_query = total_query.filter(Rollup.day <= date_to.date())
+    total_scans = total_query.scalar()
+    
+    scanned_today = db.query(func.coalesce(func.sum(Rollup.scan_count), 0)).filter(
+        company_filter,
+        Rollup.day == date.today()
+    ).scalar()
+    
+    def grouped(column):
+        return db.query(column, func.sum(Rollup.scan_count)).filter(
+            company_filter
+        ).group_by(column).having(func.sum(Rollup.scan_count) > 0).all()
+    
+    by_platform = {platform or "Unknown": count for platform, count in grouped(Rollup.platform_name)}
+    by_status = {status: count for status, count in grouped(Rollup.dispatch_status)}
+    by_courier = {courier: count for courier, count in grouped(Rollup.courier_partner) if courier}
+    
+    return DispatchSummary(
+        total_scans=total_scans,
+        scanned_today=scanned_today,
+        by_platform=by_platform,
+        by_status=by_status,
+        by_courier=by_courier
+    )
+
+
+@router.get("/live")
+async def dispatch_live_feed(
+    current_user: User = Depends(get_current_user)
+):
+    """
+    Server-Sent Events stream of the company's dispatch floor
+    
+    Events:
+    - counters: today's scans in total and by warehouse, courier, platform and status
+    - scan: a scan that was just recorded or changed
+    """
+    company_id = current_user.company_id
+    # The stream can stay open for hours, and FastAPI only closes dependency
+    # sessions once the response has finished; hand the connection that
+    # resolved the user back to the pool now
+    session = object_session(current_user)
+    if session is not None:
+        session.close()
+    return StreamingResponse(
+        dispatch_feed.stream(company_id),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+
+
 @router.get("/summary", response_model=DispatchSummary)
 async def get_dispatch_summary(
     date_from: Optional[datetime] = None,
@@ -266,9 +408,30 @@ async def get_dispatch_summary(
     current_user: User = Depends(get_current_user)
 ):
     """Get dispatch summary statistics"""
+    return cache.response_cache.get_or_compute(
+        ("dispatch.summary", current_user.company_id, date_from, date_to),
+        [cache.DISPATCH],
+        lambda: _build_dispatch_summary(db, current_user.company_id, date_from, date_to),
+        company_id=current_user.company_id
+    )
+
+
+def _build_dispatch_summary(
+    db: Session,
+    company_id: int,
+    date_from: Optional[datetime],
+    date_to: Optional[datetime]
+) -> DispatchSummary:
+    """Compute dispatch summary statistics (uncached)"""
+    
+    def whole_day(value: Optional[datetime]) -> bool:
+        return value is None or value == value.replace(hour=0, minute=0, second=0, microsecond=0)
+    
+    if whole_day(date_from) and whole_day(date_to) and rollups.is_ready(db, rollups.DISPATCH):
+        return _dispatch_summary_from_rollups(db, company_id, date_from, date_to)
     
     query = db.query(DispatchScan).filter(
-        DispatchScan.company_id == current_user.company_id
+        DispatchScan.company_id == company_id
     )
     
     # Apply date filters
@@ -285,7 +448,7 @@ async def get_dispatch_summary(
     today_start = datetime.now().replace(hour=0, minute=0, second=0, microsecond=0)
     scanned_today = db.query(DispatchScan).filter(
         and_(
-            DispatchScan.company_id == current_user.company_id,
+            DispatchScan.company_id == company_id,
             DispatchScan.scanned_at >= today_start
         )
     ).count()
@@ -295,7 +458,7 @@ async def get_dispatch_summary(
         DispatchScan.platform_name,
         func.count(DispatchScan.id).label('count')
     ).filter(
-        DispatchScan.company_id == current_user.company_id
+        DispatchScan.company_id == company_id
     ).group_by(DispatchScan.platform_name).all()
     
     by_platform = {platform or "Unknown": count for platform, count in by_platform_raw}
@@ -305,7 +468,7 @@ async def get_dispatch_summary(
         DispatchScan.dispatch_status,
         func.count(DispatchScan.id).label('count')
     ).filter(
-        DispatchScan.company_id == current_user.company_id
+        DispatchScan.company_id == company_id
     ).group_by(DispatchScan.dispatch_status).all()
     
     by_status = {status: count for status, count in by_status_raw}
@@ -316,7 +479,7 @@ async def get_dispatch_summary(
         func.count(DispatchScan.id).label('count')
     ).filter(
         and_(
-            DispatchScan.company_id == current_user.company_id,
+            DispatchScan.company_id == company_id,
             DispatchScan.courier_partner.isnot(None)
         )
     ).group_by(DispatchScan.courier_partner).all()
@@ -333,67 +496,75 @@ async def get_dispatch_summary(
 
 
 @router.get("/report", response_model=DispatchReport)
-async def generate_dispatch_report(
+def generate_dispatch_report(
     date_from: datetime = Query(..., description="Report start date"),
     date_to: datetime = Query(..., description="Report end date"),
     platform_id: Optional[int] = None,
     platform_name: Optional[str] = None,
+    request: Request = None,
+    background_tasks: BackgroundTasks = None,
+    format: str = Query(default="json", enum=["json", "csv", "xlsx"]),
+    delivery: str = Query(default="stream", enum=["stream", "file"]),
     db: Session = Depends(get_db),
     current_user: User = Depends(get_current_user)
 ):
-    """Generate detailed dispatch report"""
-    
-    # Build query
-    query = db.query(
-        DispatchScan,
-        User.full_name.label("scanned_by_name"),
-        Warehouse.name.label("warehouse_name"),
-        Order.order_total,
-        Order.customer_name
-    ).join(
-        User, DispatchScan.scanned_by_user_id == User.id
-    ).outerjoin(
-        Warehouse, DispatchScan.warehouse_id == Warehouse.id
-    ).outerjoin(
-        Order, DispatchScan.order_id == Order.id
-    ).filter(
-        DispatchScan.company_id == current_user.company_id
-    )
+    """
+    Generate detailed dispatch report
     
-    # Apply date filter
-    query = query.filter(DispatchScan.scanned_at >= date_from)
-    date_to_inclusive = date_to + timedelta(days=1)
-    query = query.filter(DispatchScan.scanned_at < date_to_inclusive)
+    Formats:
+    - json: Whole report in one document (default)
+    - csv / xlsx: Rows written out as they are read, for periods too large for json
     
-    # Apply platform filters
-    if platform_id:
-        query = query.filter(DispatchScan.platform_id == platform_id)
+    Delivery (csv / xlsx):
+    - stream: Report is the response body (default)
+    - file: Report is generated in the background; poll the returned download_url
+    """
+    filters = dispatch_reports.report_filters(current_user.company_id, date_from, date_to, platform_id, platform_name)
+    span = dispatch_reports.report_span(date_from, date_to)
+    if format != "json":
+        title = f"Dispatch report {date_from.date()} to {date_to.date()}"
+        
+        if delivery == "file":
+            job_id = dispatch_reports.start_file(current_user.company_id, format)
+            background_tasks.add_task(
+                dispatch_reports.write_file, current_user.company_id, job_id, format, filters, span, title
+            )
+            return JSONResponse({
+                "job_id": job_id,
+                "status": "running",
+                "download_url": str(request.url_for("download_dispatch_report", job_id=job_id)),
+            }, status_code=202)
+        
+        summary = dispatch_reports.report_summary(db, filters, span)
+        filename = f"dispatch_report_{date_from.strftime('%Y%m%d')}_{date_to.strftime('%Y%m%d')}.{format}"
+        return StreamingResponse(
+            dispatch_reports.stream_report(format, filters, span, title),
+            media_type=dispatch_reports.MEDIA_TYPES[format],
+            headers={
+                "Content-Disposition": f"attachment; filename={filename}",
+                "X-Total-Count": str(summary["total_records"]),
+            }
+        )
     
-    if platform_name:
-        query = query.filter(DispatchScan.platform_name == platform_name)
+    # Build report items (archived months included when the period reaches them)
+    items = [
+        DispatchReportItem(**dict(zip(dispatch_reports.REPORT_FIELDS, row)))
+        for row in dispatch_reports.report_rows(db, filters, span)
+    ]
     
-    # Execute query
-    results = query.all()
-    
-    # Build report items
-    items = []
-    for scan, scanned_by_name, warehouse_name, order_total, customer_name in results:
-        items.append(DispatchReportItem(
-            scan_id=scan.id,
-            platform_order_id=scan.platform_order_id,
-            platform_name=scan.platform_name,
-            scanned_at=scan.scanned_at,
-            scanned_by=scanned_by_name or "Unknown",
-            warehouse_name=warehouse_name,
-            awb_number=scan.awb_number,
-            courier_partner=scan.courier_partner,
-            dispatch_status=scan.dispatch_status,
-            order_total=float(order_total) if order_total else None,
-            customer_name=customer_name
-        ))
-    
-    # Get summary for report period
-    summary = await get_dispatch_summary(date_from, date_to, db, current_user)
+    # Summary from the same filters and months as the items (as in csv / xlsx)
+    totals = dispatch_reports.report_summary(db, filters, span)
+    today_start = datetime.now().replace(hour=0, minute=0, second=0, microsecond=0)
+    summary = DispatchSummary(
+        total_scans=totals["total_records"],
+        scanned_today=db.query(DispatchScan).filter(
+            DispatchScan.company_id == current_user.company_id,
+            DispatchScan.scanned_at >= today_start
+        ).count(),
+        by_platform=totals["by_platform"],
+        by_status=totals["by_status"],
+        by_courier=totals["by_courier"]
+    )
     
     return DispatchReport(
         date_from=date_from,
@@ -404,6 +575,23 @@ async def generate_dispatch_report(
     )
 
 
+@router.get("/report/files/{job_id}")
+async def download_dispatch_report(
+    job_id: str,
+    current_user: User = Depends(get_current_user)
+):
+    """Download a report generated with delivery=file, or its status while it is being generated"""
+    status, detail = dispatch_reports.file_status(current_user.company_id, job_id)
+    if status is None:
+        raise HTTPException(status_code=404, detail="Report not found")
+    if status == "failed":
+        raise HTTPException(status_code=500, detail=f"Report generation failed: {detail}")
+    if status == "running":
+        return JSONResponse({"job_id": job_id, "status": "running"}, status_code=202)
+    fmt = detail.rsplit(".", 1)[-1]
+    return FileResponse(detail, media_type=dispatch_reports.MEDIA_TYPES[fmt], filename=os.path.basename(detail))
+
+
 @router.post("/validate", response_model=ValidationResponse)
 async def validate_barcode(
     barcode_data: str = Query(..., description="Barcode or platform order ID to validate"),
@@ -412,10 +600,8 @@ async def validate_barcode(
 ):
     """Validate a barcode before scanning"""
     
-    # Try to find order by platform_order_id
-    order = db.query(Order).filter(
-        Order.platform_order_id == barcode_data
-    ).first()
+    # Find order by platform_order_id (or AWB of a scanned parcel), from memory when it is indexed
+    order = dispatch_index.lookup(db, current_user.company_id, barcode_data)
     
     if not order:
         return ValidationResponse(
@@ -425,18 +611,13 @@ async def validate_barcode(
         )
     
     # Check if already dispatched
-    existing_scan = db.query(DispatchScan).filter(
-        and_(
-            DispatchScan.platform_order_id == barcode_data,
-            DispatchScan.company_id == current_user.company_id
-        )
-    ).first()
+    existing_scan = order.scan(current_user.company_id)
     
     if existing_scan:
         return ValidationResponse(
             is_valid=False,
             message=f"Order already dispatched on {existing_scan.scanned_at.strftime('%Y-%m-%d %H:%M')}",
-            order_id=order.id,
+            order_id=order.order_id,
             platform_order_id=order.platform_order_id,
             already_dispatched=True,
             order_details={
@@ -450,9 +631,9 @@ async def validate_barcode(
     return ValidationResponse(
         is_valid=True,
         message="Order found and ready for dispatch",
-        order_id=order.id,
+        order_id=order.order_id,
         platform_order_id=order.platform_order_id,
-        platform_name=order.platform.name if order.platform else None,
+        platform_name=order.platform_name,
         already_dispatched=False,
         order_details={
             "customer_name": order.customer_name,
@@ -460,3 +641,125 @@ async def validate_barcode(
             "order_status": order.order_status
         }
     )
+
+
+# ============================================================
+# COURIER MANIFESTS
+# ============================================================
+
+@router.post("/manifests/close", response_model=ManifestCloseResponse)
+def close_manifest_cutoff(
+    request_data: ManifestCloseRequest,
+    db: Session = Depends(get_db),
+    current_user: User = Depends(get_current_user)
+):
+    """
+    Close a dispatch cutoff: put every scanned parcel not yet on a manifest,
+    up to cutoff_at, on one manifest per courier and warehouse
+    """
+    cutoff_at = request_data.cutoff_at or datetime.now()
+    created = manifests.close_cutoff(
+        db,
+        current_user.company_id,
+        current_user.id,
+        cutoff_at=cutoff_at,
+        courier_partner=request_data.courier_partner,
+        warehouse_id=request_data.warehouse_id
+    )
+    db.commit()
+    
+    return ManifestCloseResponse(
+        cutoff_at=cutoff_at,
+        parcel_count=sum(manifest.parcel_count for manifest in created),
+        manifests=[CourierManifestResponse.model_validate(manifest) for manifest in created]
+    )
+
+
+@router.get("/manifests", response_model=List[CourierManifestResponse])
+async def list_manifests(
+    date_from: Optional[datetime] = None,
+    date_to: Optional[datetime] = None,
+    courier_partner: Optional[str] = None,
+    warehouse_id: Optional[int] = None,
+    status: Optional[str] = None,
+    limit: int = Query(default=100, le=1000),
+    db: Session = Depends(get_db),
+    current_user: User = Depends(get_current_user)
+):
+    """List courier manifests, latest cutoff first"""
+    query = db.query(CourierManifest).filter(CourierManifest.company_id == current_user.company_id)
+    
+    if date_from:
+        query = query.filter(CourierManifest.cutoff_at >= date_from)
+    if date_to:
+        query = query.filter(CourierManifest.cutoff_at < date_to + timedelta(days=1))
+    if courier_partner:
+        query = query.filter(CourierManifest.courier_partner == courier_partner)
+    if warehouse_id:
+        query = query.filter(CourierManifest.warehouse_id == warehouse_id)
+    if status:
+        query = query.filter(CourierManifest.status == status)
+    
+    return query.order_by(CourierManifest.cutoff_at.desc(), CourierManifest.id.desc()).limit(limit).all()
+
+
+@router.post("/manifests/export")
+async def export_manifests(
+    export: ManifestExportRequest,
+    db: Session = Depends(get_db),
+    current_user: User = Depends(get_current_user)
+):
+    """Download manifests as a ZIP of printable handover sheets"""
+    if len(export.ids) > documents.BULK_EXPORT_MAX:
+        raise HTTPException(status_code=400, detail=f"At most {documents.BULK_EXPORT_MAX} manifests can be exported at once")
+    
+    snapshots = manifests.load_snapshots(db, current_user.company_id, export.ids)
+    if not snapshots:
+        raise HTTPException(status_code=404, detail="No manifests found")
+    
+    return StreamingResponse(
+        manifests.stream_zip([snapshots[manifest_id] for manifest_id in dict.fromkeys(export.ids) if manifest_id in snapshots]),
+        media_type="application/zip",
+        headers={"Content-Disposition": 'attachment; filename="manifests.zip"'}
+    )
+
+
+@router.get("/manifests/{manifest_id}/document", response_class=HTMLResponse)
+async def get_manifest_document(
+    manifest_id: int,
+    db: Session = Depends(get_db),
+    current_user: User = Depends(get_current_user)
+):
+    """Printable handover sheet of a manifest"""
+    snapshots = manifests.load_snapshots(db, current_user.company_id, [manifest_id])
+    if not snapshots:
+        raise HTTPException(status_code=404, detail="Manifest not found")
+    
+    snapshot = snapshots[manifest_id]
+    return HTMLResponse(
+        content=manifests.render(snapshot),
+        headers={"Content-Disposition": f'inline; filename="{manifests.filename(snapshot["number"])}"'}
+    )
+
+
+@router.post("/manifests/{manifest_id}/handover", response_model=CourierManifestResponse)
+async def hand_over_manifest(
+    manifest_id: int,
+    db: Session = Depends(get_db),
+    current_user: User = Depends(get_current_user)
+):
+    """Mark a manifest as handed over to the courier"""
+    manifest = db.query(CourierManifest).filter(
+        CourierManifest.id == manifest_id,
+        CourierManifest.company_id == current_user.company_id
+    ).first()
+    if not manifest:
+        raise HTTPException(status_code=404, detail="Manifest not found")
+    if manifest.status == "handed_over":
+        raise HTTPException(status_code=400, detail=f"Manifest '{manifest.manifest_number}' was handed over on {manifest.handed_over_at}")
+    
+    manifest.status = "handed_over"
+    manifest.handed_over_at = datetime.now()
+    db.commit()
+    db.refresh(manifest)
+    return manifest
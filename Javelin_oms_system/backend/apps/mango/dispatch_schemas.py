@@ -1,6 +1,6 @@
 """Pydantic schemas for Dispatch Scanning"""
 from pydantic import BaseModel, Field
-from typing import Optional, Dict, Any
+from typing import Optional, Dict, Any, List
 from datetime import datetime
 
 
@@ -21,6 +21,38 @@ class DispatchScanCreate(BaseModel):
     metadata: Optional[Dict[str, Any]] = Field(None, description="Additional metadata")
 
 
+class DispatchScanBatchItem(DispatchScanCreate):
+    """One scan of a batch; scanned_at is only honoured in replay mode"""
+    client_scan_id: Optional[str] = Field(None, description="Scanner's own ID for the scan, echoed in its outcome")
+    scan_action: Optional[str] = Field(None, pattern="^(dispatch|cancel)$", description="Overrides the batch's scan action")
+    scanned_at: Optional[datetime] = Field(None, description="When the parcel was scanned (offline buffer replay)")
+
+
+class DispatchScanBatch(BaseModel):
+    """Schema for recording many dispatch scans at once"""
+    scans: List[DispatchScanBatchItem] = Field(..., min_length=1, max_length=1000)
+
+
+class DispatchScanOutcome(BaseModel):
+    """Result of one scan of a batch"""
+    index: int
+    client_scan_id: Optional[str] = None
+    platform_order_id: str
+    status: str  # recorded, cancelled, duplicate, error
+    scan_id: Optional[int] = None
+    order_id: Optional[int] = None
+    detail: Optional[str] = None
+
+
+class DispatchScanBatchResponse(BaseModel):
+    """Schema for batch scan response"""
+    recorded: int
+    cancelled: int
+    duplicates: int
+    errors: int
+    outcomes: List[DispatchScanOutcome]
+
+
 class DispatchScanUpdate(BaseModel):
     """Schema for updating dispatch scan status"""
     dispatch_status: Optional[str] = Field(None, description="New dispatch status")
@@ -113,3 +145,43 @@ class ValidationResponse(BaseModel):
     platform_name: Optional[str] = None
     already_dispatched: bool = False
     order_details: Optional[Dict[str, Any]] = None
+
+
+# ============================================================
+# COURIER MANIFEST SCHEMAS
+# ============================================================
+
+class ManifestCloseRequest(BaseModel):
+    """Schema for closing a dispatch cutoff into courier manifests"""
+    cutoff_at: Optional[datetime] = Field(None, description="Manifest scans up to this time (default: now)")
+    courier_partner: Optional[str] = Field(None, description="Only this courier's scans")
+    warehouse_id: Optional[int] = Field(None, description="Only this warehouse's scans")
+
+
+class CourierManifestResponse(BaseModel):
+    """Schema for courier manifest response"""
+    id: int
+    company_id: int
+    manifest_number: str
+    courier_partner: Optional[str]
+    warehouse_id: Optional[int]
+    cutoff_at: datetime
+    parcel_count: int
+    status: str
+    handed_over_at: Optional[datetime] = None
+    created_at: Optional[datetime] = None
+
+    class Config:
+        from_attributes = True
+
+
+class ManifestCloseResponse(BaseModel):
+    """Schema for the manifests created by a cutoff"""
+    cutoff_at: datetime
+    parcel_count: int
+    manifests: List[CourierManifestResponse]
+
+
+class ManifestExportRequest(BaseModel):
+    """Schema for downloading manifest documents"""
+    ids: List[int] = Field(..., min_length=1)
@@ -0,0 +1,561 @@
+"""
+Document Rendering
+Printable HTML for invoices, quotations and sales orders.
+
+Templates are read and parsed once at import. A rendered document is stored
+on disk under a hash of its snapshot (the document, its items, customer and
+company as the template sees them), so an unchanged document is served from
+the file without rendering it again. The "generated on" time is stamped when
+the HTML is served, not cached. Bulk exports render the documents that are not
+cached in a process pool and stream them as a ZIP.
+"""
+
+import hashlib
+import json
+import os
+import threading
+import zipfile
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime
+from html import escape
+from pathlib import Path
+from string import Template
+from typing import Dict, Iterable, Iterator, List, Optional, Tuple
+
+from sqlalchemy.orm import Session, selectinload
+
+from ..common import models
+from ..common.db import project_root
+
+TEMPLATE_DIR = Path(__file__).parent / "templates" / "documents"
+DOCUMENT_CACHE_DIR = Path(os.getenv("DOCUMENT_CACHE_DIR", str(project_root / "document_cache")))
+RENDER_WORKERS = int(os.getenv("DOCUMENT_RENDER_WORKERS", "4"))
+BULK_EXPORT_MAX = int(os.getenv("DOCUMENT_EXPORT_MAX", "500"))
+
+# Below this many uncached documents an export renders in-process
+_POOL_THRESHOLD = 8
+
+CURRENCY_SYMBOLS = {
+    "INR": "₹",
+    "USD": "$",
+    "EUR": "€",
+    "GBP": "£"
+}
+
+
+class DocumentSpec:
+    def __init__(self, model, number_column: str, template: str, filename_prefix: str, label: str):
+        self.model = model
+        self.number_column = number_column
+        self.template = template
+        self.filename_prefix = filename_prefix
+        self.label = label
+
+
+DOCUMENTS = {
+    "invoice": DocumentSpec(models.Invoice, "invoice_number", "invoice.html", "TaxInvoice", "Invoice"),
+    "quotation": DocumentSpec(models.Quotation, "quotation_number", "quotation.html", "Quotation", "Quotation"),
+    "sales_order": DocumentSpec(models.SalesOrder, "order_number", "sales_order.html", "SalesOrder", "Sales order"),
+}
+
+_TEMPLATES = {
+    doc_type: Template((TEMPLATE_DIR / spec.template).read_text(encoding="utf-8"))
+    for doc_type, spec in DOCUMENTS.items()
+}
+
+# Part of every cache key, so editing a template (or this module) retires old renders
+TEMPLATE_VERSION = hashlib.sha256(
+    b"".join(_TEMPLATES[doc_type].template.encode("utf-8") for doc_type in sorted(_TEMPLATES))
+    + Path(__file__).read_bytes()
+).hexdigest()[:16]
+
+
+# Rendered in place of the generation time, which stamp() fills in on every serve
+_GENERATED_ON = "<!--generated-on-->"
+_GENERATED_ON_FORMATS = {
+    "invoice": "%d-%m-%Y at %I:%M %p",
+    "quotation": "%B %d, %Y at %I:%M %p",
+    "sales_order": "%B %d, %Y at %I:%M %p",
+}
+
+
+def filename(doc_type: str, number: str) -> str:
+    return f"{DOCUMENTS[doc_type].filename_prefix}_{number}.html"
+
+
+def stamp(doc_type: str, content: str, generated_on: Optional[datetime] = None) -> str:
+    """Rendered (or cached) HTML with its generation time filled in"""
+    generated_on = generated_on or datetime.now()
+    return content.replace(_GENERATED_ON, generated_on.strftime(_GENERATED_ON_FORMATS[doc_type]))
+
+
+# ---------------------------------------------------------------------------
+# Rendering (plain data in, HTML out; runs in worker processes)
+# ---------------------------------------------------------------------------
+
+_ITEM_ROW = Template("""
+                <tr>
+                    <td>$index</td>
+                    <td>
+                        <strong>$description</strong>
+                        $extra
+                    </td>
+                    <td class="text-center">$quantity $unit</td>
+                    <td class="text-right">$unit_price</td>
+                    <td class="text-right">$discount_percent%</td>
+                    <td class="text-right">$tax_rate%</td>
+                    <td class="text-right"><strong>$line_total</strong></td>
+                </tr>
+                """)
+
+_INVOICE_ITEM_ROW = Template("""
+                <tr>
+                    <td>$index</td>
+                    <td>$hsn_code</td>
+                    <td>
+                        <strong>$description</strong>
+                        $extra
+                    </td>
+                    <td class="text-center">$quantity $unit</td>
+                    <td class="text-right">$unit_price</td>
+                    <td class="text-right">$discount_percent%</td>
+                    <td class="text-right">$tax_rate%</td>
+                    $tax_cells
+                    <td class="text-right"><strong>$line_total</strong></td>
+                </tr>
+                """)
+
+_TERMS_BLOCK = Template("""
+    <div class="terms">
+        <h4>$heading</h4>
+        <p>$text</p>
+    </div>
+    """)
+
+
+def _text(value) -> str:
+    return escape(str(value)) if value is not None else ""
+
+
+def _optional(fmt: str, value) -> str:
+    """fmt with the escaped value, or nothing when value is empty"""
+    return fmt.format(_text(value)) if value else ""
+
+
+def _date(value, fmt: str, default: str = "N/A") -> str:
+    return value.strftime(fmt) if value else default
+
+
+def _money(symbol: str, value) -> str:
+    return f"{symbol}{float(value or 0):,.2f}"
+
+
+def _company_context(doc: dict) -> dict:
+    company = doc["company"]
+    return {
+        "company_name": _text(company["name"] or "Company"),
+        "company_address": _text(company["address"] or ""),
+        "company_phone": _optional("Phone: {}", company["phone"]),
+        "company_email": _optional("Email: {}", company["email"]),
+    }
+
+
+def _customer_context(doc: dict) -> dict:
+    customer = doc["customer"] or {}
+    return {
+        "customer_name": _text(customer.get("name") or "N/A"),
+        "customer_email": _optional("<p>{}</p>", customer.get("email")),
+        "customer_code": _optional("<p>Code: {}</p>", customer.get("customer_code")),
+    }
+
+
+def _item_rows(doc: dict, symbol: str, with_notes: bool) -> str:
+    rows = []
+    for idx, item in enumerate(doc["items"]):
+        extra = _optional('<br><small style="color: #64748b;">SKU: {}</small>', item["sku"])
+        if with_notes:
+            extra += "\n                        " + _optional('<br><small style="color: #64748b;">{}</small>', item["notes"])
+        rows.append(_ITEM_ROW.substitute(
+            index=idx + 1,
+            description=_text(item["description"] or "N/A"),
+            extra=extra,
+            quantity=item["quantity"],
+            unit=_text(item["unit_of_measure"] or "PCS"),
+            unit_price=_money(symbol, item["unit_price"]),
+            discount_percent=f"{float(item['discount_percent'] or 0):.2f}",
+            tax_rate=f"{float(item['tax_rate'] or 0):.2f}",
+            line_total=_money(symbol, item["line_total"]),
+        ))
+    return "".join(rows)
+
+
+def _render_invoice(doc: dict) -> str:
+    symbol = CURRENCY_SYMBOLS.get(doc["currency"], doc["currency"])
+    customer = doc["customer"] or {}
+    company = doc["company"]
+
+    # Determine if inter-state or intra-state
+    customer_state = customer.get("state")
+    is_interstate = customer_state and company["state"] and customer_state != company["state"]
+
+    if is_interstate:
+        tax_headers = '<th style="width: 8%;" class="text-right">IGST</th>'
+        tax_totals = f'<tr><td class="label">IGST:</td><td class="amount">{_money(symbol, doc["igst_amount"])}</td></tr>'
+    else:
+        tax_headers = ('<th style="width: 4%;" class="text-right">CGST</th>'
+                       '<th style="width: 4%;" class="text-right">SGST</th>')
+        tax_totals = (f'<tr><td class="label">CGST:</td><td class="amount">{_money(symbol, doc["cgst_amount"])}</td></tr>'
+                      f'<tr><td class="label">SGST:</td><td class="amount">{_money(symbol, doc["sgst_amount"])}</td></tr>')
+
+    rows = []
+    for idx, item in enumerate(doc["items"]):
+        if is_interstate:
+            tax_cells = f'<td class="text-right">{_money(symbol, item["igst_amount"])}</td>'
+        else:
+            tax_cells = (f'<td class="text-right">{_money(symbol, item["cgst_amount"])}</td>'
+                         f'<td class="text-right">{_money(symbol, item["sgst_amount"])}</td>')
+        rows.append(_INVOICE_ITEM_ROW.substitute(
+            index=idx + 1,
+            hsn_code=_text(item["hsn_code"] or "N/A"),
+            description=_text(item["description"] or "N/A"),
+            extra=_optional("<br><small>SKU: {}</small>", item["sku"]),
+            quantity=item["quantity"],
+            unit=_text(item["unit_of_measure"] or "PCS"),
+            unit_price=_money(symbol, item["unit_price"]),
+            discount_percent=f"{float(item['discount_percent'] or 0):.2f}",
+            tax_rate=f"{float(item['tax_rate'] or 0):.2f}",
+            tax_cells=tax_cells,
+            line_total=_money(symbol, item["line_total"]),
+        ))
+
+    balance = float(doc["balance_amount"] or 0)
+    paid = float(doc["paid_amount"] or 0)
+    return _TEMPLATES["invoice"].substitute(
+        number=_text(doc["number"]),
+        **_company_context(doc),
+        company_gst=_optional("GSTIN: {}", doc["gst_number"] or company["tax_id"]),
+        customer_name=_text(customer.get("name") or "N/A"),
+        customer_email=_optional("<p>{}</p>", customer.get("email")),
+        customer_phone=_optional("<p>{}</p>", customer.get("phone")),
+        customer_gst=_optional("<p>GSTIN: {}</p>", doc["customer_gst_number"]),
+        billing_address=_optional("<p>{}</p>", doc["billing_address"]),
+        shipping_address=_optional("<p>{}</p>", doc["shipping_address"]) or "<p>Same as billing address</p>",
+        invoice_date=_date(doc["invoice_date"], "%d-%m-%Y"),
+        due_date=_date(doc["due_date"], "%d-%m-%Y"),
+        place_of_supply=_text(doc["place_of_supply"] or customer_state or "N/A"),
+        status=_text(doc["status"]),
+        payment_status=_text(doc["payment_status"]),
+        balance_line=f"<strong>Balance:</strong> {_money(symbol, balance)}" if balance > 0 else "",
+        tax_headers=tax_headers,
+        item_rows="".join(rows),
+        subtotal=_money(symbol, doc["subtotal"]),
+        discount_amount=_money(symbol, doc["discount_amount"]),
+        tax_totals=tax_totals,
+        shipping_charges=_money(symbol, doc["shipping_charges"]),
+        total_amount=_money(symbol, doc["total_amount"]),
+        paid_row=f'<tr><td class="label">Paid:</td><td class="amount">{_money(symbol, paid)}</td></tr>' if paid > 0 else "",
+        balance_row=(f'<tr><td class="label">Balance:</td><td class="amount"><strong>{_money(symbol, balance)}</strong></td></tr>'
+                     if balance > 0 else ""),
+        notes=_optional('<div class="info-box"><h3>Notes</h3><p>{}</p></div>', doc["notes"]),
+        terms_conditions=_optional('<div class="info-box"><h3>Terms & Conditions</h3><p>{}</p></div>', doc["terms_conditions"]),
+        generated_on=_GENERATED_ON,
+    )
+
+
+def _render_quotation(doc: dict) -> str:
+    symbol = CURRENCY_SYMBOLS.get(doc["currency"], doc["currency"])
+
+    def terms(heading, value):
+        return _TERMS_BLOCK.substitute(heading=heading, text=_text(value)) if value else ""
+
+    return _TEMPLATES["quotation"].substitute(
+        number=_text(doc["number"]),
+        **_company_context(doc),
+        **_customer_context(doc),
+        quotation_date=_date(doc["quotation_date"], "%B %d, %Y"),
+        valid_until=_date(doc["valid_until"], "%B %d, %Y"),
+        valid_until_text=_date(doc["valid_until"], "%B %d, %Y", "the specified date"),
+        status=_text(doc["status"]),
+        item_rows=_item_rows(doc, symbol, with_notes=True),
+        subtotal=_money(symbol, doc["subtotal"]),
+        discount_amount=_money(symbol, doc["discount_amount"]),
+        tax_amount=_money(symbol, doc["tax_amount"]),
+        total_amount=_money(symbol, doc["total_amount"]),
+        payment_terms=terms("Payment Terms", doc["payment_terms"]),
+        delivery_terms=terms("Delivery Terms", doc["delivery_terms"]),
+        terms_conditions=terms("Terms & Conditions", doc["terms_conditions"]),
+        notes=terms("Notes", doc["notes"]),
+        generated_on=_GENERATED_ON,
+    )
+
+
+def _render_sales_order(doc: dict) -> str:
+    symbol = CURRENCY_SYMBOLS.get(doc["currency"], doc["currency"])
+    return _TEMPLATES["sales_order"].substitute(
+        number=_text(doc["number"]),
+        **_company_context(doc),
+        **_customer_context(doc),
+        order_date=_date(doc["order_date"], "%B %d, %Y"),
+        delivery_date=_date(doc["delivery_date"], "%B %d, %Y"),
+        status=_text(doc["status"]),
+        shipping_address=_optional('<div class="info-box"><h3>Shipping Address</h3><p>{}</p></div>', doc["shipping_address"]),
+        item_rows=_item_rows(doc, symbol, with_notes=False),
+        subtotal=_money(symbol, doc["subtotal"]),
+        discount_amount=_money(symbol, doc["discount_amount"]),
+        tax_amount=_money(symbol, doc["tax_amount"]),
+        shipping_charges=_money(symbol, doc["shipping_charges"]),
+        total_amount=_money(symbol, doc["total_amount"]),
+        notes=_optional('<div class="info-box"><h3>Notes</h3><p>{}</p></div>', doc["notes"]),
+        generated_on=_GENERATED_ON,
+    )
+
+
+_RENDERERS = {
+    "invoice": _render_invoice,
+    "quotation": _render_quotation,
+    "sales_order": _render_sales_order,
+}
+
+
+def render(doc_type: str, doc: dict) -> str:
+    """HTML for a document snapshot (see load_snapshots), to be stamp()ed before serving"""
+    return _RENDERERS[doc_type](doc)
+
+
+def _render_job(job: Tuple[str, dict]) -> str:
+    return render(*job)
+
+
+# ---------------------------------------------------------------------------
+# Snapshots: everything a template needs, as plain picklable data
+# ---------------------------------------------------------------------------
+
+_DOCUMENT_FIELDS = {
+    "invoice": (
+        "invoice_date", "due_date", "status", "payment_status", "gst_number", "customer_gst_number",
+        "billing_address", "shipping_address", "place_of_supply", "subtotal", "discount_amount",
+        "igst_amount", "cgst_amount", "sgst_amount", "shipping_charges", "total_amount",
+        "paid_amount", "balance_amount", "notes", "terms_conditions",
+    ),
+    "quotation": (
+        "quotation_date", "valid_until", "status", "subtotal", "discount_amount", "tax_amount",
+        "total_amount", "payment_terms", "delivery_terms", "terms_conditions", "notes",
+    ),
+    "sales_order": (
+        "order_date", "delivery_date", "status", "shipping_address", "subtotal", "discount_amount",
+        "tax_amount", "shipping_charges", "total_amount", "notes",
+    ),
+}
+
+_ITEM_FIELDS = (
+    "description", "sku", "quantity", "unit_of_measure", "unit_price", "discount_percent", "tax_rate", "line_total",
+)
+_INVOICE_ITEM_FIELDS = _ITEM_FIELDS + ("hsn_code", "igst_amount", "cgst_amount", "sgst_amount")
+_QUOTATION_ITEM_FIELDS = _ITEM_FIELDS + ("notes",)
+
+
+def _snapshot(doc_type: str, document, company) -> dict:
+    spec = DOCUMENTS[doc_type]
+    item_fields = {"invoice": _INVOICE_ITEM_FIELDS, "quotation": _QUOTATION_ITEM_FIELDS}.get(doc_type, _ITEM_FIELDS)
+    customer = document.customer
+
+    snapshot = {field: getattr(document, field) for field in _DOCUMENT_FIELDS[doc_type]}
+    snapshot.update(
+        number=getattr(document, spec.number_column),
+        currency=document.currency,
+        company={
+            "name": company.name if company else None,
+            "address": company.address if company else None,
+            "phone": company.phone if company else None,
+            "email": company.email if company else None,
+            "state": company.state if company else None,
+            "tax_id": company.tax_id if company else None,
+        },
+        customer={
+            "name": customer.name,
+            "email": customer.email,
+            "phone": customer.phone,
+            "customer_code": customer.customer_code,
+            "state": getattr(customer, "state", None),
+        } if customer else None,
+        items=[{field: getattr(item, field) for field in item_fields} for item in document.items],
+    )
+    return snapshot
+
+
+def load_snapshots(db: Session, doc_type: str, company_id: int, ids: List[int]) -> Dict[int, dict]:
+    """Snapshots for the given documents of a company, keyed by id (missing ids are left out)"""
+    if not ids:
+        return {}
+    model = DOCUMENTS[doc_type].model
+    documents = db.query(model).options(
+        selectinload(model.customer),
+        selectinload(model.items)
+    ).filter(
+        model.id.in_(ids),
+        model.company_id == company_id
+    ).all()
+    company = db.query(models.Company).filter(models.Company.id == company_id).first()
+    return {document.id: _snapshot(doc_type, document, company) for document in documents}
+
+
+# ---------------------------------------------------------------------------
+# Disk cache
+# ---------------------------------------------------------------------------
+
+def cache_key(doc_type: str, snapshot: dict) -> str:
+    """Disk cache key: a hash of everything the template is rendered from"""
+    content = json.dumps(snapshot, sort_keys=True, default=str)
+    source = f"{doc_type}:{TEMPLATE_VERSION}:{content}"
+    return hashlib.sha256(source.encode("utf-8")).hexdigest()
+
+
+def _cache_path(key: str) -> Path:
+    return DOCUMENT_CACHE_DIR / key[:2] / f"{key}.html"
+
+
+def _read_cached(key: str) -> Optional[str]:
+    try:
+        return _cache_path(key).read_text(encoding="utf-8")
+    except (FileNotFoundError, NotADirectoryError):
+        return None
+
+
+def _write_cached(key: str, content: str):
+    path = _cache_path(key)
+    try:
+        path.parent.mkdir(parents=True, exist_ok=True)
+        # Write then rename, so readers never see a partial file
+        tmp = path.with_suffix(f".{os.getpid()}.{threading.get_ident()}.tmp")
+        tmp.write_text(content, encoding="utf-8")
+        os.replace(tmp, path)
+    except OSError as e:
+        print(f"Could not cache rendered document {key}: {e}")
+
+
+def get_document(db: Session, doc_type: str, company_id: int, doc_id: int) -> Optional[Tuple[str, str]]:
+    """(document number, HTML) for one document, served from the disk cache when unchanged"""
+    snapshot = load_snapshots(db, doc_type, company_id, [doc_id]).get(doc_id)
+    if snapshot is None:
+        return None
+    key = cache_key(doc_type, snapshot)
+
+    content = _read_cached(key)
+    if content is None:
+        content = render(doc_type, snapshot)
+        _write_cached(key, content)
+    return snapshot["number"], stamp(doc_type, content)
+
+
+# ---------------------------------------------------------------------------
+# Bulk export
+# ---------------------------------------------------------------------------
+
+_pool: Optional[ProcessPoolExecutor] = None
+_pool_lock = threading.Lock()
+
+
+def _get_pool() -> ProcessPoolExecutor:
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            _pool = ProcessPoolExecutor(max_workers=RENDER_WORKERS)
+        return _pool
+
+
+def shutdown_render_pool():
+    global _pool
+    with _pool_lock:
+        if _pool is not None:
+            _pool.shutdown(wait=False, cancel_futures=True)
+            _pool = None
+
+
+def render_many(function, jobs: List) -> Iterator[str]:
+    """
+    function(job) for each job, in order, in the worker pool when there are
+    enough of them. function must be a module-level function and jobs plain
+    picklable data.
+    """
+    if RENDER_WORKERS <= 1 or len(jobs) < _POOL_THRESHOLD:
+        return (function(job) for job in jobs)
+    chunksize = max(1, len(jobs) // (RENDER_WORKERS * 4))
+    return _get_pool().map(function, jobs, chunksize=chunksize)
+
+
+def _render_all(doc_type: str, snapshots: List[dict]) -> Iterator[str]:
+    """Render snapshots in order, in the worker pool when there are enough of them"""
+    return render_many(_render_job, [(doc_type, snapshot) for snapshot in snapshots])
+
+
+class _ZipOutput:
+    """Write-only sink for ZipFile; the streamed bytes are collected until drained"""
+
+    def __init__(self):
+        self._chunks = []
+
+    def write(self, data) -> int:
+        self._chunks.append(bytes(data))
+        return len(data)
+
+    def flush(self):
+        pass
+
+    def drain(self) -> bytes:
+        data = b"".join(self._chunks)
+        self._chunks = []
+        return data
+
+
+def prepare_export(db: Session, doc_type: str, company_id: int, ids: List[int]) -> dict:
+    """
+    Everything a ZIP export needs from the database, gathered up front so the
+    response can be streamed after the request's session is closed.
+    """
+    ids = list(dict.fromkeys(ids))
+    snapshots = load_snapshots(db, doc_type, company_id, ids)
+
+    entries = []  # (id, number, key, cached HTML or None)
+    for doc_id in ids:
+        if doc_id not in snapshots:
+            continue
+        key = cache_key(doc_type, snapshots[doc_id])
+        entries.append((doc_id, snapshots[doc_id]["number"], key, _read_cached(key)))
+
+    missing = {doc_id for doc_id, _, _, content in entries if content is None}
+    return {
+        "doc_type": doc_type,
+        "entries": entries,
+        "snapshots": {doc_id: snapshot for doc_id, snapshot in snapshots.items() if doc_id in missing},
+        "not_found": [doc_id for doc_id in ids if doc_id not in snapshots],
+    }
+
+
+def zip_files(files: Iterable[Tuple[str, str]]) -> Iterator[bytes]:
+    """ZIP of (filename, content) pairs, yielded as it is written"""
+    output = _ZipOutput()
+    with zipfile.ZipFile(output, mode="w", compression=zipfile.ZIP_DEFLATED) as archive:
+        for name, content in files:
+            archive.writestr(name, content)
+            data = output.drain()
+            if data:
+                yield data
+    yield output.drain()
+
+
+def stream_zip(export: dict) -> Iterator[bytes]:
+    """ZIP of the prepared documents, yielded as it is written"""
+    doc_type = export["doc_type"]
+    snapshots = export["snapshots"]
+    entries = [entry for entry in export["entries"] if entry[3] is not None or entry[0] in snapshots]
+    rendered = _render_all(doc_type, [snapshots[doc_id] for doc_id, _, _, content in entries if content is None])
+    generated_on = datetime.now()
+
+    def files():
+        for doc_id, number, key, content in entries:
+            if content is None:
+                content = next(rendered)
+                _write_cached(key, content)
+            yield filename(doc_type, number), stamp(doc_type, content, generated_on)
+
+    yield from zip_files(files())
@@ -0,0 +1,353 @@
+"""
+Batch Invoicing Service
+Bills many sales orders in one transaction: reference data is prefetched in
+bulk, invoices and lines are inserted in batches and the matching customer
+ledger entries are posted alongside
+"""
+
+from collections import defaultdict
+from datetime import datetime
+from decimal import Decimal
+from typing import Dict, List, Optional
+
+from sqlalchemy import func, or_
+from sqlalchemy.orm import Session
+
+from ..common import models, rollups
+from . import receivables, sequences
+
+ZERO = Decimal(0)
+UNBILLABLE_STATUSES = ("CANCELLED", "DRAFT")  # Never invoiced, even when asked for by id
+
+
+def gst_split(line_tax: Decimal, tax_rate: Decimal, is_interstate: bool) -> dict:
+    """IGST for inter-state supply, CGST + SGST (50-50) for intra-state"""
+    if is_interstate:
+        return {
+            "igst_rate": tax_rate, "igst_amount": line_tax,
+            "cgst_rate": ZERO, "cgst_amount": ZERO,
+            "sgst_rate": ZERO, "sgst_amount": ZERO,
+        }
+    return {
+        "igst_rate": ZERO, "igst_amount": ZERO,
+        "cgst_rate": tax_rate / 2, "cgst_amount": line_tax / 2,
+        "sgst_rate": tax_rate / 2, "sgst_amount": line_tax / 2,
+    }
+
+
+def _customer_states(db: Session, customer_ids) -> Dict[int, str]:
+    """Billing state per customer: default billing address first, then any billing address"""
+    rows = db.query(
+        models.CustomerAddress.customer_id,
+        models.CustomerAddress.state,
+        models.CustomerAddress.is_default
+    ).filter(
+        models.CustomerAddress.customer_id.in_(customer_ids),
+        models.CustomerAddress.address_type.in_(["BILLING", "BOTH"])
+    ).order_by(models.CustomerAddress.id).all()
+
+    states = {}
+    for customer_id, state, is_default in rows:
+        if customer_id not in states or is_default:
+            states[customer_id] = state
+    return states
+
+
+def invoice_sales_orders(
+    db: Session,
+    company_id: int,
+    user_id: int,
+    sales_order_ids: Optional[List[int]] = None,
+    status: Optional[str] = None,
+    order_date_from: Optional[datetime] = None,
+    order_date_to: Optional[datetime] = None,
+    invoice_date: Optional[datetime] = None,
+    limit: int = 1000
+) -> dict:
+    """
+    Create one invoice per matching sales order that has not been invoiced yet
+    and post an INVOICE debit to each customer's ledger. Cancelled and draft
+    orders are left out (reported in skipped when asked for by id). Does not
+    commit.
+    """
+    invoice_date = invoice_date or datetime.now()
+
+    # 1. Sales orders to bill
+    query = db.query(models.SalesOrder).filter(models.SalesOrder.company_id == company_id)
+    if sales_order_ids:
+        query = query.filter(models.SalesOrder.id.in_(sales_order_ids))
+    if status:
+        query = query.filter(models.SalesOrder.status == status.upper())
+    if order_date_from:
+        query = query.filter(models.SalesOrder.order_date >= order_date_from)
+    if order_date_to:
+        query = query.filter(models.SalesOrder.order_date <= order_date_to)
+    if not sales_order_ids:
+        query = query.filter(or_(
+            models.SalesOrder.status.is_(None), func.upper(models.SalesOrder.status).notin_(UNBILLABLE_STATUSES)
+        ))
+    # Locked in id order, so overlapping runs wait for each other instead of both billing the same orders
+    orders = query.order_by(models.SalesOrder.id).limit(limit).with_for_update().all()
+
+    order_ids = [order.id for order in orders]
+    already_invoiced = {
+        sales_order_id: invoice_number
+        for sales_order_id, invoice_number in db.query(
+            models.Invoice.sales_order_id, models.Invoice.invoice_number
+        ).filter(models.Invoice.sales_order_id.in_(order_ids)).all()
+    } if order_ids else {}
+
+    skipped = [
+        {"sales_order_id": order.id, "order_number": order.order_number,
+         "detail": f"Already invoiced as {already_invoiced[order.id]}"}
+        for order in orders if order.id in already_invoiced
+    ]
+    unbillable = {order.id for order in orders if (order.status or "").upper() in UNBILLABLE_STATUSES}
+    skipped += [
+        {"sales_order_id": order.id, "order_number": order.order_number,
+         "detail": f"Sales order is {order.status.upper()}"}
+        for order in orders if order.id in unbillable and order.id not in already_invoiced
+    ]
+    if sales_order_ids:
+        found = set(order_ids)
+        skipped += [
+            {"sales_order_id": so_id, "detail": "Sales order not found"}
+            for so_id in dict.fromkeys(sales_order_ids) if so_id not in found
+        ]
+    orders = [order for order in orders if order.id not in already_invoiced and order.id not in unbillable]
+    if not orders:
+        return {"invoices": [], "skipped": skipped}
+
+    # 2. Prefetch lines, products, customers and company tax settings in bulk
+    lines_by_order = defaultdict(list)
+    for line in db.query(models.SalesOrderItem).filter(
+        models.SalesOrderItem.order_id.in_([order.id for order in orders])
+    ).order_by(models.SalesOrderItem.id).all():
+        lines_by_order[line.order_id].append(line)
+
+    product_ids = {line.product_id for lines in lines_by_order.values() for line in lines if line.product_id}
+    products = {
+        product_id: (sku, name, hsn_code)
+        for product_id, sku, name, hsn_code in db.query(
+            models.Product.id, models.Product.sku, models.Product.name, models.Product.hsn_code
+        ).filter(models.Product.id.in_(product_ids)).all()
+    } if product_ids else {}
+
+    customer_ids = {order.customer_id for order in orders}
+    customers = {
+        customer.id: customer
+        for customer in db.query(models.Customer).filter(
+            models.Customer.id.in_(customer_ids)
+        ).order_by(models.Customer.id).with_for_update().all()
+    }
+    customer_states = _customer_states(db, customer_ids)
+
+    company = db.query(models.Company).filter(models.Company.id == company_id).first()
+    company_gst = (getattr(company, "gst_number", None) or company.tax_id) if company else None
+    company_state = company.state if company else None
+
+    # 3. Numbers for the whole batch in one counter update
+    numbers = sequences.next_numbers(db, "invoice", company_id, len(orders), on=invoice_date)
+
+    # 4. Compute every invoice and its lines
+    invoices = []
+    pending_lines = []  # (invoice, [line mappings])
+    for order, invoice_number in zip(orders, numbers):
+        customer = customers.get(order.customer_id)
+        customer_state = customer_states.get(order.customer_id)
+        is_interstate = bool(customer_state and company_state and customer_state != company_state)
+
+        subtotal = discount_total = tax_total = ZERO
+        igst_total = cgst_total = sgst_total = ZERO
+        line_rows = []
+        for line in lines_by_order[order.id]:
+            quantity = Decimal(line.quantity or 0)
+            unit_price = Decimal(str(line.unit_price or 0))
+            discount_percent = Decimal(str(line.discount_percent or 0))
+            tax_rate = Decimal(str(line.tax_rate or 0))
+
+            line_subtotal = quantity * unit_price
+            line_discount = line_subtotal * discount_percent / 100
+            line_tax = (line_subtotal - line_discount) * tax_rate / 100
+            split = gst_split(line_tax, tax_rate, is_interstate)
+
+            sku, name, hsn_code = products.get(line.product_id, (None, None, None))
+            line_rows.append({
+                "product_id": line.product_id,
+                "sales_order_item_id": line.id,
+                "sku": line.sku or sku,
+                "description": line.description or name or "",
+                "hsn_code": hsn_code,
+                "quantity": line.quantity,
+                "unit_price": unit_price,
+                "discount_percent": discount_percent,
+                "discount_amount": line_discount,
+                "tax_rate": tax_rate,
+                "tax_amount": line_tax,
+                "line_total": line_subtotal - line_discount + line_tax,
+                "unit_of_measure": line.unit_of_measure or "PCS",
+                "notes": line.notes,
+                **split,
+            })
+
+            subtotal += line_subtotal
+            discount_total += line_discount
+            tax_total += line_tax
+            igst_total += split["igst_amount"]
+            cgst_total += split["cgst_amount"]
+            sgst_total += split["sgst_amount"]
+
+        shipping = Decimal(str(order.shipping_charges or 0))
+        total = subtotal - discount_total + tax_total + shipping
+        invoice = models.Invoice(
+            company_id=company_id,
+            invoice_number=invoice_number,
+            sales_order_id=order.id,
+            quotation_id=order.quotation_id,
+            customer_id=order.customer_id,
+            invoice_date=invoice_date,
+            due_date=order.delivery_date,
+            status="DRAFT",
+            shipping_address=order.shipping_address,
+            payment_terms=order.payment_terms,
+            delivery_terms=order.delivery_terms,
+            notes=f"Invoice generated from Sales Order {order.order_number}",
+            currency=order.currency or "INR",
+            shipping_charges=shipping,
+            gst_number=company_gst,
+            customer_gst_number=getattr(customer, "gst_number", None),
+            place_of_supply=customer_state,
+            tax_type="GST",
+            subtotal=subtotal,
+            discount_amount=discount_total,
+            tax_amount=tax_total,
+            igst_amount=igst_total,
+            cgst_amount=cgst_total,
+            sgst_amount=sgst_total,
+            total_amount=total,
+            balance_amount=total,
+            payment_status="UNPAID",
+            created_by_user_id=user_id
+        )
+        invoices.append(invoice)
+        pending_lines.append((invoice, line_rows))
+
+    # 5. Insert invoices for their ids (one multi-row INSERT where the driver supports RETURNING), then all lines at once
+    db.add_all(invoices)
+    db.flush()
+    db.bulk_insert_mappings(models.InvoiceItem, [
+        {"invoice_id": invoice.id, **row}
+        for invoice, line_rows in pending_lines
+        for row in line_rows
+    ])
+
+    # 6. Ledger entries with running balances, in invoice order per customer
+    ledger_entries = []
+    for invoice in invoices:
+        customer = customers.get(invoice.customer_id)
+        if not customer:
+            continue
+        customer.current_balance = Decimal(str(customer.current_balance or 0)) + invoice.total_amount
+        ledger_entries.append(models.CustomerLedger(
+            customer_id=invoice.customer_id,
+            company_id=company_id,
+            transaction_date=invoice_date,
+            transaction_type="INVOICE",
+            reference_number=invoice.invoice_number,
+            reference_type="sale_invoice",
+            reference_id=invoice.id,
+            debit_amount=invoice.total_amount,
+            credit_amount=0,
+            balance=customer.current_balance,
+            description=f"Invoice {invoice.invoice_number}",
+            due_date=invoice.due_date,
+            created_by_user_id=user_id
+        ))
+    db.bulk_save_objects(ledger_entries, return_defaults=True)
+    rollups.record_ledger_entries(db, ledger_entries)
+    receivables.record_entries(db, ledger_entries, user_id=user_id)
+
+    return {
+        "invoices": [
+            {
+                "invoice_id": invoice.id,
+                "invoice_number": invoice.invoice_number,
+                "sales_order_id": invoice.sales_order_id,
+                "customer_id": invoice.customer_id,
+                "total_amount": float(invoice.total_amount),
+            }
+            for invoice in invoices
+        ],
+        "skipped": skipped,
+    }
+
+
+def reverse_invoice_posting(db: Session, invoice: models.Invoice, user_id: int) -> Optional[models.CustomerLedger]:
+    """
+    Undo the INVOICE ledger debit of an invoice that is about to be deleted:
+    post an ADJUSTMENT credit for the same amount, allocated to the debit so
+    both stay closed on a rebuild, drop the invoice's open item and take it
+    out of the open amounts and aging. Raises ValueError once payments or
+    credits have been applied to the invoice. Returns the reversal entry, or
+    None when the invoice was never posted. Does not commit.
+    """
+    ledger = models.CustomerLedger
+    entry = db.query(ledger).filter(
+        ledger.company_id == invoice.company_id,
+        ledger.transaction_type == "INVOICE",
+        ledger.reference_type == "sale_invoice",
+        ledger.reference_id == invoice.id
+    ).with_for_update().first()
+    if entry is None:
+        return None
+
+    allocated = db.query(models.LedgerAllocation.id).filter(
+        models.LedgerAllocation.debit_entry_id == entry.id
+    ).first()
+    if allocated or entry.is_reconciled:
+        raise ValueError(f"Payments have been applied to invoice {invoice.invoice_number}; it cannot be deleted")
+
+    amount = Decimal(str(entry.debit_amount or 0))
+    customer = db.query(models.Customer).filter(models.Customer.id == entry.customer_id).with_for_update().first()
+    customer.current_balance = Decimal(str(customer.current_balance or 0)) - amount
+
+    now = datetime.now()
+    reversal = models.CustomerLedger(
+        customer_id=entry.customer_id,
+        company_id=entry.company_id,
+        transaction_date=now,
+        transaction_type="ADJUSTMENT",
+        reference_number=entry.reference_number,
+        reference_type="sale_invoice_deleted",
+        reference_id=invoice.id,
+        debit_amount=0,
+        credit_amount=amount,
+        balance=customer.current_balance,
+        description=f"Invoice {invoice.invoice_number} deleted",
+        is_reconciled=True,
+        reconciled_date=now,
+        created_by_user_id=user_id
+    )
+    db.add(reversal)
+    entry.is_reconciled = True
+    entry.reconciled_date = now
+    db.flush()
+
+    db.add(models.LedgerAllocation(
+        company_id=entry.company_id,
+        customer_id=entry.customer_id,
+        credit_entry_id=reversal.id,
+        debit_entry_id=entry.id,
+        amount=amount,
+        method=receivables.REVERSAL,
+        allocated_at=now,
+        created_by_user_id=user_id
+    ))
+    db.query(models.CustomerOpenItem).filter(
+        models.CustomerOpenItem.ledger_entry_id == entry.id
+    ).delete(synchronize_session=False)
+
+    rollups.record_ledger_entries(db, [reversal])
+    # The invoice leaves the open amounts and aging as if settled in full
+    rollups.record_invoice_payments(db, [(entry, amount, True)])
+    return reversal
@@ -0,0 +1,199 @@
+"""
+Courier Manifests
+Closing a dispatch cutoff puts every scanned parcel that is not on a manifest
+yet, up to the cutoff time, on one manifest per courier and warehouse. The
+groups come from a single GROUP BY, their numbers from one sequence
+allocation, and each group's scans get their manifest_id with one UPDATE,
+so a cutoff costs a few statements per courier/warehouse, not per parcel.
+Cancelled scans are left off.
+
+Manifest documents (printable handover sheets) are rendered from plain
+snapshots in the document render pool, so a cutoff's manifests render in
+parallel.
+"""
+
+from datetime import datetime
+from html import escape
+from string import Template
+from typing import Dict, Iterator, List, Optional
+
+from sqlalchemy import or_
+from sqlalchemy.orm import Session
+
+from ..common import models
+from . import documents, sequences
+
+_TEMPLATE = Template((documents.TEMPLATE_DIR / "manifest.html").read_text(encoding="utf-8"))
+
+_PARCEL_ROW = Template("""
+            <tr>
+                <td>$index</td>
+                <td>$awb_number</td>
+                <td>$platform_order_id</td>
+                <td>$platform_name</td>
+                <td>$customer_name</td>
+                <td>$scanned_at</td>
+            </tr>""")
+
+
+def _text(value) -> str:
+    return escape(str(value)) if value is not None else ""
+
+
+def _open_scans(company_id: int, cutoff_at: datetime, courier_partner: Optional[str] = None,
+                warehouse_id: Optional[int] = None) -> list:
+    """Filters for the company's scans up to cutoff_at that are on no manifest"""
+    scan = models.DispatchScan
+    filters = [
+        scan.company_id == company_id,
+        scan.manifest_id.is_(None),
+        scan.scanned_at <= cutoff_at,
+        or_(scan.dispatch_status.is_(None), scan.dispatch_status != "cancelled"),
+    ]
+    if courier_partner:
+        filters.append(scan.courier_partner == courier_partner)
+    if warehouse_id:
+        filters.append(scan.warehouse_id == warehouse_id)
+    return filters
+
+
+def _same(column, value):
+    return column.is_(None) if value is None else column == value
+
+
+def close_cutoff(
+    db: Session,
+    company_id: int,
+    user_id: Optional[int],
+    cutoff_at: Optional[datetime] = None,
+    courier_partner: Optional[str] = None,
+    warehouse_id: Optional[int] = None
+) -> List[models.CourierManifest]:
+    """
+    Create the manifests for a cutoff (optionally only one courier or
+    warehouse) and assign their scans. The caller commits.
+    """
+    cutoff_at = cutoff_at or datetime.now()
+    scan = models.DispatchScan
+    filters = _open_scans(company_id, cutoff_at, courier_partner, warehouse_id)
+
+    groups = db.query(scan.courier_partner, scan.warehouse_id).filter(*filters).group_by(
+        scan.courier_partner, scan.warehouse_id
+    ).order_by(scan.courier_partner, scan.warehouse_id).all()
+    if not groups:
+        return []
+
+    numbers = sequences.next_numbers(db, "manifest", company_id, len(groups), on=cutoff_at.date())
+    manifests = [
+        models.CourierManifest(
+            company_id=company_id,
+            manifest_number=number,
+            courier_partner=courier,
+            warehouse_id=warehouse,
+            cutoff_at=cutoff_at,
+            created_by_user_id=user_id
+        )
+        for number, (courier, warehouse) in zip(numbers, groups)
+    ]
+    db.add_all(manifests)
+    db.flush()
+
+    for manifest in manifests:
+        # The count is whatever the update caught, including scans replayed since the GROUP BY
+        manifest.parcel_count = db.query(scan).filter(
+            *filters,
+            _same(scan.courier_partner, manifest.courier_partner),
+            _same(scan.warehouse_id, manifest.warehouse_id)
+        ).update({scan.manifest_id: manifest.id}, synchronize_session=False)
+    db.flush()
+    return manifests
+
+
+# ---------------------------------------------------------------------------
+# Documents
+# ---------------------------------------------------------------------------
+
+def filename(manifest_number: str) -> str:
+    return f"Manifest_{manifest_number.replace('/', '-')}.html"
+
+
+def load_snapshots(db: Session, company_id: int, manifest_ids: List[int]) -> Dict[int, dict]:
+    """Everything the manifest template needs, as plain data, keyed by manifest id"""
+    manifests = db.query(
+        models.CourierManifest, models.Warehouse.name
+    ).outerjoin(
+        models.Warehouse, models.Warehouse.id == models.CourierManifest.warehouse_id
+    ).filter(
+        models.CourierManifest.company_id == company_id,
+        models.CourierManifest.id.in_(manifest_ids)
+    ).all()
+    if not manifests:
+        return {}
+    company_name = db.query(models.Company.name).filter(models.Company.id == company_id).scalar()
+    generated_on = datetime.now()
+
+    snapshots = {
+        manifest.id: {
+            "number": manifest.manifest_number,
+            "company_name": company_name,
+            "courier_partner": manifest.courier_partner,
+            "warehouse_name": warehouse_name,
+            "cutoff_at": manifest.cutoff_at,
+            "parcel_count": manifest.parcel_count,
+            "parcels": [],
+            "generated_on": generated_on,
+        }
+        for manifest, warehouse_name in manifests
+    }
+
+    scan = models.DispatchScan
+    for row in db.query(
+        scan.manifest_id, scan.awb_number, scan.platform_order_id, scan.platform_name,
+        models.Order.customer_name, scan.scanned_at
+    ).outerjoin(
+        models.Order, models.Order.id == scan.order_id
+    ).filter(
+        scan.company_id == company_id,
+        scan.manifest_id.in_(list(snapshots))
+    ).order_by(scan.manifest_id, scan.scanned_at, scan.id).yield_per(5000):
+        snapshots[row[0]]["parcels"].append(tuple(row[1:]))
+    return snapshots
+
+
+def render(snapshot: dict) -> str:
+    """HTML handover sheet for a manifest snapshot"""
+    rows = "".join(
+        _PARCEL_ROW.substitute(
+            index=index,
+            awb_number=_text(awb_number),
+            platform_order_id=_text(platform_order_id),
+            platform_name=_text(platform_name),
+            customer_name=_text(customer_name),
+            scanned_at=scanned_at.strftime("%d %b %H:%M") if scanned_at else "",
+        )
+        for index, (awb_number, platform_order_id, platform_name, customer_name, scanned_at)
+        in enumerate(snapshot["parcels"], 1)
+    )
+    return _TEMPLATE.substitute(
+        number=_text(snapshot["number"]),
+        company_name=_text(snapshot["company_name"]),
+        courier_partner=_text(snapshot["courier_partner"] or "Unassigned"),
+        warehouse_name=_text(snapshot["warehouse_name"] or "-"),
+        cutoff_at=snapshot["cutoff_at"].strftime("%d %b %Y %H:%M"),
+        parcel_count=len(snapshot["parcels"]),
+        parcel_rows=rows,
+        generated_on=snapshot["generated_on"].strftime("%B %d, %Y at %I:%M %p"),
+    )
+
+
+def render_all(snapshots: List[dict]) -> Iterator[str]:
+    """Render manifests in order, in the document render pool when there are enough of them"""
+    return documents.render_many(render, snapshots)
+
+
+def stream_zip(snapshots: List[dict]) -> Iterator[bytes]:
+    """ZIP of the manifests' documents, yielded as it is written"""
+    rendered = render_all(snapshots)
+    yield from documents.zip_files(
+        (filename(snapshot["number"]), content) for snapshot, content in zip(snapshots, rendered)
+    )
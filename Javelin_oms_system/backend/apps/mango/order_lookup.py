@@ -0,0 +1,611 @@
+"""
+Order Lookup Index
+One place to find an order by order id, AWB, customer name/phone or SKU,
+whichever store it lives in:
+
+    oms            orders / order_items (marketplace sync)
+    mango          mango_channel_orders (Excel imports)
+    channel_table  per-channel physical tables (uploads)
+    master         master_order_sheet
+    dispatch       dispatch_scans
+
+Every record gets an order_lookup_entries row (what to show for a hit) and
+order_lookup_keys rows holding its identifiers lower-cased with separators
+removed, so "ORD-123/45" is found by "ord12345" or "ORD-123". AWBs also get
+awb_suffix keys (each suffix of at least MIN_AWB_FRAGMENT characters), so a
+fragment from the end or middle of an AWB is a prefix search too. ORM-written
+sources are indexed from the flush that writes them; channel table rows are
+written with raw SQL, so the upload route indexes them explicitly
+(index_channel_rows). Identifier lookups are range scans on
+(company_id, lookup_key); names match word by word like the document search.
+
+OMS orders are not company scoped and are indexed under company 0, which every
+company sees, matching the OMS order list.
+
+Until the index has been built (rebuild(), see backend/rebuild_order_lookup.py)
+the order list keeps using its LIKE search.
+"""
+
+import re
+from collections import defaultdict
+from datetime import datetime
+from typing import Dict, Iterable, List, Optional, Sequence, Tuple
+
+from sqlalchemy import and_, case, delete, event, false, func, insert, inspect, literal, or_, select, text, union_all
+from sqlalchemy.orm import Session
+
+from ..common import archive, models
+from .channel_master_models import Channel, ChannelFieldMapping, ChannelTable, MasterOrderSheet
+
+ORDER_LOOKUP = "order_lookup"  # rollup_state marker once rebuilt
+AWB_SUFFIXES = "order_lookup_awb_suffixes"  # rollup_state marker once rebuilt with awb_suffix keys
+BATCH_SIZE = 1000
+MAX_QUERY_WORDS = 6
+MAX_HITS = 200
+MIN_AWB_FRAGMENT = 4  # Shortest suffix indexed, so the shortest suffix/contains AWB search
+
+OMS = "oms"
+MANGO = "mango"
+CHANNEL_TABLE = "channel_table"
+MASTER = "master"
+DISPATCH = "dispatch"
+SOURCES = (OMS, MANGO, CHANNEL_TABLE, MASTER, DISPATCH)
+
+OMS_COMPANY = 0
+
+ORDER_ID, AWB, PHONE, SKU, EMAIL, NAME = "order_id", "awb", "phone", "sku", "email", "name"
+AWB_SUFFIX = "awb_suffix"
+
+AWB_EXACT, AWB_PREFIX, AWB_ENDS_WITH, AWB_CONTAINS = "exact", "prefix", "suffix", "contains"
+AWB_MATCHES = (AWB_EXACT, AWB_PREFIX, AWB_ENDS_WITH, AWB_CONTAINS)
+
+_KEY_LENGTH = models.OrderLookupKey.lookup_key.type.length
+_PHONE_DIGITS = 10  # Also index the national number of phones stored with a country code
+
+# Columns of channel tables that are bookkeeping, not order data
+_SYSTEM_COLUMNS = {
+    "id", "company_id", "uploaded_by_user_id", "uploaded_at", "raw_data",
+    "is_synced_to_master", "master_order_id", "synced_at", "created_at", "updated_at",
+}
+
+_ready = set()
+
+
+def _marked(db: Session, marker: str) -> bool:
+    if marker not in _ready:
+        if db.query(models.RollupState.name).filter(models.RollupState.name == marker).first() is not None:
+            _ready.add(marker)
+    return marker in _ready
+
+
+def is_ready(db: Session) -> bool:
+    return _marked(db, ORDER_LOOKUP)
+
+
+def awb_ready(db: Session) -> bool:
+    """Whether the index has been rebuilt since awb_suffix keys were introduced"""
+    return _marked(db, AWB_SUFFIXES)
+
+
+# ---------------------------------------------------------------------------
+# Keys
+# ---------------------------------------------------------------------------
+
+def _text(value) -> str:
+    # Excel numbers come back as floats: 9876543210.0 is the phone 9876543210
+    if isinstance(value, float) and value.is_integer():
+        value = int(value)
+    return str(value)
+
+
+def normalize(value) -> str:
+    """Lower-case letters and digits only"""
+    if value is None:
+        return ""
+    return re.sub(r"[^0-9a-z]", "", _text(value).lower())[:_KEY_LENGTH]
+
+
+def tokenize(value) -> List[str]:
+    return [word[:_KEY_LENGTH] for word in re.findall(r"[0-9a-z]+", _text(value).lower())] if value is not None else []
+
+
+def key_type_for_field(field_name: str) -> Optional[str]:
+    """Guess which kind of identifier a free-form column/field holds from its name"""
+    name = field_name.lower()
+    parts = set(re.split(r"[^0-9a-z]+", name))
+    if "awb" in name or "tracking" in name or "waybill" in name:
+        return AWB
+    if "sku" in name:
+        return SKU
+    if "phone" in name or "mobile" in name:
+        return PHONE
+    if "email" in name:
+        return EMAIL
+    if "order" in name and parts & {"id", "no", "number", "num", "ref", "orderid", "orderno"}:
+        return ORDER_ID
+    if "name" in parts and parts & {"customer", "buyer", "recipient", "shipping", "billing"}:
+        return NAME
+    return None
+
+
+def _field_pairs(data, field_types: Optional[Dict[str, str]] = None) -> List[Tuple[str, object]]:
+    """(key type, value) pairs from the top level of a free-form dict"""
+    if not isinstance(data, dict):
+        return []
+    pairs = []
+    for field, value in data.items():
+        if value is None or isinstance(value, (dict, list)):
+            continue
+        key_type = (field_types or {}).get(field) or key_type_for_field(field)
+        if key_type:
+            pairs.append((key_type, value))
+    return pairs
+
+
+def _keys(pairs: Iterable[Tuple[str, object]]) -> set:
+    keys = set()
+    for key_type, value in pairs:
+        if value is None or value == "":
+            continue
+        if key_type == NAME:
+            keys.update((NAME, word) for word in tokenize(value))
+            continue
+        key = normalize(value)
+        if not key:
+            continue
+        keys.add((key_type, key))
+        if key_type == AWB:
+            keys.update((AWB_SUFFIX, key[start:]) for start in range(1, len(key) - MIN_AWB_FRAGMENT + 1))
+        if key_type == PHONE and key.isdigit() and len(key) > _PHONE_DIGITS:
+            keys.add((PHONE, key[-_PHONE_DIGITS:]))
+    return keys
+
+
+def _first(pairs: Sequence[Tuple[str, object]], key_type: str):
+    return next((_text(value) for kind, value in pairs if kind == key_type and value not in (None, "")), None)
+
+
+def _entry(company_id, source, source_table, record_id, pairs, order_ref=None, channel=None,
+           customer_name=None, status=None, order_date=None) -> Tuple[dict, set]:
+    entry = {
+        "company_id": company_id or OMS_COMPANY,
+        "source": source,
+        "source_table": source_table,
+        "record_id": record_id,
+        "order_ref": _clip(order_ref or _first(pairs, ORDER_ID) or _first(pairs, AWB), models.OrderLookupEntry.order_ref),
+        "channel": _clip(channel, models.OrderLookupEntry.channel),
+        "customer_name": _clip(customer_name or _first(pairs, NAME), models.OrderLookupEntry.customer_name),
+        "status": _clip(status, models.OrderLookupEntry.status),
+        "order_date": order_date if isinstance(order_date, datetime) else None,
+    }
+    return entry, _keys(pairs)
+
+
+def _clip(value, column):
+    return _text(value)[:column.type.length] if value not in (None, "") else None
+
+
+# ---------------------------------------------------------------------------
+# Loading records from each source
+# ---------------------------------------------------------------------------
+
+def _load_oms(conn, ids) -> List[Tuple[dict, set]]:
+    order = models.Order
+    skus = defaultdict(list)
+    for order_id, sku in conn.execute(
+        select(models.OrderItem.order_id, models.OrderItem.sku).where(models.OrderItem.order_id.in_(ids))
+    ):
+        skus[order_id].append(sku)
+
+    records = []
+    for row in conn.execute(
+        select(
+            order.id, order.platform_order_id, order.customer_name, order.customer_email,
+            order.order_status, order.purchase_date, order.platform_metadata, models.Platform.name
+        ).outerjoin(models.Platform, models.Platform.id == order.platform_id).where(order.id.in_(ids))
+    ):
+        pairs = [(ORDER_ID, row.platform_order_id), (NAME, row.customer_name), (EMAIL, row.customer_email)]
+        pairs += [(SKU, sku) for sku in skus[row.id]]
+        pairs += _field_pairs(row.platform_metadata)
+        records.append(_entry(
+            OMS_COMPANY, OMS, order.__tablename__, row.id, pairs, order_ref=row.platform_order_id,
+            channel=row.name, customer_name=row.customer_name, status=row.order_status,
+            order_date=row.purchase_date
+        ))
+    return records
+
+
+def _load_mango(conn, ids) -> List[Tuple[dict, set]]:
+    order = models.MangoChannelOrder
+    records = []
+    for row in conn.execute(
+        select(
+            order.id, order.company_id, order.platform, order.platform_order_id, order.customer_name,
+            order.customer_email, order.order_status, order.created_at, order.channel_data
+        ).where(order.id.in_(ids))
+    ):
+        pairs = [(ORDER_ID, row.platform_order_id), (NAME, row.customer_name), (EMAIL, row.customer_email)]
+        pairs += _field_pairs(row.channel_data)
+        records.append(_entry(
+            row.company_id, MANGO, order.__tablename__, row.id, pairs, order_ref=row.platform_order_id,
+            channel=row.platform, customer_name=row.customer_name, status=row.order_status,
+            order_date=row.created_at
+        ))
+    return records
+
+
+def _load_master(conn, ids) -> List[Tuple[dict, set]]:
+    sheet = MasterOrderSheet
+    records = []
+    for row in conn.execute(
+        select(
+            sheet.master_order_id, Channel.company_id, Channel.channel_name, sheet.channel_order_id,
+            sheet.order_number, sheet.customer_name, sheet.customer_email, sheet.customer_phone,
+            sheet.order_status, sheet.order_date, sheet.items
+        ).outerjoin(Channel, Channel.id == sheet.channel_id).where(sheet.master_order_id.in_(ids))
+    ):
+        pairs = [
+            (ORDER_ID, row.channel_order_id), (ORDER_ID, row.order_number), (NAME, row.customer_name),
+            (EMAIL, row.customer_email), (PHONE, row.customer_phone),
+        ]
+        for item in row.items if isinstance(row.items, list) else []:
+            pairs += _field_pairs(item)
+        records.append(_entry(
+            row.company_id, MASTER, sheet.__tablename__, row.master_order_id, pairs,
+            order_ref=row.order_number or row.channel_order_id, channel=row.channel_name,
+            customer_name=row.customer_name, status=row.order_status, order_date=row.order_date
+        ))
+    return records
+
+
+def _load_dispatch(conn, ids) -> List[Tuple[dict, set]]:
+    scan = models.DispatchScan
+    records = []
+    for row in conn.execute(
+        select(
+            scan.id, scan.company_id, scan.platform_name, scan.platform_order_id, scan.awb_number,
+            scan.dispatch_status, scan.scanned_at, scan.scan_metadata
+        ).where(scan.id.in_(ids))
+    ):
+        pairs = [(ORDER_ID, row.platform_order_id), (AWB, row.awb_number)]
+        pairs += _field_pairs(row.scan_metadata)
+        records.append(_entry(
+            row.company_id, DISPATCH, scan.__tablename__, row.id, pairs,
+            order_ref=row.platform_order_id or row.awb_number, channel=row.platform_name,
+            status=row.dispatch_status, order_date=row.scanned_at
+        ))
+    return records
+
+
+_LOADERS = {
+    OMS: (models.Order, _load_oms),
+    MANGO: (models.MangoChannelOrder, _load_mango),
+    MASTER: (MasterOrderSheet, _load_master),
+    DISPATCH: (models.DispatchScan, _load_dispatch),
+}
+
+
+def _channel_field_types(conn, channel_id: int) -> Dict[str, str]:
+    """Key type per channel column, from the channel's master field mappings"""
+    field_types = {}
+    for channel_field, master_field in conn.execute(
+        select(ChannelFieldMapping.channel_field_name, ChannelFieldMapping.master_field_name)
+        .where(ChannelFieldMapping.channel_id == channel_id)
+    ):
+        key_type = key_type_for_field(master_field)
+        if key_type:
+            field_types[channel_field] = key_type
+    return field_types
+
+
+def _channel_records(table_name: str, channel_name: Optional[str], field_types: Dict[str, str],
+                     rows: Iterable[Tuple[int, dict]]) -> List[Tuple[dict, set]]:
+    records = []
+    for record_id, data in rows:
+        fields = {column: value for column, value in data.items() if column not in _SYSTEM_COLUMNS}
+        pairs = _field_pairs(fields, field_types)
+        status = next((value for column, value in fields.items() if "status" in column.lower() and value), None)
+        records.append(_entry(
+            data.get("company_id"), CHANNEL_TABLE, table_name, record_id, pairs, channel=channel_name,
+            status=status, order_date=data.get("uploaded_at")
+        ))
+    return records
+
+
+# ---------------------------------------------------------------------------
+# Index maintenance
+# ---------------------------------------------------------------------------
+
+def _remove(conn, source: str, source_table: str, record_ids: List[int]):
+    for model in (models.OrderLookupKey, models.OrderLookupEntry):
+        conn.execute(delete(model).where(
+            model.source == source, model.source_table == source_table, model.record_id.in_(record_ids)
+        ))
+
+
+def _write(conn, source: str, source_table: str, record_ids: List[int], records: List[Tuple[dict, set]]):
+    """Replace whatever is indexed for record_ids with records"""
+    _remove(conn, source, source_table, record_ids)
+    if not records:
+        return
+    conn.execute(insert(models.OrderLookupEntry), [entry for entry, _ in records])
+    keys = [
+        {
+            "company_id": entry["company_id"], "source": source, "source_table": source_table,
+            "record_id": entry["record_id"], "key_type": key_type, "lookup_key": key,
+        }
+        for entry, entry_keys in records
+        for key_type, key in entry_keys
+    ]
+    if keys:
+        conn.execute(insert(models.OrderLookupKey), keys)
+
+
+def reindex(conn, source: str, ids: Iterable[int]):
+    """Re-read the given records of an ORM source and replace their index rows"""
+    model, loader = _LOADERS[source]
+    ids = list(ids)
+    for start in range(0, len(ids), BATCH_SIZE):
+        chunk = ids[start:start + BATCH_SIZE]
+        _write(conn, source, model.__tablename__, chunk, loader(conn, chunk))
+
+
+def index_channel_rows(db: Session, channel, table_name: str, rows: Sequence[Tuple[int, dict]]):
+    """
+    Index rows just inserted into a channel's physical table.
+    rows are (id, column values); the caller commits.
+    """
+    if not rows:
+        return
+    conn = db.connection()
+    field_types = _channel_field_types(conn, channel.id)
+    for start in range(0, len(rows), BATCH_SIZE):
+        chunk = rows[start:start + BATCH_SIZE]
+        for record_id, data in chunk:
+            data.setdefault("company_id", channel.company_id)
+        _write(
+            conn, CHANNEL_TABLE, table_name, [record_id for record_id, _ in chunk],
+            _channel_records(table_name, channel.channel_name, field_types, chunk)
+        )
+
+
+_ARCHIVED_SOURCES = {models.Order.__tablename__: OMS, models.DispatchScan.__tablename__: DISPATCH}
+
+
+@archive.on_archive
+def _forget_archived(conn, table_name: str, ids: List[int]):
+    """Rows moved to the archive leave the index, which only covers the main database"""
+    source = _ARCHIVED_SOURCES.get(table_name)
+    if source is None and table_name not in archive.SPECS:
+        source = CHANNEL_TABLE
+    if source:
+        _remove(conn, source, table_name, ids)
+
+
+_ORDER_FIELDS = ("platform_order_id", "customer_name", "customer_email", "order_status", "purchase_date",
+                 "platform_metadata", "platform_id")
+_TRACKED = {
+    models.Order: (OMS, "id", _ORDER_FIELDS),
+    models.MangoChannelOrder: (MANGO, "id", ("platform", "platform_order_id", "customer_name", "customer_email",
+                                             "order_status", "channel_data")),
+    MasterOrderSheet: (MASTER, "master_order_id", ("channel_id", "channel_order_id", "order_number", "order_date",
+                                                   "customer_name", "customer_email", "customer_phone",
+                                                   "order_status", "items")),
+    models.DispatchScan: (DISPATCH, "id", ("platform_name", "platform_order_id", "awb_number", "dispatch_status",
+                                           "scan_metadata")),
+}
+
+
+def _changed(obj, fields) -> bool:
+    state = inspect(obj)
+    return any(state.attrs[name].history.has_changes() for name in fields)
+
+
+@event.listens_for(Session, "after_flush")
+def _collect_changed_orders(session, flush_context):
+    changed = session.info.setdefault("order_lookup_reindex", defaultdict(set))
+    removed = session.info.setdefault("order_lookup_remove", defaultdict(set))
+
+    for obj in session.new:
+        if isinstance(obj, models.OrderItem):
+            changed[OMS].add(obj.order_id)
+        elif type(obj) in _TRACKED:
+            source, pk, _ = _TRACKED[type(obj)]
+            changed[source].add(getattr(obj, pk))
+    for obj in session.dirty:
+        if isinstance(obj, models.OrderItem):
+            if _changed(obj, ("sku", "order_id")):
+                changed[OMS].add(obj.order_id)
+        elif type(obj) in _TRACKED:
+            source, pk, fields = _TRACKED[type(obj)]
+            if _changed(obj, fields):
+                changed[source].add(getattr(obj, pk))
+    for obj in session.deleted:
+        if isinstance(obj, models.OrderItem):
+            changed[OMS].add(obj.order_id)
+        elif type(obj) in _TRACKED:
+            source, pk, _ = _TRACKED[type(obj)]
+            removed[source].add(getattr(obj, pk))
+
+
+@event.listens_for(Session, "after_flush_postexec")
+def _update_index(session, flush_context):
+    changed = session.info.pop("order_lookup_reindex", None) or {}
+    removed = session.info.pop("order_lookup_remove", None) or {}
+    if not changed and not removed:
+        return
+
+    conn = session.connection()
+    for source, ids in removed.items():
+        ids = [record_id for record_id in ids if record_id is not None]
+        if ids:
+            _remove(conn, source, _LOADERS[source][0].__tablename__, ids)
+    for source, ids in changed.items():
+        ids = [record_id for record_id in ids if record_id is not None and record_id not in removed.get(source, ())]
+        if ids:
+            reindex(conn, source, ids)
+
+
+def _channel_tables(conn) -> Dict[str, Tuple[int, int, str]]:
+    """Physical table name -> (channel id, company id, channel name) for tables that exist"""
+    tables = {}
+    for channel_id, company_id, channel_name, table_name in conn.execute(
+        select(Channel.id, Channel.company_id, Channel.channel_name, Channel.table_name)
+    ):
+        tables[table_name] = (channel_id, company_id, channel_name)
+    for channel_id, company_id, channel_name, table_name in conn.execute(
+        select(Channel.id, Channel.company_id, Channel.channel_name, ChannelTable.table_name)
+        .join(ChannelTable, ChannelTable.channel_id == Channel.id)
+        .where(ChannelTable.table_type == "orders")
+    ):
+        tables[table_name] = (channel_id, company_id, channel_name)
+
+    existing = set(inspect(conn).get_table_names())
+    return {name: channel for name, channel in tables.items() if name in existing}
+
+
+def rebuild(db: Session) -> Dict[str, int]:
+    """Re-index every order of every source and mark the index ready; caller commits"""
+    conn = db.connection()
+    conn.execute(delete(models.OrderLookupKey))
+    conn.execute(delete(models.OrderLookupEntry))
+    counts = {}
+    for source, (model, _) in _LOADERS.items():
+        pk = inspect(model).primary_key[0]
+        ids = [record_id for (record_id,) in conn.execute(select(pk).order_by(pk))]
+        reindex(conn, source, ids)
+        counts[source] = len(ids)
+
+    counts[CHANNEL_TABLE] = 0
+    for table_name, (channel_id, company_id, channel_name) in _channel_tables(conn).items():
+        field_types = _channel_field_types(conn, channel_id)
+        last_id = 0
+        while True:
+            rows = [dict(row._mapping) for row in conn.execute(
+                text(f"SELECT * FROM {table_name} WHERE id > :last_id ORDER BY id LIMIT :batch_size"),
+                {"last_id": last_id, "batch_size": BATCH_SIZE}
+            )]
+            if not rows:
+                break
+            last_id = rows[-1]["id"]
+            for row in rows:
+                row["company_id"] = row.get("company_id") or company_id
+            records = _channel_records(table_name, channel_name, field_types, [(row["id"], row) for row in rows])
+            _write(conn, CHANNEL_TABLE, table_name, [row["id"] for row in rows], records)
+            counts[CHANNEL_TABLE] += len(rows)
+
+    for marker in (ORDER_LOOKUP, AWB_SUFFIXES):
+        if not db.query(models.RollupState).filter(models.RollupState.name == marker).first():
+            db.add(models.RollupState(name=marker))
+    return counts
+
+
+# ---------------------------------------------------------------------------
+# Querying
+# ---------------------------------------------------------------------------
+
+def _prefix(value: str):
+    """lookup_key LIKE 'value%' as a range, so it can use the index regardless of collation"""
+    column = models.OrderLookupKey.lookup_key
+    return and_(column >= value, column < value[:-1] + chr(ord(value[-1]) + 1))
+
+
+def matches(company_id: int, query: str, sources: Optional[Sequence[str]] = None):
+    """
+    Subquery of (source, source_table, record_id, score) for records matching query:
+    an identifier starting with it (3 when exact, 2 otherwise) or a name having a
+    word starting with every word of it (1).
+    """
+    key = models.OrderLookupKey
+    scope = [key.company_id.in_([company_id, OMS_COMPANY])]
+    if sources:
+        scope.append(key.source.in_(list(sources)))
+    triple = (key.source, key.source_table, key.record_id)
+
+    selects = []
+    compact = normalize(query)
+    if compact:
+        candidates = [compact]
+        if compact.isdigit() and len(compact) > _PHONE_DIGITS:
+            candidates.append(compact[-_PHONE_DIGITS:])
+        exact = key.lookup_key.in_(candidates)
+        selects.append(select(*triple, case((exact, 3), else_=2).label("score")).where(
+            *scope, key.key_type.notin_([NAME, AWB_SUFFIX]), or_(*[_prefix(candidate) for candidate in candidates])
+        ))
+
+    words = list(dict.fromkeys(tokenize(query)))[:MAX_QUERY_WORDS]
+    if words:
+        hits = [func.max(case((_prefix(word), 1), else_=0)) for word in words]
+        selects.append(select(*triple, literal(1).label("score")).where(
+            *scope, key.key_type == NAME, or_(*[_prefix(word) for word in words])
+        ).group_by(*triple).having(and_(*[hit > 0 for hit in hits])))
+
+    if not selects:
+        selects.append(select(*triple, literal(0).label("score")).where(false()))
+    found = (union_all(*selects) if len(selects) > 1 else selects[0]).subquery()
+    return select(
+        found.c.source, found.c.source_table, found.c.record_id, func.max(found.c.score).label("score")
+    ).group_by(found.c.source, found.c.source_table, found.c.record_id).subquery()
+
+
+def record_ids(company_id: int, query: str, source: str):
+    """Select of the record ids of one source matching query, for IN filters"""
+    found = matches(company_id, query, [source])
+    return select(found.c.record_id)
+
+
+def awb_indexed(fragment: str, match: str = AWB_CONTAINS) -> bool:
+    """True when awb_record_ids can answer this search (short suffix/contains fragments are not indexed)"""
+    fragment = normalize(fragment)
+    return bool(fragment) and (match in (AWB_EXACT, AWB_PREFIX) or len(fragment) >= MIN_AWB_FRAGMENT)
+
+
+def awb_record_ids(company_id: int, fragment: str, match: str = AWB_CONTAINS, source: str = DISPATCH):
+    """
+    Select of the record ids of one source with an AWB equal to, starting with,
+    ending with or containing fragment. Every match is an equality or range
+    scan on (company_id, lookup_key): suffix and contains search the
+    awb_suffix keys, so they need at least MIN_AWB_FRAGMENT letters/digits.
+    """
+    key = models.OrderLookupKey
+    fragment = normalize(fragment)
+    if not fragment:
+        raise ValueError("AWB search needs letters or digits")
+    if match in (AWB_ENDS_WITH, AWB_CONTAINS) and len(fragment) < MIN_AWB_FRAGMENT:
+        raise ValueError(f"AWB {match} search needs at least {MIN_AWB_FRAGMENT} letters/digits")
+
+    key_types = [AWB] if match in (AWB_EXACT, AWB_PREFIX) else [AWB, AWB_SUFFIX]
+    condition = key.lookup_key == fragment if match in (AWB_EXACT, AWB_ENDS_WITH) else _prefix(fragment)
+    return select(key.record_id).where(
+        key.company_id == company_id, key.source == source, key.key_type.in_(key_types), condition
+    ).distinct()
+
+
+def lookup(db: Session, company_id: int, query: str, sources: Optional[Sequence[str]] = None,
+           limit: int = 50) -> List[dict]:
+    """Best matching records across sources: exact identifiers first, then prefixes, then names; newest first"""
+    found = matches(company_id, query, sources)
+    entry = models.OrderLookupEntry
+    rows = db.execute(
+        select(entry, found.c.score).join(found, and_(
+            entry.source == found.c.source,
+            entry.source_table == found.c.source_table,
+            entry.record_id == found.c.record_id
+        )).order_by(
+            found.c.score.desc(), entry.order_date.is_(None), entry.order_date.desc(), entry.id.desc()
+        ).limit(min(limit, MAX_HITS))
+    ).all()
+    return [
+        {
+            "source": hit.source,
+            "source_table": hit.source_table,
+            "record_id": hit.record_id,
+            "order_ref": hit.order_ref,
+            "channel": hit.channel,
+            "customer_name": hit.customer_name,
+            "status": hit.status,
+            "order_date": hit.order_date.isoformat() if hit.order_date else None,
+            "exact": score == 3,
+        }
+        for hit, score in rows
+    ]
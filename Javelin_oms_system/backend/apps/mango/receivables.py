@@ -0,0 +1,440 @@
+"""
+Receivables Matching Engine
+Open-item accounting for the customer ledger. A debit entry (invoice, opening
+balance, debit note) stays open until credits (payments, credit notes,
+returns) are allocated to it, and a credit stays open until it has been
+applied. Allocations are recorded in ledger_allocations; whatever is still
+open lives in customer_open_items, which is all receivables queries need to
+read.
+
+Credits are applied oldest-due-first (FIFO) unless allocated explicitly.
+Fully matched entries are flagged is_reconciled on the ledger and their open
+item is removed; payments against invoices also reduce the aging rollups.
+
+Until the open items have been built (rebuild(), see
+backend/rebuild_open_items.py) nothing is matched and readers use the ledger.
+"""
+
+from collections import defaultdict
+from datetime import datetime
+from decimal import Decimal
+from typing import Dict, Iterable, List, Optional, Sequence, Tuple
+
+from sqlalchemy import func
+from sqlalchemy.orm import Session
+
+from ..common import models, rollups
+
+ZERO = Decimal(0)
+
+DEBIT = "DEBIT"
+CREDIT = "CREDIT"
+
+FIFO = "FIFO"
+EXPLICIT = "EXPLICIT"
+SETTLEMENT = "SETTLEMENT"
+REVERSAL = "REVERSAL"  # A deleted invoice's debit closed by its ADJUSTMENT credit
+
+
+def is_ready(db: Session) -> bool:
+    return rollups.is_ready(db, rollups.OPEN_ITEMS)
+
+
+def _amount(value) -> Decimal:
+    return Decimal(str(value or 0))
+
+
+def _item_row(entry, open_amount: Optional[Decimal] = None) -> Optional[dict]:
+    """Open item for a ledger entry, or None when it nets to zero"""
+    net = _amount(entry.debit_amount) - _amount(entry.credit_amount)
+    if net == 0:
+        return None
+    original = abs(net)
+    return {
+        "company_id": entry.company_id,
+        "customer_id": entry.customer_id,
+        "ledger_entry_id": entry.id,
+        "side": DEBIT if net > 0 else CREDIT,
+        "transaction_type": entry.transaction_type,
+        "reference_number": entry.reference_number,
+        "document_date": entry.transaction_date,
+        "due_date": entry.due_date,
+        "original_amount": original,
+        "open_amount": original if open_amount is None else open_amount,
+    }
+
+
+def record_entries(db: Session, entries: Sequence, auto_match: bool = True, user_id: Optional[int] = None):
+    """
+    Open items for new (flushed) ledger entries; with auto_match, apply the
+    customers' open credits to their open debits FIFO. Does not commit.
+    """
+    if not entries or not is_ready(db):
+        return
+    rows = [row for row in (_item_row(entry) for entry in entries) if row]
+    if not rows:
+        return
+    db.bulk_insert_mappings(models.CustomerOpenItem, rows)
+    if auto_match:
+        match_fifo(db, {row["customer_id"] for row in rows}, user_id=user_id)
+
+
+# ---------------------------------------------------------------------------
+# Matching
+# ---------------------------------------------------------------------------
+
+class _Matcher:
+    """Applies credits to debits in memory, then writes the outcome in bulk"""
+
+    def __init__(self, db: Session, user_id: Optional[int] = None):
+        self.db = db
+        self.user_id = user_id
+        self.allocations = []
+        self.touched = {}
+        self.invoice_payments = []
+
+    def apply(self, credit: models.CustomerOpenItem, debit: models.CustomerOpenItem,
+              amount: Optional[Decimal], method: str) -> Decimal:
+        """Allocate up to amount (everything possible when None); returns what was applied"""
+        applied = min(credit.open_amount, debit.open_amount)
+        if amount is not None:
+            applied = min(applied, amount)
+        if applied <= 0:
+            return ZERO
+
+        credit.open_amount -= applied
+        debit.open_amount -= applied
+        self.touched[credit.id] = credit
+        self.touched[debit.id] = debit
+        self.allocations.append({
+            "company_id": debit.company_id,
+            "customer_id": debit.customer_id,
+            "credit_entry_id": credit.ledger_entry_id,
+            "debit_entry_id": debit.ledger_entry_id,
+            "amount": applied,
+            "method": method,
+            "allocated_at": datetime.now(),
+            "created_by_user_id": self.user_id,
+        })
+        if debit.transaction_type == "INVOICE":
+            self.invoice_payments.append((debit, applied, debit.open_amount == 0))
+        return applied
+
+    def finish(self) -> List[dict]:
+        if not self.allocations:
+            return []
+        db = self.db
+        db.bulk_insert_mappings(models.LedgerAllocation, self.allocations)
+
+        closed = [item for item in self.touched.values() if item.open_amount == 0]
+        if closed:
+            db.query(models.CustomerLedger).filter(
+                models.CustomerLedger.id.in_([item.ledger_entry_id for item in closed])
+            ).update({
+                models.CustomerLedger.is_reconciled: True,
+                models.CustomerLedger.reconciled_date: datetime.now()
+            }, synchronize_session=False)
+            for item in closed:
+                db.delete(item)
+
+        rollups.record_invoice_payments(db, self.invoice_payments)
+        db.flush()
+        return self.allocations
+
+
+def _open_items(db: Session, side: str, customer_ids: Iterable[int]) -> Dict[int, List[models.CustomerOpenItem]]:
+    """Locked open items per customer, in the order they should be matched"""
+    item = models.CustomerOpenItem
+    query = db.query(item).filter(item.side == side, item.customer_id.in_(list(customer_ids)))
+    if side == DEBIT:
+        # Oldest due first; items without a due date after those with one
+        query = query.order_by(item.due_date.is_(None), item.due_date, item.document_date, item.id)
+    else:
+        query = query.order_by(item.document_date, item.id)
+
+    grouped = defaultdict(list)
+    for row in query.with_for_update().all():
+        grouped[row.customer_id].append(row)
+    return grouped
+
+
+def _fifo(matcher: _Matcher, credits: List[models.CustomerOpenItem], debits: List[models.CustomerOpenItem]):
+    debits = iter(debits)
+    debit = next(debits, None)
+    for credit in credits:
+        while debit is not None and credit.open_amount > 0:
+            matcher.apply(credit, debit, None, FIFO)
+            if debit.open_amount == 0:
+                debit = next(debits, None)
+        if debit is None:
+            break
+
+
+def match_fifo(db: Session, customer_ids: Iterable[int], user_id: Optional[int] = None) -> List[dict]:
+    """Apply each customer's open credits to their open debits, oldest first. Does not commit."""
+    credits = _open_items(db, CREDIT, set(customer_ids))
+    if not credits:
+        return []
+    debits = _open_items(db, DEBIT, credits.keys())
+
+    matcher = _Matcher(db, user_id)
+    for customer_id, customer_credits in credits.items():
+        if debits.get(customer_id):
+            _fifo(matcher, customer_credits, debits[customer_id])
+    return matcher.finish()
+
+
+def allocate(
+    db: Session,
+    customer_id: int,
+    credit_entry_id: int,
+    allocations: Optional[Sequence[Tuple[int, Decimal]]] = None,
+    user_id: Optional[int] = None
+) -> List[dict]:
+    """
+    Apply an open credit entry to the given (debit entry id, amount) pairs, or
+    FIFO when allocations is None. Raises ValueError for entries that are not
+    open for this customer or amounts above what is open. Does not commit.
+    """
+    item = models.CustomerOpenItem
+    credit = db.query(item).filter(
+        item.customer_id == customer_id,
+        item.side == CREDIT,
+        item.ledger_entry_id == credit_entry_id
+    ).with_for_update().first()
+    if not credit:
+        raise ValueError(f"Ledger entry {credit_entry_id} is not an open credit of this customer")
+
+    matcher = _Matcher(db, user_id)
+    if allocations is None:
+        _fifo(matcher, [credit], _open_items(db, DEBIT, [customer_id]).get(customer_id, []))
+        return matcher.finish()
+
+    debit_ids = [debit_entry_id for debit_entry_id, _ in allocations]
+    debits = {
+        row.ledger_entry_id: row
+        for row in db.query(item).filter(
+            item.customer_id == customer_id,
+            item.side == DEBIT,
+            item.ledger_entry_id.in_(debit_ids)
+        ).with_for_update().all()
+    }
+    requested = sum((_amount(amount) for _, amount in allocations), ZERO)
+    if requested > credit.open_amount:
+        raise ValueError(f"Only {credit.open_amount} of ledger entry {credit_entry_id} is unapplied")
+    for debit_entry_id, amount in allocations:
+        debit = debits.get(debit_entry_id)
+        if not debit:
+            raise ValueError(f"Ledger entry {debit_entry_id} is not an open debit of this customer")
+        if _amount(amount) > debit.open_amount:
+            raise ValueError(f"Only {debit.open_amount} of ledger entry {debit_entry_id} is open")
+        matcher.apply(credit, debit, _amount(amount), EXPLICIT)
+    return matcher.finish()
+
+
+# ---------------------------------------------------------------------------
+# Settlement import
+# ---------------------------------------------------------------------------
+
+def reconcile_settlements(
+    db: Session,
+    company_id: int,
+    lines: Sequence[dict],
+    user_id: Optional[int] = None,
+    apply_remainder: bool = True
+) -> List[dict]:
+    """
+    Post imported bank/marketplace settlement lines as PAYMENT ledger entries
+    and match them. Each line has amount and optionally reference_number (the
+    invoice or document it pays), customer_id, transaction_date,
+    settlement_reference and description; the customer is taken from the
+    referenced open item when not given. A line is applied to its referenced
+    document first and, with apply_remainder, the rest FIFO. Does not commit.
+
+    Returns one outcome per line.
+    """
+    item = models.CustomerOpenItem
+    references = {line["reference_number"] for line in lines if line.get("reference_number")}
+    open_by_reference = defaultdict(list)
+    if references:
+        for row in db.query(item).filter(
+            item.company_id == company_id,
+            item.side == DEBIT,
+            item.reference_number.in_(references)
+        ).order_by(item.due_date.is_(None), item.due_date, item.id).with_for_update().all():
+            open_by_reference[row.reference_number].append(row)
+
+    # Resolve each line's customer
+    results = []
+    resolved = []  # (result, line, customer_id)
+    for index, line in enumerate(lines):
+        result = {"line": index, "reference_number": line.get("reference_number"), "amount": float(line["amount"])}
+        results.append(result)
+        customer_id = line.get("customer_id")
+        candidates = open_by_reference.get(line.get("reference_number"), [])
+        if customer_id is None:
+            customer_ids = {row.customer_id for row in candidates}
+            if len(customer_ids) == 1:
+                customer_id = customer_ids.pop()
+            else:
+                result["status"] = "error"
+                result["detail"] = (
+                    "Reference matches several customers; pass customer_id" if customer_ids
+                    else "No open item with this reference; pass customer_id"
+                )
+                continue
+        resolved.append((result, line, customer_id))
+
+    customers = {
+        customer.id: customer
+        for customer in db.query(models.Customer).filter(
+            models.Customer.company_id == company_id,
+            models.Customer.id.in_({customer_id for _, _, customer_id in resolved})
+        ).order_by(models.Customer.id).with_for_update().all()
+    } if resolved else {}
+
+    # One PAYMENT entry per line, with running balances per customer
+    now = datetime.now()
+    posted = []  # (result, line, entry)
+    for result, line, customer_id in resolved:
+        customer = customers.get(customer_id)
+        if not customer:
+            result["status"] = "error"
+            result["detail"] = "Customer not found"
+            continue
+        amount = _amount(line["amount"])
+        customer.current_balance = _amount(customer.current_balance) - amount
+        reference = line.get("settlement_reference") or line.get("reference_number")
+        entry = models.CustomerLedger(
+            customer_id=customer_id,
+            company_id=company_id,
+            transaction_date=line.get("transaction_date") or now,
+            transaction_type="PAYMENT",
+            reference_number=reference,
+            reference_type="settlement",
+            debit_amount=0,
+            credit_amount=amount,
+            balance=customer.current_balance,
+            description=line.get("description") or f"Settlement {reference or ''}".strip(),
+            created_by_user_id=user_id
+        )
+        result["customer_id"] = customer_id
+        posted.append((result, line, entry))
+
+    if not posted:
+        return results
+
+    entries = [entry for _, _, entry in posted]
+    db.bulk_save_objects(entries, return_defaults=True)
+    rollups.record_ledger_entries(db, entries)
+    record_entries(db, entries, auto_match=False, user_id=user_id)
+
+    credits = {
+        row.ledger_entry_id: row
+        for row in db.query(item).filter(
+            item.ledger_entry_id.in_([entry.id for entry in entries])
+        ).with_for_update().all()
+    }
+
+    # Referenced documents first
+    matcher = _Matcher(db, user_id)
+    for result, line, entry in posted:
+        credit = credits.get(entry.id)
+        for debit in open_by_reference.get(line.get("reference_number"), []):
+            if credit is None or credit.open_amount == 0:
+                break
+            if debit.customer_id == entry.customer_id:
+                matcher.apply(credit, debit, None, SETTLEMENT)
+    allocations = matcher.finish()
+    if apply_remainder:
+        allocations += match_fifo(db, {entry.customer_id for entry in entries}, user_id=user_id)
+
+    applied = defaultdict(list)
+    for allocation in allocations:
+        applied[allocation["credit_entry_id"]].append(allocation)
+    references_by_entry = dict(db.query(
+        models.CustomerLedger.id, models.CustomerLedger.reference_number
+    ).filter(
+        models.CustomerLedger.id.in_({allocation["debit_entry_id"] for allocation in allocations})
+    ).all()) if allocations else {}
+
+    for result, line, entry in posted:
+        credit = credits.get(entry.id)
+        result["status"] = "posted"
+        result["ledger_entry_id"] = entry.id
+        result["applied"] = [
+            {
+                "debit_entry_id": allocation["debit_entry_id"],
+                "reference_number": references_by_entry.get(allocation["debit_entry_id"]),
+                "amount": float(allocation["amount"]),
+                "method": allocation["method"],
+            }
+            for allocation in applied[entry.id]
+        ]
+        result["unapplied"] = float(credit.open_amount) if credit is not None and credit.open_amount > 0 else 0.0
+    return results
+
+
+# ---------------------------------------------------------------------------
+# Rebuild
+# ---------------------------------------------------------------------------
+
+def rebuild(db: Session, match: bool = True) -> Dict[str, int]:
+    """
+    Recompute customer_open_items from the ledger minus recorded allocations,
+    sync is_reconciled, mark the open items ready and, with match, apply open
+    credits FIFO. Caller commits.
+    """
+    ledger = models.CustomerLedger
+    allocation = models.LedgerAllocation
+    allocated = defaultdict(Decimal)
+    for column in (allocation.debit_entry_id, allocation.credit_entry_id):
+        for entry_id, amount in db.query(column, func.sum(allocation.amount)).group_by(column).all():
+            allocated[entry_id] += _amount(amount)
+
+    db.query(models.CustomerOpenItem).delete(synchronize_session=False)
+    batch = []
+    count = 0
+    for entry in db.query(
+        ledger.id, ledger.company_id, ledger.customer_id, ledger.transaction_type, ledger.reference_number,
+        ledger.transaction_date, ledger.due_date, ledger.debit_amount, ledger.credit_amount
+    ).order_by(ledger.id).yield_per(5000):
+        row = _item_row(entry)
+        if row is None:
+            continue
+        row["open_amount"] = row["original_amount"] - allocated.get(entry.id, ZERO)
+        if row["open_amount"] <= 0:
+            continue
+        batch.append(row)
+        if len(batch) >= 5000:
+            db.bulk_insert_mappings(models.CustomerOpenItem, batch)
+            count += len(batch)
+            batch = []
+    db.bulk_insert_mappings(models.CustomerOpenItem, batch)
+    count += len(batch)
+
+    # Entries with nothing left open are reconciled, the rest are not
+    open_ids = db.query(models.CustomerOpenItem.ledger_entry_id)
+    db.query(ledger).filter(ledger.id.in_(open_ids)).update(
+        {ledger.is_reconciled: False, ledger.reconciled_date: None}, synchronize_session=False
+    )
+    db.query(ledger).filter(
+        ledger.id.notin_(open_ids), ledger.is_reconciled.isnot(True)
+    ).update({ledger.is_reconciled: True, ledger.reconciled_date: datetime.now()}, synchronize_session=False)
+
+    if not db.query(models.RollupState).filter(models.RollupState.name == rollups.OPEN_ITEMS).first():
+        db.add(models.RollupState(name=rollups.OPEN_ITEMS, rebuilt_at=datetime.now()))
+        db.flush()
+
+    counts = {"open_items": count, "allocations": 0}
+    if match:
+        customer_ids = [customer_id for (customer_id,) in db.query(models.CustomerOpenItem.customer_id).filter(
+            models.CustomerOpenItem.side == CREDIT
+        ).distinct().all()]
+        counts["allocations"] = len(match_fifo(db, customer_ids))
+        counts["open_items"] = db.query(models.CustomerOpenItem).count()
+
+    # Open invoice amounts and aging follow the open items from now on
+    if rollups.is_ready(db, rollups.CUSTOMER_BALANCES):
+        rollups.rebuild_customer_balances(db)
+    return counts
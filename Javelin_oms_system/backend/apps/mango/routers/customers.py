@@ -1,14 +1,18 @@
 """Customer Management API Endpoints"""
-from fastapi import APIRouter, Depends, HTTPException, Query
+from fastapi import APIRouter, Depends, HTTPException, Query, Response
 from sqlalchemy.orm import Session
-from sqlalchemy import func, extract
+from sqlalchemy import and_, case, func, extract, or_
 from typing import List, Optional, Dict
-from datetime import datetime, timedelta
+from datetime import date, datetime, timedelta
 from decimal import Decimal
 
 from backend.apps.common.db import get_db
-from backend.apps.common.models import Customer, CustomerAddress, CustomerContact, CustomerLedger
-from backend.apps.mango import schemas
+from backend.apps.common import rollups, pagination
+from backend.apps.common.models import (
+    Customer, CustomerAddress, CustomerContact, CustomerLedger, CustomerLedgerMonthlyRollup,
+    CustomerBalanceSummary, CustomerAgingRollup, CustomerOpenItem
+)
+from backend.apps.mango import schemas, sequences, search_index, receivables
 
 router = APIRouter(tags=["Customers"])
 
@@ -20,19 +24,6 @@ async def get_current_user():
     return {"user_id": 1, "company_id": 1}
 
 
-# Helper function to generate customer code
-def generate_customer_code(db: Session) -> str:
-    """Generate next customer code: CUST-0001, CUST-0002, etc."""
-    last_customer = db.query(Customer).order_by(Customer.id.desc()).first()
-    if last_customer and last_customer.customer_code:
-        try:
-            last_num = int(last_customer.customer_code.split("-")[1])
-            return f"CUST-{last_num + 1:04d}"
-        except:
-            pass
-    return "CUST-0001"
-
-
 # ============================================================
 # CUSTOMER CRUD ENDPOINTS
 # ============================================================
@@ -46,7 +37,7 @@ def create_customer(
     """Create a new customer with addresses and contacts"""
     
     # Generate customer code
-    customer_code = generate_customer_code(db)
+    customer_code = sequences.next_number(db, "customer", current_user.get("company_id", 1))
     
     # Create customer
     db_customer = Customer(
@@ -108,6 +99,9 @@ def create_customer(
             created_by_user_id=current_user.get("user_id")
         )
         db.add(opening_entry)
+        db.flush()
+        rollups.record_ledger_entry(db, opening_entry)
+        receivables.record_entries(db, [opening_entry], user_id=current_user.get("user_id"))
     
     db.commit()
     db.refresh(db_customer)
@@ -117,29 +111,40 @@ def create_customer(
 
 @router.get("", response_model=List[schemas.CustomerListResponse])
 def get_customers(
+    response: Response,
     skip: int = 0,
     limit: int = 100,
     search: Optional[str] = None,
     customer_type: Optional[str] = None,
     is_active: Optional[bool] = None,
     is_credit_hold: Optional[bool] = None,
+    cursor: Optional[str] = Query(None, description="X-Next-Cursor from the previous page"),
+    total: Optional[str] = Query(None, enum=list(pagination.TOTAL_MODES), description="Include X-Total-Count: exact or estimate (cached)"),
     db: Session = Depends(get_db),
     current_user: dict = Depends(get_current_user)
 ):
-    """Get list of customers with filters"""
+    """Get list of customers with filters (keyset paginated, see X-Next-Cursor)"""
     
     query = db.query(Customer).filter(
         Customer.company_id == current_user.get("company_id", 1)
     )
     
+    sort = [(Customer.id, False)]
+    
     # Apply filters
     if search:
-        query = query.filter(
-            (Customer.name.contains(search)) |
-            (Customer.email.contains(search)) |
-            (Customer.phone.contains(search)) |
-            (Customer.customer_code.contains(search))
-        )
+        if search_index.is_ready(db):
+            # Indexed word-prefix search, best matches first
+            ranked = search_index.match("customer", current_user.get("company_id", 1), search)
+            query = query.join(ranked, ranked.c.doc_id == Customer.id)
+            sort = [(ranked.c.rank, True)] + sort
+        else:
+            query = query.filter(
+                (Customer.name.contains(search)) |
+                (Customer.email.contains(search)) |
+                (Customer.phone.contains(search)) |
+                (Customer.customer_code.contains(search))
+            )
     
     if customer_type:
         query = query.filter(Customer.customer_type == customer_type)
@@ -150,9 +155,14 @@ def get_customers(
     if is_credit_hold is not None:
         query = query.filter(Customer.is_credit_hold == is_credit_hold)
     
-    customers = query.offset(skip).limit(limit).all()
+    page = pagination.paginate(
+        query, sort, limit,
+        cursor=cursor, offset=skip, total=total,
+        count_key=("customers", current_user.get("company_id", 1), search, customer_type, is_active, is_credit_hold)
+    )
+    page.apply_headers(response)
     
-    return customers
+    return page.items
 
 
 @router.get("/{customer_id}", response_model=schemas.CustomerResponse)
@@ -264,6 +274,7 @@ def get_customer_ledger(
 def create_ledger_entry(
     customer_id: int,
     entry: schemas.CustomerLedgerCreate,
+    auto_match: bool = Query(True, description="Apply open payments/credits to open invoices, oldest first"),
     db: Session = Depends(get_db),
     current_user: dict = Depends(get_current_user)
 ):
@@ -275,8 +286,8 @@ def create_ledger_entry(
         raise HTTPException(status_code=404, detail="Customer not found")
     
     # Calculate new balance
-    balance_change = entry.debit_amount - entry.credit_amount
-    new_balance = customer.current_balance + balance_change
+    balance_change = Decimal(str(entry.debit_amount)) - Decimal(str(entry.credit_amount))
+    new_balance = Decimal(str(customer.current_balance or 0)) + balance_change
     
     # Create ledger entry
     db_entry = CustomerLedger(
@@ -296,6 +307,9 @@ def create_ledger_entry(
     )
     
     db.add(db_entry)
+    db.flush()
+    rollups.record_ledger_entry(db, db_entry)
+    receivables.record_entries(db, [db_entry], auto_match=auto_match, user_id=current_user.get("user_id"))
     
     # Update customer balance
     customer.current_balance = new_balance
@@ -306,6 +320,135 @@ def create_ledger_entry(
     return db_entry
 
 
+def _aging_buckets(db: Session, customer_id: int):
+    """
+    Unpaid invoice amounts by days past due: 0-30, 31-60, 61-90, 90+.
+    Summed from the per-due-day aging rollup once built, otherwise from the
+    open items, otherwise from unreconciled invoices in the ledger.
+    """
+    today = date.today()
+    if rollups.is_ready(db, rollups.CUSTOMER_BALANCES):
+        due = CustomerAgingRollup.due_day
+        amount = CustomerAgingRollup.open_amount
+        filters = [CustomerAgingRollup.customer_id == customer_id]
+        thresholds = [today - timedelta(days=days) for days in (30, 60, 90)]
+    elif receivables.is_ready(db):
+        due = CustomerOpenItem.due_date
+        amount = CustomerOpenItem.open_amount
+        filters = [
+            CustomerOpenItem.customer_id == customer_id,
+            CustomerOpenItem.side == receivables.DEBIT,
+            CustomerOpenItem.transaction_type == "INVOICE",
+            CustomerOpenItem.due_date.isnot(None)
+        ]
+        thresholds = [datetime.combine(today - timedelta(days=days), datetime.min.time()) for days in (30, 60, 90)]
+    else:
+        due = CustomerLedger.due_date
+        amount = CustomerLedger.debit_amount
+        filters = [
+            CustomerLedger.customer_id == customer_id,
+            CustomerLedger.transaction_type == "INVOICE",
+            CustomerLedger.is_reconciled == False,
+            CustomerLedger.due_date.isnot(None)
+        ]
+        thresholds = [datetime.combine(today - timedelta(days=days), datetime.min.time()) for days in (30, 60, 90)]
+    
+    thirty, sixty, ninety = thresholds
+    buckets = db.query(
+        func.sum(case((due >= thirty, amount), else_=0)),
+        func.sum(case((and_(due < thirty, due >= sixty), amount), else_=0)),
+        func.sum(case((and_(due < sixty, due >= ninety), amount), else_=0)),
+        func.sum(case((due < ninety, amount), else_=0))
+    ).filter(*filters).one()
+    return [float(value or 0) for value in buckets]
+
+
+# ============================================================
+# RECEIVABLES MATCHING
+# ============================================================
+
+def _require_open_items(db: Session):
+    if not receivables.is_ready(db):
+        raise HTTPException(
+            status_code=409,
+            detail="Open items have not been built yet. Run backend/rebuild_open_items.py"
+        )
+
+
+@router.post("/settlements/reconcile")
+def reconcile_settlements(
+    request: schemas.SettlementReconcileRequest,
+    db: Session = Depends(get_db),
+    current_user: dict = Depends(get_current_user)
+):
+    """
+    Post imported bank/marketplace settlement lines as payments and match each
+    to the invoice it references (then the oldest open items). Returns one
+    outcome per line; lines that cannot be matched to a customer are skipped.
+    """
+    _require_open_items(db)
+    results = receivables.reconcile_settlements(
+        db,
+        current_user.get("company_id", 1),
+        [line.model_dump() for line in request.lines],
+        user_id=current_user.get("user_id"),
+        apply_remainder=request.apply_remainder
+    )
+    db.commit()
+    
+    posted = [result for result in results if result["status"] == "posted"]
+    return {
+        "posted": len(posted),
+        "errors": len(results) - len(posted),
+        "applied_amount": sum(line["amount"] for result in posted for line in result["applied"]),
+        "unapplied_amount": sum(result["unapplied"] for result in posted),
+        "lines": results
+    }
+
+
+@router.get("/{customer_id}/open-items", response_model=List[schemas.CustomerOpenItemResponse])
+def get_customer_open_items(
+    customer_id: int,
+    side: Optional[str] = Query(None, enum=[receivables.DEBIT, receivables.CREDIT]),
+    db: Session = Depends(get_db),
+    current_user: dict = Depends(get_current_user)
+):
+    """Unpaid debits and unapplied credits of a customer, oldest due first"""
+    _require_open_items(db)
+    query = db.query(CustomerOpenItem).filter(
+        CustomerOpenItem.customer_id == customer_id,
+        CustomerOpenItem.company_id == current_user.get("company_id", 1)
+    )
+    if side:
+        query = query.filter(CustomerOpenItem.side == side)
+    return query.order_by(
+        CustomerOpenItem.due_date.is_(None), CustomerOpenItem.due_date, CustomerOpenItem.document_date
+    ).all()
+
+
+@router.post("/{customer_id}/allocations", response_model=List[schemas.LedgerAllocationResponse])
+def allocate_ledger_entry(
+    customer_id: int,
+    request: schemas.LedgerAllocationRequest,
+    db: Session = Depends(get_db),
+    current_user: dict = Depends(get_current_user)
+):
+    """Apply a payment/credit entry to specific invoices, or to the oldest open invoices when none are given"""
+    _require_open_items(db)
+    allocations = None
+    if request.allocations is not None:
+        allocations = [(line.debit_entry_id, Decimal(str(line.amount))) for line in request.allocations]
+    try:
+        result = receivables.allocate(
+            db, customer_id, request.credit_entry_id, allocations, user_id=current_user.get("user_id")
+        )
+    except ValueError as e:
+        db.rollback()
+        raise HTTPException(status_code=400, detail=str(e))
+    db.commit()
+    return result
+
+
 @router.get("/{customer_id}/balance", response_model=schemas.CustomerBalanceResponse)
 def get_customer_balance(
     customer_id: int,
@@ -318,34 +461,7 @@ def get_customer_balance(
     if not customer:
         raise HTTPException(status_code=404, detail="Customer not found")
     
-    # Calculate aging (simplified - would need more complex logic for real aging)
-    now = datetime.now()
-    thirty_days_ago = now - timedelta(days=30)
-    sixty_days_ago = now - timedelta(days=60)
-    ninety_days_ago = now - timedelta(days=90)
-    
-    # Get outstanding invoices (entries with due dates)
-    ledger_entries = db.query(CustomerLedger).filter(
-        CustomerLedger.customer_id == customer_id,
-        CustomerLedger.transaction_type == "INVOICE",
-        CustomerLedger.is_reconciled == False
-    ).all()
-    
-    aging_current = 0
-    aging_30 = 0
-    aging_60 = 0
-    aging_90_plus = 0
-    
-    for entry in ledger_entries:
-        if entry.due_date:
-            if entry.due_date >= thirty_days_ago:
-                aging_current += float(entry.debit_amount)
-            elif entry.due_date >= sixty_days_ago:
-                aging_30 += float(entry.debit_amount)
-            elif entry.due_date >= ninety_days_ago:
-                aging_60 += float(entry.debit_amount)
-            else:
-                aging_90_plus += float(entry.debit_amount)
+    aging_current, aging_30, aging_60, aging_90_plus = _aging_buckets(db, customer_id)
     
     return {
         "customer_id": customer.id,
@@ -384,19 +500,28 @@ def get_customer_statement(
     
     transactions = query.order_by(CustomerLedger.transaction_date).all()
     
-    # Calculate totals
-    total_debit = sum(float(t.debit_amount) for t in transactions)
-    total_credit = sum(float(t.credit_amount) for t in transactions)
-    opening_balance = customer.opening_balance
+    # Totals: from the running summary for the full history, otherwise summed by the database
+    summary = None
+    if not start_date and not end_date and rollups.is_ready(db, rollups.CUSTOMER_BALANCES):
+        summary = db.query(
+            CustomerBalanceSummary.debit_total, CustomerBalanceSummary.credit_total
+        ).filter(CustomerBalanceSummary.customer_id == customer_id).first()
+    if summary is None:
+        summary = query.with_entities(
+            func.sum(CustomerLedger.debit_amount), func.sum(CustomerLedger.credit_amount)
+        ).order_by(None).one()
+    total_debit = Decimal(str(summary[0] or 0))
+    total_credit = Decimal(str(summary[1] or 0))
+    opening_balance = Decimal(str(customer.opening_balance or 0))
     closing_balance = opening_balance + total_debit - total_credit
     
     return {
         "customer": customer,
         "opening_balance": float(opening_balance),
         "transactions": transactions,
-        "closing_balance": closing_balance,
-        "total_debit": total_debit,
-        "total_credit": total_credit
+        "closing_balance": float(closing_balance),
+        "total_debit": float(total_debit),
+        "total_credit": float(total_credit)
     }
 
 
@@ -417,18 +542,75 @@ def get_customer_analytics(
     end_date = datetime.now()
     start_date = end_date - timedelta(days=months * 30)
     
-    # Get all ledger entries in date range
-    ledger_entries = db.query(CustomerLedger).filter(
+    company_id = current_user.get("company_id", 1)
+    ledger_filter = (
         CustomerLedger.customer_id == customer_id,
-        CustomerLedger.company_id == current_user.get("company_id", 1),
+        CustomerLedger.company_id == company_id,
+    )
+    
+    # Whole months strictly inside the range come from the monthly rollup;
+    # the partial months at either end are read from the ledger itself
+    first_full_month = (start_date.replace(day=1) + timedelta(days=32)).replace(
+        day=1, hour=0, minute=0, second=0, microsecond=0
+    )
+    current_month = end_date.replace(day=1, hour=0, minute=0, second=0, microsecond=0)
+    use_rollups = first_full_month < current_month and rollups.is_ready(db, rollups.CUSTOMER_LEDGER)
+    
+    raw_filter = [
+        *ledger_filter,
         CustomerLedger.transaction_date >= start_date,
         CustomerLedger.transaction_date <= end_date
-    ).order_by(CustomerLedger.transaction_date).all()
-    
-    # Calculate monthly trends
+    ]
+    if use_rollups:
+        raw_filter.append(or_(
+            CustomerLedger.transaction_date < first_full_month,
+            CustomerLedger.transaction_date >= current_month
+        ))
+    
+    # (month, type) -> count, debit, credit, closing balance, last transaction; grouped by the database
+    month = rollups.month_key(db, CustomerLedger.transaction_date)
+    grouped = db.query(
+        month.label("month"),
+        CustomerLedger.transaction_type,
+        func.count(CustomerLedger.id),
+        func.sum(CustomerLedger.debit_amount),
+        func.sum(CustomerLedger.credit_amount),
+        func.max(CustomerLedger.transaction_date).label("last_at")
+    ).filter(*raw_filter).group_by(month, CustomerLedger.transaction_type).subquery()
+    
+    buckets = {}
+    for month_key, txn_type, count, debit, credit, last_at in db.query(grouped).all():
+        buckets[(month_key, txn_type)] = [count, debit or 0, credit or 0, 0, last_at]
+    
+    # Closing balance of each bucket is the balance of its latest entry
+    if buckets:
+        closing = db.query(
+            grouped.c.month, CustomerLedger.transaction_type, CustomerLedger.balance
+        ).join(grouped, and_(
+            CustomerLedger.transaction_type == grouped.c.transaction_type,
+            CustomerLedger.transaction_date == grouped.c.last_at
+        )).filter(*ledger_filter).order_by(CustomerLedger.id).all()
+        for month_key, txn_type, balance in closing:
+            buckets[(month_key, txn_type)][3] = balance or 0
+    
+    if use_rollups:
+        rollup_rows = db.query(CustomerLedgerMonthlyRollup).filter(
+            CustomerLedgerMonthlyRollup.customer_id == customer_id,
+            CustomerLedgerMonthlyRollup.company_id == company_id,
+            CustomerLedgerMonthlyRollup.month >= first_full_month.strftime("%Y-%m"),
+            CustomerLedgerMonthlyRollup.month < current_month.strftime("%Y-%m")
+        ).all()
+        for row in rollup_rows:
+            buckets[(row.month, row.transaction_type)] = [
+                row.entry_count, row.debit_total or 0, row.credit_total or 0,
+                row.closing_balance or 0, row.last_transaction_at
+            ]
+    
+    # Calculate monthly trends and transaction breakdown by type
     monthly_data = {}
-    for entry in ledger_entries:
-        month_key = entry.transaction_date.strftime("%Y-%m")
+    month_last_seen = {}
+    transaction_breakdown = {}
+    for (month_key, txn_type), (count, debit, credit, balance, last_at) in buckets.items():
         if month_key not in monthly_data:
             monthly_data[month_key] = {
                 "sales": 0,
@@ -437,14 +619,24 @@ def get_customer_analytics(
                 "balance": 0
             }
         
-        if entry.transaction_type == "INVOICE":
-            monthly_data[month_key]["sales"] += float(entry.debit_amount)
-        elif entry.transaction_type == "PAYMENT":
-            monthly_data[month_key]["payments"] += float(entry.credit_amount)
-        elif entry.transaction_type in ["CREDIT_NOTE", "RETURN"]:
-            monthly_data[month_key]["returns"] += float(entry.credit_amount)
+        if txn_type == "INVOICE":
+            monthly_data[month_key]["sales"] += float(debit)
+        elif txn_type == "PAYMENT":
+            monthly_data[month_key]["payments"] += float(credit)
+        elif txn_type in ["CREDIT_NOTE", "RETURN"]:
+            monthly_data[month_key]["returns"] += float(credit)
         
-        monthly_data[month_key]["balance"] = float(entry.balance)
+        if month_key not in month_last_seen or (last_at and last_at >= month_last_seen[month_key]):
+            month_last_seen[month_key] = last_at or datetime.min
+            monthly_data[month_key]["balance"] = float(balance)
+        
+        if txn_type not in transaction_breakdown:
+            transaction_breakdown[txn_type] = {
+                "count": 0,
+                "total_amount": 0
+            }
+        transaction_breakdown[txn_type]["count"] += count
+        transaction_breakdown[txn_type]["total_amount"] += float(debit) + float(credit)
     
     # Convert to list format for frontend
     monthly_trends = []
@@ -454,70 +646,91 @@ def get_customer_analytics(
             **monthly_data[month]
         })
     
-    # Transaction breakdown by type
-    transaction_breakdown = {}
-    for entry in ledger_entries:
-        txn_type = entry.transaction_type
-        if txn_type not in transaction_breakdown:
-            transaction_breakdown[txn_type] = {
-                "count": 0,
-                "total_amount": 0
-            }
-        transaction_breakdown[txn_type]["count"] += 1
-        if entry.debit_amount > 0:
-            transaction_breakdown[txn_type]["total_amount"] += float(entry.debit_amount)
-        if entry.credit_amount > 0:
-            transaction_breakdown[txn_type]["total_amount"] += float(entry.credit_amount)
-    
-    # Outstanding invoices
-    outstanding_invoices = db.query(CustomerLedger).filter(
-        CustomerLedger.customer_id == customer_id,
-        CustomerLedger.transaction_type == "INVOICE",
-        CustomerLedger.is_reconciled == False,
-        CustomerLedger.debit_amount > 0
-    ).order_by(CustomerLedger.due_date.asc()).limit(10).all()
+    # Outstanding invoices: what is still unpaid from the open items once built
+    if receivables.is_ready(db):
+        outstanding_invoices = [
+            (item.ledger_entry_id, item.reference_number, item.document_date, item.due_date, item.open_amount)
+            for item in db.query(CustomerOpenItem).filter(
+                CustomerOpenItem.customer_id == customer_id,
+                CustomerOpenItem.side == receivables.DEBIT,
+                CustomerOpenItem.transaction_type == "INVOICE"
+            ).order_by(CustomerOpenItem.due_date.asc()).limit(10).all()
+        ]
+    else:
+        outstanding_invoices = [
+            (inv.id, inv.reference_number, inv.transaction_date, inv.due_date, inv.debit_amount)
+            for inv in db.query(CustomerLedger).filter(
+                CustomerLedger.customer_id == customer_id,
+                CustomerLedger.transaction_type == "INVOICE",
+                CustomerLedger.is_reconciled == False,
+                CustomerLedger.debit_amount > 0
+            ).order_by(CustomerLedger.due_date.asc()).limit(10).all()
+        ]
     
     outstanding_list = []
-    for inv in outstanding_invoices:
+    for entry_id, reference_number, invoice_date, due_date, amount in outstanding_invoices:
         days_overdue = 0
-        if inv.due_date:
-            days_overdue = (datetime.now() - inv.due_date).days
+        if due_date:
+            days_overdue = (datetime.now() - due_date).days
         outstanding_list.append({
-            "id": inv.id,
-            "reference_number": inv.reference_number,
-            "invoice_date": inv.transaction_date.isoformat() if inv.transaction_date else None,
-            "due_date": inv.due_date.isoformat() if inv.due_date else None,
-            "amount": float(inv.debit_amount),
+            "id": entry_id,
+            "reference_number": reference_number,
+            "invoice_date": invoice_date.isoformat() if invoice_date else None,
+            "due_date": due_date.isoformat() if due_date else None,
+            "amount": float(amount),
             "days_overdue": days_overdue if days_overdue > 0 else 0
         })
     
     # Calculate statistics
-    total_sales = sum(float(e.debit_amount) for e in ledger_entries if e.transaction_type == "INVOICE")
-    total_payments = sum(float(e.credit_amount) for e in ledger_entries if e.transaction_type == "PAYMENT")
-    total_returns = sum(float(e.credit_amount) for e in ledger_entries if e.transaction_type in ["CREDIT_NOTE", "RETURN"])
+    total_sales = sum(data["sales"] for data in monthly_data.values())
+    total_payments = sum(data["payments"] for data in monthly_data.values())
+    total_returns = sum(data["returns"] for data in monthly_data.values())
+    total_transactions = sum(data["count"] for data in transaction_breakdown.values())
     avg_invoice_value = total_sales / max(transaction_breakdown.get("INVOICE", {}).get("count", 1), 1)
     
-    # Calculate average payment days (simplified)
+    # Calculate average payment days (simplified): payments matched to invoices by reference
+    payments = db.query(
+        CustomerLedger.reference_number,
+        CustomerLedger.transaction_date
+    ).filter(
+        *ledger_filter,
+        CustomerLedger.transaction_type == "PAYMENT",
+        CustomerLedger.reference_number.isnot(None),
+        CustomerLedger.transaction_date >= start_date,
+        CustomerLedger.transaction_date <= end_date
+    ).all()
+    
+    invoice_due_dates = {}
+    if payments:
+        invoices = db.query(
+            CustomerLedger.reference_number,
+            CustomerLedger.due_date
+        ).filter(
+            CustomerLedger.customer_id == customer_id,
+            CustomerLedger.transaction_type == "INVOICE",
+            CustomerLedger.reference_number.in_({ref for ref, _ in payments})
+        ).order_by(CustomerLedger.id).all()
+        for reference_number, due_date in invoices:
+            invoice_due_dates.setdefault(reference_number, due_date)
+    
     payment_days = []
-    for entry in ledger_entries:
-        if entry.transaction_type == "PAYMENT" and entry.reference_number:
-            # Find corresponding invoice
-            invoice = db.query(CustomerLedger).filter(
-                CustomerLedger.customer_id == customer_id,
-                CustomerLedger.reference_number == entry.reference_number,
-                CustomerLedger.transaction_type == "INVOICE"
-            ).first()
-            if invoice and invoice.due_date:
-                days = (entry.transaction_date - invoice.due_date).days
-                if days > 0:
-                    payment_days.append(days)
+    for reference_number, paid_at in payments:
+        due_date = invoice_due_dates.get(reference_number)
+        if due_date:
+            days = (paid_at - due_date).days
+            if days > 0:
+                payment_days.append(days)
     
     avg_payment_days = sum(payment_days) / len(payment_days) if payment_days else 0
     
     # Recent activity (last 10 transactions)
-    recent_activity = ledger_entries[-10:] if len(ledger_entries) > 10 else ledger_entries
+    recent_activity = db.query(CustomerLedger).filter(
+        *ledger_filter,
+        CustomerLedger.transaction_date >= start_date,
+        CustomerLedger.transaction_date <= end_date
+    ).order_by(CustomerLedger.transaction_date.desc(), CustomerLedger.id.desc()).limit(10).all()
     recent_list = []
-    for act in reversed(recent_activity):
+    for act in recent_activity:
         recent_list.append({
             "id": act.id,
             "date": act.transaction_date.isoformat() if act.transaction_date else None,
@@ -527,7 +740,7 @@ def get_customer_analytics(
             "amount": float(act.debit_amount if act.debit_amount > 0 else act.credit_amount),
             "is_debit": act.debit_amount > 0
         })
-    
+
     return {
         "monthly_trends": monthly_trends,
         "transaction_breakdown": transaction_breakdown,
@@ -539,7 +752,7 @@ def get_customer_analytics(
             "total_returns": total_returns,
             "avg_invoice_value": avg_invoice_value,
             "avg_payment_days": round(avg_payment_days, 1),
-            "total_transactions": len(ledger_entries),
+            "total_transactions": total_transactions,
             "outstanding_count": len(outstanding_list)
         }
     }
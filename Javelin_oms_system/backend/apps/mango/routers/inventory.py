@@ -6,8 +6,9 @@ from typing import List, Optional
 from datetime import datetime, timedelta
 
 from ...common.dependencies import get_db, AppAccessChecker
-from ...common import models
+from ...common import models, cache
 from .. import schemas
+from .. import stock_balances
 
 # Require 'mango' app access for all endpoints in this router
 require_mango = AppAccessChecker("mango")
@@ -927,69 +928,19 @@ def complete_stock_transfer(
     db: Session = Depends(get_db)
 ):
     """Complete a stock transfer and update stock ledger (only for approved transfers)"""
-    from datetime import datetime
-    
-    # Get transfer with items
-    transfer = db.query(models.StockTransfer).join(
-        models.Warehouse,
-        models.StockTransfer.source_warehouse_id == models.Warehouse.id
-    ).filter(
-        models.StockTransfer.id == transfer_id,
-        models.Warehouse.company_id == current_user.company_id
-    ).first()
-    
-    if not transfer:
-        raise HTTPException(status_code=404, detail="Stock transfer not found")
-    
-    if transfer.status == "COMPLETED":
-        raise HTTPException(status_code=400, detail="Transfer is already completed")
-    
-    if transfer.status == "CANCELLED":
-        raise HTTPException(status_code=400, detail="Cannot complete a cancelled transfer")
-    
-    # Check approval status
-    if transfer.approval_status != "approved":
-        raise HTTPException(
-            status_code=400, 
-            detail="Transfer must be approved before it can be completed"
-        )
-    
-    # Process each item and create stock ledger entries
-    for item in transfer.items:
-        # Set quantity received to quantity sent (assuming full receipt)
-        item.quantity_received = item.quantity_sent
-        
-        # Create stock ledger entry for source warehouse (OUT)
-        source_ledger = models.StockLedger(
-            product_id=item.product_id,
-            warehouse_id=transfer.source_warehouse_id,
-            transaction_type="OUT_TRANSFER",
-            quantity=-item.quantity_sent,  # Negative for outbound
-            reference_model="STOCK_TRANSFER",
-            reference_id=transfer.transfer_number,
-            balance_after=0  # TODO: Calculate actual balance
-        )
-        db.add(source_ledger)
-        
-        # Create stock ledger entry for destination warehouse (IN)
-        dest_ledger = models.StockLedger(
-            product_id=item.product_id,
-            warehouse_id=transfer.destination_warehouse_id,
-            transaction_type="IN_TRANSFER",
-            quantity=item.quantity_received,  # Positive for inbound
-            reference_model="STOCK_TRANSFER",
-            reference_id=transfer.transfer_number,
-            balance_after=0  # TODO: Calculate actual balance
-        )
-        db.add(dest_ledger)
-    
-    # Update transfer status
-    transfer.status = "COMPLETED"
-    transfer.completed_date = datetime.now()
-    
+    outcome = stock_balances.complete_transfers(db, [transfer_id], current_user.company_id)[0]
+
+    if outcome["status"] != "completed":
+        db.rollback()
+        status_code = 404 if outcome["detail"] == "Stock transfer not found" else 400
+        if outcome.get("shortages"):
+            raise HTTPException(status_code=status_code, detail={"message": outcome["detail"], "shortages": outcome["shortages"]})
+        raise HTTPException(status_code=status_code, detail=outcome["detail"])
+
     db.commit()
-    db.refresh(transfer)
-    
+
+    transfer = db.query(models.StockTransfer).filter(models.StockTransfer.id == transfer_id).first()
+
     return {
         "success": True,
         "message": "Stock transfer completed successfully",
@@ -997,6 +948,34 @@ def complete_stock_transfer(
     }
 
 
+@router.post("/stock-transfers/batch-complete")
+def complete_stock_transfers_batch(
+    batch: schemas.StockTransferBatchComplete,
+    current_user: models.User = Depends(require_mango),
+    db: Session = Depends(get_db)
+):
+    """Complete many approved stock transfers in a single transaction"""
+    if not batch.transfer_ids:
+        raise HTTPException(status_code=400, detail="No transfer ids provided")
+
+    results = stock_balances.complete_transfers(
+        db,
+        batch.transfer_ids,
+        current_user.company_id,
+        all_or_nothing=batch.all_or_nothing
+    )
+    db.commit()
+
+    completed = sum(1 for r in results if r["status"] == "completed")
+
+    return {
+        "success": completed == len(results),
+        "completed": completed,
+        "failed": len(results) - completed,
+        "results": results
+    }
+
+
 @router.delete("/stock-transfers/{transfer_id}")
 def cancel_stock_transfer(
     transfer_id: int,
@@ -1262,6 +1241,8 @@ def create_grn(grn: schemas.GRNCreate, db: Session = Depends(get_db)):
     db.refresh(db_grn)
     
     # 2. Process Items & Update Stock
+    po = db.query(models.PurchaseOrder).filter(models.PurchaseOrder.id == grn.po_id).first()
+    movements = []
     for item in grn.items:
         # A. Create GRN Line
         db_item = models.GRNItem(
@@ -1282,20 +1263,19 @@ def create_grn(grn: schemas.GRNCreate, db: Session = Depends(get_db)):
         if po_item:
             po_item.quantity_received += item.quantity_received
             
-        # C. Update Stock Ledger (IN) if Accepted > 0
+        # C. Queue Stock Ledger (IN) if Accepted > 0
         if item.quantity_accepted > 0:
-            po = db.query(models.PurchaseOrder).filter(models.PurchaseOrder.id == grn.po_id).first()
-            
-            ledger_entry = models.StockLedger(
-                product_id=item.product_id,
-                warehouse_id=po.warehouse_id,
-                transaction_type="IN_PO",
-                quantity=item.quantity_accepted,
-                reference_model="GRN",
-                reference_id=db_grn.grn_number,
-                balance_after=0 # TODO: Calculate actual balance
-            )
-            db.add(ledger_entry)
+            movements.append({
+                "product_id": item.product_id,
+                "warehouse_id": po.warehouse_id,
+                "transaction_type": "IN_PO",
+                "quantity": item.quantity_accepted,
+                "reference_model": "GRN",
+                "reference_id": db_grn.grn_number
+            })
+
+    # D. Post ledger rows and update maintained balances
+    stock_balances.post_movements(db, movements)
 
     db.commit()
     db.refresh(db_grn)
@@ -1310,15 +1290,25 @@ def get_inventory_summary(
     db: Session = Depends(get_db)
 ):
     """Get overall inventory summary statistics"""
+    return cache.response_cache.get_or_compute(
+        ("inventory.summary", current_user.company_id),
+        [cache.INVENTORY],
+        lambda: _build_inventory_summary(db, current_user.company_id),
+        company_id=current_user.company_id
+    )
+
+
+def _build_inventory_summary(db: Session, company_id: int) -> dict:
+    """Compute the inventory summary for a company"""
     
     # Total items count
     total_items = db.query(func.count(models.Product.id)).filter(
-        models.Product.company_id == current_user.company_id
+        models.Product.company_id == company_id
     ).scalar() or 0
     
     # Total unique SKUs
     total_skus = db.query(func.count(func.distinct(models.Product.sku))).filter(
-        models.Product.company_id == current_user.company_id
+        models.Product.company_id == company_id
     ).scalar() or 0
     
     # Calculate total quantity from stock ledger (sum of all positive balances)
@@ -1339,13 +1329,13 @@ def get_inventory_summary(
         models.StockLedger,
         models.Product.id == models.StockLedger.product_id
     ).filter(
-        models.Product.company_id == current_user.company_id,
+        models.Product.company_id == company_id,
         models.StockLedger.quantity > 0
     ).scalar() or 0
     
     # Low stock items (below reorder level)
     low_stock_count = db.query(func.count(models.Product.id)).filter(
-        models.Product.company_id == current_user.company_id,
+        models.Product.company_id == company_id,
         models.Product.reorder_level.isnot(None),
         # This would need actual stock calculation, simplified for now
     ).scalar() or 0
@@ -1366,9 +1356,19 @@ def get_warehouse_summary(
     db: Session = Depends(get_db)
 ):
     """Get inventory summary grouped by warehouse"""
+    return cache.response_cache.get_or_compute(
+        ("inventory.warehouse_summary", current_user.company_id),
+        [cache.INVENTORY],
+        lambda: _build_warehouse_summary(db, current_user.company_id),
+        company_id=current_user.company_id
+    )
+
+
+def _build_warehouse_summary(db: Session, company_id: int) -> dict:
+    """Compute per-warehouse inventory totals for a company"""
     
     warehouses = db.query(models.Warehouse).filter(
-        models.Warehouse.company_id == current_user.company_id,
+        models.Warehouse.company_id == company_id,
         models.Warehouse.is_active == 1
     ).all()
     
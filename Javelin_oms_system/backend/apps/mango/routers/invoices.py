@@ -1,5 +1,5 @@
 """Tax Invoices Management API Endpoints"""
-from fastapi import APIRouter, Depends, HTTPException, Query
+from fastapi import APIRouter, Depends, HTTPException, Query, Response
 from sqlalchemy.orm import Session
 from sqlalchemy import func, or_
 from typing import List, Optional
@@ -7,8 +7,9 @@ from datetime import datetime, timedelta
 from decimal import Decimal
 
 from ...common.dependencies import get_db
-from ...common.models import Invoice, InvoiceItem, Customer, Product, SalesOrder, SalesOrderItem, Company
-from .. import schemas
+from ...common import pagination
+from ...common.models import Invoice, InvoiceItem, Customer, Product, Company
+from .. import schemas, sequences, invoicing, documents, search_index
 
 router = APIRouter(prefix="/invoices", tags=["Invoices"])
 
@@ -19,23 +20,9 @@ async def get_current_user():
     return {"user_id": 1, "company_id": 1}
 
 
-def generate_invoice_number(db: Session, company_id: int) -> str:
-    """Generate next invoice number: INV-0001, INV-0002, etc."""
-    last_invoice = db.query(Invoice).filter(
-        Invoice.company_id == company_id
-    ).order_by(Invoice.id.desc()).first()
-    
-    if last_invoice and last_invoice.invoice_number:
-        try:
-            last_num = int(last_invoice.invoice_number.split("-")[1])
-            return f"INV-{last_num + 1:04d}"
-        except:
-            pass
-    return "INV-0001"
-
-
 @router.get("")
 def get_invoices(
+    response: Response,
     skip: int = 0,
     limit: int = 100,
     status: Optional[str] = None,
@@ -44,10 +31,12 @@ def get_invoices(
     search: Optional[str] = None,
     start_date: Optional[datetime] = None,
     end_date: Optional[datetime] = None,
+    cursor: Optional[str] = Query(None, description="X-Next-Cursor from the previous page"),
+    total: Optional[str] = Query(None, enum=list(pagination.TOTAL_MODES), description="Include X-Total-Count: exact or estimate (cached)"),
     db: Session = Depends(get_db),
     current_user: dict = Depends(get_current_user)
 ):
-    """Get list of invoices with filters"""
+    """Get list of invoices with filters (keyset paginated, see X-Next-Cursor)"""
     
     from sqlalchemy.orm import joinedload
     
@@ -65,14 +54,22 @@ def get_invoices(
     if customer_id:
         query = query.filter(Invoice.customer_id == customer_id)
     
+    sort = [(Invoice.invoice_date, True), (Invoice.id, True)]
+    
     if search:
-        query = query.join(Customer).filter(
-            or_(
-                Invoice.invoice_number.contains(search),
-                Customer.name.contains(search),
-                Customer.email.contains(search)
+        if search_index.is_ready(db):
+            # Indexed word-prefix search, best matches first
+            ranked = search_index.match("invoice", current_user.get("company_id", 1), search)
+            query = query.join(ranked, ranked.c.doc_id == Invoice.id)
+            sort = [(ranked.c.rank, True)] + sort
+        else:
+            query = query.join(Customer).filter(
+                or_(
+                    Invoice.invoice_number.contains(search),
+                    Customer.name.contains(search),
+                    Customer.email.contains(search)
+                )
             )
-        )
     
     if start_date:
         query = query.filter(Invoice.invoice_date >= start_date)
@@ -80,7 +77,13 @@ def get_invoices(
     if end_date:
         query = query.filter(Invoice.invoice_date <= end_date)
     
-    invoices = query.order_by(Invoice.invoice_date.desc()).offset(skip).limit(limit).all()
+    page = pagination.paginate(
+        query, sort, limit,
+        cursor=cursor, offset=skip, total=total,
+        count_key=("invoices", current_user.get("company_id", 1), status, payment_status, customer_id, search, start_date, end_date)
+    )
+    page.apply_headers(response)
+    invoices = page.items
     
     # Convert to response format
     result = []
@@ -110,6 +113,42 @@ def get_invoices(
     return result
 
 
+@router.get("/number-gaps")
+def get_invoice_number_gaps(
+    financial_year: Optional[str] = Query(None, description="Financial year, e.g. 2025-26"),
+    db: Session = Depends(get_db),
+    current_user: dict = Depends(get_current_user)
+):
+    """Invoice numbers that were allocated but never issued (for GST reporting)"""
+    
+    gaps = sequences.list_gaps(db, "invoice", current_user.get("company_id", 1), financial_year)
+    return {"count": len(gaps), "gaps": gaps}
+
+
+@router.post("/export")
+def export_invoices(
+    export: schemas.DocumentExportRequest,
+    db: Session = Depends(get_db),
+    current_user: dict = Depends(get_current_user)
+):
+    """Download many invoices as a ZIP of printable HTML documents"""
+    
+    from fastapi.responses import StreamingResponse
+    
+    if len(export.ids) > documents.BULK_EXPORT_MAX:
+        raise HTTPException(status_code=400, detail=f"At most {documents.BULK_EXPORT_MAX} documents can be exported at once")
+    
+    prepared = documents.prepare_export(db, "invoice", current_user.get("company_id", 1), export.ids)
+    if not prepared["entries"]:
+        raise HTTPException(status_code=404, detail="No invoices found")
+    
+    return StreamingResponse(
+        documents.stream_zip(prepared),
+        media_type="application/zip",
+        headers={"Content-Disposition": 'attachment; filename="invoices.zip"'}
+    )
+
+
 @router.get("/{invoice_id}")
 def get_invoice(
     invoice_id: int,
@@ -218,7 +257,7 @@ def create_invoice(
     user_id = current_user.get("user_id", 1)
     
     # Generate invoice number
-    invoice_number = generate_invoice_number(db, company_id)
+    invoice_number = sequences.next_number(db, "invoice", company_id, on=invoice.invoice_date)
     
     # Calculate totals
     subtotal = Decimal(0)
@@ -354,52 +393,54 @@ def create_invoice_from_sales_order(
     db: Session = Depends(get_db),
     current_user: dict = Depends(get_current_user)
 ):
-    """Create invoice from sales order"""
+    """Create invoice from sales order (same taxes and ledger posting as the batch endpoint)"""
     
-    from sqlalchemy.orm import joinedload
+    result = invoicing.invoice_sales_orders(
+        db,
+        company_id=current_user.get("company_id", 1),
+        user_id=current_user.get("user_id", 1),
+        sales_order_ids=[sales_order_id]
+    )
     
-    # Get sales order with product relationships
-    sales_order = db.query(SalesOrder).options(
-        joinedload(SalesOrder.customer),
-        joinedload(SalesOrder.items).joinedload(SalesOrderItem.product)
-    ).filter(
-        SalesOrder.id == sales_order_id,
-        SalesOrder.company_id == current_user.get("company_id", 1)
-    ).first()
+    if not result["invoices"]:
+        detail = result["skipped"][0]["detail"]
+        raise HTTPException(status_code=404 if detail == "Sales order not found" else 400, detail=detail)
     
-    if not sales_order:
-        raise HTTPException(status_code=404, detail="Sales order not found")
-    
-    # Create invoice from sales order
-    invoice_data = schemas.InvoiceCreate(
-        sales_order_id=sales_order_id,
-        customer_id=sales_order.customer_id,
-        invoice_date=datetime.now(),
-        due_date=sales_order.delivery_date,
-        status="DRAFT",
-        shipping_address=sales_order.shipping_address,
-        payment_terms=sales_order.payment_terms,
-        delivery_terms=sales_order.delivery_terms,
-        notes=f"Invoice generated from Sales Order {sales_order.order_number}",
-        currency=sales_order.currency,
-        shipping_charges=float(sales_order.shipping_charges or 0),
-        items=[
-            schemas.InvoiceItemCreate(
-                product_id=item.product_id,
-                sku=item.sku,
-                description=item.description,
-                hsn_code=getattr(item.product, 'hsn_code', None) if item.product else None,
-                quantity=item.quantity,
-                unit_price=float(item.unit_price),
-                discount_percent=float(item.discount_percent or 0),
-                tax_rate=float(item.tax_rate or 0),
-                unit_of_measure=item.unit_of_measure
-            )
-            for item in sales_order.items
-        ]
+    db.commit()
+    
+    return get_invoice(result["invoices"][0]["invoice_id"], db, current_user)
+
+
+@router.post("/batch-from-sales-orders")
+def create_invoices_from_sales_orders(
+    batch: schemas.InvoiceBatchFromSalesOrders,
+    db: Session = Depends(get_db),
+    current_user: dict = Depends(get_current_user)
+):
+    """Invoice many sales orders at once and post them to the customer ledger"""
+    
+    if not batch.sales_order_ids and not (batch.status or batch.order_date_from or batch.order_date_to):
+        raise HTTPException(status_code=400, detail="Provide sales_order_ids or at least one filter")
+    
+    result = invoicing.invoice_sales_orders(
+        db,
+        company_id=current_user.get("company_id", 1),
+        user_id=current_user.get("user_id", 1),
+        sales_order_ids=batch.sales_order_ids,
+        status=batch.status,
+        order_date_from=batch.order_date_from,
+        order_date_to=batch.order_date_to,
+        invoice_date=batch.invoice_date,
+        limit=batch.limit
     )
+    db.commit()
     
-    return create_invoice(invoice_data, db, current_user)
+    return {
+        "success": True,
+        "created": len(result["invoices"]),
+        "skipped": len(result["skipped"]),
+        **result
+    }
 
 
 @router.put("/{invoice_id}")
@@ -472,6 +513,13 @@ def delete_invoice(
             detail="Cannot delete paid invoice"
         )
     
+    # Take its ledger debit, open item and aging back out in the same transaction
+    try:
+        invoicing.reverse_invoice_posting(db, invoice, current_user.get("user_id", 1))
+    except ValueError as e:
+        db.rollback()
+        raise HTTPException(status_code=400, detail=str(e))
+    
     db.delete(invoice)
     db.commit()
     
@@ -537,328 +585,17 @@ def generate_invoice_pdf(
 ):
     """Generate Tax Invoice PDF - returns HTML for viewing or PDF for download"""
     
-    from sqlalchemy.orm import joinedload
     from fastapi.responses import HTMLResponse
     
-    invoice = db.query(Invoice).options(
-        joinedload(Invoice.customer),
-        joinedload(Invoice.items)
-    ).filter(
-        Invoice.id == invoice_id,
-        Invoice.company_id == current_user.get("company_id", 1)
-    ).first()
-    
-    if not invoice:
+    # Served from the rendered-document cache unless the invoice changed since it was last rendered
+    document = documents.get_document(db, "invoice", current_user.get("company_id", 1), invoice_id)
+    if not document:
         raise HTTPException(status_code=404, detail="Invoice not found")
-    
-    # Get company info
-    company = db.query(Company).filter(Company.id == invoice.company_id).first()
-    company_name = company.name if company else "Company"
-    company_address = getattr(company, 'address', '') if company else ''
-    company_phone = getattr(company, 'phone', '') if company else ''
-    company_email = getattr(company, 'email', '') if company else ''
-    company_gst = invoice.gst_number or (getattr(company, 'gst_number', None) if company else None)
-    company_state = getattr(company, 'state', None) if company else None
-    
-    # Format currency symbol
-    currency_symbols = {
-        "INR": "₹",
-        "USD": "$",
-        "EUR": "€",
-        "GBP": "£"
-    }
-    currency_symbol = currency_symbols.get(invoice.currency, invoice.currency)
-    
-    # Determine if inter-state or intra-state
-    customer_state = getattr(invoice.customer, 'state', None) if invoice.customer else None
-    is_interstate = customer_state and company_state and customer_state != company_state
-    
-    # Generate HTML for Tax Invoice
-    html_content = f"""
-    <!DOCTYPE html>
-    <html>
-    <head>
-        <meta charset="UTF-8">
-        <title>Tax Invoice {invoice.invoice_number}</title>
-        <style>
-            @media print {{
-                @page {{
-                    margin: 1cm;
-                    size: A4;
-                }}
-                .no-print {{ display: none; }}
-            }}
-            body {{
-                font-family: 'Arial', sans-serif;
-                margin: 0;
-                padding: 20px;
-                color: #333;
-                max-width: 210mm;
-                margin: 0 auto;
-            }}
-            .header {{
-                border: 2px solid #000;
-                padding: 15px;
-                margin-bottom: 20px;
-            }}
-            .header h1 {{
-                color: #000;
-                margin: 0;
-                font-size: 28px;
-                font-weight: bold;
-                text-align: center;
-            }}
-            .header h2 {{
-                color: #000;
-                margin: 5px 0;
-                font-size: 16px;
-                font-weight: normal;
-                text-align: center;
-            }}
-            .company-info {{
-                float: right;
-                text-align: right;
-                font-size: 11px;
-            }}
-            .invoice-info {{
-                margin: 20px 0;
-                display: flex;
-                justify-content: space-between;
-            }}
-            .info-box {{
-                border: 1px solid #000;
-                padding: 10px;
-                margin-bottom: 15px;
-                font-size: 11px;
-            }}
-            .info-box h3 {{
-                margin: 0 0 8px 0;
-                color: #000;
-                font-size: 12px;
-                text-transform: uppercase;
-                font-weight: bold;
-            }}
-            .info-box p {{
-                margin: 3px 0;
-                font-size: 11px;
-            }}
-            table {{
-                width: 100%;
-                border-collapse: collapse;
-                margin: 20px 0;
-                font-size: 10px;
-            }}
-            th {{
-                background: #000;
-                color: white;
-                padding: 8px;
-                text-align: left;
-                font-weight: 600;
-                border: 1px solid #000;
-            }}
-            td {{
-                padding: 8px;
-                border: 1px solid #000;
-            }}
-            .text-right {{
-                text-align: right;
-            }}
-            .text-center {{
-                text-align: center;
-            }}
-            .totals {{
-                margin-top: 20px;
-                float: right;
-                width: 300px;
-            }}
-            .totals table {{
-                margin: 0;
-            }}
-            .totals td {{
-                padding: 6px 10px;
-                border: 1px solid #000;
-            }}
-            .totals .label {{
-                text-align: right;
-                font-weight: 600;
-            }}
-            .totals .amount {{
-                text-align: right;
-            }}
-            .total-row {{
-                background: #f0f0f0;
-                font-weight: bold;
-            }}
-            .total-row td {{
-                padding: 10px;
-                font-size: 12px;
-            }}
-            .gst-summary {{
-                margin-top: 20px;
-                border: 1px solid #000;
-                padding: 10px;
-            }}
-            .gst-summary h4 {{
-                margin: 0 0 10px 0;
-                font-size: 12px;
-            }}
-            .footer {{
-                margin-top: 30px;
-                padding-top: 15px;
-                border-top: 2px solid #000;
-                font-size: 10px;
-                text-align: center;
-            }}
-            .action-buttons {{
-                text-align: center;
-                margin: 30px 0;
-            }}
-            .btn {{
-                padding: 12px 24px;
-                margin: 0 10px;
-                border: none;
-                border-radius: 6px;
-                cursor: pointer;
-                font-size: 14px;
-                font-weight: 600;
-            }}
-            .btn-primary {{
-                background: #2563eb;
-                color: white;
-            }}
-            .btn-secondary {{
-                background: #64748b;
-                color: white;
-            }}
-        </style>
-    </head>
-    <body>
-        <div class="header">
-            <h1>TAX INVOICE</h1>
-            <h2>{invoice.invoice_number}</h2>
-            <div class="company-info">
-                <strong>{company_name}</strong><br>
-                {company_address}<br>
-                {f'Phone: {company_phone}' if company_phone else ''}<br>
-                {f'Email: {company_email}' if company_email else ''}<br>
-                {f'GSTIN: {company_gst}' if company_gst else ''}
-            </div>
-        </div>
-        
-        <div class="invoice-info">
-            <div class="info-box" style="flex: 1; margin-right: 10px;">
-                <h3>Bill To:</h3>
-                <p><strong>{invoice.customer.name if invoice.customer else 'N/A'}</strong></p>
-                {f'<p>{invoice.customer.email}</p>' if invoice.customer and invoice.customer.email else ''}
-                {f'<p>{invoice.customer.phone}</p>' if invoice.customer and getattr(invoice.customer, "phone", None) else ''}
-                {f'<p>GSTIN: {invoice.customer_gst_number}</p>' if invoice.customer_gst_number else ''}
-                {f'<p>{invoice.billing_address}</p>' if invoice.billing_address else ''}
-            </div>
-            
-            <div class="info-box" style="flex: 1; margin-left: 10px;">
-                <h3>Ship To:</h3>
-                {f'<p>{invoice.shipping_address}</p>' if invoice.shipping_address else '<p>Same as billing address</p>'}
-            </div>
-        </div>
-        
-        <div class="info-box">
-            <div style="display: flex; justify-content: space-between;">
-                <div>
-                    <strong>Invoice Date:</strong> {invoice.invoice_date.strftime('%d-%m-%Y') if invoice.invoice_date else 'N/A'}<br>
-                    <strong>Due Date:</strong> {invoice.due_date.strftime('%d-%m-%Y') if invoice.due_date else 'N/A'}<br>
-                    <strong>Place of Supply:</strong> {invoice.place_of_supply or (customer_state if customer_state else 'N/A')}
-                </div>
-                <div>
-                    <strong>Status:</strong> {invoice.status}<br>
-                    <strong>Payment Status:</strong> {invoice.payment_status}<br>
-                    {f'<strong>Balance:</strong> {currency_symbol}{float(invoice.balance_amount):,.2f}' if invoice.balance_amount > 0 else ''}
-                </div>
-            </div>
-        </div>
-        
-        <table>
-            <thead>
-                <tr>
-                    <th style="width: 3%;">#</th>
-                    <th style="width: 8%;">HSN</th>
-                    <th style="width: 30%;">Description</th>
-                    <th style="width: 6%;" class="text-center">Qty</th>
-                    <th style="width: 10%;" class="text-right">Rate</th>
-                    <th style="width: 8%;" class="text-right">Disc %</th>
-                    <th style="width: 8%;" class="text-right">Tax %</th>
-                    {f'<th style="width: 8%;" class="text-right">IGST</th>' if is_interstate else '<th style="width: 4%;" class="text-right">CGST</th><th style="width: 4%;" class="text-right">SGST</th>'}
-                    <th style="width: 10%;" class="text-right">Amount</th>
-                </tr>
-            </thead>
-            <tbody>
-                {''.join([
-                    f'''
-                    <tr>
-                        <td>{idx + 1}</td>
-                        <td>{item.hsn_code or 'N/A'}</td>
-                        <td>
-                            <strong>{item.description or 'N/A'}</strong>
-                            {f'<br><small>SKU: {item.sku}</small>' if item.sku else ''}
-                        </td>
-                        <td class="text-center">{item.quantity} {item.unit_of_measure or 'PCS'}</td>
-                        <td class="text-right">{currency_symbol}{float(item.unit_price):,.2f}</td>
-                        <td class="text-right">{float(item.discount_percent or 0):.2f}%</td>
-                        <td class="text-right">{float(item.tax_rate or 0):.2f}%</td>
-                        {f'<td class="text-right">{currency_symbol}{float(item.igst_amount):,.2f}</td>' if is_interstate else f'<td class="text-right">{currency_symbol}{float(item.cgst_amount):,.2f}</td><td class="text-right">{currency_symbol}{float(item.sgst_amount):,.2f}</td>'}
-                        <td class="text-right"><strong>{currency_symbol}{float(item.line_total):,.2f}</strong></td>
-                    </tr>
-                    '''
-                    for idx, item in enumerate(invoice.items)
-                ])}
-            </tbody>
-        </table>
-        
-        <div class="totals">
-            <table>
-                <tr>
-                    <td class="label">Subtotal:</td>
-                    <td class="amount">{currency_symbol}{float(invoice.subtotal or 0):,.2f}</td>
-                </tr>
-                <tr>
-                    <td class="label">Discount:</td>
-                    <td class="amount">{currency_symbol}{float(invoice.discount_amount or 0):,.2f}</td>
-                </tr>
-                {f'<tr><td class="label">IGST:</td><td class="amount">{currency_symbol}{float(invoice.igst_amount or 0):,.2f}</td></tr>' if is_interstate else f'<tr><td class="label">CGST:</td><td class="amount">{currency_symbol}{float(invoice.cgst_amount or 0):,.2f}</td></tr><tr><td class="label">SGST:</td><td class="amount">{currency_symbol}{float(invoice.sgst_amount or 0):,.2f}</td></tr>'}
-                <tr>
-                    <td class="label">Shipping:</td>
-                    <td class="amount">{currency_symbol}{float(invoice.shipping_charges or 0):,.2f}</td>
-                </tr>
-                <tr class="total-row">
-                    <td class="label">TOTAL:</td>
-                    <td class="amount">{currency_symbol}{float(invoice.total_amount or 0):,.2f}</td>
-                </tr>
-                {f'<tr><td class="label">Paid:</td><td class="amount">{currency_symbol}{float(invoice.paid_amount or 0):,.2f}</td></tr>' if invoice.paid_amount > 0 else ''}
-                {f'<tr><td class="label">Balance:</td><td class="amount"><strong>{currency_symbol}{float(invoice.balance_amount or 0):,.2f}</strong></td></tr>' if invoice.balance_amount > 0 else ''}
-            </table>
-        </div>
-        
-        {f'<div class="info-box"><h3>Notes</h3><p>{invoice.notes}</p></div>' if invoice.notes else ''}
-        {f'<div class="info-box"><h3>Terms & Conditions</h3><p>{invoice.terms_conditions}</p></div>' if invoice.terms_conditions else ''}
-        
-        <div class="footer">
-            <p style="text-align: center;">
-                <strong>This is a computer-generated invoice.</strong><br>
-                Generated on {datetime.now().strftime('%d-%m-%Y at %I:%M %p')}
-            </p>
-        </div>
-        
-        <div class="action-buttons no-print">
-            <button class="btn btn-primary" onclick="window.print()">🖨️ Print Invoice</button>
-            <button class="btn btn-secondary" onclick="window.close()">❌ Close</button>
-        </div>
-    </body>
-    </html>
-    """
+    number, html_content = document
     
     if view:
         return HTMLResponse(content=html_content)
     else:
         return HTMLResponse(content=html_content, headers={
-            "Content-Disposition": f'attachment; filename="TaxInvoice_{invoice.invoice_number}.html"'
+            "Content-Disposition": f'attachment; filename="{documents.filename("invoice", number)}"'
         })
-
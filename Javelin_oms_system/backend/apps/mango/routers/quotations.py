@@ -1,5 +1,5 @@
 """Quotations Management API Endpoints"""
-from fastapi import APIRouter, Depends, HTTPException, Query
+from fastapi import APIRouter, Depends, HTTPException, Query, Response
 from sqlalchemy.orm import Session
 from sqlalchemy import func, or_
 from typing import List, Optional
@@ -7,8 +7,9 @@ from datetime import datetime, timedelta
 from decimal import Decimal
 
 from ...common.dependencies import get_db
+from ...common import pagination
 from ...common.models import Quotation, QuotationItem, Customer, Product, SalesOrder, SalesOrderItem
-from .. import schemas
+from .. import schemas, sequences, documents, search_index
 
 router = APIRouter(prefix="/quotations", tags=["Quotations"])
 
@@ -19,23 +20,9 @@ async def get_current_user():
     return {"user_id": 1, "company_id": 1}
 
 
-def generate_quotation_number(db: Session, company_id: int) -> str:
-    """Generate next quotation number: QTN-0001, QTN-0002, etc."""
-    last_quote = db.query(Quotation).filter(
-        Quotation.company_id == company_id
-    ).order_by(Quotation.id.desc()).first()
-    
-    if last_quote and last_quote.quotation_number:
-        try:
-            last_num = int(last_quote.quotation_number.split("-")[1])
-            return f"QTN-{last_num + 1:04d}"
-        except:
-            pass
-    return "QTN-0001"
-
-
 @router.get("")
 def get_quotations(
+    response: Response,
     skip: int = 0,
     limit: int = 100,
     status: Optional[str] = None,
@@ -43,10 +30,12 @@ def get_quotations(
     search: Optional[str] = None,
     start_date: Optional[datetime] = None,
     end_date: Optional[datetime] = None,
+    cursor: Optional[str] = Query(None, description="X-Next-Cursor from the previous page"),
+    total: Optional[str] = Query(None, enum=list(pagination.TOTAL_MODES), description="Include X-Total-Count: exact or estimate (cached)"),
     db: Session = Depends(get_db),
     current_user: dict = Depends(get_current_user)
 ):
-    """Get list of quotations with filters"""
+    """Get list of quotations with filters (keyset paginated, see X-Next-Cursor)"""
     
     from sqlalchemy.orm import joinedload
     
@@ -61,15 +50,23 @@ def get_quotations(
     if customer_id:
         query = query.filter(Quotation.customer_id == customer_id)
     
+    sort = [(Quotation.quotation_date, True), (Quotation.id, True)]
+    
     if search:
-        # Join customer for search, but keep it in the query for eager loading
-        query = query.join(Customer).filter(
-            or_(
-                Quotation.quotation_number.contains(search),
-                Customer.name.contains(search),
-                Customer.email.contains(search)
+        if search_index.is_ready(db):
+            # Indexed word-prefix search, best matches first
+            ranked = search_index.match("quotation", current_user.get("company_id", 1), search)
+            query = query.join(ranked, ranked.c.doc_id == Quotation.id)
+            sort = [(ranked.c.rank, True)] + sort
+        else:
+            # Join customer for search, but keep it in the query for eager loading
+            query = query.join(Customer).filter(
+                or_(
+                    Quotation.quotation_number.contains(search),
+                    Customer.name.contains(search),
+                    Customer.email.contains(search)
+                )
             )
-        )
     else:
         # Even without search, ensure customer is loaded via joinedload
         pass  # Already handled by joinedload above
@@ -80,7 +77,13 @@ def get_quotations(
     if end_date:
         query = query.filter(Quotation.quotation_date <= end_date)
     
-    quotations = query.order_by(Quotation.quotation_date.desc()).offset(skip).limit(limit).all()
+    page = pagination.paginate(
+        query, sort, limit,
+        cursor=cursor, offset=skip, total=total,
+        count_key=("quotations", current_user.get("company_id", 1), status, customer_id, search, start_date, end_date)
+    )
+    page.apply_headers(response)
+    quotations = page.items
     
     # Convert to response format with customer dict
     result = []
@@ -107,6 +110,30 @@ def get_quotations(
     return result
 
 
+@router.post("/export")
+def export_quotations(
+    export: schemas.DocumentExportRequest,
+    db: Session = Depends(get_db),
+    current_user: dict = Depends(get_current_user)
+):
+    """Download many quotations as a ZIP of printable HTML documents"""
+    
+    from fastapi.responses import StreamingResponse
+    
+    if len(export.ids) > documents.BULK_EXPORT_MAX:
+        raise HTTPException(status_code=400, detail=f"At most {documents.BULK_EXPORT_MAX} documents can be exported at once")
+    
+    prepared = documents.prepare_export(db, "quotation", current_user.get("company_id", 1), export.ids)
+    if not prepared["entries"]:
+        raise HTTPException(status_code=404, detail="No quotations found")
+    
+    return StreamingResponse(
+        documents.stream_zip(prepared),
+        media_type="application/zip",
+        headers={"Content-Disposition": 'attachment; filename="quotations.zip"'}
+    )
+
+
 @router.get("/{quotation_id}")
 def get_quotation(
     quotation_id: int,
@@ -197,7 +224,7 @@ def create_quotation(
     user_id = current_user.get("user_id", 1)
     
     # Generate quotation number
-    quotation_number = generate_quotation_number(db, company_id)
+    quotation_number = sequences.next_number(db, "quotation", company_id)
     
     # Calculate totals
     subtotal = Decimal(0)
@@ -587,21 +614,6 @@ def reject_quotation(
     return {"success": True, "message": "Quotation rejected"}
 
 
-def generate_sales_order_number(db: Session, company_id: int) -> str:
-    """Generate next sales order number: SO-0001, SO-0002, etc."""
-    last_order = db.query(SalesOrder).filter(
-        SalesOrder.company_id == company_id
-    ).order_by(SalesOrder.id.desc()).first()
-    
-    if last_order and last_order.order_number:
-        try:
-            last_num = int(last_order.order_number.split("-")[1])
-            return f"SO-{last_num + 1:04d}"
-        except:
-            pass
-    return "SO-0001"
-
-
 @router.post("/{quotation_id}/convert-to-order")
 def convert_to_order(
     quotation_id: int,
@@ -634,7 +646,7 @@ def convert_to_order(
     user_id = current_user.get("user_id", 1)
     
     # Generate order number
-    order_number = generate_sales_order_number(db, company_id)
+    order_number = sequences.next_number(db, "sales_order", company_id)
     
     # Create sales order
     sales_order = SalesOrder(
@@ -703,343 +715,19 @@ def generate_quotation_pdf(
 ):
     """Generate PDF for quotation - returns HTML for viewing or PDF for download"""
     
-    from sqlalchemy.orm import joinedload
-    from fastapi.responses import HTMLResponse, Response
+    from fastapi.responses import HTMLResponse
     
-    quotation = db.query(Quotation).options(
-        joinedload(Quotation.customer),
-        joinedload(Quotation.items)
-    ).filter(
-        Quotation.id == quotation_id,
-        Quotation.company_id == current_user.get("company_id", 1)
-    ).first()
-    
-    if not quotation:
+    # Served from the rendered-document cache unless the quotation changed since it was last rendered
+    document = documents.get_document(db, "quotation", current_user.get("company_id", 1), quotation_id)
+    if not document:
         raise HTTPException(status_code=404, detail="Quotation not found")
-    
-    # Get company info (if available)
-    from ...common.models import Company
-    company = db.query(Company).filter(Company.id == quotation.company_id).first()
-    company_name = company.name if company else "Company"
-    company_address = getattr(company, 'address', '') if company else ''
-    company_phone = getattr(company, 'phone', '') if company else ''
-    company_email = getattr(company, 'email', '') if company else ''
-    
-    # Format currency symbol
-    currency_symbols = {
-        "INR": "₹",
-        "USD": "$",
-        "EUR": "€",
-        "GBP": "£"
-    }
-    currency_symbol = currency_symbols.get(quotation.currency, quotation.currency)
-    
-    # Generate HTML for PDF
-    html_content = f"""
-    <!DOCTYPE html>
-    <html>
-    <head>
-        <meta charset="UTF-8">
-        <title>Quotation {quotation.quotation_number}</title>
-        <style>
-            @media print {{
-                @page {{
-                    margin: 1.5cm;
-                    size: A4;
-                }}
-                .no-print {{ display: none; }}
-            }}
-            body {{
-                font-family: 'Arial', sans-serif;
-                margin: 0;
-                padding: 20px;
-                color: #333;
-                max-width: 210mm;
-                margin: 0 auto;
-            }}
-            .header {{
-                border-bottom: 3px solid #2563eb;
-                padding-bottom: 20px;
-                margin-bottom: 30px;
-            }}
-            .header h1 {{
-                color: #2563eb;
-                margin: 0;
-                font-size: 32px;
-                font-weight: bold;
-            }}
-            .header h2 {{
-                color: #64748b;
-                margin: 5px 0;
-                font-size: 18px;
-                font-weight: normal;
-            }}
-            .company-info {{
-                float: right;
-                text-align: right;
-                font-size: 12px;
-                color: #64748b;
-            }}
-            .quotation-info {{
-                margin: 20px 0;
-                display: flex;
-                justify-content: space-between;
-            }}
-            .info-box {{
-                background: #f8fafc;
-                padding: 15px;
-                border-radius: 8px;
-                margin-bottom: 20px;
-            }}
-            .info-box h3 {{
-                margin: 0 0 10px 0;
-                color: #1e293b;
-                font-size: 14px;
-                text-transform: uppercase;
-            }}
-            .info-box p {{
-                margin: 5px 0;
-                font-size: 13px;
-            }}
-            table {{
-                width: 100%;
-                border-collapse: collapse;
-                margin: 30px 0;
-                font-size: 12px;
-            }}
-            th {{
-                background: #2563eb;
-                color: white;
-                padding: 12px;
-                text-align: left;
-                font-weight: 600;
-            }}
-            td {{
-                padding: 12px;
-                border-bottom: 1px solid #e2e8f0;
-            }}
-            tr:hover {{
-                background: #f8fafc;
-            }}
-            .text-right {{
-                text-align: right;
-            }}
-            .text-center {{
-                text-align: center;
-            }}
-            .totals {{
-                margin-top: 20px;
-                float: right;
-                width: 300px;
-            }}
-            .totals table {{
-                margin: 0;
-            }}
-            .totals td {{
-                padding: 8px 12px;
-                border: none;
-            }}
-            .totals .label {{
-                text-align: right;
-                font-weight: 600;
-            }}
-            .totals .amount {{
-                text-align: right;
-                font-size: 14px;
-            }}
-            .total-row {{
-                background: #2563eb;
-                color: white;
-                font-weight: bold;
-                font-size: 16px;
-            }}
-            .total-row td {{
-                padding: 15px 12px;
-            }}
-            .footer {{
-                margin-top: 50px;
-                padding-top: 20px;
-                border-top: 2px solid #e2e8f0;
-                font-size: 11px;
-                color: #64748b;
-            }}
-            .terms {{
-                margin-top: 30px;
-                padding: 15px;
-                background: #f8fafc;
-                border-radius: 8px;
-            }}
-            .terms h4 {{
-                margin: 0 0 10px 0;
-                color: #1e293b;
-            }}
-            .terms p {{
-                margin: 5px 0;
-                font-size: 12px;
-                line-height: 1.6;
-            }}
-            .action-buttons {{
-                text-align: center;
-                margin: 30px 0;
-            }}
-            .btn {{
-                padding: 12px 24px;
-                margin: 0 10px;
-                border: none;
-                border-radius: 6px;
-                cursor: pointer;
-                font-size: 14px;
-                font-weight: 600;
-                text-decoration: none;
-                display: inline-block;
-            }}
-            .btn-primary {{
-                background: #2563eb;
-                color: white;
-            }}
-            .btn-secondary {{
-                background: #64748b;
-                color: white;
-            }}
-            .btn:hover {{
-                opacity: 0.9;
-            }}
-        </style>
-    </head>
-    <body>
-        <div class="header">
-            <div class="company-info">
-                <strong>{company_name}</strong><br>
-                {company_address}<br>
-                {f'Phone: {company_phone}' if company_phone else ''}<br>
-                {f'Email: {company_email}' if company_email else ''}
-            </div>
-            <h1>QUOTATION</h1>
-            <h2>{quotation.quotation_number}</h2>
-        </div>
-        
-        <div class="quotation-info">
-            <div class="info-box">
-                <h3>Quotation Details</h3>
-                <p><strong>Date:</strong> {quotation.quotation_date.strftime('%B %d, %Y') if quotation.quotation_date else 'N/A'}</p>
-                <p><strong>Valid Until:</strong> {quotation.valid_until.strftime('%B %d, %Y') if quotation.valid_until else 'N/A'}</p>
-                <p><strong>Status:</strong> <span style="padding: 4px 8px; background: #dbeafe; border-radius: 4px; font-size: 11px;">{quotation.status}</span></p>
-            </div>
-            
-            <div class="info-box">
-                <h3>Bill To</h3>
-                <p><strong>{quotation.customer.name if quotation.customer else 'N/A'}</strong></p>
-                {f'<p>{quotation.customer.email}</p>' if quotation.customer and quotation.customer.email else ''}
-                {f'<p>Code: {quotation.customer.customer_code}</p>' if quotation.customer and quotation.customer.customer_code else ''}
-            </div>
-        </div>
-        
-        <table>
-            <thead>
-                <tr>
-                    <th style="width: 5%;">#</th>
-                    <th style="width: 40%;">Description</th>
-                    <th style="width: 10%;" class="text-center">Qty</th>
-                    <th style="width: 15%;" class="text-right">Unit Price</th>
-                    <th style="width: 10%;" class="text-right">Discount %</th>
-                    <th style="width: 10%;" class="text-right">Tax %</th>
-                    <th style="width: 15%;" class="text-right">Total</th>
-                </tr>
-            </thead>
-            <tbody>
-                {''.join([
-                    f'''
-                    <tr>
-                        <td>{idx + 1}</td>
-                        <td>
-                            <strong>{item.description or 'N/A'}</strong>
-                            {f'<br><small style="color: #64748b;">SKU: {item.sku}</small>' if item.sku else ''}
-                            {f'<br><small style="color: #64748b;">{item.notes}</small>' if item.notes else ''}
-                        </td>
-                        <td class="text-center">{item.quantity} {item.unit_of_measure or 'PCS'}</td>
-                        <td class="text-right">{currency_symbol}{float(item.unit_price):,.2f}</td>
-                        <td class="text-right">{float(item.discount_percent or 0):.2f}%</td>
-                        <td class="text-right">{float(item.tax_rate or 0):.2f}%</td>
-                        <td class="text-right"><strong>{currency_symbol}{float(item.line_total):,.2f}</strong></td>
-                    </tr>
-                    '''
-                    for idx, item in enumerate(quotation.items)
-                ])}
-            </tbody>
-        </table>
-        
-        <div class="totals">
-            <table>
-                <tr>
-                    <td class="label">Subtotal:</td>
-                    <td class="amount">{currency_symbol}{float(quotation.subtotal or 0):,.2f}</td>
-                </tr>
-                <tr>
-                    <td class="label">Discount:</td>
-                    <td class="amount">{currency_symbol}{float(quotation.discount_amount or 0):,.2f}</td>
-                </tr>
-                <tr>
-                    <td class="label">Tax:</td>
-                    <td class="amount">{currency_symbol}{float(quotation.tax_amount or 0):,.2f}</td>
-                </tr>
-                <tr class="total-row">
-                    <td class="label">Total:</td>
-                    <td class="amount">{currency_symbol}{float(quotation.total_amount or 0):,.2f}</td>
-                </tr>
-            </table>
-        </div>
-        
-        {f'''
-        <div class="terms">
-            <h4>Payment Terms</h4>
-            <p>{quotation.payment_terms}</p>
-        </div>
-        ''' if quotation.payment_terms else ''}
-        
-        {f'''
-        <div class="terms">
-            <h4>Delivery Terms</h4>
-            <p>{quotation.delivery_terms}</p>
-        </div>
-        ''' if quotation.delivery_terms else ''}
-        
-        {f'''
-        <div class="terms">
-            <h4>Terms & Conditions</h4>
-            <p>{quotation.terms_conditions}</p>
-        </div>
-        ''' if quotation.terms_conditions else ''}
-        
-        {f'''
-        <div class="terms">
-            <h4>Notes</h4>
-            <p>{quotation.notes}</p>
-        </div>
-        ''' if quotation.notes else ''}
-        
-        <div class="footer">
-            <p style="text-align: center;">
-                <strong>Thank you for your business!</strong><br>
-                This quotation is valid until {quotation.valid_until.strftime('%B %d, %Y') if quotation.valid_until else 'the specified date'}.<br>
-                Generated on {datetime.now().strftime('%B %d, %Y at %I:%M %p')}
-            </p>
-        </div>
-        
-        <div class="action-buttons no-print">
-            <button class="btn btn-primary" onclick="window.print()">🖨️ Print</button>
-            <button class="btn btn-secondary" onclick="window.close()">❌ Close</button>
-        </div>
-    </body>
-    </html>
-    """
+    number, html_content = document
     
     if view:
         return HTMLResponse(content=html_content)
     else:
-        # For download, we'll return HTML that can be printed to PDF
-        # In production, you might want to use reportlab or weasyprint for actual PDF generation
         return HTMLResponse(content=html_content, headers={
-            "Content-Disposition": f'attachment; filename="Quotation_{quotation.quotation_number}.html"'
+            "Content-Disposition": f'attachment; filename="{documents.filename("quotation", number)}"'
         })
 
 
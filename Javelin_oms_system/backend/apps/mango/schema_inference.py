@@ -0,0 +1,447 @@
+"""
+Channel File Schema Inference
+Guesses the type of every column of an uploaded channel file (CSV or Excel)
+from a random sample of its rows instead of the first row or two.
+
+Files are read CHUNK_ROWS rows at a time into a reservoir of
+SCHEMA_SAMPLE_ROWS rows, so every row read has the same chance of being in
+the sample and memory stays flat. Reading stops after SCHEMA_SCAN_SECONDS
+(the sample then covers the rows read so far, reported as incomplete), which
+keeps inference on a 1 GB export to a few seconds.
+
+The sample is classified all at once: every non-empty cell of every column is
+stacked into one series, each pattern (number, currency, boolean, phone,
+email, pincode) and each date format is matched once against all of them, and
+the match rates are grouped back by column. A column gets the first kind that
+at least SCHEMA_MATCH_THRESHOLD of its values match; confidence is that
+share (for text, the share matching no typed kind).
+"""
+
+import os
+import time
+from datetime import date, datetime
+from typing import BinaryIO, Dict, Iterable, Iterator, List, Optional, Tuple
+
+import numpy as np
+import pandas as pd
+
+SCHEMA_SAMPLE_ROWS = int(os.getenv("SCHEMA_SAMPLE_ROWS", "5000"))
+SCHEMA_SCAN_SECONDS = float(os.getenv("SCHEMA_SCAN_SECONDS", "5"))
+SCHEMA_MATCH_THRESHOLD = float(os.getenv("SCHEMA_MATCH_THRESHOLD", "0.95"))
+CHUNK_ROWS = 20000
+
+TEXT = "text"
+INTEGER = "integer"
+DECIMAL = "decimal"
+CURRENCY = "currency"
+BOOLEAN = "boolean"
+DATE = "date"
+DATETIME = "datetime"
+PHONE = "phone"
+EMAIL = "email"
+PINCODE = "pincode"
+
+_NUMBER = r"[+-]?(?:\d{1,3}(?:,\d{2,3})+|\d+)(?:\.\d+)?"
+PATTERNS = {
+    INTEGER: r"[+-]?\d+",
+    DECIMAL: _NUMBER,
+    CURRENCY: rf"(?:₹|Rs\.?|INR|\$|USD|€|£)\s?{_NUMBER}|{_NUMBER}\s?(?:INR|Rs\.?|₹)",
+    PHONE: r"(?:\+?91[\s-]?|0)?[6-9]\d{4}[\s-]?\d{5}",
+    EMAIL: r"[^@\s]+@[^@\s]+\.[A-Za-z]{2,}",
+    PINCODE: r"[1-9]\d{2}\s?\d{3}",
+}
+BOOLEAN_WORDS = {"true", "false", "yes", "no", "y", "n", "t", "f"}
+BOOLEAN_TRUE = {"true", "yes", "y", "t", "1"}
+BOOLEAN_VALUES = BOOLEAN_WORDS | {"0", "1"}
+# Phone numbers and pincodes look like any other number; the header has to say so
+NAME_HINTS = {
+    PHONE: ("phone", "mobile", "contact", "tel", "mob"),
+    PINCODE: ("pincode", "pin_code", "pin", "zip", "postal"),
+}
+# Tried in order; the first format parsing the most values wins (day first before month first)
+DATE_FORMATS = (
+    "ISO8601", "%d-%m-%Y", "%d/%m/%Y", "%d.%m.%Y", "%d-%m-%Y %H:%M", "%d/%m/%Y %H:%M", "%d-%m-%Y %H:%M:%S",
+    "%d/%m/%Y %H:%M:%S", "%m/%d/%Y", "%m/%d/%Y %H:%M", "%m/%d/%Y %H:%M:%S", "%Y/%m/%d", "%d-%b-%Y", "%d %b %Y",
+    "%d-%b-%y", "%b %d, %Y", "%d %B %Y",
+)
+_DATE_LIKE = r"\d{1,4}[-/. ]\w+.*|[A-Za-z]{3,9} \d{1,2}, \d{4}"
+# Checked in order; the first kind clearing the threshold is the column's type
+KINDS = (BOOLEAN, EMAIL, PHONE, PINCODE, INTEGER, DECIMAL, CURRENCY, DATETIME)
+
+SQL_TYPES = {
+    BOOLEAN: "BOOLEAN", DATE: "DATE", DATETIME: "DATETIME", PHONE: "VARCHAR(20)",
+    PINCODE: "VARCHAR(10)", EMAIL: "VARCHAR(255)",
+}
+FIELD_TYPES = {  # Channel field types (see channel_management_routes type_mapping)
+    INTEGER: "Number", DECIMAL: "Decimal", CURRENCY: "Decimal", BOOLEAN: "Select", DATE: "Date", DATETIME: "Date",
+}
+CONFIG_TYPES = {  # Channel configuration field types
+    INTEGER: "number", DECIMAL: "number", CURRENCY: "number", BOOLEAN: "boolean", DATE: "date", DATETIME: "date",
+}
+VALIDATIONS = {EMAIL: "email", PHONE: "phone"}
+
+
+class ColumnProfile:
+    def __init__(self, name: str, kind: str, confidence: float, values: int, nulls: int,
+                 max_length: int, sample_values: List[str], date_format: Optional[str] = None,
+                 max_abs: Optional[float] = None):
+        self.name = name
+        self.kind = kind
+        self.confidence = confidence  # Share of the sampled values backing the kind
+        self.values = values  # Non-empty sampled values
+        self.nulls = nulls
+        self.max_length = max_length
+        self.sample_values = sample_values
+        self.date_format = date_format
+        self.max_abs = max_abs  # Largest magnitude of a numeric column
+
+    @property
+    def null_ratio(self) -> float:
+        total = self.values + self.nulls
+        return self.nulls / total if total else 1.0
+
+    def to_dict(self) -> Dict:
+        return {
+            "column_name": self.name,
+            "kind": self.kind,
+            "confidence": self.confidence,
+            "sql_type": sql_type(self),
+            "date_format": self.date_format,
+            "null_ratio": round(self.null_ratio, 4),
+            "max_length": self.max_length,
+            "sample_values": self.sample_values,
+        }
+
+
+# ---------------------------------------------------------------------------
+# Types for the callers
+# ---------------------------------------------------------------------------
+
+def sql_type(profile: ColumnProfile) -> str:
+    """Column type for a channel table"""
+    if profile.kind == INTEGER:
+        return "BIGINT" if (profile.max_abs or 0) >= 2 ** 31 else "INT"
+    if profile.kind in (DECIMAL, CURRENCY):
+        return "DECIMAL(18,2)" if (profile.max_abs or 0) >= 10 ** 10 else "DECIMAL(12,2)"
+    if profile.kind in SQL_TYPES:
+        return SQL_TYPES[profile.kind]
+    if profile.max_length > 500:
+        return "TEXT"
+    if profile.max_length > 255:
+        return f"VARCHAR({min(profile.max_length + 50, 1000)})"
+    return "VARCHAR(255)"
+
+
+def field_type(profile: ColumnProfile) -> str:
+    """Channel field type (Text, Number, Decimal, Date, Select, LongText)"""
+    if profile.kind in FIELD_TYPES:
+        return FIELD_TYPES[profile.kind]
+    return "LongText" if profile.max_length > 255 else "Text"
+
+
+def config_type(profile: ColumnProfile) -> str:
+    """Channel configuration field type (text, number, date, boolean)"""
+    return CONFIG_TYPES.get(profile.kind, "text")
+
+
+def validation(profile: ColumnProfile) -> str:
+    return VALIDATIONS.get(profile.kind, "none")
+
+
+# ---------------------------------------------------------------------------
+# Sampling
+# ---------------------------------------------------------------------------
+
+def _cell(value) -> Optional[str]:
+    """Text of a spreadsheet cell as it would appear in a CSV export"""
+    if value is None or (isinstance(value, float) and np.isnan(value)) or value is pd.NaT:
+        return None
+    if isinstance(value, bool):
+        return "true" if value else "false"
+    if isinstance(value, float) and value.is_integer():
+        return str(int(value))
+    if isinstance(value, datetime):
+        return value.isoformat(sep=" ")
+    if isinstance(value, date):
+        return value.isoformat()
+    return str(value)
+
+
+def _text(series: pd.Series) -> pd.Series:
+    """Series as stripped strings, empty cells as NA"""
+    if pd.api.types.is_bool_dtype(series.dtype):
+        series = series.map({True: "true", False: "false"})
+    elif pd.api.types.is_datetime64_any_dtype(series.dtype):
+        series = series.dt.strftime("%Y-%m-%d %H:%M:%S")
+    elif pd.api.types.is_float_dtype(series.dtype):
+        present = series.dropna()
+        if len(present) and np.isfinite(present).all() and (present % 1 == 0).all():
+            series = series.astype("Int64")
+    elif series.dtype == object:
+        series = series.map(_cell)
+    text = series.astype("string").str.strip()
+    return text.mask(text == "")
+
+
+def _headers(row: Iterable) -> List[str]:
+    """Header names, blanks named by position and repeats renamed x.1, x.2 like pandas does"""
+    names = [str(value).strip() if value not in (None, "") else f"column_{i}" for i, value in enumerate(row)]
+    seen = set(names)
+    counts = {}
+    headers = []
+    for name in names:
+        if name in counts:
+            while True:
+                counts[name] += 1
+                renamed = f"{name}.{counts[name]}"
+                if renamed not in seen:
+                    break
+            seen.add(renamed)
+            headers.append(renamed)
+        else:
+            counts[name] = 0
+            headers.append(name)
+    return headers
+
+
+def _csv_chunks(fileobj: BinaryIO) -> Iterator[pd.DataFrame]:
+    return pd.read_csv(
+        fileobj, dtype=str, keep_default_na=False, na_values=[""], chunksize=CHUNK_ROWS,
+        encoding="utf-8-sig", encoding_errors="replace",
+    )
+
+
+def _xlsx_chunks(fileobj: BinaryIO) -> Iterator[pd.DataFrame]:
+    from openpyxl import load_workbook
+
+    workbook = load_workbook(fileobj, read_only=True, data_only=True)
+    try:
+        rows = workbook.active.iter_rows(values_only=True)
+        headers = _headers(next(rows, ()))
+        chunk = []
+        read = 0
+        for row in rows:
+            chunk.append([_cell(value) for value in row[:len(headers)]])
+            read += 1
+            if len(chunk) == CHUNK_ROWS:
+                yield pd.DataFrame(chunk, columns=headers[:max(map(len, chunk))])
+                chunk = []
+        if chunk:
+            yield pd.DataFrame(chunk, columns=headers[:max(map(len, chunk))])
+        elif not read:
+            # Header-only sheet (a channel template): the columns still need profiles
+            yield pd.DataFrame(columns=headers)
+    finally:
+        workbook.close()
+
+
+def _xls_chunks(fileobj: BinaryIO) -> Iterator[pd.DataFrame]:
+    # xlrd has no streaming mode; the sheet is loaded once and sampled like the rest
+    frame = pd.read_excel(fileobj, dtype=object)
+    if frame.empty:
+        yield frame
+    for start in range(0, len(frame), CHUNK_ROWS):
+        yield frame.iloc[start:start + CHUNK_ROWS]
+
+
+def reservoir(chunks: Iterable[pd.DataFrame], size: int, seconds: float,
+              seed: Optional[int] = None) -> Tuple[pd.DataFrame, int, bool]:
+    """
+    Uniform random sample of up to size rows from a stream of frames
+    (Algorithm R, a chunk at a time). Returns the sample, the rows read and
+    whether the stream was read to the end before the time ran out.
+    """
+    rng = np.random.default_rng(seed)
+    deadline = time.monotonic() + seconds
+    sample = None
+    seen = 0
+    for chunk in chunks:
+        if seen and time.monotonic() > deadline:
+            return sample, seen, False
+        chunk = chunk.reset_index(drop=True)
+        held = 0 if sample is None else len(sample)
+        fill = min(size - held, len(chunk))
+        if fill > 0:
+            head = chunk.iloc[:fill]
+            sample = head.copy() if sample is None else pd.concat([sample, head], ignore_index=True)
+        elif sample is None:
+            sample = chunk.iloc[:0].copy()
+        if fill < len(chunk):
+            # Row i of the stream replaces slot j ~ U[0, i] when j < size; later rows win a shared slot
+            positions = np.arange(seen + max(fill, 0), seen + len(chunk))
+            slots = rng.integers(0, positions + 1)
+            taken = slots < size
+            replace = pd.Series(positions[taken] - seen, index=slots[taken])
+            replace = replace[~replace.index.duplicated(keep="last")]
+            sample.iloc[replace.index.to_numpy()] = chunk.iloc[replace.to_numpy()].to_numpy()
+        seen += len(chunk)
+    return (sample if sample is not None else pd.DataFrame()), seen, True
+
+
+def sample_file(fileobj: BinaryIO, filename: str, rows: Optional[int] = None,
+                seconds: Optional[float] = None) -> Tuple[pd.DataFrame, int, bool]:
+    """Random sample of a CSV/XLSX/XLS file's rows: (sample, rows read, read to the end)"""
+    name = (filename or "").lower()
+    if name.endswith(".csv"):
+        chunks = _csv_chunks(fileobj)
+    elif name.endswith(".xlsx"):
+        chunks = _xlsx_chunks(fileobj)
+    elif name.endswith(".xls"):
+        chunks = _xls_chunks(fileobj)
+    else:
+        raise ValueError("Only CSV and Excel files are supported.")
+    return reservoir(
+        chunks, rows or SCHEMA_SAMPLE_ROWS, SCHEMA_SCAN_SECONDS if seconds is None else seconds
+    )
+
+
+def sample_frame(frame: pd.DataFrame, rows: Optional[int] = None) -> pd.DataFrame:
+    """Random sample of an already loaded frame"""
+    rows = rows or SCHEMA_SAMPLE_ROWS
+    return frame.sample(n=rows, random_state=0) if len(frame) > rows else frame
+
+
+# ---------------------------------------------------------------------------
+# Classification
+# ---------------------------------------------------------------------------
+
+def _rates(matches: pd.Series, counts: pd.Series) -> pd.Series:
+    """Share of each column's values matching"""
+    return matches.groupby(level=1, sort=False).sum().reindex(counts.index, fill_value=0) / counts
+
+
+def _date_rates(values: pd.Series, counts: pd.Series) -> Tuple[pd.DataFrame, Dict[str, pd.Series]]:
+    candidates = values[values.str.fullmatch(_DATE_LIKE)]
+    rates, parsed = {}, {}
+    for fmt in DATE_FORMATS:
+        if candidates.empty:
+            break
+        parsed[fmt] = pd.to_datetime(candidates, format=fmt, errors="coerce", utc=fmt == "ISO8601")
+        rates[fmt] = _rates(parsed[fmt].notna(), counts)
+    return pd.DataFrame(rates, index=counts.index), parsed
+
+
+def profile_frame(frame: pd.DataFrame) -> Dict[str, ColumnProfile]:
+    """Kind and confidence of every column of a (sampled) frame, by column name"""
+    text = pd.DataFrame({column: _text(frame[column]) for column in frame.columns}, index=frame.index)
+    columns = [str(column) for column in frame.columns]
+    text.columns = columns
+    values = text.stack().dropna()
+    if values.empty:
+        # Nothing but headers and empty cells: every column is text
+        return {
+            column: ColumnProfile(column, TEXT, 0.0, 0, int(text[column].isna().sum()), 0, [])
+            for column in columns
+        }
+    counts = values.groupby(level=1, sort=False).size().reindex(columns, fill_value=0)
+    present = counts[counts > 0]
+
+    lowered = values.str.lower()
+    rates = pd.DataFrame({
+        kind: _rates(values.str.fullmatch(pattern), present) for kind, pattern in PATTERNS.items()
+    }, index=present.index)
+    rates[BOOLEAN] = _rates(lowered.isin(BOOLEAN_VALUES), present)
+    has_words = _rates(lowered.isin(BOOLEAN_WORDS), present) > 0
+    date_rates, parsed = _date_rates(values, present)
+    rates[DATETIME] = date_rates.max(axis=1) if not date_rates.empty else 0.0
+    date_formats = date_rates.idxmax(axis=1) if not date_rates.empty else pd.Series(dtype=object)
+
+    numbers = pd.to_numeric(values.str.replace(r"[^\d.+-]", "", regex=True), errors="coerce")
+    max_abs = numbers.abs().groupby(level=1, sort=False).max()
+    lengths = values.str.len().groupby(level=1, sort=False).max()
+
+    profiles = {}
+    for column in columns:
+        column_values = text[column].dropna()
+        nulls = len(text) - len(column_values)
+        samples = column_values.head(3).tolist()
+        if column not in present.index:
+            profiles[column] = ColumnProfile(column, TEXT, 0.0, 0, nulls, 0, [])
+            continue
+
+        kind, confidence, fmt = TEXT, None, None
+        for candidate in KINDS:
+            rate = float(rates.at[column, candidate])
+            if rate < SCHEMA_MATCH_THRESHOLD:
+                continue
+            if candidate == BOOLEAN and not has_words[column]:
+                continue  # Only 0 and 1: a number
+            if candidate in NAME_HINTS and not any(hint in column.lower() for hint in NAME_HINTS[candidate]):
+                continue
+            kind, confidence = candidate, rate
+            break
+        if kind == DATETIME:
+            fmt = date_formats[column]
+            moments = parsed[fmt].xs(column, level=1).dropna()
+            if fmt == "ISO8601":
+                moments = moments.dt.tz_localize(None)
+            kind = DATETIME if (moments != moments.dt.normalize()).any() else DATE
+        if confidence is None:
+            confidence = 1.0 - float(rates.loc[column].max())
+
+        profiles[column] = ColumnProfile(
+            column, kind, round(confidence, 4), int(present[column]), nulls, int(lengths[column]),
+            samples, fmt, float(max_abs[column]) if pd.notna(max_abs.get(column)) else None
+        )
+    return profiles
+
+
+def infer_file(fileobj: BinaryIO, filename: str) -> Tuple[Dict[str, ColumnProfile], int, int, bool]:
+    """Profiles of a file's columns: (profiles, rows read, rows sampled, read to the end)"""
+    sample, scanned, complete = sample_file(fileobj, filename)
+    return profile_frame(sample), scanned, len(sample), complete
+
+
+# ---------------------------------------------------------------------------
+# Converting values for typed columns
+# ---------------------------------------------------------------------------
+
+def _family(column_type: str) -> str:
+    column_type = column_type.upper()
+    if "BOOL" in column_type or column_type.startswith("TINYINT(1)"):
+        return BOOLEAN
+    if "INT" in column_type:
+        return INTEGER
+    if any(name in column_type for name in ("DEC", "NUM", "FLOAT", "DOUBLE", "REAL")):
+        return DECIMAL
+    if "DATE" in column_type or "TIME" in column_type:
+        return DATETIME
+    return TEXT
+
+
+def convert(frame: pd.DataFrame, profiles: Dict[str, ColumnProfile],
+            column_types: Dict[str, str]) -> pd.DataFrame:
+    """
+    Copy of frame with each column parsed as its profile's kind, where the
+    table column (column_types, by name) has a matching type: currency and
+    grouped numbers become numbers, dates datetimes, yes/no booleans, and
+    phone numbers and pincodes keep their digits as text. Values that do not
+    parse become null.
+    """
+    converted = frame.copy()
+    for column, profile in profiles.items():
+        if column not in converted.columns or column not in column_types:
+            continue
+        family = _family(column_types[column])
+        series = converted[column]
+        if profile.kind in (INTEGER, DECIMAL, CURRENCY) and family in (INTEGER, DECIMAL):
+            if not pd.api.types.is_numeric_dtype(series.dtype):
+                text = _text(series).str.replace(r"[^\d.+-]", "", regex=True)
+                series = pd.to_numeric(text, errors="coerce")
+        elif profile.kind in (DATE, DATETIME) and family == DATETIME:
+            if not pd.api.types.is_datetime64_any_dtype(series.dtype):
+                series = pd.to_datetime(_text(series), format=profile.date_format, errors="coerce",
+                                        utc=profile.date_format == "ISO8601")
+            if series.dt.tz is not None:
+                series = series.dt.tz_localize(None)
+            # Plain date/datetime objects: database drivers do not all take pandas Timestamps
+            series = series.dt.date if profile.kind == DATE else series.dt.to_pydatetime()
+        elif profile.kind == BOOLEAN and family in (BOOLEAN, INTEGER):
+            text = _text(series).str.lower()
+            series = text.isin(BOOLEAN_TRUE).astype(object).where(text.isin(BOOLEAN_VALUES))
+        elif profile.kind in (PHONE, PINCODE) and family == TEXT:
+            series = _text(series)
+        else:
+            continue
+        converted[column] = series.astype(object).where(series.notna(), None)
+    return converted
@@ -323,6 +323,11 @@ class TransferApprovalRequest(BaseModel):
     """Schema for approval/rejection actions"""
     rejection_reason: Optional[str] = None
 
+class StockTransferBatchComplete(BaseModel):
+    """Schema for completing many approved transfers at once"""
+    transfer_ids: List[int]
+    all_or_nothing: Optional[bool] = False  # Roll back the whole batch if any transfer fails
+
 class StockTransferResponse(BaseModel):
     id: int
     transfer_number: str
@@ -634,6 +639,49 @@ class CustomerStatementResponse(BaseModel):
     total_credit: float
 
 
+# --- Receivables Matching Schemas ---
+class CustomerOpenItemResponse(BaseModel):
+    ledger_entry_id: int
+    side: str  # DEBIT (customer owes) or CREDIT (unapplied payment/credit)
+    transaction_type: Optional[str] = None
+    reference_number: Optional[str] = None
+    document_date: Optional[datetime] = None
+    due_date: Optional[datetime] = None
+    original_amount: float
+    open_amount: float
+    
+    class Config:
+        from_attributes = True
+
+class LedgerAllocationLine(BaseModel):
+    debit_entry_id: int
+    amount: float = Field(..., gt=0)
+
+class LedgerAllocationRequest(BaseModel):
+    """Schema for applying a payment/credit entry to invoices; FIFO when allocations is omitted"""
+    credit_entry_id: int
+    allocations: Optional[List[LedgerAllocationLine]] = None
+
+class LedgerAllocationResponse(BaseModel):
+    credit_entry_id: int
+    debit_entry_id: int
+    amount: float
+    method: str  # FIFO, EXPLICIT, SETTLEMENT
+
+class SettlementLine(BaseModel):
+    amount: float = Field(..., gt=0)
+    reference_number: Optional[str] = Field(None, description="Invoice/document number the amount pays")
+    customer_id: Optional[int] = Field(None, description="Taken from the referenced open item when omitted")
+    transaction_date: Optional[datetime] = None
+    settlement_reference: Optional[str] = Field(None, description="Bank UTR or marketplace settlement id")
+    description: Optional[str] = None
+
+class SettlementReconcileRequest(BaseModel):
+    """Schema for posting and matching imported bank/marketplace settlement lines"""
+    lines: List[SettlementLine] = Field(..., min_length=1)
+    apply_remainder: bool = Field(True, description="Apply what a line leaves on its document to the oldest open items")
+
+
 # --- Quotation Schemas ---
 class QuotationItemBase(BaseModel):
     product_id: Optional[int] = None
@@ -906,6 +954,21 @@ class InvoicePaymentUpdate(BaseModel):
     notes: Optional[str] = None
 
 
+class InvoiceBatchFromSalesOrders(BaseModel):
+    """Schema for invoicing many sales orders at once (ids and/or filters)"""
+    sales_order_ids: Optional[List[int]] = None
+    status: Optional[str] = None  # Sales order status filter, e.g. DELIVERED
+    order_date_from: Optional[datetime] = None
+    order_date_to: Optional[datetime] = None
+    invoice_date: Optional[datetime] = None  # Defaults to now
+    limit: int = Field(1000, gt=0, le=10000)
+
+
+class DocumentExportRequest(BaseModel):
+    """Schema for exporting many invoices, quotations or sales orders as a ZIP"""
+    ids: List[int] = Field(..., min_length=1)
+
+
 class InvoiceResponse(InvoiceBase):
     id: int
     company_id: int
@@ -0,0 +1,222 @@
+"""
+Search Index
+Word-prefix search for customers, invoices, quotations and sales orders.
+
+Every searchable field is split into lower-case words stored in search_terms
+with a weight, and kept up to date from the flush that changes the document.
+A search matches documents having, for every word of the query, a term that
+starts with it; documents are ranked by the summed weight of their best term
+per query word. Prefix lookups are range scans on (company_id, doc_type, term),
+so they use the index on both SQLite and MySQL.
+
+Until the index has been built (rebuild(), see backend/rebuild_search_index.py)
+the list endpoints keep using their LIKE search.
+"""
+
+import re
+from collections import defaultdict
+from typing import Dict, Iterable, List
+
+from sqlalchemy import and_, case, delete, event, false, func, insert, inspect, literal, or_, select
+from sqlalchemy.orm import Session
+
+from ..common import models
+
+SEARCH_INDEX = "search_index"  # rollup_state marker once rebuilt
+MAX_QUERY_TERMS = 8
+BATCH_SIZE = 1000
+
+_TERM_LENGTH = models.SearchTerm.term.type.length
+
+
+class IndexSpec:
+    def __init__(self, model, fields, customer_fields=()):
+        # fields: (attribute name, weight, compact); compact also indexes the
+        # value with separators removed, so "98765 43210" matches "9876543210"
+        self.model = model
+        self.fields = fields
+        self.customer_fields = customer_fields
+
+
+_CUSTOMER_FIELDS = (("name", 3, False), ("email", 2, False))
+
+SPECS = {
+    "customer": IndexSpec(models.Customer, (
+        ("customer_code", 4, True), ("name", 3, False), ("email", 2, False), ("phone", 2, True),
+    )),
+    "invoice": IndexSpec(models.Invoice, (("invoice_number", 4, True),), _CUSTOMER_FIELDS),
+    "quotation": IndexSpec(models.Quotation, (("quotation_number", 4, True),), _CUSTOMER_FIELDS),
+    "sales_order": IndexSpec(models.SalesOrder, (("order_number", 4, True),), _CUSTOMER_FIELDS),
+}
+_DOC_TYPES = {spec.model: doc_type for doc_type, spec in SPECS.items()}
+_CUSTOMER_DOCUMENTS = [doc_type for doc_type, spec in SPECS.items() if spec.customer_fields]
+
+_ready = False
+
+
+def is_ready(db: Session) -> bool:
+    global _ready
+    if not _ready:
+        _ready = db.query(models.RollupState.name).filter(models.RollupState.name == SEARCH_INDEX).first() is not None
+    return _ready
+
+
+def tokenize(text) -> List[str]:
+    return re.findall(r"[0-9a-z]+", str(text).lower()) if text else []
+
+
+def _terms(values) -> Dict[str, int]:
+    """term -> weight for (value, weight, compact) triples"""
+    terms = {}
+    for value, weight, compact in values:
+        words = tokenize(value)
+        if compact and len(words) > 1:
+            words.append("".join(words))
+        for word in words:
+            word = word[:_TERM_LENGTH]
+            terms[word] = max(weight, terms.get(word, 0))
+    return terms
+
+
+# ---------------------------------------------------------------------------
+# Index maintenance
+# ---------------------------------------------------------------------------
+
+def _term_rows(conn, doc_type: str, ids: Iterable[int]) -> List[dict]:
+    spec = SPECS[doc_type]
+    model = spec.model
+    columns = [model.id, model.company_id] + [getattr(model, name) for name, _, _ in spec.fields]
+    columns += [getattr(models.Customer, name) for name, _, _ in spec.customer_fields]
+    stmt = select(*columns)
+    if spec.customer_fields:
+        stmt = stmt.outerjoin(models.Customer, models.Customer.id == model.customer_id)
+
+    rows = []
+    weights = [(weight, compact) for _, weight, compact in spec.fields + spec.customer_fields]
+    for row in conn.execute(stmt.where(model.id.in_(list(ids)))):
+        doc_id, company_id, values = row[0], row[1], row[2:]
+        terms = _terms((value, weight, compact) for value, (weight, compact) in zip(values, weights))
+        rows.extend(
+            {"company_id": company_id or 0, "doc_type": doc_type, "doc_id": doc_id, "term": term, "weight": weight}
+            for term, weight in terms.items()
+        )
+    return rows
+
+
+def reindex(conn, doc_type: str, ids: Iterable[int]):
+    """Replace the terms of the given documents with their current values"""
+    ids = list(ids)
+    for start in range(0, len(ids), BATCH_SIZE):
+        chunk = ids[start:start + BATCH_SIZE]
+        conn.execute(delete(models.SearchTerm).where(
+            models.SearchTerm.doc_type == doc_type, models.SearchTerm.doc_id.in_(chunk)
+        ))
+        rows = _term_rows(conn, doc_type, chunk)
+        if rows:
+            conn.execute(insert(models.SearchTerm), rows)
+
+
+def _indexed_fields_changed(obj, spec: IndexSpec) -> bool:
+    state = inspect(obj)
+    names = [name for name, _, _ in spec.fields] + (["customer_id"] if spec.customer_fields else [])
+    return any(state.attrs[name].history.has_changes() for name in names)
+
+
+@event.listens_for(Session, "after_flush")
+def _collect_changed_documents(session, flush_context):
+    changed = session.info.setdefault("search_reindex", defaultdict(set))
+    removed = session.info.setdefault("search_remove", defaultdict(set))
+
+    for obj in session.new:
+        doc_type = _DOC_TYPES.get(type(obj))
+        if doc_type:
+            changed[doc_type].add(obj.id)
+    for obj in session.dirty:
+        doc_type = _DOC_TYPES.get(type(obj))
+        if doc_type and _indexed_fields_changed(obj, SPECS[doc_type]):
+            changed[doc_type].add(obj.id)
+    for obj in session.deleted:
+        doc_type = _DOC_TYPES.get(type(obj))
+        if doc_type:
+            removed[doc_type].add(obj.id)
+
+
+@event.listens_for(Session, "after_flush_postexec")
+def _update_index(session, flush_context):
+    changed = session.info.pop("search_reindex", None) or {}
+    removed = session.info.pop("search_remove", None) or {}
+    if not changed and not removed:
+        return
+
+    conn = session.connection()
+    for doc_type, ids in removed.items():
+        conn.execute(delete(models.SearchTerm).where(
+            models.SearchTerm.doc_type == doc_type, models.SearchTerm.doc_id.in_(list(ids))
+        ))
+
+    # Documents carry their customer's name and email
+    customer_ids = changed.get("customer")
+    if customer_ids:
+        for doc_type in _CUSTOMER_DOCUMENTS:
+            model = SPECS[doc_type].model
+            changed.setdefault(doc_type, set()).update(
+                doc_id for (doc_id,) in conn.execute(select(model.id).where(model.customer_id.in_(list(customer_ids))))
+            )
+
+    for doc_type, ids in changed.items():
+        if ids:
+            reindex(conn, doc_type, ids)
+
+
+def rebuild(db: Session) -> Dict[str, int]:
+    """Re-index every document and mark the index ready; caller commits"""
+    conn = db.connection()
+    conn.execute(delete(models.SearchTerm))
+    counts = {}
+    for doc_type, spec in SPECS.items():
+        ids = [doc_id for (doc_id,) in conn.execute(select(spec.model.id).order_by(spec.model.id))]
+        reindex(conn, doc_type, ids)
+        counts[doc_type] = len(ids)
+
+    if not db.query(models.RollupState).filter(models.RollupState.name == SEARCH_INDEX).first():
+        db.add(models.RollupState(name=SEARCH_INDEX))
+    return counts
+
+
+# ---------------------------------------------------------------------------
+# Querying
+# ---------------------------------------------------------------------------
+
+def _prefix(term: str):
+    """term LIKE 'word%' as a range, so it can use the index regardless of collation"""
+    column = models.SearchTerm.term
+    return and_(column >= term, column < term[:-1] + chr(ord(term[-1]) + 1))
+
+
+def match(doc_type: str, company_id: int, text: str):
+    """
+    Subquery of (doc_id, rank) for documents matching every word of text.
+    Join it to the document table and order by rank.
+    """
+    words = list(dict.fromkeys(word[:_TERM_LENGTH] for word in tokenize(text)))[:MAX_QUERY_TERMS]
+    if not words:
+        return select(
+            models.SearchTerm.doc_id.label("doc_id"), literal(0).label("rank")
+        ).where(false()).subquery()
+
+    scores = [func.max(case((_prefix(word), models.SearchTerm.weight), else_=0)) for word in words]
+    rank = scores[0]
+    for score in scores[1:]:
+        rank = rank + score
+
+    return select(
+        models.SearchTerm.doc_id.label("doc_id"), rank.label("rank")
+    ).where(
+        models.SearchTerm.company_id == company_id,
+        models.SearchTerm.doc_type == doc_type,
+        or_(*[_prefix(word) for word in words])
+    ).group_by(
+        models.SearchTerm.doc_id
+    ).having(
+        and_(*[score > 0 for score in scores])
+    ).subquery()
@@ -0,0 +1,253 @@
+"""
+Document Number Sequences
+Allocates invoice, quotation, sales order, courier manifest and customer
+numbers from the document_sequences counter table instead of reading the
+latest document
+"""
+
+import os
+import re
+import threading
+from datetime import date
+from typing import Dict, List, Optional, Tuple
+
+from sqlalchemy import event, update
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import Session
+
+from ..common import models
+
+# Numbers handed to each worker per counter round trip. 1 keeps numbering
+# strictly consecutive; larger blocks save a round trip per document at the
+# cost of gaps (recorded in document_sequence_gaps) when a worker stops.
+SEQUENCE_BLOCK_SIZE = int(os.getenv("SEQUENCE_BLOCK_SIZE", "1"))
+
+
+class SequenceSpec:
+    def __init__(self, model, column: str, default_format: str, company_scoped: bool = True):
+        self.model = model
+        self.column = column
+        self.default_format = default_format
+        self.company_scoped = company_scoped
+
+
+# Formats can be overridden with <DOC_TYPE>_NUMBER_FORMAT, e.g.
+# INVOICE_NUMBER_FORMAT="INV/{fy}/{number:04d}". A format containing {fy}
+# restarts numbering every financial year.
+SEQUENCES = {
+    "invoice": SequenceSpec(models.Invoice, "invoice_number", "INV-{number:04d}"),
+    "quotation": SequenceSpec(models.Quotation, "quotation_number", "QTN-{number:04d}"),
+    "sales_order": SequenceSpec(models.SalesOrder, "order_number", "SO-{number:04d}"),
+    "manifest": SequenceSpec(models.CourierManifest, "manifest_number", "MAN-{number:05d}"),
+    # Customer codes have always been numbered across companies
+    "customer": SequenceSpec(models.Customer, "customer_code", "CUST-{number:04d}", company_scoped=False),
+}
+
+SequenceKey = Tuple[int, str, str]  # (company_id, doc_type, period)
+
+_blocks: Dict[SequenceKey, List[int]] = {}  # key -> [next number, end of block (exclusive)]
+_blocks_lock = threading.Lock()
+
+
+def number_format(doc_type: str) -> str:
+    return os.getenv(f"{doc_type.upper()}_NUMBER_FORMAT", SEQUENCES[doc_type].default_format)
+
+
+def financial_year(on: date) -> str:
+    """Indian financial year (April - March) label, e.g. 2025-26"""
+    start = on.year if on.month >= 4 else on.year - 1
+    return f"{start}-{(start + 1) % 100:02d}"
+
+
+def _sequence_key(doc_type: str, company_id: int, on: Optional[date]) -> SequenceKey:
+    spec = SEQUENCES[doc_type]
+    period = financial_year(on or date.today()) if "{fy}" in number_format(doc_type) else ""
+    return (company_id if spec.company_scoped else 0, doc_type, period)
+
+
+def format_number(doc_type: str, number: int, period: str = "") -> str:
+    return number_format(doc_type).format(number=number, fy=period)
+
+
+def _seed_value(db: Session, key: SequenceKey) -> int:
+    """First number for a new counter: one past the latest existing document"""
+    company_id, doc_type, period = key
+    spec = SEQUENCES[doc_type]
+    column = getattr(spec.model, spec.column)
+    prefix = number_format(doc_type).split("{number")[0].format(fy=period)
+
+    query = db.query(column).filter(column.like(f"{prefix}%"))
+    if spec.company_scoped:
+        query = query.filter(spec.model.company_id == company_id)
+    latest = query.order_by(spec.model.id.desc()).first()
+
+    if latest and latest[0]:
+        match = re.search(r"(\d+)$", latest[0])
+        if match:
+            return int(match.group(1)) + 1
+    return 1
+
+
+def _take(session: Session, key: SequenceKey, count: int) -> int:
+    """Advance the counter by `count` inside session's transaction; returns the first number taken"""
+    company_id, doc_type, period = key
+    counter = models.DocumentSequence
+    key_filter = (
+        counter.company_id == company_id,
+        counter.doc_type == doc_type,
+        counter.period == period,
+    )
+
+    for _ in range(2):
+        updated = session.execute(
+            update(counter).where(*key_filter).values(next_value=counter.next_value + count)
+        ).rowcount
+        if updated:
+            return session.query(counter.next_value).filter(*key_filter).scalar() - count
+
+        try:
+            with session.begin_nested():
+                session.add(counter(
+                    company_id=company_id, doc_type=doc_type, period=period,
+                    next_value=_seed_value(session, key)
+                ))
+        except IntegrityError:
+            pass  # Another worker created the counter first
+    raise RuntimeError(f"Could not allocate a {doc_type} number")
+
+
+def _separate_transactions(db: Session) -> bool:
+    # SQLite has a single writer, so a second connection would wait on the
+    # request's own write lock; there the counter moves with the request instead
+    return db.get_bind().dialect.name != "sqlite"
+
+
+def next_number(db: Session, doc_type: str, company_id: int, on: Optional[date] = None) -> str:
+    """
+    Allocate the next document number.
+
+    The counter is advanced in its own short transaction, so its row is not
+    locked for the rest of the request. If db's transaction then does not
+    commit, the number is recorded in the gap register instead of being reused.
+    """
+    key = _sequence_key(doc_type, company_id, on)
+
+    if not _separate_transactions(db):
+        return format_number(doc_type, _take(db, key, 1), key[2])
+
+    # Make sure db has a transaction whose end we will see
+    db.connection()
+
+    if SEQUENCE_BLOCK_SIZE > 1:
+        with _blocks_lock:
+            block = _blocks.get(key)
+            if not block or block[0] >= block[1]:
+                with Session(bind=db.get_bind()) as session:
+                    first = _take(session, key, SEQUENCE_BLOCK_SIZE)
+                    session.commit()
+                block = _blocks[key] = [first, first + SEQUENCE_BLOCK_SIZE]
+            number = block[0]
+            block[0] += 1
+    else:
+        with Session(bind=db.get_bind()) as session:
+            number = _take(session, key, 1)
+            session.commit()
+
+    db.info.setdefault("allocated_numbers", []).append((key, number))
+    return format_number(doc_type, number, key[2])
+
+
+def next_numbers(db: Session, doc_type: str, company_id: int, count: int, on: Optional[date] = None) -> List[str]:
+    """Allocate `count` consecutive document numbers with a single counter update"""
+    if count <= 0:
+        return []
+    key = _sequence_key(doc_type, company_id, on)
+
+    if not _separate_transactions(db):
+        first = _take(db, key, count)
+    else:
+        db.connection()
+        with Session(bind=db.get_bind()) as session:
+            first = _take(session, key, count)
+            session.commit()
+        db.info.setdefault("allocated_numbers", []).extend((key, n) for n in range(first, first + count))
+
+    return [format_number(doc_type, n, key[2]) for n in range(first, first + count)]
+
+
+def _record_gaps(bind, gaps: List[Tuple[SequenceKey, int]], reason: str):
+    with Session(bind=bind) as session:
+        for (company_id, doc_type, period), number in gaps:
+            session.add(models.DocumentSequenceGap(
+                company_id=company_id,
+                doc_type=doc_type,
+                period=period,
+                number=number,
+                document_number=format_number(doc_type, number, period),
+                reason=reason
+            ))
+        session.commit()
+
+
+@event.listens_for(Session, "after_commit")
+def _numbers_used(session):
+    session.info.pop("allocated_numbers", None)
+
+
+@event.listens_for(Session, "after_transaction_end")
+def _numbers_abandoned(session, transaction):
+    if transaction.parent is not None:
+        return
+    abandoned = session.info.pop("allocated_numbers", None)
+    if abandoned:
+        _record_gaps(session.get_bind(), abandoned, "rolled_back")
+
+
+def release_blocks(bind):
+    """Hand back this worker's unused pre-allocated numbers (call on shutdown)"""
+    counter = models.DocumentSequence
+    with _blocks_lock:
+        blocks = [(key, block) for key, block in _blocks.items() if block[0] < block[1]]
+        _blocks.clear()
+
+    gaps = []
+    with Session(bind=bind) as session:
+        for (company_id, doc_type, period), (first_unused, end) in blocks:
+            # If nobody has reserved past this block, rewind the counter instead of leaving a gap
+            rewound = session.execute(
+                update(counter).where(
+                    counter.company_id == company_id,
+                    counter.doc_type == doc_type,
+                    counter.period == period,
+                    counter.next_value == end
+                ).values(next_value=first_unused)
+            ).rowcount
+            if not rewound:
+                gaps.extend(((company_id, doc_type, period), n) for n in range(first_unused, end))
+        session.commit()
+
+    if gaps:
+        _record_gaps(bind, gaps, "unused_block")
+
+
+def list_gaps(db: Session, doc_type: str, company_id: int, period: Optional[str] = None) -> List[dict]:
+    """Skipped numbers for a document type, oldest first"""
+    spec = SEQUENCES[doc_type]
+    query = db.query(models.DocumentSequenceGap).filter(
+        models.DocumentSequenceGap.company_id == (company_id if spec.company_scoped else 0),
+        models.DocumentSequenceGap.doc_type == doc_type
+    )
+    if period is not None:
+        query = query.filter(models.DocumentSequenceGap.period == period)
+
+    return [
+        {
+            "number": gap.document_number,
+            "period": gap.period or None,
+            "reason": gap.reason,
+            "recorded_at": gap.created_at.isoformat() if gap.created_at else None
+        }
+        for gap in query.order_by(
+            models.DocumentSequenceGap.period, models.DocumentSequenceGap.number
+        ).all()
+    ]
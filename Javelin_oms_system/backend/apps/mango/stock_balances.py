@@ -0,0 +1,251 @@
+"""
+Stock Balance Service
+Keeps StockBalance rows in step with StockLedger writes and completes
+approved stock transfers in bulk
+"""
+
+from datetime import datetime
+from collections import defaultdict
+from typing import Dict, Iterable, List, Optional, Tuple
+
+from sqlalchemy import func
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import Session
+
+from ..common import models, cache
+
+BalanceKey = Tuple[int, int]  # (product_id, warehouse_id)
+
+
+def lock_balances(db: Session, keys: Iterable[BalanceKey]) -> Dict[BalanceKey, models.StockBalance]:
+    """
+    Load and row-lock the balances for the given (product_id, warehouse_id) keys.
+
+    Rows are locked in id order so concurrent callers cannot deadlock. Keys
+    without a balance row yet are seeded from the ledger history; if another
+    transaction seeds the same key first, its row is locked and used instead.
+    """
+    keys = set(keys)
+    if not keys:
+        return {}
+
+    product_ids = {product_id for product_id, _ in keys}
+    warehouse_ids = {warehouse_id for _, warehouse_id in keys}
+
+    rows = db.query(models.StockBalance).filter(
+        models.StockBalance.product_id.in_(product_ids),
+        models.StockBalance.warehouse_id.in_(warehouse_ids)
+    ).order_by(models.StockBalance.id).with_for_update().all()
+
+    balances = {
+        (row.product_id, row.warehouse_id): row
+        for row in rows
+        if (row.product_id, row.warehouse_id) in keys
+    }
+
+    missing = keys - balances.keys()
+    if missing:
+        ledger_totals = db.query(
+            models.StockLedger.product_id,
+            models.StockLedger.warehouse_id,
+            func.sum(models.StockLedger.quantity)
+        ).filter(
+            models.StockLedger.product_id.in_({p for p, _ in missing}),
+            models.StockLedger.warehouse_id.in_({w for _, w in missing})
+        ).group_by(
+            models.StockLedger.product_id,
+            models.StockLedger.warehouse_id
+        ).all()
+        seeded = {(p, w): int(total or 0) for p, w, total in ledger_totals}
+
+        for product_id, warehouse_id in sorted(missing):
+            try:
+                with db.begin_nested():
+                    balance = models.StockBalance(
+                        product_id=product_id,
+                        warehouse_id=warehouse_id,
+                        quantity=seeded.get((product_id, warehouse_id), 0)
+                    )
+                    db.add(balance)
+            except IntegrityError:
+                # Another writer seeded it first
+                balance = db.query(models.StockBalance).filter(
+                    models.StockBalance.product_id == product_id,
+                    models.StockBalance.warehouse_id == warehouse_id
+                ).with_for_update().one()
+            balances[(product_id, warehouse_id)] = balance
+
+    return balances
+
+
+def post_movements(
+    db: Session,
+    movements: List[dict],
+    balances: Optional[Dict[BalanceKey, models.StockBalance]] = None
+) -> List[dict]:
+    """
+    Apply ledger movements to the maintained balances and bulk-insert the
+    StockLedger rows with their real balance_after.
+
+    Each movement is a dict of StockLedger column values (product_id,
+    warehouse_id, quantity, transaction_type, reference_model, reference_id).
+    Does not commit.
+    """
+    if not movements:
+        return []
+
+    if balances is None:
+        balances = lock_balances(db, ((m["product_id"], m["warehouse_id"]) for m in movements))
+
+    rows = []
+    for movement in movements:
+        balance = balances[(movement["product_id"], movement["warehouse_id"])]
+        balance.quantity = (balance.quantity or 0) + movement["quantity"]
+        rows.append({**movement, "balance_after": balance.quantity})
+
+    db.bulk_insert_mappings(models.StockLedger, rows)
+    cache.touch(db, cache.INVENTORY)
+    return rows
+
+
+def complete_transfers(
+    db: Session,
+    transfer_ids: List[int],
+    company_id: int,
+    all_or_nothing: bool = False
+) -> List[dict]:
+    """
+    Complete approved stock transfers in one pass.
+
+    Transfers are locked, their lines read in a single query, the affected
+    source and destination balances locked, and the paired OUT/IN ledger rows
+    bulk-inserted. A transfer that would drive any source balance negative is
+    skipped and reported; with all_or_nothing the batch runs in a savepoint
+    and any failure rolls back just that savepoint, leaving whatever else the
+    caller has in the session. Returns one outcome dict per requested id, in
+    order. Does not commit.
+    """
+    transfer_ids = list(dict.fromkeys(transfer_ids))
+    savepoint = db.begin_nested() if all_or_nothing else None
+
+    transfers = db.query(models.StockTransfer).join(
+        models.Warehouse,
+        models.StockTransfer.source_warehouse_id == models.Warehouse.id
+    ).filter(
+        models.StockTransfer.id.in_(transfer_ids),
+        models.Warehouse.company_id == company_id
+    ).order_by(models.StockTransfer.id).with_for_update().all()
+    transfers_by_id = {t.id: t for t in transfers}
+
+    outcomes = {}
+    eligible = []
+    for transfer_id in transfer_ids:
+        transfer = transfers_by_id.get(transfer_id)
+        if not transfer:
+            outcomes[transfer_id] = {"status": "error", "detail": "Stock transfer not found"}
+        elif transfer.status == "COMPLETED":
+            outcomes[transfer_id] = {"status": "error", "detail": "Transfer is already completed"}
+        elif transfer.status == "CANCELLED":
+            outcomes[transfer_id] = {"status": "error", "detail": "Cannot complete a cancelled transfer"}
+        elif transfer.approval_status != "approved":
+            outcomes[transfer_id] = {"status": "error", "detail": "Transfer must be approved before it can be completed"}
+        else:
+            eligible.append(transfer)
+
+    # Read all lines of the eligible transfers at once instead of lazy-loading transfer.items
+    lines_by_transfer = defaultdict(list)
+    if eligible:
+        lines = db.query(
+            models.StockTransferItem.transfer_id,
+            models.StockTransferItem.product_id,
+            models.StockTransferItem.quantity_sent
+        ).filter(
+            models.StockTransferItem.transfer_id.in_([t.id for t in eligible])
+        ).order_by(models.StockTransferItem.id).all()
+        for transfer_id, product_id, quantity_sent in lines:
+            lines_by_transfer[transfer_id].append((product_id, quantity_sent or 0))
+
+    keys = set()
+    for transfer in eligible:
+        for product_id, _ in lines_by_transfer[transfer.id]:
+            keys.add((product_id, transfer.source_warehouse_id))
+            keys.add((product_id, transfer.destination_warehouse_id))
+    balances = lock_balances(db, keys)
+
+    # Projected balances let later transfers in the batch see earlier ones
+    projected = {key: balance.quantity or 0 for key, balance in balances.items()}
+    movements = []
+    completed_ids = []
+    now = datetime.now()
+
+    for transfer in eligible:
+        lines = lines_by_transfer[transfer.id]
+
+        required = defaultdict(int)
+        for product_id, quantity in lines:
+            required[(product_id, transfer.source_warehouse_id)] += quantity
+
+        shortages = [
+            {"product_id": key[0], "available": projected[key], "required": quantity}
+            for key, quantity in required.items()
+            if projected[key] < quantity
+        ]
+        if shortages:
+            outcomes[transfer.id] = {
+                "status": "error",
+                "detail": "Insufficient stock in source warehouse",
+                "shortages": shortages
+            }
+            continue
+
+        for product_id, quantity in lines:
+            projected[(product_id, transfer.source_warehouse_id)] -= quantity
+            projected[(product_id, transfer.destination_warehouse_id)] += quantity
+            movements.append({
+                "product_id": product_id,
+                "warehouse_id": transfer.source_warehouse_id,
+                "transaction_type": "OUT_TRANSFER",
+                "quantity": -quantity,  # Negative for outbound
+                "reference_model": "STOCK_TRANSFER",
+                "reference_id": transfer.transfer_number
+            })
+            movements.append({
+                "product_id": product_id,
+                "warehouse_id": transfer.destination_warehouse_id,
+                "transaction_type": "IN_TRANSFER",
+                "quantity": quantity,  # Positive for inbound (full receipt)
+                "reference_model": "STOCK_TRANSFER",
+                "reference_id": transfer.transfer_number
+            })
+
+        transfer.status = "COMPLETED"
+        transfer.completed_date = now
+        completed_ids.append(transfer.id)
+        outcomes[transfer.id] = {
+            "status": "completed",
+            "transfer_number": transfer.transfer_number,
+            "lines": len(lines)
+        }
+
+    failed = len(transfer_ids) - len(completed_ids)
+    if all_or_nothing and failed:
+        for transfer in eligible:
+            if transfer.id in completed_ids:
+                outcomes[transfer.id] = {"status": "skipped", "detail": "Batch aborted: another transfer failed"}
+        savepoint.rollback()
+        return [{"transfer_id": tid, **outcomes[tid]} for tid in transfer_ids]
+
+    if completed_ids:
+        post_movements(db, movements, balances)
+
+        # Full receipt: quantity_received = quantity_sent for every completed line
+        db.query(models.StockTransferItem).filter(
+            models.StockTransferItem.transfer_id.in_(completed_ids)
+        ).update(
+            {models.StockTransferItem.quantity_received: models.StockTransferItem.quantity_sent},
+            synchronize_session=False
+        )
+
+    if savepoint is not None:
+        savepoint.commit()
+    return [{"transfer_id": tid, **outcomes[tid]} for tid in transfer_ids]
@@ -1,4 +1,5 @@
 from fastapi import APIRouter, Depends, HTTPException, status
+from fastapi.concurrency import run_in_threadpool
 from fastapi.security import OAuth2PasswordBearer, OAuth2PasswordRequestForm
 from sqlalchemy.orm import Session
 from backend.apps.common import SessionLocal, models, security
@@ -56,14 +57,15 @@ class Token(BaseModel):
     access_token: str
     token_type: str
 
-@router.post("/register", response_model=UserResponse)
-def register(user_data: UserCreate, db: Session = Depends(get_db)):
-    """Register a new user"""
-    db_user = db.query(models.User).filter(models.User.email == user_data.email).first()
-    if db_user:
-        raise HTTPException(status_code=400, detail="Email already registered")
-    
-    hashed_password = security.get_password_hash(user_data.password)
+# register and login are async so bcrypt can wait on the hashing executor without
+# holding a request thread; their database work still goes through the threadpool
+# so it never blocks the event loop.
+
+def _user_by_email(db: Session, email: str) -> Optional[models.User]:
+    return db.query(models.User).filter(models.User.email == email).first()
+
+
+def _create_user(db: Session, user_data: UserCreate, hashed_password: str) -> UserResponse:
     db_user = models.User(
         email=user_data.email,
         hashed_password=hashed_password,
@@ -72,20 +74,39 @@ def register(user_data: UserCreate, db: Session = Depends(get_db)):
     db.add(db_user)
     db.commit()
     db.refresh(db_user)
-    return db_user
+    return UserResponse.model_validate(db_user)
+
+
+@router.post("/register", response_model=UserResponse)
+async def register(user_data: UserCreate, db: Session = Depends(get_db)):
+    """Register a new user"""
+    db_user = await run_in_threadpool(_user_by_email, db, user_data.email)
+    if db_user:
+        raise HTTPException(status_code=400, detail="Email already registered")
+    
+    hashed_password = await security.get_password_hash_async(user_data.password)
+    return await run_in_threadpool(_create_user, db, user_data, hashed_password)
 
 @router.post("/login", response_model=Token)
-def login(form_data: OAuth2PasswordRequestForm = Depends(), db: Session = Depends(get_db)):
+async def login(form_data: OAuth2PasswordRequestForm = Depends(), db: Session = Depends(get_db)):
     """Login and get access token"""
-    user = db.query(models.User).filter(models.User.email == form_data.username).first()
-    if not user or not security.verify_password(form_data.password, user.hashed_password):
+    # bcrypt runs on the dedicated hashing executor, not the shared request threadpool
+    user = await run_in_threadpool(_user_by_email, db, form_data.username)
+    if not user or not await security.verify_password_async(form_data.password, user.hashed_password):
         raise HTTPException(
             status_code=status.HTTP_401_UNAUTHORIZED,
             detail="Incorrect email or password",
             headers={"WWW-Authenticate": "Bearer"},
         )
     
-    access_token = security.create_access_token(data={"sub": user.email})
+    email = user.email  # Read before the commit below expires it
+    
+    # Move the stored hash to the configured cost while we have the plain password
+    if security.password_needs_rehash(user.hashed_password):
+        user.hashed_password = await security.get_password_hash_async(form_data.password)
+        await run_in_threadpool(db.commit)
+    
+    access_token = security.create_access_token(data={"sub": email})
     return {"access_token": access_token, "token_type": "bearer"}
 
 
@@ -1,12 +1,39 @@
 from fastapi import APIRouter, Depends, Query
-from sqlalchemy.orm import Session
-from sqlalchemy import func
+from sqlalchemy.orm import Session, joinedload
+from sqlalchemy import func, case
 from typing import Optional
 from datetime import datetime, timedelta, date
-from backend.apps.common import get_db, models
+from backend.apps.common import get_db, models, rollups, cache
 
 router = APIRouter(prefix="/dashboard", tags=["Dashboard"])
 
+# Order status buckets used by the summary
+PENDING_STATUSES = ["Pending", "Confirmed", "Processing"]
+SHIPPED_STATUSES = ["Shipped", "Dispatched", "Out for Delivery"]
+DELIVERED_STATUSES = ["Delivered", "Completed"]
+CANCELLED_STATUSES = ["Cancelled", "Returned"]
+
+
+def _grouped_order_stats(db: Session, platform_col, status_col, count_expr, revenue_col, filters):
+    """Order count, revenue and status buckets per platform, from orders or their daily rollup"""
+    def status_count(statuses):
+        return func.sum(case((status_col.in_(statuses), count_expr), else_=0))
+    
+    count = func.count() if isinstance(count_expr, int) else func.sum(count_expr)
+    return db.query(
+        platform_col.label('platform_id'),
+        count.label('order_count'),
+        func.sum(revenue_col).label('revenue'),
+        status_count(PENDING_STATUSES).label('pending'),
+        status_count(SHIPPED_STATUSES).label('shipped'),
+        status_count(DELIVERED_STATUSES).label('delivered'),
+        status_count(CANCELLED_STATUSES).label('cancelled'),
+    ).filter(
+        *filters
+    ).group_by(
+        platform_col
+    ).all()
+
 
 @router.get("/summary", response_model=dict)
 def get_summary(
@@ -16,105 +43,105 @@ def get_summary(
     db: Session = Depends(get_db)
 ):
     """Get aggregated dashboard summary across all platforms or filtered by platform and date range"""
-    # Base query
-    order_query = db.query(models.Order)
-    if platform_id:
-        order_query = order_query.filter(models.Order.platform_id == platform_id)
-    
+    return cache.response_cache.get_or_compute(
+        ("dashboard.summary", platform_id, start_date, end_date),
+        [cache.ORDERS, cache.INVENTORY],
+        lambda: _build_summary(db, platform_id, start_date, end_date)
+    )
+
+
+def _build_summary(db: Session, platform_id: Optional[int], start_date: Optional[str], end_date: Optional[str]) -> dict:
+    """Compute the dashboard summary (uncached)"""
     # Date filtering
+    start_dt = end_dt = None
     if start_date:
         try:
             start_dt = datetime.strptime(start_date, "%Y-%m-%d").date()
-            order_query = order_query.filter(models.Order.purchase_date >= start_dt)
         except ValueError:
             pass  # Invalid date format, ignore
     
     if end_date:
         try:
-            end_dt = datetime.strptime(end_date, "%Y-%m-%d").date()
             # Add one day to include the entire end date
-            end_dt = end_dt + timedelta(days=1)
-            order_query = order_query.filter(models.Order.purchase_date < end_dt)
+            end_dt = datetime.strptime(end_date, "%Y-%m-%d").date() + timedelta(days=1)
         except ValueError:
             pass  # Invalid date format, ignore
     
-    # Total orders (with date filter applied)
-    total_orders = order_query.count()
+    order_filters = []
+    if platform_id:
+        order_filters.append(models.Order.platform_id == platform_id)
+    if start_dt:
+        order_filters.append(models.Order.purchase_date >= start_dt)
+    if end_dt:
+        order_filters.append(models.Order.purchase_date < end_dt)
+    
+    # Totals, status buckets and platform breakdown in a single grouped pass,
+    # over the daily rollup when it is available (dashboard ranges are whole days)
+    if rollups.is_ready(db, rollups.ORDERS):
+        rollup = models.OrderDailyRollup
+        rollup_filters = []
+        if platform_id:
+            rollup_filters.append(rollup.platform_id == platform_id)
+        if start_dt:
+            rollup_filters.append(rollup.day >= start_dt)
+        if end_dt:
+            rollup_filters.append(rollup.day < end_dt)
+        grouped = _grouped_order_stats(
+            db, rollup.platform_id, rollup.order_status, rollup.order_count, rollup.revenue, rollup_filters
+        )
+        if not start_dt and not end_dt:
+            # Orders without a purchase date never reach the rollup
+            grouped += _grouped_order_stats(
+                db, models.Order.platform_id, models.Order.order_status, 1, models.Order.order_total,
+                order_filters + [models.Order.purchase_date.is_(None)]
+            )
+    else:
+        grouped = _grouped_order_stats(
+            db, models.Order.platform_id, models.Order.order_status, 1, models.Order.order_total, order_filters
+        )
     
-    # Total revenue (with date filter applied)
-    total_revenue = order_query.with_entities(func.sum(models.Order.order_total)).scalar() or 0
+    stats_by_platform = {}
+    for row in grouped:
+        stats = stats_by_platform.setdefault(row.platform_id or None, dict.fromkeys(row._fields[1:], 0))
+        for field in row._fields[1:]:
+            stats[field] += getattr(row, field) or 0
+    platform_stats = stats_by_platform.values()
+    
+    total_orders = sum(int(stats["order_count"]) for stats in platform_stats)
+    total_revenue = sum(stats["revenue"] for stats in platform_stats)
     
     # Orders by status
-    pending_orders = order_query.filter(models.Order.order_status.in_(["Pending", "Confirmed", "Processing"])).count()
-    shipped_orders = order_query.filter(models.Order.order_status.in_(["Shipped", "Dispatched", "Out for Delivery"])).count()
-    delivered_orders = order_query.filter(models.Order.order_status.in_(["Delivered", "Completed"])).count()
-    cancelled_orders = order_query.filter(models.Order.order_status.in_(["Cancelled", "Returned"])).count()
-    
-    # Platform breakdown (with date filter)
-    try:
-        platform_query = db.query(
-            models.Platform.id,
-            models.Platform.display_name,
-            func.count(models.Order.id).label('order_count'),
-            func.sum(models.Order.order_total).label('revenue')
-        ).outerjoin(
-            models.Order, models.Platform.id == models.Order.platform_id
-        )
-        
-        # Apply date filters to platform breakdown
-        if start_date:
-            try:
-                start_dt = datetime.strptime(start_date, "%Y-%m-%d").date()
-                platform_query = platform_query.filter(models.Order.purchase_date >= start_dt)
-            except ValueError:
-                pass
-        
-        if end_date:
-            try:
-                end_dt = datetime.strptime(end_date, "%Y-%m-%d").date()
-                end_dt = end_dt + timedelta(days=1)
-                platform_query = platform_query.filter(models.Order.purchase_date < end_dt)
-            except ValueError:
-                pass
-        
-        if platform_id:
-            platform_query = platform_query.filter(models.Platform.id == platform_id)
-        
-        platform_stats = platform_query.group_by(
-            models.Platform.id, models.Platform.display_name
-        ).all()
-        
-        platform_breakdown = [
-            {
-                "platform_id": p.id,
-                "platform_name": p.display_name,
-                "order_count": int(count or 0),
-                "revenue": float(revenue or 0)
-            }
-            for p, count, revenue in platform_stats
-        ]
-    except Exception as e:
-        # Fallback if join fails
-        platforms = db.query(models.Platform).all()
-        platform_breakdown = [
-            {
-                "platform_id": p.id,
-                "platform_name": p.display_name,
-                "order_count": 0,
-                "revenue": 0.0
-            }
-            for p in platforms
-        ]
-    
-    # Total inventory
-    inv_query = db.query(models.Inventory)
+    pending_orders = sum(int(stats["pending"]) for stats in platform_stats)
+    shipped_orders = sum(int(stats["shipped"]) for stats in platform_stats)
+    delivered_orders = sum(int(stats["delivered"]) for stats in platform_stats)
+    cancelled_orders = sum(int(stats["cancelled"]) for stats in platform_stats)
+    
+    # Platform breakdown (platforms without orders in range are listed with zeros)
+    platforms_query = db.query(models.Platform.id, models.Platform.display_name)
+    if platform_id:
+        platforms_query = platforms_query.filter(models.Platform.id == platform_id)
+    
+    platform_breakdown = []
+    for p_id, p_name in platforms_query.order_by(models.Platform.id).all():
+        stats = stats_by_platform.get(p_id)
+        platform_breakdown.append({
+            "platform_id": p_id,
+            "platform_name": p_name,
+            "order_count": int(stats["order_count"]) if stats else 0,
+            "revenue": float(stats["revenue"]) if stats else 0.0
+        })
+    
+    # Total inventory in one aggregate query
+    inv_query = db.query(
+        func.count(models.Inventory.id),
+        func.sum(models.Inventory.total_quantity),
+        func.sum(models.Inventory.available_quantity),
+        func.sum(models.Inventory.reserved_quantity)
+    )
     if platform_id:
         inv_query = inv_query.filter(models.Inventory.platform_id == platform_id)
     
-    total_skus = inv_query.count()
-    total_inventory_qty = inv_query.with_entities(func.sum(models.Inventory.total_quantity)).scalar() or 0
-    available_inventory_qty = inv_query.with_entities(func.sum(models.Inventory.available_quantity)).scalar() or 0
-    reserved_inventory_qty = inv_query.with_entities(func.sum(models.Inventory.reserved_quantity)).scalar() or 0
+    total_skus, total_inventory_qty, available_inventory_qty, reserved_inventory_qty = inv_query.one()
     
     # Order status distribution for charts
     order_status_distribution = {
@@ -124,8 +151,12 @@ def get_summary(
         "Cancelled": cancelled_orders
     }
     
-    # Recent orders (last 10)
-    recent_orders = order_query.order_by(models.Order.purchase_date.desc()).limit(10).all()
+    # Recent orders (last 10), platform eager-loaded
+    recent_orders = db.query(models.Order).options(
+        joinedload(models.Order.platform)
+    ).filter(
+        *order_filters
+    ).order_by(models.Order.purchase_date.desc()).limit(10).all()
     recent_orders_data = [
         {
             "id": o.id,
@@ -158,10 +189,10 @@ def get_summary(
         "order_status_distribution": order_status_distribution,
         "platform_breakdown": platform_breakdown,
         "inventory": {
-            "total_skus": int(total_skus),
-            "total_quantity": int(total_inventory_qty),
-            "available_quantity": int(available_inventory_qty),
-            "reserved_quantity": int(reserved_inventory_qty),
+            "total_skus": int(total_skus or 0),
+            "total_quantity": int(total_inventory_qty or 0),
+            "available_quantity": int(available_inventory_qty or 0),
+            "reserved_quantity": int(reserved_inventory_qty or 0),
         },
         "recent_orders": recent_orders_data
     }
@@ -1,7 +1,7 @@
 from fastapi import APIRouter, Depends, Query, HTTPException, Body
 from sqlalchemy.orm import Session
 from typing import List, Optional, Dict, Any
-from backend.apps.common import get_db, models
+from backend.apps.common import get_db, models, rollups
 from ..services import OrderService, SyncService
 from ..platforms import get_adapter
 
@@ -150,7 +150,9 @@ def update_shipment_status(
             platform_order_id=order_id
         ).first()
         if order:
+            old_status = order.order_status
             order.order_status = shipment_data.get("shipment_status", order.order_status)
+            rollups.record_order_status_change(db, order, old_status)
             db.commit()
         
         return result
@@ -197,7 +199,9 @@ def confirm_shipment(
             platform_order_id=order_id
         ).first()
         if order:
+            old_status = order.order_status
             order.order_status = "Shipped"
+            rollups.record_order_status_change(db, order, old_status)
             # Store tracking info in metadata
             if not order.platform_metadata:
                 order.platform_metadata = {}
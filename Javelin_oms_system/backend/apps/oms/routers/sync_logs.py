@@ -1,8 +1,11 @@
 """Sync logs router for viewing connection and sync history"""
+from datetime import datetime, timedelta
+from itertools import islice
 from fastapi import APIRouter, Depends, Query
+from sqlalchemy import select
 from sqlalchemy.orm import Session
 from typing import List, Optional
-from backend.apps.common import get_db, models
+from backend.apps.common import archive, get_db, models
 
 router = APIRouter(prefix="/sync-logs", tags=["Sync Logs"])
 
@@ -12,25 +15,49 @@ def get_sync_logs(
     platform_id: Optional[int] = Query(None, description="Filter by platform ID"),
     job_type: Optional[str] = Query(None, description="Filter by job type (orders, inventory)"),
     status: Optional[str] = Query(None, description="Filter by status"),
+    date_from: Optional[datetime] = Query(None, description="Logs created on or after"),
+    date_to: Optional[datetime] = Query(None, description="Logs created up to this date (inclusive)"),
     limit: int = Query(50, ge=1, le=200),
     db: Session = Depends(get_db)
 ):
-    """Get sync logs with optional filters"""
-    query = db.query(models.SyncLog)
+    """
+    Get sync logs with optional filters, latest first.
+    Archived months are included when date_from reaches back into them.
+    """
+    logs_table = models.SyncLog.__table__
+    statement = select(logs_table)
     
     if platform_id:
-        query = query.filter(models.SyncLog.platform_id == platform_id)
+        statement = statement.where(logs_table.c.platform_id == platform_id)
     if job_type:
-        query = query.filter(models.SyncLog.job_type == job_type)
+        statement = statement.where(logs_table.c.job_type == job_type)
     if status:
-        query = query.filter(models.SyncLog.status == status)
+        statement = statement.where(logs_table.c.status == status)
+    if date_from:
+        statement = statement.where(logs_table.c.created_at >= date_from)
+    date_to_inclusive = date_to + timedelta(days=1) if date_to else None
+    if date_to_inclusive:
+        statement = statement.where(logs_table.c.created_at < date_to_inclusive)
     
-    logs = query.order_by(models.SyncLog.created_at.desc()).limit(limit).all()
+    statement = statement.order_by(logs_table.c.created_at.desc(), logs_table.c.id.desc()).limit(limit)
+    if date_from:
+        rows = archive.union_rows(
+            db, statement, logs_table.name, date_from, date_to_inclusive,
+            key=lambda log: (log.created_at, log.id), reverse=True
+        )
+    else:
+        rows = db.execute(statement)
+    logs = list(islice(rows, limit))
+    
+    platform_ids = {log.platform_id for log in logs if log.platform_id}
+    platforms = dict(
+        db.query(models.Platform.id, models.Platform.display_name).filter(models.Platform.id.in_(platform_ids)).all()
+    ) if platform_ids else {}
     
     return [
         {
             "id": log.id,
-            "platform": log.platform.display_name if log.platform else "All Platforms",
+            "platform": platforms.get(log.platform_id, "All Platforms"),
             "platform_id": log.platform_id,
             "job_type": log.job_type,
             "status": log.status,
@@ -3,6 +3,7 @@ from sqlalchemy.orm import Session
 from typing import List, Dict, Any, Optional
 from datetime import datetime
 from backend.apps.common.models import Order, OrderItem, Platform
+from backend.apps.common import rollups
 from backend.apps.common.utils import parse_datetime
 
 
@@ -90,6 +91,7 @@ class OrderService:
             )
             db.add(item)
         
+        rollups.record_order(db, order)
         return order
 
 
@@ -0,0 +1,69 @@
+"""
+Move months that closed more than ARCHIVE_HOT_MONTHS ago out of the main
+database into per-month archive files (see apps/common/archive.py).
+
+Usage:
+    python -m backend.archive_closed_months                       # dispatch_scans, sync_logs
+    python -m backend.archive_closed_months orders stock_ledger   # named tables
+    python -m backend.archive_closed_months channels              # every per-channel table
+    python -m backend.archive_closed_months --dry-run
+"""
+import argparse
+
+from sqlalchemy import inspect, select
+
+from backend.apps.common import SessionLocal, Base, engine, archive
+from backend.apps.mango import order_lookup  # noqa: F401  (drops archived rows from the lookup index)
+from backend.apps.mango.channel_master_models import Channel, ChannelTable
+
+CHANNELS = "channels"
+
+
+def _channel_tables(db) -> list:
+    names = {name for (name,) in db.execute(select(Channel.table_name))}
+    names.update(name for (name,) in db.execute(select(ChannelTable.table_name)))
+    existing = set(inspect(db.connection()).get_table_names())
+    return sorted(name for name in names if name in existing)
+
+
+def _tables(db, requested: list) -> list:
+    """Requested tables, referencing tables first (scans before the orders they point at)"""
+    tables = [name for name in archive.SPECS if name in requested]
+    if CHANNELS in requested:
+        tables += _channel_tables(db)
+    unknown = set(requested) - set(archive.SPECS) - {CHANNELS}
+    return tables + sorted(unknown)
+
+
+def archive_closed_months(requested: list, dry_run: bool = False):
+    """Archive every closed month of the requested tables"""
+    Base.metadata.create_all(bind=engine)
+    db = SessionLocal()
+    try:
+        print(f"Keeping months from {archive.hot_boundary():%Y-%m} in the main database")
+        for table_name in _tables(db, requested):
+            months = archive.closed_months(db, table_name)
+            if not months:
+                print(f"{table_name}: nothing to archive")
+                continue
+            for month, rows in months:
+                if dry_run:
+                    print(f"{table_name} {month:%Y-%m}: {rows} rows to archive")
+                    continue
+                moved = archive.archive_month(db, table_name, month)
+                kept = f", {rows - moved} still referenced" if moved < rows else ""
+                print(f"{table_name} {month:%Y-%m}: {moved} rows archived{kept}")
+    except Exception:
+        db.rollback()
+        raise
+    finally:
+        db.close()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Archive closed months of high-volume tables")
+    parser.add_argument("tables", nargs="*", default=list(archive.DEFAULT_TABLES),
+                        help=f"Tables to archive ({', '.join(archive.SPECS)}, a channel table or '{CHANNELS}')")
+    parser.add_argument("--dry-run", action="store_true", help="Only report what would be archived")
+    args = parser.parse_args()
+    archive_closed_months(args.tables, args.dry_run)
@@ -0,0 +1,80 @@
+"""
+Login throughput benchmark
+
+Simulates a burst of concurrent logins (password verification) and, at the same
+time, a stream of cheap requests on the shared request threadpool, and reports
+login throughput plus the latency those other requests see. Compares running
+bcrypt on the shared pool (the old behaviour) with the dedicated hashing
+executor in thread and process mode.
+
+Usage:
+    python -m backend.benchmark_login [--logins 200] [--rounds 12] [--workers 4]
+"""
+import argparse
+import asyncio
+import statistics
+import time
+
+from anyio import to_thread
+
+from backend.apps.common import security
+
+
+async def _background_requests(stop: asyncio.Event, latencies: list):
+    """Cheap sync endpoint stand-in: a no-op on the shared threadpool every 10 ms"""
+    while not stop.is_set():
+        started = time.perf_counter()
+        await to_thread.run_sync(lambda: None)
+        latencies.append((time.perf_counter() - started) * 1000)
+        await asyncio.sleep(0.01)
+
+
+async def _run(mode: str, logins: int, hashed: str) -> dict:
+    if mode == "shared":
+        verify = lambda: to_thread.run_sync(security.verify_password, "password", hashed)
+    else:
+        security.shutdown_hashing_executor()
+        security.HASHING_EXECUTOR = mode
+        verify = lambda: security.verify_password_async("password", hashed)
+
+    stop = asyncio.Event()
+    latencies = []
+    background = asyncio.create_task(_background_requests(stop, latencies))
+
+    started = time.perf_counter()
+    results = await asyncio.gather(*(verify() for _ in range(logins)))
+    elapsed = time.perf_counter() - started
+
+    stop.set()
+    await background
+    assert all(results)
+
+    latencies.sort()
+    return {
+        "mode": mode,
+        "logins_per_sec": logins / elapsed,
+        "other_p50_ms": statistics.median(latencies) if latencies else 0.0,
+        "other_p99_ms": latencies[int(len(latencies) * 0.99) - 1] if latencies else 0.0,
+    }
+
+
+def benchmark_login(logins: int, rounds: int, workers: int):
+    security.HASHING_WORKERS = workers
+    hashed = security.get_password_hash("password", rounds=rounds)
+
+    print(f"{logins} concurrent logins, bcrypt cost {rounds}, {workers} hashing workers\n")
+    print(f"{'mode':<10}{'logins/s':>12}{'other p50 ms':>16}{'other p99 ms':>16}")
+    for mode in ("shared", "thread", "process"):
+        result = asyncio.run(_run(mode, logins, hashed))
+        print(f"{result['mode']:<10}{result['logins_per_sec']:>12.1f}"
+              f"{result['other_p50_ms']:>16.2f}{result['other_p99_ms']:>16.2f}")
+    security.shutdown_hashing_executor()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--logins", type=int, default=200)
+    parser.add_argument("--rounds", type=int, default=security.BCRYPT_ROUNDS)
+    parser.add_argument("--workers", type=int, default=security.HASHING_WORKERS)
+    args = parser.parse_args()
+    benchmark_login(args.logins, args.rounds, args.workers)
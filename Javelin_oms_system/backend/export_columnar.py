@@ -0,0 +1,33 @@
+"""
+Export new orders, order items, returns, ledger entries and dispatch scans
+to the columnar analytics files (see apps/mango/columnar_export.py).
+
+Usage:
+    python -m backend.export_columnar                    # every dataset, new rows only
+    python -m backend.export_columnar dispatch_scans
+    python -m backend.export_columnar --rebuild          # rewrite from scratch
+"""
+import argparse
+
+from backend.apps.common import SessionLocal
+from backend.apps.mango import columnar_export
+
+
+def export_columnar(names: list, rebuild: bool = False):
+    """Write the rows exported since the last run"""
+    db = SessionLocal()
+    try:
+        counts = columnar_export.export(db, names, rebuild=rebuild)
+        for name, rows in counts.items():
+            print(f"{name}: {rows} rows exported")
+        print(f"Snapshot version {columnar_export.load_state()['version']} in {columnar_export.COLUMNAR_EXPORT_DIR}")
+    finally:
+        db.close()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Export analytics datasets to Parquet/Arrow files")
+    parser.add_argument("datasets", nargs="*", help=f"Datasets ({', '.join(columnar_export.DATASETS)}); default all")
+    parser.add_argument("--rebuild", action="store_true", help="Delete the datasets' files and export every row again")
+    args = parser.parse_args()
+    export_columnar(args.datasets, args.rebuild)
@@ -1,7 +1,7 @@
 from fastapi import FastAPI
 from fastapi.staticfiles import StaticFiles
 from fastapi.middleware.cors import CORSMiddleware
-from .apps.common import Base, engine, SessionLocal, models
+from .apps.common import Base, engine, SessionLocal, models, security
 from .apps.oms.routers import orders, inventory, dashboard, platforms, connections, sync_logs, reports, auth
 
 Base.metadata.create_all(bind=engine)
@@ -81,6 +81,10 @@ app.include_router(channel_management_routes.router, prefix="/api", tags=["Multi
 from .apps.mango import channel_upload_routes
 app.include_router(channel_upload_routes.router, prefix="/api", tags=["Multi-Channel Upload"])
 
+# Jaimini Intelligence (analytics over the columnar exports)
+from .apps.jaimini import routes as jaimini_routes
+app.include_router(jaimini_routes.router, prefix="/jaimini", tags=["Jaimini Analytics"])
+
 
 # Mount frontend directory
 import os
@@ -146,6 +150,36 @@ def init_platforms():
         db.close()
 
 
+@app.on_event("shutdown")
+def stop_hashing_executor():
+    security.shutdown_hashing_executor()
+
+
+from .apps.mango import sequences, documents, dispatch_index
+
+@app.on_event("startup")
+def warm_dispatch_index():
+    """Load dispatchable orders into the in-memory index used by barcode validation"""
+    db = SessionLocal()
+    try:
+        dispatch_index.warm(db)
+    except Exception as e:
+        print(f"Error warming dispatch index: {e}")
+    finally:
+        db.close()
+
+
+@app.on_event("shutdown")
+def release_document_numbers():
+    """Return unused pre-allocated document numbers to their sequences"""
+    sequences.release_blocks(engine)
+
+
+@app.on_event("shutdown")
+def stop_document_renderers():
+    documents.shutdown_render_pool()
+
+
 @app.get("/")
 def root():
     return {
@@ -0,0 +1,35 @@
+"""
+Database Migration: Add Archived Periods
+
+Creates the archived_periods catalogue of months moved out of the main
+database by backend/archive_closed_months.py. New databases get it from
+create_all; run this script once on an existing database.
+
+Instructions:
+1. Run: python3 backend/migrations/add_archived_periods.py
+2. Safe to run again; an existing table is skipped
+"""
+
+import sys
+import os
+
+# Add parent directory to path
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+from apps.common.db import engine
+from apps.common import models
+
+
+def run_migration():
+    """Create archived_periods if missing"""
+
+    print("Starting migration: Adding archived periods...")
+
+    models.ArchivedPeriod.__table__.create(bind=engine, checkfirst=True)
+    print("✓ archived_periods")
+
+    print("Migration complete.")
+
+
+if __name__ == "__main__":
+    run_migration()
@@ -0,0 +1,47 @@
+"""
+Database Migration: Add Courier Manifests
+
+Creates the courier_manifests table and the dispatch_scans index used to find
+unmanifested scans up to a cutoff and a manifest's parcels. New databases get
+both from create_all; run this script once on an existing database.
+
+Instructions:
+1. Run: python3 backend/migrations/add_courier_manifests.py
+2. Safe to run again; existing tables and indexes are skipped
+"""
+
+import sys
+import os
+
+# Add parent directory to path
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+from sqlalchemy import inspect
+
+from apps.common.db import engine
+from apps.common import models
+
+
+def run_migration():
+    """Create courier_manifests and ix_dispatch_scans_company_manifest if missing"""
+
+    print("Starting migration: Adding courier manifests...")
+
+    models.CourierManifest.__table__.create(bind=engine, checkfirst=True)
+    print("✓ courier_manifests")
+
+    if models.DispatchScan.__tablename__ in set(inspect(engine).get_table_names()):
+        index = next(
+            index for index in models.DispatchScan.__table__.indexes
+            if index.name == "ix_dispatch_scans_company_manifest"
+        )
+        index.create(bind=engine, checkfirst=True)
+        print("✓ dispatch_scans: ix_dispatch_scans_company_manifest")
+    else:
+        print("- dispatch_scans does not exist yet, skipped (create_all adds the index)")
+
+    print("Migration complete.")
+
+
+if __name__ == "__main__":
+    run_migration()
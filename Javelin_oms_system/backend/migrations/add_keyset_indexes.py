@@ -0,0 +1,50 @@
+"""
+Database Migration: Add Keyset Pagination Indexes
+
+The invoice, quotation, sales order and dispatch scan lists page by seeking on
+(company_id, <date>, id). New databases get these indexes from create_all;
+run this script once to add them to an existing database.
+
+Instructions:
+1. Run: python3 backend/migrations/add_keyset_indexes.py
+2. Safe to run again; existing indexes are skipped
+"""
+
+import sys
+import os
+
+# Add parent directory to path
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+from sqlalchemy import inspect
+
+from apps.common.db import engine
+from apps.common import models
+
+INDEXES = [
+    (models.Invoice, "ix_invoices_company_date_id"),
+    (models.Quotation, "ix_quotations_company_date_id"),
+    (models.SalesOrder, "ix_sales_orders_company_date_id"),
+    (models.DispatchScan, "ix_dispatch_scans_company_scanned_id"),
+]
+
+
+def run_migration():
+    """Create the keyset pagination indexes that do not exist yet"""
+
+    print("Starting migration: Adding keyset pagination indexes...")
+
+    existing_tables = set(inspect(engine).get_table_names())
+    for model, name in INDEXES:
+        if model.__tablename__ not in existing_tables:
+            print(f"- {model.__tablename__} does not exist yet, skipped (create_all adds the index)")
+            continue
+        index = next(index for index in model.__table__.indexes if index.name == name)
+        index.create(bind=engine, checkfirst=True)
+        print(f"✓ {model.__tablename__}: {name}")
+
+    print("Migration complete.")
+
+
+if __name__ == "__main__":
+    run_migration()
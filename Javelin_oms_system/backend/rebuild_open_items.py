@@ -0,0 +1,23 @@
+import sys
+
+from backend.apps.common import SessionLocal, Base, engine
+from backend.apps.mango import receivables
+
+def rebuild_open_items(match: bool = True):
+    """Recompute customer open items from the ledger and allocations, then apply open credits FIFO"""
+    Base.metadata.create_all(bind=engine)
+    db = SessionLocal()
+    try:
+        counts = receivables.rebuild(db, match=match)
+        db.commit()
+        for name, rows in counts.items():
+            print(f"{name}: {rows}")
+    except Exception:
+        db.rollback()
+        raise
+    finally:
+        db.close()
+
+if __name__ == "__main__":
+    # --no-match keeps existing payments unapplied so they can be allocated by hand
+    rebuild_open_items(match="--no-match" not in sys.argv[1:])
@@ -0,0 +1,20 @@
+from backend.apps.common import SessionLocal, Base, engine
+from backend.apps.mango import order_lookup
+
+def rebuild_order_lookup():
+    """Re-index orders from OMS, Mango imports, channel tables, the master sheet and dispatch scans"""
+    Base.metadata.create_all(bind=engine)
+    db = SessionLocal()
+    try:
+        counts = order_lookup.rebuild(db)
+        db.commit()
+        for source, records in counts.items():
+            print(f"{source}: {records} records indexed")
+    except Exception:
+        db.rollback()
+        raise
+    finally:
+        db.close()
+
+if __name__ == "__main__":
+    rebuild_order_lookup()
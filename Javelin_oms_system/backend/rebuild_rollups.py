@@ -0,0 +1,19 @@
+from backend.apps.common import SessionLocal, Base, engine, rollups
+
+def rebuild_rollups():
+    """Recompute all analytics rollup tables from the raw rows"""
+    Base.metadata.create_all(bind=engine)
+    db = SessionLocal()
+    try:
+        counts = rollups.rebuild_all(db)
+        db.commit()
+        for name, rows in counts.items():
+            print(f"{name}: {rows} rollup rows")
+    except Exception:
+        db.rollback()
+        raise
+    finally:
+        db.close()
+
+if __name__ == "__main__":
+    rebuild_rollups()
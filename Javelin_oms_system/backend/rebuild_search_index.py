@@ -0,0 +1,20 @@
+from backend.apps.common import SessionLocal, Base, engine
+from backend.apps.mango import search_index
+
+def rebuild_search_index():
+    """Re-index all customers, invoices, quotations and sales orders for search"""
+    Base.metadata.create_all(bind=engine)
+    db = SessionLocal()
+    try:
+        counts = search_index.rebuild(db)
+        db.commit()
+        for doc_type, documents in counts.items():
+            print(f"{doc_type}: {documents} documents indexed")
+    except Exception:
+        db.rollback()
+        raise
+    finally:
+        db.close()
+
+if __name__ == "__main__":
+    rebuild_search_index()